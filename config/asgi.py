@@ -5,6 +5,10 @@ It exposes the ASGI callable as a module-level variable named ``application``.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/5.2/howto/deployment/asgi/
+
+Потоковый AI-чат (core:ai_ask_stream) отдаёт ответ по частям только под
+ASGI, например:
+    gunicorn config.asgi:application -k uvicorn.workers.UvicornWorker
 """
 
 import os
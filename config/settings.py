@@ -61,6 +61,8 @@ MIDDLEWARE = [
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
+    # Счётчик SQL-запросов (выключен, пока QUERY_INSTRUMENTATION_ENABLED=False)
+    'core.middleware.QueryInstrumentationMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
     # Middleware для HTMX
     'django_htmx.middleware.HtmxMiddleware',
@@ -106,6 +108,17 @@ DATABASES = {
     }
 }
 
+# Учётная запись только на чтение для SQL, сгенерированного AI-чатом
+# (core/ai_sql_sandbox.py). Без AI_DB_USER запросы идут через 'default',
+# но всё равно в транзакции READ ONLY.
+if os.getenv('AI_DB_USER'):
+    DATABASES['ai_readonly'] = {
+        **DATABASES['default'],
+        'USER': os.getenv('AI_DB_USER'),
+        'PASSWORD': os.getenv('AI_DB_PASSWORD'),
+        'TEST': {'MIRROR': 'default'},
+    }
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -156,6 +169,9 @@ X_FRAME_OPTIONS = 'SAMEORIGIN'
 # Настройки для Медиа-файлов (загружаемых пользователями)
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
+# Закрытые файлы (core/private_storage.py): готовые PDF и архивы фоновых задач.
+# Вне MEDIA_ROOT — /media/ раздаётся без проверки прав
+PRIVATE_MEDIA_ROOT = Path(os.environ.get('PRIVATE_MEDIA_ROOT', BASE_DIR / 'private_media'))
 
 
 # --- ✨ НАЧАЛО ИСПРАВЛЕНИЯ КЭША ✨ ---
@@ -177,6 +193,120 @@ CRISPY_TEMPLATE_PACK = "tailwind"
 USE_DEPRECATED_PYTZ = True
 TIME_ZONE_PYTZ = 'Asia/Dushanbe'
 
+# --- ИНСТРУМЕНТАЦИЯ ЗАПРОСОВ К БД (core.middleware.QueryInstrumentationMiddleware) ---
+# Включайте на staging: QUERY_INSTRUMENTATION=true в .env
+QUERY_INSTRUMENTATION_ENABLED = os.environ.get('QUERY_INSTRUMENTATION', 'False').lower() == 'true'
+QUERY_INSTRUMENTATION_LOG = os.path.join(BASE_DIR, 'logs', 'query_budget.log')
+QUERY_INSTRUMENTATION_TOP_N = 5
+# Бюджет SQL-запросов на одно представление (имя из urls.py).
+# При превышении в лог пишется WARNING.
+QUERY_BUDGET_DEFAULT = 100
+QUERY_BUDGETS = {
+    # Значения совпадают с бюджетами в core/tests.py (QueryBudgetTestCase)
+    'core:dashboard': 35,
+    'core:statistics': 28,
+    'core:deep_analysis': 32,
+    'core:monitoring': 30,
+    'core:grading': 30,
+    'core:student_progress': 18,
+    'core:student_dashboard': 15,
+    'core:api_header_search': 10,
+    'core:export_detailed_results_excel': 10,
+    'core:export_monitoring_excel': 20,
+    'core:export_grading_excel': 20,
+    'core:gat_test_list': 30,
+}
+
+# --- РЕНДЕРИНГ PDF (core/pdf_service.py) ---
+# Число процессов WeasyPrint; 0 — рендер прямо в запросе (разработка, тесты)
+PDF_RENDER_WORKERS = int(os.environ.get('PDF_RENDER_WORKERS', 2))
+# Сколько секунд запрос ждёт готовый PDF, прежде чем перевести рендер в фон
+PDF_RENDER_WAIT_SECONDS = int(os.environ.get('PDF_RENDER_WAIT_SECONDS', 10))
+# Размер куска (в страницах) при параллельном рендеринге больших таблиц
+PDF_CHUNK_PAGES = int(os.environ.get('PDF_CHUNK_PAGES', 10))
+# Кеш готовых PDF: файлы старше срока удаляются, а при превышении общего
+# размера — сначала самые старые (не чаще раза в PDF_CACHE_PRUNE_INTERVAL секунд)
+PDF_CACHE_TTL_HOURS = int(os.environ.get('PDF_CACHE_TTL_HOURS', 72))
+PDF_CACHE_MAX_MB = int(os.environ.get('PDF_CACHE_MAX_MB', 500))
+PDF_CACHE_PRUNE_INTERVAL = 3600
+
+# --- ПАКЕТНАЯ ВЫГРУЗКА В ZIP (core/batch_export.py) ---
+# Одновременных выгрузок; 0 — выгрузка выполняется прямо в запросе
+BATCH_EXPORT_WORKERS = int(os.environ.get('BATCH_EXPORT_WORKERS', 1))
+
+# --- МАССОВОЕ УДАЛЕНИЕ (core/bulk_delete.py) ---
+# Потоков для фоновых удалений; 0 — удаление выполняется прямо в запросе
+BULK_DELETE_WORKERS = int(os.environ.get('BULK_DELETE_WORKERS', 1))
+# Корневых строк (учеников/результатов) в одной пачке; меньше одной пачки — сразу в запросе
+BULK_DELETE_BATCH_SIZE = 2000
+
+# --- ВИДЖЕТЫ ПАНЕЛИ УПРАВЛЕНИЯ (core/views/dashboard.py) ---
+# Потоков для параллельного расчёта виджетов; 0 — по очереди в запросе
+DASHBOARD_WIDGET_WORKERS = int(os.environ.get('DASHBOARD_WIDGET_WORKERS', 4))
+# Сколько секунд хранится виджет (ключ включает версии данных школ)
+DASHBOARD_WIDGET_CACHE_TTL = 600
+
+# --- СНИМКИ АНАЛИТИКИ (core/snapshots.py) ---
+# Отдавать предрасчитанные снимки (python manage.py precompute_analytics по cron).
+# celery и django-celery-beat есть в requirements.txt, но не подключены: нет
+# приложения Celery, django_celery_beat нет в INSTALLED_APPS, нет брокера
+# (на хостинге нет Redis, см. CACHES) и воркера. Поэтому — задача по расписанию
+# хостинга/cron, а не beat
+ANALYTICS_SNAPSHOTS_ENABLED = os.environ.get('ANALYTICS_SNAPSHOTS_ENABLED', 'True').lower() == 'true'
+# Снимок старше этого не используется, даже если данные не менялись (часы)
+ANALYTICS_SNAPSHOT_MAX_AGE_HOURS = 36
+# Сколько последних версий снимка хранить
+ANALYTICS_SNAPSHOT_KEEP = 3
+
+# --- КЕШ AI-ЧАТА (core/ai_service.py) ---
+# Сколько секунд хранится SQL, сгенерированный моделью для вопроса
+AI_SQL_CACHE_TTL = int(os.environ.get('AI_SQL_CACHE_TTL', 600))
+# Готовые таблицы ответов (ключ включает версию данных, поэтому TTL длиннее)
+AI_TABLE_CACHE_TTL = int(os.environ.get('AI_TABLE_CACHE_TTL', 3600))
+# Сколько секунд одинаковый параллельный запрос ждёт ответ первого
+AI_SINGLE_FLIGHT_WAIT = 60
+# Порция строк таблицы в потоковом ответе чата (core/views/ai_chat.py:ai_ask_stream)
+AI_STREAM_BATCH_SIZE = 50
+
+# --- ПЕСОЧНИЦА SQL AI-ЧАТА (core/ai_sql_sandbox.py) ---
+AI_SQL_DATABASE = 'ai_readonly' if 'ai_readonly' in DATABASES else 'default'
+# Предел оценки стоимости плана (EXPLAIN, только PostgreSQL) и таймаут запроса
+AI_SQL_MAX_COST = int(os.environ.get('AI_SQL_MAX_COST', 100000))
+AI_SQL_TIMEOUT_MS = 8000
+# Строк на странице таблицы ответа и всего доступно по страницам
+AI_TABLE_PAGE_SIZE = 50
+AI_SQL_MAX_ROWS = 1000
+# Сколько секунд живёт ссылка на страницы результата (история чата в сессии)
+AI_TABLE_PAGE_TTL = 86400
+
+# --- ЛОКАЛЬНЫЙ РОУТЕР ВОПРОСОВ AI-ЧАТА (core/ai_intents.py) ---
+# Частые вопросы (топ-N, средние, история ученика, группа риска) без вызова модели
+AI_INTENT_ROUTER_ENABLED = os.environ.get('AI_INTENT_ROUTER', 'True').lower() == 'true'
+# Сколько секунд кешируются справочники (школы, классы, предметы, четверти)
+AI_INTENT_REFERENCE_TTL = 300
+# Предел строк в локальном ответе и порог группы риска (% верных по предмету)
+AI_INTENT_MAX_ROWS = 100
+AI_AT_RISK_THRESHOLD = 40
+# Журнал вопросов чата (JSON-строки с маршрутом ответа) для команды ai_intent_hit_rate
+AI_QUESTION_LOG = os.path.join(BASE_DIR, 'logs', 'ai_questions.log')
+
+# --- МАССОВОЕ СОЗДАНИЕ АККАУНТОВ (core/account_provisioning.py) ---
+# Процессов для хеширования паролей; 0 или 1 — хеширование в текущем процессе
+ACCOUNT_HASH_WORKERS = int(os.environ.get('ACCOUNT_HASH_WORKERS', min(4, os.cpu_count() or 1)))
+
+# --- ИНДЕКС ПОДСКАЗОК ПОИСКА В ШАПКЕ (core/typeahead.py) ---
+# Поиск в памяти процесса без SQL (каждый процесс держит свою копию индекса)
+TYPEAHEAD_ENABLED = os.environ.get('TYPEAHEAD_ENABLED', 'False').lower() == 'true'
+# Как часто сверять версию данных школы (изменения из других процессов), секунды
+TYPEAHEAD_CHECK_INTERVAL = 5
+# Не дольше этого индекс школы живёт без полной перестройки, секунды
+TYPEAHEAD_MAX_AGE = 900
+
+# --- ОТВЕТЫ ПО ВОПРОСАМ (core/student_answers.py) ---
+# Писать строки StudentAnswer при загрузке; иначе только scores_by_subject,
+# а строки строятся по требованию (materialize_answers)
+STUDENT_ANSWERS_ON_UPLOAD = os.environ.get('STUDENT_ANSWERS_ON_UPLOAD', 'False').lower() == 'true'
+
 # --- НАСТРОЙКИ ЛОГИРОВАНИЯ ---
 LOGGING = {
     'version': 1,
@@ -186,6 +316,11 @@ LOGGING = {
             'format': '{levelname} {asctime} {module} {message}',
             'style': '{',
         },
+        # Одна JSON-запись на строку (сообщение уже сериализовано)
+        'json_line': {
+            'format': '{message}',
+            'style': '{',
+        },
     },
     'handlers': {
         'cleanup_file': {
@@ -195,6 +330,20 @@ LOGGING = {
             'filename': os.path.join(BASE_DIR, 'logs/cleanup.log'),
             'formatter': 'verbose',
         },
+        'query_budget_file': {
+            'level': 'INFO',
+            'class': 'logging.FileHandler',
+            'filename': QUERY_INSTRUMENTATION_LOG,
+            'formatter': 'json_line',
+            'delay': True,
+        },
+        'ai_question_file': {
+            'level': 'INFO',
+            'class': 'logging.FileHandler',
+            'filename': AI_QUESTION_LOG,
+            'formatter': 'json_line',
+            'delay': True,
+        },
     },
     'loggers': {
         'cleanup_logger': { # Имя логгера, которое мы использовали во view
@@ -202,6 +351,16 @@ LOGGING = {
             'level': 'WARNING',
             'propagate': True,
         },
+        'query_budget_logger': {
+            'handlers': ['query_budget_file'],
+            'level': 'INFO',
+            'propagate': False,
+        },
+        'ai_question_logger': {
+            'handlers': ['ai_question_file'],
+            'level': 'INFO',
+            'propagate': False,
+        },
     },
 }
 
@@ -213,6 +372,20 @@ if not os.path.exists(LOGS_DIR):
     
 GOOGLE_API_KEY = os.getenv('GOOGLE_API_KEY')
 
+# --- КЛИЕНТ API МОДЕЛИ (core/ai_client.py) ---
+# Модели по порядку предпочтения; адрес API можно направить на заглушку
+AI_MODELS = ["gemini-2.0-flash-exp", "gemini-1.5-flash", "gemini-1.5-pro", "gemini-pro"]
+AI_API_BASE_URL = os.getenv('AI_API_BASE_URL', 'https://generativelanguage.googleapis.com/v1beta')
+# Через сколько секунд без ответа параллельно спрашивается следующая модель
+AI_HEDGE_DELAY = float(os.getenv('AI_HEDGE_DELAY', 4))
+# Предел ожидания ответа на один вопрос и на один HTTP-запрос (секунды)
+AI_TOTAL_TIMEOUT = 45
+AI_REQUEST_TIMEOUT = 30
+# Предохранитель: после скольких ошибок подряд модель отключается и на сколько секунд
+AI_BREAKER_FAILURES = 3
+AI_BREAKER_RESET_SECONDS = 60
+AI_HTTP_POOL_SIZE = 10
+
 # ВАЖНО: Добавьте это, чтобы работал вход через HTTPS
 CSRF_TRUSTED_ORIGINS = [
     'https://andarzedu.pythonanywhere.com',
@@ -0,0 +1,180 @@
+# D:\New_GAT\core\account_provisioning.py
+
+"""
+Массовое создание аккаунтов учеников и сброс паролей.
+
+Вместо цикла «проверить логин → create_user → сохранить профиль» на
+каждого ученика:
+  1. логины для всей пачки резервируются одним запросом к auth_user;
+  2. пароли хешируются настроенным хешером параллельно в пуле процессов
+     (PBKDF2 — самая дорогая часть операции);
+  3. пользователи и профили пишутся через bulk_create / bulk_update.
+"""
+
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from django.conf import settings
+from django.contrib.auth.hashers import get_hasher
+from django.contrib.auth.models import User
+from django.db import IntegrityError, transaction
+from django.utils.crypto import get_random_string
+
+from accounts.models import UserProfile
+from .password_worker import hash_passwords
+
+PASSWORD_LENGTH = 8
+# Сколько базовых логинов проверять одним регулярным выражением
+USERNAME_LOOKUP_BATCH = 500
+BULK_BATCH_SIZE = 500
+RESERVE_ATTEMPTS = 3
+PASSWORD_SET_LABEL = '(пароль установлен)'
+
+_lock = threading.Lock()
+_pool = None
+
+
+def _workers():
+    default = min(4, os.cpu_count() or 1)
+    return getattr(settings, 'ACCOUNT_HASH_WORKERS', default)
+
+
+def _get_pool():
+    global _pool
+    with _lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(
+                max_workers=_workers(), mp_context=multiprocessing.get_context('spawn')
+            )
+    return _pool
+
+
+def hash_password_batch(passwords):
+    """Хеширует пароли хешером по умолчанию (PASSWORD_HASHERS[0])."""
+    hasher = get_hasher('default')
+    hasher_path = f"{type(hasher).__module__}.{type(hasher).__qualname__}"
+    pairs = [(password, hasher.salt()) for password in passwords]
+
+    workers = _workers()
+    if workers <= 1 or len(pairs) < 2:
+        return hash_passwords(hasher_path, pairs)
+
+    # Порции по числу процессов: меньше пересылок между процессами
+    size = -(-len(pairs) // workers)
+    chunks = [pairs[i:i + size] for i in range(0, len(pairs), size)]
+    pool = _get_pool()
+    futures = [pool.submit(hash_passwords, hasher_path, chunk) for chunk in chunks]
+    return [encoded for future in futures for encoded in future.result()]
+
+
+def base_username_for(student):
+    """Базовый логин: латинские имя+фамилия, иначе ID ученика."""
+    first_name = student.first_name_en or ''
+    last_name = student.last_name_en or ''
+    base_username = f"{first_name}{last_name}" if first_name or last_name else student.student_id
+    return ''.join(e for e in base_username if e.isalnum()).lower()
+
+
+def reserve_usernames(bases):
+    """
+    Подбирает уникальные логины для списка базовых логинов (с повторами).
+    Занятые логины вида base, base1, base2... читаются одним запросом на
+    USERNAME_LOOKUP_BATCH баз; правило нумерации — как у прежнего цикла.
+    """
+    bases = [base or 'student' for base in bases]
+    unique_bases = sorted(set(bases))
+    taken = set()
+    for i in range(0, len(unique_bases), USERNAME_LOOKUP_BATCH):
+        batch = unique_bases[i:i + USERNAME_LOOKUP_BATCH]
+        # Базы состоят только из букв и цифр — экранирование не требуется
+        pattern = rf"^({'|'.join(batch)})[0-9]*$"
+        taken.update(User.objects.filter(username__regex=pattern).values_list('username', flat=True))
+
+    usernames = []
+    for base in bases:
+        candidate, counter = base, 1
+        while candidate in taken:
+            candidate = f"{base}{counter}"
+            counter += 1
+        taken.add(candidate)
+        usernames.append(candidate)
+    return usernames
+
+
+def _create_accounts(students):
+    """Создаёт пользователей и профили; возвращает [(student, username, password)]."""
+    usernames = reserve_usernames([base_username_for(student) for student in students])
+    passwords = [get_random_string(length=PASSWORD_LENGTH) for _ in students]
+    encoded = hash_password_batch(passwords)
+
+    users = [
+        User(
+            username=username, password=password_hash,
+            first_name=student.first_name_ru, last_name=student.last_name_ru,
+        )
+        for student, username, password_hash in zip(students, usernames, encoded)
+    ]
+    # Сигнал post_save (автосоздание профиля) при bulk_create не срабатывает —
+    # профили создаются ниже одной пачкой
+    created = User.objects.bulk_create(users, batch_size=BULK_BATCH_SIZE)
+    if any(user.pk is None for user in created):
+        # БД без RETURNING: получаем id по логинам
+        ids = dict(User.objects.filter(username__in=usernames).values_list('username', 'id'))
+        for user in created:
+            user.pk = ids[user.username]
+
+    UserProfile.objects.bulk_create([
+        UserProfile(user=user, role=UserProfile.Role.STUDENT, student=student)
+        for user, student in zip(created, students)
+    ], batch_size=BULK_BATCH_SIZE)
+    return list(zip(students, usernames, passwords))
+
+
+def provision_student_accounts(students_queryset, reset_passwords=False):
+    """
+    Создаёт аккаунты ученикам без аккаунта и (при reset_passwords)
+    сбрасывает пароли существующим.
+
+    Возвращает {'credentials': [...], 'created': int, 'reset': int};
+    credentials — список {'full_name', 'username', 'password'} для листа
+    логинов, отсортированный по ФИО.
+    """
+    credentials = []
+
+    # 1. Ученики с аккаунтом
+    with_accounts = list(
+        students_queryset.filter(user_profile__isnull=False).select_related('user_profile__user')
+    )
+    users = [student.user_profile.user for student in with_accounts]
+    passwords = [PASSWORD_SET_LABEL] * len(users)
+    if reset_passwords and users:
+        passwords = [get_random_string(length=PASSWORD_LENGTH) for _ in users]
+        for user, encoded in zip(users, hash_password_batch(passwords)):
+            user.password = encoded
+        User.objects.bulk_update(users, ['password'], batch_size=BULK_BATCH_SIZE)
+    for student, user, password in zip(with_accounts, users, passwords):
+        credentials.append({'full_name': student.full_name_ru, 'username': user.username, 'password': password})
+
+    # 2. Ученики без аккаунта
+    to_create = list(students_queryset.filter(user_profile__isnull=True))
+    created = []
+    for attempt in range(RESERVE_ATTEMPTS):
+        try:
+            # Точка сохранения: при гонке за логин повторяем резервирование
+            with transaction.atomic():
+                created = _create_accounts(to_create) if to_create else []
+            break
+        except IntegrityError:
+            if attempt == RESERVE_ATTEMPTS - 1:
+                raise
+    for student, username, password in created:
+        credentials.append({'full_name': student.full_name_ru, 'username': username, 'password': password})
+
+    credentials.sort(key=lambda item: item['full_name'])
+    return {
+        'credentials': credentials,
+        'created': len(created),
+        'reset': len(users) if reset_passwords else 0,
+    }
@@ -5,7 +5,8 @@ from django.db.models import Count
 
 from .models import (
     AcademicYear, Quarter, School, SchoolClass, Subject,
-    GatTest, Student, StudentResult, TeacherNote, QuestionCount
+    GatTest, Student, StudentResult, TeacherNote, QuestionCount, BackgroundJob,
+    AnalyticsSnapshot
 )
 
 # ==========================================================
@@ -171,4 +172,22 @@ class TeacherNoteAdmin(admin.ModelAdmin):
 
     def short_note(self, obj):
         return obj.note[:50] + '...' if len(obj.note) > 50 else obj.note
-    short_note.short_description = 'Заметка (коротко)'
\ No newline at end of file
+    short_note.short_description = 'Заметка (коротко)'
+
+
+@admin.register(BackgroundJob)
+class BackgroundJobAdmin(admin.ModelAdmin):
+    """Админка для фоновых задач (PDF, выгрузки)."""
+    list_display = ('title', 'kind', 'status', 'user', 'progress', 'total', 'created_at', 'finished_at')
+    list_filter = ('kind', 'status')
+    search_fields = ('title', 'user__username', 'cache_key')
+    readonly_fields = ('created_at', 'updated_at', 'finished_at')
+
+
+@admin.register(AnalyticsSnapshot)
+class AnalyticsSnapshotAdmin(admin.ModelAdmin):
+    """Админка для снимков аналитики (команда precompute_analytics)."""
+    list_display = ('kind', 'key', 'version', 'data_token', 'computed_at', 'duration_ms')
+    list_filter = ('kind',)
+    search_fields = ('key',)
+    readonly_fields = ('computed_at',)
@@ -0,0 +1,274 @@
+# D:\New_GAT\core\ai_client.py
+
+"""
+HTTP-клиент к API модели (Google Generative Language) для AI-чата.
+
+  * Один общий requests.Session с пулом keep-alive соединений вместо
+    нового соединения (и TLS-рукопожатия) на каждый запрос.
+  * Предохранитель (circuit breaker) на каждую модель: после 429 модель
+    пропускается до истечения Retry-After, после 404 — надолго, после
+    серии ошибок — на AI_BREAKER_RESET_SECONDS. Никаких sleep() в потоке
+    запроса.
+  * Хеджирование: если модель не ответила за AI_HEDGE_DELAY секунд,
+    параллельно запрашивается следующая; берётся первый удачный ответ.
+    Быстрая ошибка сразу передаёт очередь следующей модели.
+
+Адрес API (AI_API_BASE_URL) и список моделей (AI_MODELS) задаются в
+settings — в тестах клиент направляется на локальный сервер-заглушку.
+"""
+
+import logging
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_API_BASE_URL = 'https://generativelanguage.googleapis.com/v1beta'
+# Список моделей от самой быстрой/умной к старым
+DEFAULT_MODELS = [
+    "gemini-2.0-flash-exp",          # Самая новая и быстрая
+    "gemini-1.5-flash",              # Стабильная быстрая
+    "gemini-1.5-pro",                # Умная, но медленнее
+    "gemini-pro"                     # Старая надежная
+]
+CONNECT_TIMEOUT = 5
+# Модели нет (404): не спрашиваем её час
+NOT_FOUND_COOLDOWN = 3600
+
+
+class AIClientError(Exception):
+    """Ошибка запроса к модели."""
+
+
+class RateLimited(AIClientError):
+    def __init__(self, model_name, retry_after=None):
+        super().__init__(f"429_LIMIT (Model {model_name})")
+        self.retry_after = retry_after
+
+
+class ModelNotFound(AIClientError):
+    def __init__(self, model_name):
+        super().__init__(f"404_NOT_FOUND (Model {model_name})")
+
+
+class AllModelsFailed(AIClientError):
+    """Ни одна модель не дала ответа (или все выключены предохранителями)."""
+
+
+# =============================================================================
+# --- ПРЕДОХРАНИТЕЛЬ ---
+# =============================================================================
+
+class CircuitBreaker:
+    """
+    Предохранитель модели: closed -> (ошибки) -> open -> (пауза) -> half-open.
+    В состоянии half-open пропускается один пробный запрос: успех закрывает
+    предохранитель, ошибка снова размыкает его.
+    """
+
+    def __init__(self, name, failure_threshold=3, reset_timeout=60):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._open_until = 0.0
+        self._probing = False
+
+    @property
+    def state(self):
+        with self._lock:
+            if self._open_until and time.monotonic() < self._open_until:
+                return 'open'
+            return 'half-open' if self._open_until else 'closed'
+
+    def allow(self):
+        with self._lock:
+            if not self._open_until:
+                return True
+            if time.monotonic() < self._open_until or self._probing:
+                return False
+            self._probing = True
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._open_until = 0.0
+            self._probing = False
+
+    def record_failure(self, cooldown=None):
+        """Ошибка запроса; cooldown размыкает предохранитель сразу на заданное время."""
+        with self._lock:
+            self._failures += 1
+            self._probing = False
+            if cooldown is not None or self._failures >= self.failure_threshold or self._open_until:
+                self._open_until = time.monotonic() + (cooldown if cooldown is not None else self.reset_timeout)
+                logger.warning("AI: модель %s отключена на %s с", self.name, round(self._open_until - time.monotonic()))
+
+
+_lock = threading.Lock()
+_session = None
+_executor = None
+_breakers = {}
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+def get_session():
+    """Общий Session с пулом соединений (keep-alive) для всех потоков."""
+    global _session
+    with _lock:
+        if _session is None:
+            pool_size = _setting('AI_HTTP_POOL_SIZE', 10)
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=0)
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+            session.headers['Content-Type'] = 'application/json'
+            _session = session
+    return _session
+
+
+def _get_executor():
+    global _executor
+    with _lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=_setting('AI_HEDGE_WORKERS', 8), thread_name_prefix='ai-request'
+            )
+    return _executor
+
+
+def get_breaker(model_name):
+    with _lock:
+        breaker = _breakers.get(model_name)
+        if breaker is None:
+            breaker = _breakers[model_name] = CircuitBreaker(
+                model_name,
+                failure_threshold=_setting('AI_BREAKER_FAILURES', 3),
+                reset_timeout=_setting('AI_BREAKER_RESET_SECONDS', 60),
+            )
+    return breaker
+
+
+def reset_breakers():
+    """Сбрасывает состояние предохранителей (тесты, смена ключа API)."""
+    with _lock:
+        _breakers.clear()
+
+
+# =============================================================================
+# --- ЗАПРОСЫ ---
+# =============================================================================
+
+def _retry_after(response):
+    try:
+        return float(response.headers.get('Retry-After'))
+    except (TypeError, ValueError):
+        return None
+
+
+def send_request(model_name, prompt):
+    """Один запрос к модели через общий пул соединений. Возвращает текст ответа."""
+    base_url = _setting('AI_API_BASE_URL', DEFAULT_API_BASE_URL).rstrip('/')
+    url = f"{base_url}/models/{model_name}:generateContent"
+    data = {"contents": [{"parts": [{"text": prompt}]}]}
+
+    response = get_session().post(
+        url, params={'key': settings.GOOGLE_API_KEY}, json=data,
+        timeout=(CONNECT_TIMEOUT, _setting('AI_REQUEST_TIMEOUT', 30)),
+    )
+    if response.status_code == 200:
+        result = response.json()
+        try:
+            return result['candidates'][0]['content']['parts'][0]['text']
+        except (KeyError, IndexError):
+            return ""
+    if response.status_code == 429:
+        raise RateLimited(model_name, _retry_after(response))
+    if response.status_code == 404:
+        raise ModelNotFound(model_name)
+    raise AIClientError(f"HTTP {response.status_code}: {response.text[:200]}")
+
+
+def _call_model(model_name, prompt):
+    """Запрос с учётом предохранителя модели (выполняется в потоке пула)."""
+    breaker = get_breaker(model_name)
+    try:
+        text = send_request(model_name, prompt)
+    except RateLimited as exc:
+        breaker.record_failure(cooldown=exc.retry_after or breaker.reset_timeout)
+        raise
+    except ModelNotFound:
+        breaker.record_failure(cooldown=NOT_FOUND_COOLDOWN)
+        raise
+    except Exception:
+        breaker.record_failure()
+        raise
+    breaker.record_success()
+    return text
+
+
+def generate(prompt, models=None):
+    """
+    Ответ первой успешно ответившей модели (хеджированные запросы).
+
+    Модели запускаются по порядку; следующая стартует, когда предыдущая
+    упала или не ответила за AI_HEDGE_DELAY секунд. Общий срок —
+    AI_TOTAL_TIMEOUT; запросы, не успевшие к ответу, дорабатывают в фоне
+    и лишь обновляют предохранители.
+    """
+    models = list(models or _setting('AI_MODELS', DEFAULT_MODELS))
+    hedge_delay = _setting('AI_HEDGE_DELAY', 4)
+    deadline = time.monotonic() + _setting('AI_TOTAL_TIMEOUT', 45)
+    executor = _get_executor()
+
+    candidates = list(models)
+    pending = {}
+    launched = 0
+    launch_next = True
+    last_error = None
+    while True:
+        if launch_next:
+            launch_next = False
+            # Предохранитель проверяется в момент запуска: пробный запрос
+            # half-open резервируется только для реально отправленной модели
+            while candidates:
+                model = candidates.pop(0)
+                if get_breaker(model).allow():
+                    pending[executor.submit(_call_model, model, prompt)] = model
+                    launched += 1
+                    break
+        if not pending:
+            break
+
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            break
+        timeout = min(hedge_delay, remaining) if candidates else remaining
+        done, _ = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+        if not done:
+            # Никто не ответил за hedge_delay — запускаем следующую модель параллельно
+            launch_next = True
+            continue
+
+        for future in done:
+            model = pending.pop(future)
+            try:
+                return future.result()
+            except Exception as exc:
+                logger.info("AI: модель %s не ответила: %s", model, exc)
+                last_error = exc
+                launch_next = True
+
+    if not launched:
+        raise AllModelsFailed("Все модели временно отключены предохранителями")
+    raise AllModelsFailed(f"Нет ответа от моделей. Последняя ошибка: {last_error or 'таймаут'}")
@@ -0,0 +1,476 @@
+# D:\New_GAT\core\ai_intents.py
+
+"""
+Локальный маршрутизатор вопросов AI-чата (без вызова модели).
+
+Частые аналитические вопросы разбираются правилами:
+  * топ-N учеников / школ / классов по тесту;
+  * средний балл по школам, классам или предметам;
+  * история результатов ученика;
+  * группа риска (предметы, где ученик набрал меньше AI_AT_RISK_THRESHOLD %).
+
+Сущности (школа, класс, номер GAT, четверть, предмет, ученик) сверяются со
+справочниками из кеша (get_reference_data), ответ строится заранее
+проверенным ORM-запросом — миллисекунды вместо секунд ожидания модели.
+
+match_intent() возвращает IntentMatch или None: тогда вопрос идёт прежним
+путём (быстрый поиск или модель). Доля вопросов, отвеченных локально,
+считается по журналу вопросов (AI_QUESTION_LOG) командой ai_intent_hit_rate.
+"""
+
+import json
+import re
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Q, Sum
+
+from .models import Quarter, School, SchoolClass, Student, StudentResult, Subject
+from .search_key import name_fragment
+
+REFERENCE_CACHE_KEY = 'ai_intents:reference'
+DEFAULT_LIMIT = 10
+
+# Вопросы, которые правилами не разобрать: объяснения, сравнения, прогнозы
+_SKIP_RE = re.compile(r'почему|зачем|объясни|как ты|сравни|корреляц|прогноз|посчитал')
+_TEST_RE = re.compile(r'(?:gat|гат)[-\s]*([1-4])\b')
+_QUARTER_RE = re.compile(r'\b([1-4]|iv|i{1,3})[-\s]*(?:я|й|ой|ей)?\s+четверт')
+_CLASS_RE = re.compile(r'(?<![\w-])(1[01]|[1-9])-?([а-яa-z])\b')
+# «10 класс», «учеников 10-го класса»; «5 классов» — это количество, а не параллель
+_PARALLEL_RE = re.compile(r'(?<![\w-])(1[01]|[1-9])(?:-?(?:й|го|х|ые|ых|ом|ой))?\s+класс(?:а|е|у|ом)?\b')
+_LIMIT_RE = re.compile(r'(?:топ|top)[-\s]*(\d{1,3})\b|\b(\d{1,3})\s+(?:лучш|худш|перв|сильн|слаб)')
+_STUDENT_ID_RE = re.compile(r'\b0*(\d{4,})\b')
+
+_HISTORY_RE = re.compile(r'истори[яию] (?:результат|ученик|оцен|балл)|динамик|прогресс|все результаты|результаты ученика')
+_AT_RISK_RE = re.compile(r'риск|отстающ|слабы|неуспева')
+_AVERAGE_RE = re.compile(r'средн')
+_TOP_RE = re.compile(r'\bтоп\b|\btop\b|лучш|рейтинг|сильнейш|худш|слабейш|\bперв(?:ые|ых)\b')
+_WORST_RE = re.compile(r'худш|слабейш')
+
+ROMAN_QUARTERS = {'i': '1', 'ii': '2', 'iii': '3', 'iv': '4'}
+# Слова в названиях школ, которые сами по себе школу не определяют
+GENERIC_SCHOOL_WORDS = {'школа', 'мактаби', 'муассисаи', 'лицей', 'гимназия', 'мту', 'номер'}
+# Слова с заглавной буквы, которые не являются именами учеников
+NOT_NAMES = {
+    'покажи', 'найди', 'выведи', 'составь', 'дай', 'какой', 'какие', 'кто', 'история',
+    'динамика', 'прогресс', 'результаты', 'все', 'ученик', 'ученика', 'ученицы', 'gat', 'гат',
+}
+
+
+def _normalize(text):
+    text = text.lower().replace('ё', 'е')
+    return re.sub(r'\s+', ' ', re.sub(r'[^\w-]+', ' ', text)).strip()
+
+
+def _stem(token):
+    """Основа слова для сравнения с учётом падежных окончаний (математике ~ математика)."""
+    if token.isdigit() or len(token) < 5:
+        return token
+    return token[:max(4, len(token) - 2)]
+
+
+def _has_token(tokens, word):
+    stem = _stem(word)
+    if stem == word:
+        return word in tokens
+    return any(token.startswith(stem) for token in tokens)
+
+
+# =============================================================================
+# --- СПРАВОЧНИКИ ---
+# =============================================================================
+
+def get_reference_data():
+    """Школы, классы, предметы и четверти для разбора вопросов (кеш AI_INTENT_REFERENCE_TTL)."""
+    data = cache.get(REFERENCE_CACHE_KEY)
+    if data is None:
+        data = {
+            'schools': list(School.objects.values('id', 'name')),
+            'classes': list(SchoolClass.objects.values('id', 'name', 'school_id', 'parent_id')),
+            'subjects': list(Subject.objects.values('id', 'name', 'abbreviation')),
+            # Порядок модели: сначала четверти последнего учебного года
+            'quarters': list(Quarter.objects.values('id', 'name', 'year__name')),
+        }
+        cache.set(REFERENCE_CACHE_KEY, data, timeout=getattr(settings, 'AI_INTENT_REFERENCE_TTL', 300))
+    return data
+
+
+def invalidate_reference_data():
+    cache.delete(REFERENCE_CACHE_KEY)
+
+
+# =============================================================================
+# --- СУЩНОСТИ ---
+# =============================================================================
+
+class Entities:
+    """Сущности, найденные в вопросе; id уже ограничены доступными школами."""
+
+    def __init__(self, question, allowed_ids, reference):
+        self.question = question
+        self.text = _normalize(question)
+        self.tokens = self.text.split()
+        self.allowed_ids = set(allowed_ids)
+        self.reference = reference
+
+        self.gat_number = self._find_gat_number()
+        self.quarter = self._find_quarter()
+        self.school_ids = self._find_schools()
+        self.class_label, self.class_ids = self._find_classes()
+        self.subjects = self._find_subjects()
+        self.limit = self._find_limit()
+
+    def _find_gat_number(self):
+        match = _TEST_RE.search(self.text)
+        return int(match.group(1)) if match else None
+
+    def _find_quarter(self):
+        match = _QUARTER_RE.search(self.text)
+        if not match:
+            return None
+        number = ROMAN_QUARTERS.get(match.group(1), match.group(1))
+        for quarter in self.reference['quarters']:
+            tokens = _normalize(quarter['name']).split()
+            if number in (ROMAN_QUARTERS.get(token, token) for token in tokens):
+                return quarter
+        return None
+
+    def _find_schools(self):
+        """Школы, все значимые слова названия которых есть в вопросе (самое точное совпадение)."""
+        best, best_score = [], 0
+        tokens = set(self.tokens)
+        for school in self.reference['schools']:
+            if school['id'] not in self.allowed_ids:
+                continue
+            name_tokens = _normalize(school['name']).split()
+            significant = [t for t in name_tokens if t not in GENERIC_SCHOOL_WORDS] or name_tokens
+            if all(t.isdigit() for t in significant):
+                # «Лицей №1»: одной цифры мало, нужно и слово «лицей»
+                significant = name_tokens
+            if all(_has_token(tokens, t) for t in significant):
+                if len(significant) > best_score:
+                    best, best_score = [school['id']], len(significant)
+                elif len(significant) == best_score:
+                    best.append(school['id'])
+        return best
+
+    def _find_classes(self):
+        """(метка, id классов): «10А» — класс, «10 класс» — параллель со всеми подклассами."""
+        match = _CLASS_RE.search(self.text)
+        if match:
+            label = f"{match.group(1)}{match.group(2)}"
+        else:
+            match = _PARALLEL_RE.search(self.text)
+            limit = _LIMIT_RE.search(self.text)
+            if not match or (limit and limit.start() <= match.start(1) < limit.end()):
+                # «топ 3 класса» — число означает количество
+                return None, []
+            label = match.group(1)
+        school_ids = set(self.school_ids) or self.allowed_ids
+        ids = [
+            c['id'] for c in self.reference['classes']
+            if c['school_id'] in school_ids and _normalize(c['name']) == label
+        ]
+        return label.upper(), ids
+
+    def _find_subjects(self):
+        tokens = set(self.tokens)
+        found = []
+        for subject in self.reference['subjects']:
+            name_tokens = _normalize(subject['name']).split()
+            abbreviation = _normalize(subject['abbreviation'] or '')
+            if (name_tokens and all(_has_token(tokens, t) for t in name_tokens)) or (abbreviation and abbreviation in tokens):
+                found.append(subject)
+        return found
+
+    def _find_limit(self):
+        match = _LIMIT_RE.search(self.text)
+        if not match:
+            return None
+        return min(int(match.group(1) or match.group(2)), getattr(settings, 'AI_INTENT_MAX_ROWS', 100))
+
+    def find_students(self, limit=5):
+        """Ученики из вопроса (по ID или по имени/фамилии с заглавной буквы) в доступных школах."""
+        students = Student.objects.filter(school_class__school_id__in=self.school_ids or self.allowed_ids)
+        match = _STUDENT_ID_RE.search(self.question)
+        if match:
+            code = match.group(1)
+            found = students.filter(Q(student_id=code) | Q(student_id=match.group(0)) | Q(pk=int(code)))
+            return list(found.select_related('school_class')[:limit])
+
+        known = set(GENERIC_SCHOOL_WORDS)
+        for school in self.reference['schools']:
+            known.update(_normalize(school['name']).split())
+        for subject in self.reference['subjects']:
+            known.update(_normalize(subject['name']).split())
+        words = [
+            w for w in re.findall(r'\b[А-ЯЁA-Z][а-яёa-z]{1,}\b', self.question)
+            if _normalize(w) not in NOT_NAMES and _normalize(w) not in known
+        ]
+        if not words:
+            return []
+        condition = Q()
+        for word in words[:2]:
+            # Целое слово в ключе поиска: без учёта регистра, ё/е и латинских двойников
+            condition &= Q(search_key__contains=name_fragment(word))
+        return list(students.filter(condition).select_related('school_class')[:limit + 1])
+
+
+# =============================================================================
+# --- ОТВЕТЫ ---
+# =============================================================================
+
+class IntentMatch:
+    """
+    Распознанный вопрос: колонки таблицы, текст над ней и run() — ORM-запрос,
+    возвращающий строки. signature однозначно описывает запрос (ключ кеша).
+    """
+
+    def __init__(self, name, params, text_response, columns, run):
+        self.name = name
+        self.params = params
+        self.text_response = text_response
+        self.columns = columns
+        self.run = run
+
+    @property
+    def signature(self):
+        return f"intent:{self.name}:{json.dumps(self.params, sort_keys=True, ensure_ascii=False)}"
+
+
+def _scope_results(entities, school_ids):
+    """Результаты в пределах школ, класса и теста из вопроса."""
+    qs = StudentResult.objects.filter(school_id__in=school_ids)
+    if entities.class_ids:
+        qs = qs.filter(Q(school_class_id__in=entities.class_ids) | Q(parallel_id__in=entities.class_ids))
+    return qs
+
+
+def _resolve_test(qs, entities):
+    """
+    Один тест (номер GAT + четверть): недостающее берётся из последнего
+    проведённого теста, чтобы не смешивать результаты разных тестов.
+    Возвращает (qs, подпись, (номер, id четверти)) или (None, None, None),
+    если результатов нет.
+    """
+    if entities.gat_number:
+        qs = qs.filter(gat_test__test_number=entities.gat_number)
+    if entities.quarter:
+        qs = qs.filter(gat_test__quarter_id=entities.quarter['id'])
+    latest = qs.order_by('-gat_test__test_date').values_list(
+        'gat_test__test_number', 'gat_test__quarter_id', 'gat_test__quarter__name'
+    ).first()
+    if latest is None:
+        return None, None, None
+    number, quarter_id, quarter_name = latest
+    qs = qs.filter(gat_test__test_number=number, gat_test__quarter_id=quarter_id)
+    return qs, f"GAT-{number}" + (f", {quarter_name}" if quarter_name else ""), (number, quarter_id)
+
+
+def _student_totals(qs, fields):
+    """Сумма баллов ученика за тест (дни 1 и 2 складываются) с полями группировки."""
+    return qs.values('student_id', *fields).annotate(score=Sum('total_score'))
+
+
+def _correct_total(answers):
+    if isinstance(answers, dict):
+        values = list(answers.values())
+    elif isinstance(answers, list):
+        values = answers
+    else:
+        return 0, 0
+    return sum(1 for v in values if v is True), len(values)
+
+
+def _top_students(entities, qs, worst):
+    limit = entities.limit or DEFAULT_LIMIT
+
+    def run():
+        totals = _student_totals(qs, [
+            'student__last_name_ru', 'student__first_name_ru',
+            'student__school_class__name', 'student__school_class__school__name',
+        ]).order_by('score' if worst else '-score', 'student__last_name_ru')[:limit]
+        return [
+            (place, f"{t['student__last_name_ru']} {t['student__first_name_ru']}",
+             t['student__school_class__name'], t['student__school_class__school__name'], t['score'])
+            for place, t in enumerate(totals, start=1)
+        ]
+
+    label = "Худшие" if worst else "Топ"
+    return 'top_students', {'limit': limit, 'worst': worst}, f"🏆 {label}-{limit} учеников:", \
+        ['Место', 'Ученик', 'Класс', 'Школа', 'Балл'], run
+
+
+def _group_average(entities, qs, level, limit=None, worst=False):
+    """Средний балл учеников (сумма за тест) по школам или классам."""
+    # Группы — школа и класс на момент теста (те же поля, что и в фильтре)
+    fields = ['school__name']
+    if level == 'class':
+        fields.append('school_class__name')
+
+    def run():
+        groups = defaultdict(list)
+        for total in _student_totals(qs, fields):
+            groups[tuple(total[f] for f in fields)].append(total['score'])
+        rows = [(*key, round(sum(scores) / len(scores), 1), len(scores)) for key, scores in groups.items()]
+        rows.sort(key=lambda row: (row[-2] if worst else -row[-2], row[:-2]))
+        if limit:
+            rows = rows[:limit]
+        return [(place, *row) for place, row in enumerate(rows, start=1)]
+
+    columns = ['Место', 'Школа'] + (['Класс'] if level == 'class' else []) + ['Средний балл', 'Учеников']
+    what = "классам" if level == 'class' else "школам"
+    return f'average_by_{level}', {'limit': limit, 'worst': worst}, f"📊 Средний балл по {what}:", columns, run
+
+
+def _subject_average(entities, qs):
+    """Доля верных ответов по предметам (scores_by_subject)."""
+    subject_ids = {str(s['id']) for s in entities.subjects}
+    names = {str(s['id']): s['name'] for s in entities.reference['subjects']}
+
+    def run():
+        stats = defaultdict(lambda: [0, 0])
+        for scores in qs.values_list('scores_by_subject', flat=True).iterator(chunk_size=2000):
+            if not isinstance(scores, dict):
+                continue
+            for sid, answers in scores.items():
+                if subject_ids and str(sid) not in subject_ids:
+                    continue
+                correct, total = _correct_total(answers)
+                stats[str(sid)][0] += correct
+                stats[str(sid)][1] += total
+        rows = [
+            (names.get(sid, sid), round(100 * correct / total, 1), total)
+            for sid, (correct, total) in stats.items() if total
+        ]
+        return sorted(rows, key=lambda row: -row[1])
+
+    return 'average_by_subject', {'subjects': sorted(subject_ids)}, "📚 Средний балл по предметам:", \
+        ['Предмет', 'Средний балл, %', 'Ответов'], run
+
+
+def _at_risk(entities, qs):
+    """Ученики с долей верных ответов по предмету ниже порога."""
+    threshold = getattr(settings, 'AI_AT_RISK_THRESHOLD', 40)
+    limit = entities.limit or getattr(settings, 'AI_INTENT_MAX_ROWS', 100)
+    subject_ids = {str(s['id']) for s in entities.subjects}
+    names = {str(s['id']): s['name'] for s in entities.reference['subjects']}
+
+    def run():
+        info = {}
+        stats = defaultdict(lambda: [0, 0])
+        values = qs.values_list(
+            'student_id', 'student__last_name_ru', 'student__first_name_ru',
+            'student__school_class__name', 'student__school_class__school__name', 'scores_by_subject',
+        )
+        for student_id, last_name, first_name, class_name, school_name, scores in values.iterator(chunk_size=2000):
+            info[student_id] = (f"{last_name} {first_name}", class_name, school_name)
+            if not isinstance(scores, dict):
+                continue
+            for sid, answers in scores.items():
+                if subject_ids and str(sid) not in subject_ids:
+                    continue
+                correct, total = _correct_total(answers)
+                stats[(student_id, str(sid))][0] += correct
+                stats[(student_id, str(sid))][1] += total
+        rows = []
+        for (student_id, sid), (correct, total) in stats.items():
+            percent = round(100 * correct / total, 1) if total else None
+            if percent is not None and percent < threshold:
+                rows.append((*info[student_id], names.get(sid, sid), percent))
+        rows.sort(key=lambda row: (row[-1], row[0]))
+        return rows[:limit]
+
+    return 'at_risk', {'limit': limit, 'threshold': threshold, 'subjects': sorted(subject_ids)}, \
+        f"⚠️ Группа риска (меньше {threshold}% по предмету):", \
+        ['Ученик', 'Класс', 'Школа', 'Предмет', 'Балл, %'], run
+
+
+def _student_history(students):
+    ids = [student.pk for student in students]
+    many = len(ids) > 1
+
+    def run():
+        results = StudentResult.objects.filter(student_id__in=ids).values_list(
+            'student__last_name_ru', 'student__first_name_ru', 'gat_test__name',
+            'gat_test__test_date', 'gat_test__quarter__name', 'total_score',
+        ).order_by('student__last_name_ru', 'student__first_name_ru', 'gat_test__test_date', 'gat_test__day')
+        rows = []
+        for last_name, first_name, test_name, test_date, quarter_name, score in results:
+            row = (test_name, test_date.strftime('%d.%m.%Y'), quarter_name or '—', score)
+            rows.append((f"{last_name} {first_name}", *row) if many else row)
+        return rows
+
+    title = "учеников" if many else f"ученика {students[0].full_name_ru} ({students[0].school_class.name})"
+    columns = (['Ученик'] if many else []) + ['Тест', 'Дата', 'Четверть', 'Балл']
+    return 'student_history', {'students': ids}, f"📈 История результатов {title}:", columns, run
+
+
+def _describe_scope(entities, test_label):
+    parts = []
+    if entities.class_label:
+        parts.append(f"класс {entities.class_label}")
+    if test_label:
+        parts.append(test_label)
+    if entities.subjects:
+        parts.append(", ".join(s['name'] for s in entities.subjects))
+    return f" ({'; '.join(parts)})" if parts else ""
+
+
+def match_intent(question, allowed_ids):
+    """IntentMatch для частого аналитического вопроса или None (вопрос уходит модели)."""
+    entities = Entities(question, allowed_ids, get_reference_data())
+    text = entities.text
+    if _SKIP_RE.search(text):
+        return None
+    # Упомянутый класс, которого нет в доступных школах, правилами не разобрать
+    if entities.class_label and not entities.class_ids:
+        return None
+    school_ids = entities.school_ids or sorted(entities.allowed_ids)
+
+    def scoped():
+        """Результаты одного теста; пустой queryset, если результатов нет."""
+        qs, label, test = _resolve_test(_scope_results(entities, school_ids), entities)
+        scope['label'], scope['test'] = label, test
+        return qs if qs is not None else StudentResult.objects.none()
+
+    scope = {'label': None, 'test': None}
+    spec = None
+    if _AT_RISK_RE.search(text):
+        spec = _at_risk(entities, scoped())
+    elif _HISTORY_RE.search(text) and not _AVERAGE_RE.search(text):
+        students = entities.find_students()
+        if not students or len(students) > 5:
+            return None
+        spec = _student_history(students)
+    elif _AVERAGE_RE.search(text):
+        if entities.subjects or 'предмет' in text:
+            spec = _subject_average(entities, scoped())
+        elif 'класс' in text:
+            spec = _group_average(entities, scoped(), 'class')
+        else:
+            spec = _group_average(entities, scoped(), 'school')
+    elif _TOP_RE.search(text):
+        worst = bool(_WORST_RE.search(text))
+        limit = entities.limit or DEFAULT_LIMIT
+        if re.search(r'учени|студент', text):
+            spec = _top_students(entities, scoped(), worst)
+        elif 'школ' in text and not entities.school_ids:
+            spec = _group_average(entities, scoped(), 'school', limit, worst)
+        elif 'класс' in text and not entities.class_ids:
+            spec = _group_average(entities, scoped(), 'class', limit, worst)
+        else:
+            spec = _top_students(entities, scoped(), worst)
+    if spec is None:
+        return None
+
+    name, params, text_response, columns, run = spec
+    params.update({
+        'schools': sorted(school_ids),
+        'classes': sorted(entities.class_ids),
+        'test': scope['test'],
+    })
+    if name != 'student_history':
+        text_response = text_response.rstrip(':') + _describe_scope(entities, scope['label']) + ":"
+    return IntentMatch(name, params, text_response, columns, run)
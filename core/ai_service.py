@@ -1,15 +1,26 @@
 # D:\Project Archive\GAT\core\ai_service.py
 
+import hashlib
 import json
 import logging
 import re
+import sys
+import threading
 import time
-import requests
+from concurrent.futures import Future
+from contextlib import ExitStack
 from django.conf import settings
-from django.db import connection
+from django.core.cache import cache
+from django.urls import reverse
+from . import ai_client
+from . import ai_sql_sandbox as sandbox
+from .ai_intents import match_intent
+from .data_version import get_data_stamp
+from .search_key import normalize_words
 from .views.permissions import get_accessible_schools
 
 logger = logging.getLogger(__name__)
+question_logger = logging.getLogger('ai_question_logger')
 
 # ==========================================
 # 1. ВСПОМОГАТЕЛЬНЫЕ ФУНКЦИИ (ПОЛНЫЕ ВЕРСИИ)
@@ -50,60 +61,21 @@ def _is_safe_sql(sql):
 
 def _send_direct_request(model_name, prompt):
     """
-    Отправляет запрос к Google API.
+    Отправляет запрос к Google API (через общий пул соединений ai_client).
     """
-    api_key = settings.GOOGLE_API_KEY
-    url = f"https://generativelanguage.googleapis.com/v1beta/models/{model_name}:generateContent?key={api_key}"
-    
-    headers = {'Content-Type': 'application/json'}
-    data = {"contents": [{"parts": [{"text": prompt}]}]}
-
-    response = requests.post(url, headers=headers, json=data, timeout=45) # Таймаут 45 сек
-    
-    if response.status_code == 200:
-        result = response.json()
-        try:
-            return result['candidates'][0]['content']['parts'][0]['text']
-        except (KeyError, IndexError):
-            return ""
-    elif response.status_code == 429:
-        raise Exception("429_LIMIT")
-    elif response.status_code == 404:
-        raise Exception(f"404_NOT_FOUND (Model {model_name})")
-    else:
-        raise Exception(f"HTTP {response.status_code}: {response.text}")
+    return ai_client.send_request(model_name, prompt)
 
 def _get_ai_response(prompt):
     """
-    Умный перебор моделей (Failover system).
+    Умный перебор моделей (Failover system): предохранители по моделям и
+    хеджированные запросы — см. core/ai_client.py.
     """
-    # Список моделей от самой быстрой/умной к старым
-    models_to_try = [
-        "gemini-2.0-flash-exp",          # Самая новая и быстрая
-        "gemini-1.5-flash",              # Стабильная быстрая
-        "gemini-1.5-pro",                # Умная, но медленнее
-        "gemini-pro"                     # Старая надежная
-    ]
-    
-    last_error = None
-    
-    for model in models_to_try:
-        try:
-            return _send_direct_request(model, prompt)
-        except Exception as e:
-            error_str = str(e)
-            if "429_LIMIT" in error_str:
-                time.sleep(1.5) # Пауза перед следующей моделью
-                continue
-            elif "404_NOT_FOUND" in error_str:
-                continue
-            
-            last_error = e
-            continue
-            
-    # Если все модели упали
-    logger.critical(f"All AI models failed. Last error: {last_error}")
-    raise Exception("AI_SERVICE_UNAVAILABLE")
+    try:
+        return ai_client.generate(prompt)
+    except ai_client.AllModelsFailed as e:
+        # Если все модели упали
+        logger.critical(f"All AI models failed. {e}")
+        raise Exception("AI_SERVICE_UNAVAILABLE")
 
 def _extract_student_info_from_query(query):
     """
@@ -260,6 +232,169 @@ def _is_search_query(query):
     
     return False
 
+# ==========================================
+# 1.1 КЕШ ОТВЕТОВ И ДЕДУПЛИКАЦИЯ ЗАПРОСОВ
+# ==========================================
+# Уровень 1: нормализованный вопрос + отпечаток доступных школ + история чата -> SQL от модели
+#            (TTL AI_SQL_CACHE_TTL: модель может ответить лучше, данные тут ни при чём).
+# Уровень 2: SQL + версия данных школ -> готовый HTML таблицы
+#            (устаревает сам при изменении данных, см. data_version).
+# Одинаковые запросы, пришедшие одновременно, выполняются один раз (single-flight).
+
+AI_CACHE_PREFIX = 'ai_chat'
+AI_CACHE_COUNTERS = ['sql_hit', 'sql_miss', 'table_hit', 'table_miss', 'shared', 'intent_hit', 'intent_miss']
+
+_flights = {}
+_flights_lock = threading.Lock()
+
+
+def _digest(*parts):
+    return hashlib.sha256('\x1f'.join(parts).encode('utf-8')).hexdigest()
+
+
+def _normalize_question(question):
+    """Вопросы, отличающиеся регистром, пробелами и знаками в конце, считаются одинаковыми."""
+    text = question.lower().replace('ё', 'е')
+    text = re.sub(r'\s+', ' ', text).strip()
+    return text.rstrip('?!. ')
+
+
+def _schools_fingerprint(allowed_ids):
+    return ','.join(map(str, sorted(allowed_ids)))
+
+
+def _sql_cache_key(question, allowed_ids, history_text=''):
+    # История входит в промпт ("а по классам?" зависит от предыдущего вопроса),
+    # поэтому и в ключ: без неё уточняющий вопрос получил бы чужой SQL
+    return f"{AI_CACHE_PREFIX}:sql:{_digest(_normalize_question(question), _schools_fingerprint(allowed_ids), history_text)}"
+
+
+def _table_cache_key(sql, text_response, data_token):
+    return f"{AI_CACHE_PREFIX}:table:{_digest(sql, text_response or '', data_token)}"
+
+
+def _count(name):
+    key = f"{AI_CACHE_PREFIX}:stats:{name}"
+    cache.add(key, 0, timeout=None)
+    try:
+        cache.incr(key)
+    except ValueError:
+        # Ключ вытеснен из кеша между add и incr
+        cache.set(key, 1, timeout=None)
+
+
+def get_ai_cache_stats():
+    """Счётчики попаданий/промахов кеша AI-чата (для настройки TTL)."""
+    keys = {name: f"{AI_CACHE_PREFIX}:stats:{name}" for name in AI_CACHE_COUNTERS}
+    values = cache.get_many(list(keys.values()))
+    stats = {name: values.get(key, 0) for name, key in keys.items()}
+    for level in ('sql', 'table', 'intent'):
+        total = stats[f'{level}_hit'] + stats[f'{level}_miss']
+        stats[f'{level}_hit_rate'] = round(100 * stats[f'{level}_hit'] / total, 1) if total else None
+    return stats
+
+
+def _log_question(question, route):
+    """Журнал вопросов (AI_QUESTION_LOG): по нему ai_intent_hit_rate считает долю локальных ответов."""
+    question_logger.info(json.dumps({
+        'ts': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'question': question,
+        'route': route,
+    }, ensure_ascii=False))
+
+
+def _single_flight(key, func):
+    """
+    Выполняет func() один раз на ключ: параллельные вызовы с тем же ключом
+    ждут результат первого (в пределах процесса).
+    """
+    with _flights_lock:
+        future = _flights.get(key)
+        is_leader = future is None
+        if is_leader:
+            future = _flights[key] = Future()
+    if not is_leader:
+        _count('shared')
+        return future.result(timeout=getattr(settings, 'AI_SINGLE_FLIGHT_WAIT', 60))
+
+    try:
+        result = func()
+    except BaseException as exc:
+        future.set_exception(exc)
+        raise
+    else:
+        future.set_result(result)
+        return result
+    finally:
+        with _flights_lock:
+            _flights.pop(key, None)
+
+
+def _ask_model_for_sql(sql_key, prompt):
+    """Вызов модели; ответ с SQL кешируется (болтовня зависит от истории чата — нет)."""
+    data = _extract_json(_get_ai_response(prompt))
+    if data.get("is_sql_needed") and data.get("sql"):
+        cache.set(sql_key, data, timeout=getattr(settings, 'AI_SQL_CACHE_TTL', 600))
+    return data
+
+
+def _page_cache_key(token):
+    return f"{AI_CACHE_PREFIX}:page:{token}"
+
+
+def _register_table(sql, text_response, allowed_ids):
+    """
+    Токен результата для постраничной подгрузки: SQL, текст и школы, для
+    которых SQL построен (по ним проверяется доступ). Одинаковые запросы
+    получают один токен — ответы из кеша уровня 2 остаются рабочими.
+    """
+    token = _digest(sql, text_response or '', _schools_fingerprint(allowed_ids))[:32]
+    cache.set(_page_cache_key(token), {
+        'sql': sql,
+        'text_response': text_response,
+        'schools': sorted(allowed_ids),
+    }, timeout=getattr(settings, 'AI_TABLE_PAGE_TTL', 86400))
+    return token
+
+
+def _cache_table(table_key, output):
+    cache.set(table_key, output, timeout=getattr(settings, 'AI_TABLE_CACHE_TTL', 3600))
+
+
+def _collect_and_cache(table_key, events):
+    output, cacheable = _collect(events)
+    if cacheable:
+        _cache_table(table_key, output)
+    return output
+
+
+def _iter_cached_answer(table_key, make_events, stream):
+    """
+    Уровень 2 кеша: готовый ответ по ключу таблицы, иначе события make_events().
+    Без stream одинаковые параллельные запросы выполняются один раз.
+    """
+    output = cache.get(table_key)
+    if output is not None:
+        _count('table_hit')
+        yield 'html', output
+        return
+    _count('table_miss')
+    if not stream:
+        yield 'html', _single_flight(table_key, lambda: _collect_and_cache(table_key, make_events()))
+        return
+
+    parts = []
+    cacheable = True
+    for kind, payload in make_events():
+        if kind == 'error':
+            cacheable = False
+        if kind != 'status':
+            parts.append(payload)
+        yield kind, payload
+    if cacheable:
+        _cache_table(table_key, ''.join(parts))
+
+
 # ==========================================
 # 2. НОВЫЙ МОДУЛЬ: BEAUTIFIER (КРАСИВЫЙ HTML)
 # ==========================================
@@ -345,6 +480,210 @@ def _format_value_smart(val, col_name):
     return str(val)
 
 
+# Статусы потокового ответа (см. iter_answer_events)
+STATUS_THINKING = 'thinking'
+STATUS_QUERY = 'query'
+STATUS_RENDERING = 'rendering'
+AI_STATUS_LABELS = {
+    STATUS_THINKING: '🤔 Думаю над вопросом...',
+    STATUS_QUERY: '⚙️ Выполняю запрос к базе...',
+    STATUS_RENDERING: '📊 Формирую таблицу...',
+}
+
+
+def _column_title(col):
+    col_name = str(col).replace('_', ' ').replace('ru', '').strip().title()
+    if 'First Name' in col_name or 'Last Name' in col_name: col_name = 'Ученик'
+    if 'Class Name' in col_name: col_name = 'Класс'
+    if 'School Name' in col_name: col_name = 'Школа'
+    if 'Total Score' in col_name or 'Avg Score' in col_name: col_name = 'Балл'
+    return col_name
+
+
+def _render_row(index, row, columns):
+    row_class = "bg-white hover:bg-indigo-50/40 transition-colors" if index % 2 == 0 else "bg-slate-50/50 hover:bg-indigo-50/40 transition-colors"
+    cells = ''.join(
+        # 🔥 ВОТ ГЛАВНОЕ ИЗМЕНЕНИЕ: ВЫЗОВ BEAUTIFIER 🔥
+        f'<td class="px-6 py-3 text-gray-700 align-middle">{_format_value_smart(val, columns[j])}</td>'
+        for j, val in enumerate(row)
+    )
+    return f'<tr class="{row_class}">{cells}</tr>'
+
+
+def _iter_page_batches(first, cursor, limit, batch_size, state):
+    """Порции строк страницы (не больше limit); state['has_next'] — есть ли строки дальше."""
+    batch, shown = first, 0
+    while batch:
+        take = batch[:limit - shown]
+        if len(take) < len(batch):
+            state['has_next'] = True
+        if take:
+            yield take
+            shown += len(take)
+        if shown >= limit:
+            state['has_next'] = state.get('has_next') or bool(cursor.fetchmany(1))
+            return
+        batch = cursor.fetchmany(batch_size)
+
+
+def _pager_html(token, page, offset, shown, has_next):
+    """Навигация по страницам результата: HTMX подгружает соседнюю страницу на место таблицы."""
+    url = reverse('core:ai_table_page', args=[token])
+    button = 'px-3 py-1 bg-white border border-gray-200 rounded-lg font-bold text-indigo-600 hover:bg-indigo-50 transition-all'
+    buttons = ''
+    if page > 1:
+        buttons += f'<button hx-get="{url}?page={page - 1}" hx-target="closest .ai-table" hx-swap="outerHTML" class="{button}">← Назад</button>'
+    if has_next and offset + shown < sandbox.max_rows():
+        buttons += f'<button hx-get="{url}?page={page + 1}" hx-target="closest .ai-table" hx-swap="outerHTML" class="{button}">Дальше →</button>'
+    elif has_next:
+        buttons += f'<span>Показаны первые {sandbox.max_rows()} строк</span>'
+    if page == 1 and not buttons:
+        return ''
+    return (
+        '<div class="flex items-center justify-between gap-3 px-4 py-2 border-t border-gray-100 bg-gray-50/60 text-xs text-gray-500">'
+        f'<span>Строки {offset + 1}–{offset + shown}</span><div class="flex items-center gap-2">{buttons}</div></div>'
+    )
+
+
+def _iter_table_events(sql, text_response, token, page=1, fragment=False, batch_size=None):
+    """
+    Выполняет SQL в песочнице (core/ai_sql_sandbox.py) и отдаёт страницу
+    результата событиями (kind, payload):
+      ('status', код)      — этап работы (STATUS_*);
+      ('html', фрагмент)   — текст, шапка таблицы (с открытым <tbody>), подвал;
+      ('rows', строки)     — очередная порция <tr> для последнего <tbody>;
+      ('error', html)      — отказ или ошибка БД (такой ответ не кешируется).
+    Склеенные payload всех событий, кроме status, дают полный HTML ответа;
+    fragment=True — только блок таблицы (для подгрузки страницы через HTMX).
+    """
+    batch_size = batch_size or getattr(settings, 'AI_STREAM_BATCH_SIZE', 50)
+    logger.info(f"Executing SQL: {sql}")
+    max_retries = 2
+
+    if not _is_safe_sql(sql):
+        yield 'error', "🚫 Запрос отклонен системой безопасности."
+        return
+
+    offset = (page - 1) * sandbox.page_size()
+    limit = min(sandbox.page_size(), sandbox.max_rows() - offset)
+    if limit <= 0:
+        yield 'error', f"🚫 Показываются только первые {sandbox.max_rows()} строк."
+        return
+
+    yield 'status', STATUS_QUERY
+    for attempt in range(max_retries):
+        stack = ExitStack()
+        try:
+            cursor = stack.enter_context(sandbox.readonly_cursor(sql))
+            # Лишняя строка показывает, есть ли следующая страница
+            cursor.execute(sandbox.paged_sql(sql, limit + 1, offset))
+            # У серверного курсора description появляется только после первой выборки
+            batch = cursor.fetchmany(min(batch_size, limit + 1))
+            columns = [col[0] for col in cursor.description] if cursor.description else []
+            break
+        except sandbox.SqlRejected as e:
+            stack.__exit__(type(e), e, e.__traceback__)
+            yield 'error', f"🚫 {e}"
+            return
+        except Exception as e:
+            stack.__exit__(type(e), e, e.__traceback__)
+            logger.warning(f"SQL Fail (Try {attempt+1}): {e}")
+            if attempt == max_retries - 1:
+                # Если AI запрос упал, а это был простой поиск, можно попробовать фоллбек (опционально)
+                yield 'error', f"😓 Ошибка базы данных.<br><small class='text-red-500'>{e}</small>"
+                return
+
+    state = {}
+    try:
+        yield from _iter_rendered_table(
+            text_response, columns, _iter_page_batches(batch, cursor, limit, batch_size, state),
+            table_id=f"ai-table-{token[:12]}", fragment=fragment,
+            pager=lambda shown: _pager_html(token, page, offset, shown, state.get('has_next', False)),
+        )
+    except BaseException:
+        # Ошибка или обрыв потока: транзакция песочницы откатывается
+        if not stack.__exit__(*sys.exc_info()):
+            raise
+    else:
+        stack.close()
+
+
+def _iter_rendered_table(text_response, columns, batches, table_id=None, pager=None, fragment=False):
+    """
+    HTML-ответ с таблицей событиями html/rows (см. _iter_table_events).
+    batches — итератор порций строк; порции уходят клиенту по мере получения.
+    pager(число показанных строк) — HTML навигации под таблицей.
+    """
+    # --- ГЕНЕРАЦИЯ КРАСИВОГО HTML (С ИСПОЛЬЗОВАНИЕМ НОВОЙ ФУНКЦИИ) ---
+    if not columns:
+        yield 'html', '' if fragment else text_response
+        return
+
+    batch = next(batches, [])
+    if not batch:
+        yield 'html', f"{'' if fragment else text_response + '<br><br>'}<div class='p-4 bg-yellow-50 text-yellow-800 rounded-xl border border-yellow-200 flex items-center gap-3'><span>🔍</span> По вашему запросу ничего не найдено.</div>"
+        return
+
+    yield 'status', STATUS_RENDERING
+    table_id = table_id or f"ai-table-{int(time.time())}"
+
+    output = '' if fragment else f"<div class='mb-4 text-slate-700 leading-relaxed font-medium'>{text_response}</div>"
+    output += f'<div class="ai-table overflow-hidden border border-gray-200 rounded-xl shadow-sm bg-white mt-2 ring-1 ring-black/5">'
+    output += f'<div class="overflow-x-auto"><table id="{table_id}" class="min-w-full text-sm text-left">'
+
+    # Шапка
+    output += '<thead class="bg-gray-50/90 border-b border-gray-200 text-[11px] uppercase font-bold text-gray-500 tracking-wider"><tr>'
+    for col in columns:
+        output += f'<th class="px-6 py-4 whitespace-nowrap text-indigo-900/80">{_column_title(col)}</th>'
+    output += '</tr></thead>'
+    output += '<tbody class="divide-y divide-gray-100 bg-white">'
+    yield 'html', output
+
+    # Тело таблицы (С КРАСИВЫМ ФОРМАТИРОВАНИЕМ)
+    index = 0
+    while batch:
+        yield 'rows', ''.join(_render_row(index + i, row, columns) for i, row in enumerate(batch))
+        index += len(batch)
+        batch = next(batches, [])
+
+    output = f"</tbody></table></div>{pager(index) if pager else ''}</div>"
+    if not fragment:
+        # Кнопка скачивания
+        output += f'''
+    <div class="mt-3 flex justify-end">
+        <button onclick="downloadCSV('{table_id}')" class="group flex items-center gap-2 px-3 py-1.5 bg-white text-emerald-600 border border-emerald-200 rounded-lg hover:bg-emerald-50 hover:border-emerald-300 transition-all text-xs font-bold shadow-sm">
+            <svg class="w-3.5 h-3.5" fill="none" stroke="currentColor" viewBox="0 0 24 24"><path stroke-linecap="round" stroke-linejoin="round" stroke-width="2" d="M4 16v1a3 3 0 003 3h10a3 3 0 003-3v-1m-4-4l-4 4m0 0l-4-4m4 4V4"></path></svg>
+            <span>Скачать CSV</span>
+        </button>
+    </div>
+    '''
+    yield 'html', output
+
+
+def _iter_intent_events(intent, batch_size=None):
+    """Ответ локального роутера (core/ai_intents.py) в том же формате событий, что и SQL."""
+    batch_size = batch_size or getattr(settings, 'AI_STREAM_BATCH_SIZE', 50)
+    yield 'status', STATUS_QUERY
+    rows = intent.run()
+    batches = (rows[i:i + batch_size] for i in range(0, len(rows), batch_size))
+    yield from _iter_rendered_table(intent.text_response, intent.columns, batches)
+
+
+def _collect(events):
+    """Склеивает события в (html, cacheable); cacheable=False, если была ошибка."""
+    parts = []
+    cacheable = True
+    for kind, payload in events:
+        if kind == 'status':
+            continue
+        if kind == 'error':
+            cacheable = False
+        parts.append(payload)
+    return ''.join(parts), cacheable
+
+
+
+
 # ==========================================
 # 3. ОСНОВНАЯ ЛОГИКА (ASK DATABASE)
 # ==========================================
@@ -353,11 +692,23 @@ def ask_database(user, user_question, chat_history=None):
     """
     Генерирует SQL запрос, выполняет его и возвращает красивый HTML-ответ.
     """
+    events = iter_answer_events(user, user_question, chat_history, stream=False)
+    return ''.join(payload for kind, payload in events if kind != 'status')
+
+
+def iter_answer_events(user, user_question, chat_history=None, stream=True):
+    """
+    Ответ на вопрос событиями (kind, payload) — формат см. _iter_table_events.
+    При stream=True таблица отдаётся порциями строк по мере чтения из БД
+    (потоковый чат); при stream=False — одним фрагментом, а одинаковые
+    параллельные запросы выполняются один раз.
+    """
     
     # --- ШАГ 1: Проверка доступа ---
     allowed_schools_qs = get_accessible_schools(user)
     if not allowed_schools_qs.exists():
-        return "😔 У вас пока нет доступа к данным школ. Обратитесь к администратору."
+        yield 'html', "😔 У вас пока нет доступа к данным школ. Обратитесь к администратору."
+        return
         
     allowed_ids = list(allowed_schools_qs.values_list('id', flat=True))
     allowed_ids_str = ", ".join(map(str, allowed_ids))
@@ -415,11 +766,10 @@ def ask_database(user, user_question, chat_history=None):
         JOIN core_school sch ON sc.school_id = sch.id
         WHERE sch.id IN ({allowed_ids_str})
         """
-        conditions = []
-        if student_info['first_name']:
-            conditions.append(f"(s.first_name_ru ILIKE '%{student_info['first_name']}%' OR s.last_name_ru ILIKE '%{student_info['first_name']}%')")
-        if student_info['last_name']:
-            conditions.append(f"(s.first_name_ru ILIKE '%{student_info['last_name']}%' OR s.last_name_ru ILIKE '%{student_info['last_name']}%')")
+        # Имя ищется по нормализованному ключу (индекс pg_trgm) с начала слова;
+        # normalize_words оставляет только буквы и цифры — в SQL не попадут кавычки
+        name_words = normalize_words(f"{student_info['first_name'] or ''} {student_info['last_name'] or ''}")
+        conditions = [f"s.search_key LIKE '% {word}%'" for word in name_words]
         
         if conditions: sql += " AND (" + " OR ".join(conditions) + ")"
         if student_info['class_name']: sql += f" AND sc.name ILIKE '%{student_info['class_name']}%'"
@@ -428,9 +778,26 @@ def ask_database(user, user_question, chat_history=None):
         sql += " ORDER BY s.last_name_ru, s.first_name_ru LIMIT 50"
         text_response = f"🔍 Результаты поиска:"
         search_type = 'name'
+
+    # СТРАТЕГИЯ 3: Локальный роутер частых аналитических вопросов (без модели)
+    intent = None
+    if not sql and getattr(settings, 'AI_INTENT_ROUTER_ENABLED', True):
+        try:
+            intent = match_intent(user_question, allowed_ids)
+        except Exception as e:
+            logger.warning(f"Intent router failed: {e}")
+        _count('intent_hit' if intent else 'intent_miss')
+    _log_question(user_question, f"intent:{intent.name}" if intent else search_type or 'model')
+
+    if intent:
+        data_token = get_data_stamp(allowed_ids)[0]
+        table_key = _table_cache_key(intent.signature, intent.text_response, data_token)
+        yield from _iter_cached_answer(table_key, lambda: _iter_intent_events(intent), stream)
+        return
     
     # --- ШАГ 4: AI СТРАТЕГИЯ (ЕСЛИ СЛОЖНЫЙ ВОПРОС ИЛИ ЧАТ) ---
     if not sql:
+        yield 'status', STATUS_THINKING
         system_prompt = f"""
 Ты — "AI Andarz", умный аналитик данных GAT.
 
@@ -446,8 +813,9 @@ def ask_database(user, user_question, chat_history=None):
    -- core_student.id = Внутренний ключ (ЧИСЛО).
    -- core_student.student_id = Текстовый код ученика (СТРОКА, напр. '00123').
 4. core_gattest (id, name, test_number, test_date)
-5. core_studentresult (student_id, gat_test_id, total_score, scores_by_subject JSONB)
+5. core_studentresult (student_id, gat_test_id, total_score, scores_by_subject JSONB, school_id, school_class_id, parallel_id)
    -- ВНИМАНИЕ: core_studentresult.student_id - это ВНЕШНИЙ КЛЮЧ на core_student.id (ЧИСЛО).
+   -- school_id, school_class_id, parallel_id - школа, класс и параллель ученика НА МОМЕНТ ТЕСТА.
 
 === ИСТОРИЯ ЧАТА ===
 {history_text}
@@ -459,6 +827,8 @@ def ask_database(user, user_question, chat_history=None):
    (НИКОГДА не используй s.student_id в ON, это приведет к ошибке типов!)
    
 2. Ищи ТОЛЬКО в школах с ID: ({allowed_ids_str}).
+   Для результатов фильтруй прямо по sr.school_id IN (...) и sr.school_class_id / sr.parallel_id,
+   без JOIN через core_student и core_schoolclass ради фильтра.
 3. Поиск по имени (ILIKE): 
    (first_name_ru ILIKE '%Имя%' AND last_name_ru ILIKE '%Фамилия%') 
    OR (first_name_ru ILIKE '%Фамилия%' AND last_name_ru ILIKE '%Имя%').
@@ -477,94 +847,55 @@ def ask_database(user, user_question, chat_history=None):
 }}
 """
         try:
-            ai_content = _get_ai_response(system_prompt)
-            data = _extract_json(ai_content)
-            
-            # Если AI решил просто поболтать
-            if not data.get("is_sql_needed") or not data.get("sql"):
-                return data.get("text_response", "Я здесь! 😊 Чем могу помочь с данными?")
-            
-            # Если AI дал SQL
-            sql = data.get("sql", "").strip().replace(';', '')
-            text_response = data.get("text_response", "Вот что я нашел 📊:")
-            search_type = 'ai'
-            
+            # Уровень 1: вопрос + доступные школы + история -> SQL (без повторного вызова модели)
+            sql_key = _sql_cache_key(user_question, allowed_ids, history_text)
+            data = cache.get(sql_key)
+            if data is not None:
+                _count('sql_hit')
+            else:
+                _count('sql_miss')
+                data = _single_flight(sql_key, lambda: _ask_model_for_sql(sql_key, system_prompt))
         except Exception as e:
             logger.error(f"AI Error: {e}")
-            return "📡 Ошибка связи с AI."
-    
-    # --- ШАГ 5: ВЫПОЛНЕНИЕ SQL И РЕНДЕР ---
-    logger.info(f"Executing SQL: {sql}")
-    max_retries = 2
-    columns = []
-    results = []
-    
-    for attempt in range(max_retries):
-        if not _is_safe_sql(sql):
-            return "🚫 Запрос отклонен системой безопасности."
-
-        try:
-            with connection.cursor() as cursor:
-                cursor.execute("SET statement_timeout = 8000;") 
-                cursor.execute(sql)
-                if cursor.description:
-                    columns = [col[0] for col in cursor.description]
-                    results = cursor.fetchall()
-                break 
+            yield 'html', "📡 Ошибка связи с AI."
+            return
 
-        except Exception as e:
-            logger.warning(f"SQL Fail (Try {attempt+1}): {e}")
-            if attempt == max_retries - 1:
-                # Если AI запрос упал, а это был простой поиск, можно попробовать фоллбек (опционально)
-                return f"😓 Ошибка базы данных.<br><small class='text-red-500'>{e}</small>"
+        # Если AI решил просто поболтать
+        if not data.get("is_sql_needed") or not data.get("sql"):
+            yield 'html', data.get("text_response", "Я здесь! 😊 Чем могу помочь с данными?")
+            return
 
-    # --- ШАГ 6: ГЕНЕРАЦИЯ КРАСИВОГО HTML (С ИСПОЛЬЗОВАНИЕМ НОВОЙ ФУНКЦИИ) ---
-    if not results and not columns:
-        return text_response
+        # Если AI дал SQL
+        sql = data.get("sql", "").strip().replace(';', '')
+        text_response = data.get("text_response", "Вот что я нашел 📊:")
+        search_type = 'ai'
+    
+    # --- ШАГ 5: ВЫПОЛНЕНИЕ SQL И РЕНДЕР ---
+    # Уровень 2: SQL + версия данных школ -> готовая таблица
+    # Ответ содержит первую страницу; остальные подгружаются по токену (render_table_page)
+    token = _register_table(sql, text_response, allowed_ids)
+    data_token = get_data_stamp(allowed_ids)[0]
+    table_key = _table_cache_key(sql, text_response, data_token)
+    yield from _iter_cached_answer(table_key, lambda: _iter_table_events(sql, text_response, token), stream)
 
-    if not results:
-        return f"{text_response}<br><br><div class='p-4 bg-yellow-50 text-yellow-800 rounded-xl border border-yellow-200 flex items-center gap-3'><span>🔍</span> По вашему запросу ничего не найдено.</div>"
 
-    table_id = f"ai-table-{int(time.time())}"
-    
-    output = f"<div class='mb-4 text-slate-700 leading-relaxed font-medium'>{text_response}</div>"
-    
-    output += f'<div class="overflow-hidden border border-gray-200 rounded-xl shadow-sm bg-white mt-2 ring-1 ring-black/5">'
-    output += f'<div class="overflow-x-auto"><table id="{table_id}" class="min-w-full text-sm text-left">'
-    
-    # Шапка
-    output += '<thead class="bg-gray-50/90 border-b border-gray-200 text-[11px] uppercase font-bold text-gray-500 tracking-wider"><tr>'
-    for col in columns:
-        col_name = str(col).replace('_', ' ').replace('ru', '').strip().title()
-        if 'First Name' in col_name or 'Last Name' in col_name: col_name = 'Ученик'
-        if 'Class Name' in col_name: col_name = 'Класс'
-        if 'School Name' in col_name: col_name = 'Школа'
-        if 'Total Score' in col_name or 'Avg Score' in col_name: col_name = 'Балл'
-        
-        output += f'<th class="px-6 py-4 whitespace-nowrap text-indigo-900/80">{col_name}</th>'
-    output += '</tr></thead>'
-    
-    # Тело таблицы (С КРАСИВЫМ ФОРМАТИРОВАНИЕМ)
-    output += '<tbody class="divide-y divide-gray-100 bg-white">'
-    for i, row in enumerate(results):
-        row_class = "bg-white hover:bg-indigo-50/40 transition-colors" if i % 2 == 0 else "bg-slate-50/50 hover:bg-indigo-50/40 transition-colors"
-        output += f'<tr class="{row_class}">'
-        for j, val in enumerate(row):
-            # 🔥 ВОТ ГЛАВНОЕ ИЗМЕНЕНИЕ: ВЫЗОВ BEAUTIFIER 🔥
-            formatted_html = _format_value_smart(val, columns[j])
-            output += f'<td class="px-6 py-3 text-gray-700 align-middle">{formatted_html}</td>'
-        output += '</tr>'
-    output += '</tbody></table></div></div>'
-
-    # Кнопка скачивания
-    if results:
-        output += f'''
-        <div class="mt-3 flex justify-end">
-            <button onclick="downloadCSV('{table_id}')" class="group flex items-center gap-2 px-3 py-1.5 bg-white text-emerald-600 border border-emerald-200 rounded-lg hover:bg-emerald-50 hover:border-emerald-300 transition-all text-xs font-bold shadow-sm">
-                <svg class="w-3.5 h-3.5" fill="none" stroke="currentColor" viewBox="0 0 24 24"><path stroke-linecap="round" stroke-linejoin="round" stroke-width="2" d="M4 16v1a3 3 0 003 3h10a3 3 0 003-3v-1m-4-4l-4 4m0 0l-4-4m4 4V4"></path></svg>
-                <span>Скачать CSV</span>
-            </button>
-        </div>
-        '''
-
-    return output
\ No newline at end of file
+def render_table_page(user, token, page):
+    """
+    Страница page результата AI-запроса (блок .ai-table для HTMX).
+    Запрос берётся по токену из кеша; пользователь должен иметь доступ ко
+    всем школам, для которых запрос был построен.
+    """
+    entry = cache.get(_page_cache_key(token))
+    if entry is None:
+        return "<div class='ai-table p-4 text-sm text-gray-500'>⌛ Результат устарел — задайте вопрос ещё раз.</div>"
+    allowed_ids = set(get_accessible_schools(user).values_list('id', flat=True))
+    if not set(entry['schools']) <= allowed_ids:
+        return "<div class='ai-table p-4 text-sm text-red-600'>🚫 Нет доступа к этим данным.</div>"
+
+    sql, text_response = entry['sql'], entry['text_response']
+    data_token = get_data_stamp(entry['schools'])[0]
+    table_key = _table_cache_key(f"{sql}\x1fpage:{page}", text_response, data_token)
+    events = _iter_cached_answer(
+        table_key, lambda: _iter_table_events(sql, text_response, token, page=page, fragment=True), stream=False
+    )
+    return ''.join(payload for kind, payload in events if kind != 'status')
@@ -0,0 +1,91 @@
+# D:\New_GAT\core\ai_sql_sandbox.py
+
+"""
+Песочница для SQL, сгенерированного моделью в AI-чате.
+
+  * Запрос выполняется на отдельном подключении AI_SQL_DATABASE (учётная
+    запись только на чтение, если задана) и всегда в транзакции READ ONLY.
+  * Таймаут — SET LOCAL statement_timeout: действует только внутри этой
+    транзакции и не остаётся на соединении из пула.
+  * Перед выполнением план проверяется через EXPLAIN: запросы дороже
+    AI_SQL_MAX_COST отклоняются (оценка стоимости есть только у PostgreSQL).
+  * Результат читается постранично: LIMIT/OFFSET поверх запроса модели,
+    не дальше AI_SQL_MAX_ROWS строк, строки — через серверный курсор.
+"""
+
+import json
+import logging
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import connections, transaction
+
+logger = logging.getLogger(__name__)
+
+
+class SqlRejected(Exception):
+    """Запрос отклонён песочницей (текст показывается пользователю)."""
+
+
+def _alias():
+    alias = getattr(settings, 'AI_SQL_DATABASE', 'default')
+    return alias if alias in connections.databases else 'default'
+
+
+def max_rows():
+    return getattr(settings, 'AI_SQL_MAX_ROWS', 1000)
+
+
+def page_size():
+    return getattr(settings, 'AI_TABLE_PAGE_SIZE', 50)
+
+
+def paged_sql(sql, limit, offset):
+    """Страница результата: запрос модели оборачивается подзапросом с LIMIT/OFFSET."""
+    return f"SELECT * FROM ({sql}) AS ai_result LIMIT {int(limit)} OFFSET {int(offset)}"
+
+
+def _plan_cost(cursor, sql):
+    cursor.execute(f"EXPLAIN (FORMAT JSON) {sql}")
+    plan = cursor.fetchone()[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return plan[0]['Plan']['Total Cost']
+
+
+@contextmanager
+def readonly_cursor(sql):
+    """
+    Курсор для запроса модели: транзакция только на чтение, таймаут, проверка
+    стоимости. SqlRejected — план дороже AI_SQL_MAX_COST.
+    """
+    alias = _alias()
+    connection = connections[alias]
+    # Внутри чужой транзакции READ ONLY объявить нельзя — остаётся таймаут и проверка плана
+    outer_atomic = connection.in_atomic_block
+    with transaction.atomic(using=alias):
+        if connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                if not outer_atomic:
+                    cursor.execute("SET TRANSACTION READ ONLY")
+                cursor.execute("SET LOCAL statement_timeout = %s", [getattr(settings, 'AI_SQL_TIMEOUT_MS', 8000)])
+                cost = _plan_cost(cursor, sql)
+            if cost > getattr(settings, 'AI_SQL_MAX_COST', 100000):
+                logger.warning(f"AI SQL rejected: plan cost {cost}: {sql}")
+                raise SqlRejected(f"Запрос слишком тяжёлый для базы (оценка {cost:.0f}). Уточните вопрос: школа, класс или тест.")
+            cursor = connection.chunked_cursor()
+        elif connection.vendor == 'sqlite':
+            # У SQLite нет READ ONLY-транзакций, но есть запрет записи на соединении
+            with connection.cursor() as cursor:
+                cursor.execute("PRAGMA query_only = ON")
+            cursor = connection.cursor()
+        else:
+            cursor = connection.cursor()
+
+        try:
+            yield cursor
+        finally:
+            cursor.close()
+            if connection.vendor == 'sqlite':
+                with connection.cursor() as reset:
+                    reset.execute("PRAGMA query_only = OFF")
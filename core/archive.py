@@ -0,0 +1,194 @@
+# D:\New_GAT\core\archive.py
+
+"""
+Горячая и архивная части результатов (StudentResult.is_archived).
+
+Результаты копятся каждую четверть, а текущие отчёты (dashboard, отчёты
+за выбранные четверти) читают только текущий год. Закрытые годы
+переносятся в архив командой archive_results:
+
+  * у результатов года ставится is_archived=True, год помечается
+    AcademicYear.is_archived;
+  * строки StudentAnswer архивных результатов удаляются (сжатие): те же
+    ответы по вопросам лежат в scores_by_subject (core/student_answers.py).
+
+Как это разделяет данные:
+  * PostgreSQL: после `archive_results --partition` таблица
+    core_studentresult секционирована по списку is_archived
+    (core_studentresult_hot / core_studentresult_archive); перенос года —
+    перемещение строк между секциями. Запрос с is_archived=False читает
+    только горячую секцию и её индексы.
+  * SQLite и другие СУБД: одна таблица, но у отчётов есть частичный индекс
+    только по горячим строкам (core_result_hot_school_idx).
+
+hot_results() добавляет is_archived=False к запросу, если период целиком
+позже последнего архивного года, — так запрос попадает в горячую часть.
+"""
+
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Max
+from django.utils import timezone
+
+from .models import ARCHIVE_BOUNDARY_CACHE_KEY, AcademicYear, StudentAnswer, StudentResult
+
+RESULTS_TABLE = 'core_studentresult'
+# Временное имя исходной таблицы на время секционирования
+UNPARTITIONED_TABLE = 'core_studentresult_unpartitioned'
+# Своя последовательность: у секционированной таблицы (до PostgreSQL 17) нет IDENTITY
+RESULTS_SEQUENCE = 'core_studentresult_partitioned_id_seq'
+
+
+# =============================================================================
+# --- ЧТЕНИЕ ---
+# =============================================================================
+
+def archive_boundary():
+    """Дата окончания последнего архивного года или None (архива нет)."""
+    boundary = cache.get(ARCHIVE_BOUNDARY_CACHE_KEY)
+    if boundary is None:
+        boundary = AcademicYear.objects.filter(is_archived=True).aggregate(end=Max('end_date'))['end'] or ''
+        cache.set(ARCHIVE_BOUNDARY_CACHE_KEY, boundary, 86400)
+    return boundary or None
+
+
+def hot_results(queryset, period_start, prefix=''):
+    """
+    Ограничивает результаты горячей частью, если период (с period_start)
+    целиком позже архива. Годы архивируются целиком, поэтому такие строки
+    не бывают архивными: фильтр ничего не меняет в ответе, но отсекает архив.
+    prefix — путь до StudentResult в запросе (например, 'results__').
+    """
+    if period_start is None:
+        return queryset
+    boundary = archive_boundary()
+    if boundary is not None and period_start <= boundary:
+        return queryset
+    return queryset.filter(**{f'{prefix}is_archived': False})
+
+
+# =============================================================================
+# --- ПЕРЕНОС В АРХИВ ---
+# =============================================================================
+
+def closed_years(today=None):
+    """Закончившиеся, но ещё не архивные годы."""
+    today = today or timezone.now().date()
+    return AcademicYear.objects.filter(end_date__lt=today, is_archived=False).order_by('start_date')
+
+
+def _move_year(year, archived, batch_size, compact):
+    """Переносит результаты года пачками по id. Возвращает (результатов, удалено ответов)."""
+    ids = (
+        StudentResult.objects.filter(gat_test__quarter__year=year, is_archived=not archived)
+        .order_by('id').values_list('id', flat=True)
+    )
+    moved = answers = 0
+    last_id = 0
+    while True:
+        chunk = list(ids.filter(id__gt=last_id)[:batch_size])
+        if not chunk:
+            break
+        last_id = chunk[-1]
+        # Короткая транзакция на пачку: отчёты не ждут перенос всего года
+        with transaction.atomic():
+            moved += StudentResult.objects.filter(id__in=chunk).update(is_archived=archived)
+            if compact:
+                answers += StudentAnswer.objects.filter(result_id__in=chunk).delete()[0]
+    year.is_archived = archived
+    year.save(update_fields=['is_archived'])
+    return moved, answers
+
+
+def archive_year(year, batch_size=5000, compact=True):
+    return _move_year(year, True, batch_size, compact)
+
+
+def restore_year(year, batch_size=5000):
+    """Возвращает год в горячую часть (ответы строит materialize_answers по требованию)."""
+    return _move_year(year, False, batch_size, compact=False)
+
+
+# =============================================================================
+# --- СЕКЦИОНИРОВАНИЕ (PostgreSQL) ---
+# =============================================================================
+
+def is_partitioned(connection):
+    if connection.vendor != 'postgresql':
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass(%s)", [RESULTS_TABLE]
+        )
+        return cursor.fetchone() is not None
+
+
+def partition_results_table(connection):
+    """
+    Однократно превращает core_studentresult в секционированную по
+    is_archived таблицу (PostgreSQL 11+). Таблица копируется целиком под
+    эксклюзивной блокировкой — запускать в окно обслуживания.
+
+    Ограничения секционирования: первичный ключ и уникальность должны
+    включать ключ секции, поэтому PK — (id, is_archived), уникальность —
+    (student, gat_test, is_archived) (год архивируется целиком, так что
+    смысл прежний), а внешний ключ StudentAnswer.result снимается
+    (каскадное удаление Django выполняет сам).
+    Возвращает False, если таблица уже секционирована.
+    """
+    if is_partitioned(connection):
+        return False
+    with transaction.atomic(using=connection.alias), connection.cursor() as cursor:
+        cursor.execute(f"LOCK TABLE {RESULTS_TABLE}, core_studentanswer IN ACCESS EXCLUSIVE MODE")
+
+        cursor.execute(
+            "SELECT conname FROM pg_constraint WHERE contype = 'f' "
+            "AND conrelid = 'core_studentanswer'::regclass AND confrelid = %s::regclass",
+            [RESULTS_TABLE],
+        )
+        for (name,) in cursor.fetchall():
+            cursor.execute(f'ALTER TABLE core_studentanswer DROP CONSTRAINT "{name}"')
+
+        # Индексы (кроме PK и уникальности) и внешние ключи пересоздаются на новой таблице
+        cursor.execute(
+            "SELECT indexdef FROM pg_indexes WHERE tablename = %s AND indexname NOT IN ("
+            "SELECT conname FROM pg_constraint WHERE conrelid = %s::regclass AND contype IN ('p', 'u'))",
+            [RESULTS_TABLE, RESULTS_TABLE],
+        )
+        index_definitions = [row[0] for row in cursor.fetchall()]
+        cursor.execute(
+            "SELECT conname, pg_get_constraintdef(oid) FROM pg_constraint "
+            "WHERE conrelid = %s::regclass AND contype = 'f'",
+            [RESULTS_TABLE],
+        )
+        foreign_keys = cursor.fetchall()
+        cursor.execute(f"SELECT COALESCE(MAX(id), 0) FROM {RESULTS_TABLE}")
+        max_id = cursor.fetchone()[0]
+
+        cursor.execute(f"ALTER TABLE {RESULTS_TABLE} RENAME TO {UNPARTITIONED_TABLE}")
+        cursor.execute(
+            f"CREATE TABLE {RESULTS_TABLE} (LIKE {UNPARTITIONED_TABLE} INCLUDING DEFAULTS INCLUDING CONSTRAINTS) "
+            f"PARTITION BY LIST (is_archived)"
+        )
+        cursor.execute(f"CREATE TABLE {RESULTS_TABLE}_hot PARTITION OF {RESULTS_TABLE} FOR VALUES IN (false)")
+        cursor.execute(f"CREATE TABLE {RESULTS_TABLE}_archive PARTITION OF {RESULTS_TABLE} FOR VALUES IN (true)")
+        cursor.execute(f"ALTER TABLE {RESULTS_TABLE} ALTER COLUMN id DROP DEFAULT")
+        cursor.execute(f"INSERT INTO {RESULTS_TABLE} SELECT * FROM {UNPARTITIONED_TABLE}")
+        cursor.execute(f"DROP TABLE {UNPARTITIONED_TABLE}")
+
+        # OWNED BY: pg_get_serial_sequence (сброс последовательностей Django) её находит
+        cursor.execute(f"CREATE SEQUENCE {RESULTS_SEQUENCE} OWNED BY {RESULTS_TABLE}.id")
+        cursor.execute("SELECT setval(%s, %s, %s)", [RESULTS_SEQUENCE, max(max_id, 1), max_id > 0])
+        cursor.execute(f"ALTER TABLE {RESULTS_TABLE} ALTER COLUMN id SET DEFAULT nextval('{RESULTS_SEQUENCE}')")
+
+        cursor.execute(f"ALTER TABLE {RESULTS_TABLE} ADD CONSTRAINT {RESULTS_TABLE}_pkey PRIMARY KEY (id, is_archived)")
+        cursor.execute(
+            f"ALTER TABLE {RESULTS_TABLE} ADD CONSTRAINT unique_result_per_student_test "
+            f"UNIQUE (student_id, gat_test_id, is_archived)"
+        )
+        for definition in index_definitions:
+            cursor.execute(definition)
+        for name, definition in foreign_keys:
+            cursor.execute(f'ALTER TABLE {RESULTS_TABLE} ADD CONSTRAINT "{name}" {definition}')
+        cursor.execute(f"ANALYZE {RESULTS_TABLE}")
+    return True
@@ -0,0 +1,349 @@
+# D:\New_GAT\core\batch_export.py
+
+"""
+Пакетная выгрузка: все классы выбранных школ одним ZIP-архивом.
+
+Вместо сотен выгрузок «по одному классу» задача BackgroundJob проходит
+по области (школы, четверть, виды отчётов) за один раз:
+  * классы школ читаются один раз и общие для всех файлов;
+  * списки учеников — один потоковый запрос (.iterator), отсортированный
+    по классам; строки группируются по классу и сразу пишутся файлом в ZIP;
+  * мониторинг — тоже один потоковый запрос результатов области,
+    отсортированный по классу результата; предметы, количество вопросов и
+    тесты читаются один раз, а таблица класса строится теми же функциями,
+    что и отчёт с фильтром по классу (core/monitoring_table.py);
+  * ZIP пишется во временный файл на диске по мере готовности классов,
+    прогресс (progress/total) обновляется после каждого файла.
+
+Готовый архив сохраняется в закрытом хранилище (core/private_storage.py)
+и отдаётся через core:background_job_download; пользователь получает
+уведомление.
+"""
+
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import zipfile
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from functools import cached_property
+from itertools import groupby
+
+from django.conf import settings
+from django.core.files import File
+from django.db import connections, transaction
+from django.urls import reverse
+from django.utils import timezone
+
+from .archive import hot_results
+from .models import (
+    BackgroundJob, GatTest, Notification, QuestionCount, Quarter, SchoolClass, Student, StudentResult, Subject,
+)
+from .monitoring_table import (
+    MONITORING_PDF_ROWS_PER_PAGE, both_days_keys, build_table_headers, build_table_rows, resolve_question_counts,
+    score_subject_ids,
+)
+from .pdf_service import ChunkedDocument, document_parts, render_document
+from .private_storage import private_storage
+from .xlsx_export import (
+    STUDENT_SHEET_HEADER, XlsxStreamWriter, student_sheet_queryset, student_sheet_row, write_monitoring_sheet,
+)
+
+logger = logging.getLogger(__name__)
+
+BATCH_EXPORT_DIR = 'batch_exports'
+STREAM_CHUNK_SIZE = 2000
+
+# Виды отчётов пакетной выгрузки
+KIND_STUDENTS_XLSX = 'students_xlsx'
+KIND_MONITORING_XLSX = 'monitoring_xlsx'
+KIND_MONITORING_PDF = 'monitoring_pdf'
+REPORT_KINDS = [
+    (KIND_STUDENTS_XLSX, 'Списки учеников (Excel)'),
+    (KIND_MONITORING_XLSX, 'Мониторинг (Excel)'),
+    (KIND_MONITORING_PDF, 'Мониторинг (PDF)'),
+]
+MONITORING_KINDS = {KIND_MONITORING_XLSX, KIND_MONITORING_PDF}
+
+_lock = threading.Lock()
+_executor = None
+
+
+def _workers():
+    return getattr(settings, 'BATCH_EXPORT_WORKERS', 1)
+
+
+def _get_executor():
+    global _executor
+    with _lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=_workers(), thread_name_prefix='batch-export')
+    return _executor
+
+
+def _safe_name(name):
+    """Имя папки/файла внутри архива без разделителей путей и служебных символов."""
+    cleaned = ''.join('_' if ch in '/\\:*?"<>|' else ch for ch in str(name)).strip()
+    return cleaned or '_'
+
+
+# =============================================================================
+# --- ОБЩИЕ СПРАВОЧНИКИ ---
+# =============================================================================
+
+class ReferenceCache:
+    """
+    Справочники выгрузки: читаются один раз и общие для всех файлов.
+    results — результаты мониторинга области (для тестов, на которые они ссылаются).
+    """
+
+    def __init__(self, school_ids, results):
+        self.school_ids = school_ids
+        self.results = results
+        self.classes = {
+            cls.id: cls for cls in SchoolClass.objects.filter(school_id__in=school_ids).select_related('school', 'parent')
+        }
+
+    def folder(self, class_id):
+        school_class = self.classes[class_id]
+        return f"{_safe_name(school_class.school.name)}/{_safe_name(school_class.name)}"
+
+    @cached_property
+    def subjects(self):
+        return {subject.id: subject for subject in Subject.objects.all()}
+
+    @cached_property
+    def question_counts(self):
+        """{предмет: {класс: число вопросов}} по всем классам школ выгрузки."""
+        q_counts_map = defaultdict(dict)
+        rows = QuestionCount.objects.filter(school_class__school_id__in=self.school_ids).values_list(
+            'subject_id', 'school_class_id', 'number_of_questions'
+        )
+        for subject_id, class_id, number in rows:
+            q_counts_map[subject_id][class_id] = number
+        return q_counts_map
+
+    @cached_property
+    def tests(self):
+        tests = GatTest.objects.filter(id__in=self.results.order_by().values('gat_test_id'))
+        return {test.id: test for test in tests}
+
+
+class BatchExport:
+    """Одна пакетная выгрузка: пишет файлы классов в открытый ZipFile."""
+
+    def __init__(self, job, archive):
+        # Локальный импорт: core.views импортирует формы, а формы — этот модуль
+        from .views.utils_reports import user_subjects
+
+        self.job = job
+        self.archive = archive
+        params = job.params
+        self.school_ids = params.get('school_ids', [])
+        quarter_id = params.get('quarter_id')
+        self.quarter = Quarter.objects.filter(pk=quarter_id).first() if quarter_id else None
+        self.kinds = set(params.get('kinds', []))
+        # Эксперту и учителю в мониторинге видны только свои предметы (как в отчёте)
+        subjects = user_subjects(job.user)
+        self.subject_ids = None if subjects is None else set(subjects.values_list('id', flat=True))
+        self.refs = ReferenceCache(self.school_ids, self.monitoring_results())
+        self.done = 0
+
+    # --- Запросы ---
+
+    def students_queryset(self):
+        # Те же ученики и связи, что в выгрузке «Ученики» одного класса
+        return student_sheet_queryset(
+            Student.objects.filter(school_class__school_id__in=self.school_ids)
+        ).order_by(
+            'school_class__school__name', 'school_class__name', 'school_class_id', 'last_name_ru', 'first_name_ru'
+        )
+
+    def monitoring_results(self):
+        """Результаты мониторинга области: класс результата (как фильтр мониторинга), четверть, предметы."""
+        results = StudentResult.objects.filter(school_id__in=self.school_ids, school_class__isnull=False)
+        period_start = None
+        if self.quarter is not None:
+            results = results.filter(gat_test__quarter=self.quarter)
+            period_start = self.quarter.start_date
+        if self.subject_ids is not None:
+            if not self.subject_ids:
+                return results.none()
+            results = results.filter(scores_by_subject__has_any_keys=[str(sid) for sid in self.subject_ids])
+        return hot_results(results, period_start)
+
+    def monitoring_class_ids(self):
+        """Классы, у которых есть результаты (в порядке файлов мониторинга)."""
+        class_ids = self.refs.results.order_by().values_list('school_class_id', flat=True).distinct()
+        return sorted(cid for cid in class_ids if cid in self.refs.classes)
+
+    def monitoring_context(self, class_id, results):
+        """
+        Контекст мониторинга класса по его результатам — тот же расчёт, что у
+        отчёта с фильтром по классу (дни теста складываются), без запросов к БД.
+        """
+        school_class = self.refs.classes[class_id]
+        results = list(results)
+        for result in results:
+            result.school_class = school_class
+            result.gat_test = self.refs.tests[result.gat_test_id]
+
+        subject_ids = self.subject_ids
+        if subject_ids is None:
+            subject_ids = score_subject_ids(result.scores_by_subject for result in results)
+        header_subjects = sorted(
+            (self.refs.subjects[sid] for sid in subject_ids if sid in self.refs.subjects), key=lambda s: s.name
+        )
+        placements = {(result.school_class_id, result.parallel_id) for result in results}
+        q_counts = resolve_question_counts(self.refs.question_counts, header_subjects, placements)
+        table_headers = build_table_headers(header_subjects, q_counts, class_id)
+        students_with_both_days = both_days_keys(
+            (result.student_id, result.gat_test.test_number, result.gat_test.day) for result in results
+        )
+
+        title_details = {'schools': school_class.school.name, 'classes': school_class.name}
+        if self.quarter is not None:
+            title_details['period'] = str(self.quarter)
+        return {
+            'table_headers': table_headers,
+            'table_rows': build_table_rows(
+                results, table_headers, q_counts, students_with_both_days, 'monitoring', group_days=True
+            ),
+            'title_details': title_details,
+        }
+
+    def count_files(self):
+        total = 0
+        if KIND_STUDENTS_XLSX in self.kinds:
+            # order_by(): иначе поля сортировки попадают в DISTINCT и классы считаются по ученикам
+            total += self.students_queryset().order_by().values('school_class_id').distinct().count()
+        if self.kinds & MONITORING_KINDS:
+            total += len(self.monitoring_class_ids()) * len(self.kinds & MONITORING_KINDS)
+        return total
+
+    # --- Запись файлов ---
+
+    def _file_written(self):
+        self.done += 1
+        BackgroundJob.objects.filter(pk=self.job.pk).update(progress=self.done)
+
+    def _write_xlsx(self, name, writer):
+        source = writer.close()
+        with self.archive.open(name, 'w') as target:
+            shutil.copyfileobj(source, target)
+        source.close()
+        self._file_written()
+
+    def export_students(self):
+        """Один потоковый запрос по всем ученикам области, файл на класс."""
+        students = self.students_queryset().iterator(chunk_size=STREAM_CHUNK_SIZE)
+        for class_id, class_students in groupby(students, key=lambda s: s.school_class_id):
+            writer = XlsxStreamWriter('Students', max_width=50)
+            writer.header([STUDENT_SHEET_HEADER])
+            for index, student in enumerate(class_students, start=1):
+                writer.append(student_sheet_row(index, student))
+            self._write_xlsx(f"{self.refs.folder(class_id)}/Ученики.xlsx", writer)
+
+    def export_monitoring(self):
+        """Один потоковый запрос по результатам области, Excel и/или PDF мониторинга на класс."""
+        results = self.refs.results.select_related('student').order_by(
+            'school_class_id', '-gat_test__test_date', '-total_score'
+        ).iterator(chunk_size=STREAM_CHUNK_SIZE)
+        for class_id, class_results in groupby(results, key=lambda r: r.school_class_id):
+            if class_id not in self.refs.classes:
+                continue
+            context = self.monitoring_context(class_id, class_results)
+            folder = self.refs.folder(class_id)
+
+            if KIND_MONITORING_XLSX in self.kinds:
+                writer = XlsxStreamWriter('Monitoring')
+                write_monitoring_sheet(writer, context['table_headers'], context['table_rows'])
+                self._write_xlsx(f"{folder}/Мониторинг.xlsx", writer)
+
+            if KIND_MONITORING_PDF in self.kinds:
+                context['title'] = 'Отчет по мониторингу'
+                document = ChunkedDocument(
+                    'monitoring/monitoring_pdf.html', context, 'table_rows', MONITORING_PDF_ROWS_PER_PAGE
+                )
+                pdf = render_document(document, document_parts(document))
+                self.archive.writestr(f"{folder}/Мониторинг.pdf", pdf)
+                self._file_written()
+
+    def run(self):
+        total = self.count_files()
+        BackgroundJob.objects.filter(pk=self.job.pk).update(total=total)
+        if KIND_STUDENTS_XLSX in self.kinds:
+            self.export_students()
+        if self.kinds & MONITORING_KINDS:
+            self.export_monitoring()
+
+
+# =============================================================================
+# --- ЗАПУСК ЗАДАЧИ ---
+# =============================================================================
+
+def batch_export_path(job):
+    return f"{BATCH_EXPORT_DIR}/{job.pk}/{job.filename}"
+
+
+def run_batch_export(job_id):
+    """Выполняет задачу пакетной выгрузки (в потоке пула или прямо в запросе)."""
+    job = BackgroundJob.objects.get(pk=job_id)
+    BackgroundJob.objects.filter(pk=job.pk).update(status=BackgroundJob.Status.RUNNING)
+
+    fd, temp_path = tempfile.mkstemp(suffix='.zip')
+    try:
+        with os.fdopen(fd, 'wb') as temp_file:
+            with zipfile.ZipFile(temp_file, 'w', compression=zipfile.ZIP_DEFLATED) as archive:
+                BatchExport(job, archive).run()
+        with open(temp_path, 'rb') as temp_file:
+            path = private_storage().save(batch_export_path(job), File(temp_file))
+    except Exception as exc:
+        logger.exception("Ошибка пакетной выгрузки %s", job.pk)
+        BackgroundJob.objects.filter(pk=job.pk).update(
+            status=BackgroundJob.Status.FAILED, error=str(exc)[:500], finished_at=timezone.now()
+        )
+        Notification.objects.create(user_id=job.user_id, message=f"Не удалось сформировать архив «{job.title}».")
+        return None
+    finally:
+        os.remove(temp_path)
+
+    BackgroundJob.objects.filter(pk=job.pk).update(
+        status=BackgroundJob.Status.DONE, result_path=path, finished_at=timezone.now()
+    )
+    Notification.objects.create(
+        user_id=job.user_id,
+        message=f"Архив «{job.title}» готов к скачиванию.",
+        link=reverse('core:background_job_download', args=[job.pk]),
+    )
+    return path
+
+
+def _run_in_thread(job_id):
+    try:
+        run_batch_export(job_id)
+    finally:
+        # У потока пула собственное подключение к БД
+        connections.close_all()
+
+
+def start_batch_export(user, school_ids, kinds, quarter_id=None, title=''):
+    """
+    Ставит пакетную выгрузку в очередь и возвращает BackgroundJob.
+    При BATCH_EXPORT_WORKERS = 0 выгрузка выполняется сразу (разработка, тесты).
+    """
+    stamp = timezone.localtime().strftime('%Y%m%d_%H%M')
+    job = BackgroundJob.objects.create(
+        user=user, kind=BackgroundJob.Kind.BATCH_EXPORT, status=BackgroundJob.Status.PENDING,
+        title=title or 'Пакетная выгрузка', filename=f"batch_export_{stamp}.zip",
+        params={'school_ids': list(school_ids), 'kinds': list(kinds), 'quarter_id': quarter_id},
+    )
+    if _workers() <= 0:
+        run_batch_export(job.pk)
+    else:
+        # Поток должен увидеть задачу в БД — запускаем после фиксации транзакции
+        transaction.on_commit(lambda: _get_executor().submit(_run_in_thread, job.pk))
+    job.refresh_from_db()
+    return job
@@ -0,0 +1,195 @@
+# D:\New_GAT\core\bulk_delete.py
+
+"""
+Массовое удаление учеников и результатов фоновой задачей (BackgroundJob).
+
+QuerySet.delete() сначала собирает в памяти все каскадные объекты
+(результаты, ответы, заметки, профили) и удаляет их по одному списку —
+очистка года занимала минуты и могла исчерпать память. Здесь:
+
+  * корневые строки берутся пачками по id (BULK_DELETE_BATCH_SIZE);
+  * для пачки зависимые таблицы очищаются DELETE ... WHERE fk IN (подзапрос)
+    в порядке зависимостей (ответы -> результаты -> заметки -> ученики),
+    SET_NULL — одним UPDATE; каждая пачка — своя короткая транзакция;
+  * прогресс (progress/total) обновляется после каждой пачки.
+
+Сигналы post_delete при этом не вызываются, поэтому в конце (и при
+ошибке — для уже удалённого) поднимаются версии данных затронутых школ
+и сбрасывается индекс подсказок; запись в журнал очистки (cleanup_logger)
+делается по итогам, как раньше делали представления.
+"""
+
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import connections, models, router, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from . import typeahead
+from .data_version import bump_data_version
+from .models import BackgroundJob, Notification, Student, StudentResult
+
+logger = logging.getLogger(__name__)
+audit_logger = logging.getLogger('cleanup_logger')
+
+TARGET_STUDENTS = 'students'
+TARGET_RESULTS = 'results'
+# Модель и путь до id школы (для версий данных) у корневых строк
+TARGETS = {
+    TARGET_STUDENTS: (Student, 'school_class__school_id'),
+    TARGET_RESULTS: (StudentResult, 'gat_test__school_id'),
+}
+
+_lock = threading.Lock()
+_executor = None
+
+
+def _workers():
+    return getattr(settings, 'BULK_DELETE_WORKERS', 1)
+
+
+def _batch_size():
+    return getattr(settings, 'BULK_DELETE_BATCH_SIZE', 2000)
+
+
+def _get_executor():
+    global _executor
+    with _lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=max(1, _workers()), thread_name_prefix='bulk-delete')
+    return _executor
+
+
+# =============================================================================
+# --- КАСКАД БЕЗ COLLECTOR ---
+# =============================================================================
+
+def _reverse_relations(model):
+    """Обратные FK/O2O на модель, включая скрытые (таблицы M2M)."""
+    return [
+        field for field in model._meta.get_fields(include_hidden=True)
+        if field.auto_created and not field.concrete and (field.one_to_many or field.one_to_one)
+    ]
+
+
+def delete_cascade(model, condition):
+    """
+    Удаляет строки model по условию condition (Q) вместе с зависимыми:
+    сначала CASCADE-потомки (рекурсивно), SET_NULL — UPDATE, затем сами
+    строки. Ничего не загружает в память. Возвращает число удалённых строк.
+    """
+    using = router.db_for_write(model)
+    rows = model._base_manager.using(using).filter(condition)
+    deleted = 0
+    for relation in _reverse_relations(model):
+        related = relation.related_model
+        lookup = {f"{relation.field.name}__in": rows.values('pk')}
+        on_delete = relation.on_delete
+        if on_delete is models.CASCADE:
+            deleted += delete_cascade(related, Q(**lookup))
+        elif on_delete is models.SET_NULL:
+            related._base_manager.using(using).filter(**lookup).update(**{relation.field.name: None})
+        elif on_delete in (models.PROTECT, models.RESTRICT):
+            blocking = related._base_manager.using(using).filter(**lookup)
+            if blocking.exists():
+                raise models.ProtectedError(
+                    f"Удаление {model._meta.verbose_name_plural} запрещено: есть {related._meta.verbose_name_plural}",
+                    set(blocking[:10]),
+                )
+        elif on_delete is not models.DO_NOTHING:
+            raise NotImplementedError(f"on_delete={on_delete.__name__} для {related.__name__} не поддерживается")
+    # _raw_delete — одиночный DELETE без Collector (его же использует быстрое удаление Django)
+    return deleted + rows._raw_delete(using)
+
+
+# =============================================================================
+# --- ЗАДАЧА ---
+# =============================================================================
+
+def run_bulk_delete(job_id):
+    """Выполняет задачу удаления (в потоке пула или прямо в запросе)."""
+    job = BackgroundJob.objects.get(pk=job_id)
+    BackgroundJob.objects.filter(pk=job.pk).update(status=BackgroundJob.Status.RUNNING)
+    model, school_path = TARGETS[job.params['target']]
+    filters = job.params.get('filters') or {}
+    roots = model._base_manager.filter(**filters).order_by('pk')
+
+    school_ids = set()
+    removed = rows = 0
+    last_id = 0
+    batch_size = _batch_size()
+    try:
+        while True:
+            ids = list(roots.filter(pk__gt=last_id).values_list('pk', flat=True)[:batch_size])
+            if not ids:
+                break
+            last_id = ids[-1]
+            with transaction.atomic():
+                batch = model._base_manager.filter(pk__in=ids)
+                school_ids.update(batch.values_list(school_path, flat=True).distinct())
+                rows += delete_cascade(model, Q(pk__in=ids))
+            removed += len(ids)
+            BackgroundJob.objects.filter(pk=job.pk).update(progress=removed)
+    except Exception as exc:
+        logger.exception("Ошибка массового удаления %s", job.pk)
+        BackgroundJob.objects.filter(pk=job.pk).update(
+            status=BackgroundJob.Status.FAILED, progress=removed, error=str(exc)[:500], finished_at=timezone.now()
+        )
+        Notification.objects.create(
+            user_id=job.user_id, message=f"Удаление «{job.title}» прервано: удалено {removed}."
+        )
+        return removed
+    finally:
+        _invalidate(job, school_ids, everything=not filters)
+
+    audit = job.params.get('audit')
+    if audit:
+        getattr(audit_logger, audit.get('level', 'warning'))(audit['message'].replace('{count}', str(removed)))
+    BackgroundJob.objects.filter(pk=job.pk).update(
+        status=BackgroundJob.Status.DONE, progress=removed, finished_at=timezone.now(),
+        params={**job.params, 'rows': rows},
+    )
+    Notification.objects.create(user_id=job.user_id, message=f"Удаление «{job.title}» завершено: {removed}.")
+    return removed
+
+
+def _invalidate(job, school_ids, everything):
+    """Версии данных и индекс подсказок: сигналы post_delete не срабатывали."""
+    bump_data_version(None if everything else school_ids)
+    if job.params['target'] == TARGET_STUDENTS and typeahead.is_enabled():
+        for school_id in school_ids:
+            typeahead.school_changed(school_id)
+
+
+def _run_in_thread(job_id):
+    try:
+        run_bulk_delete(job_id)
+    finally:
+        # У потока пула собственное подключение к БД
+        connections.close_all()
+
+
+def start_bulk_delete(user, target, filters, title, audit=None):
+    """
+    Ставит удаление в очередь и возвращает BackgroundJob. filters — kwargs
+    для filter() корневой модели (JSON: хранятся в params). audit —
+    {'level', 'message'} для журнала очистки, {count} заменяется числом.
+    Удаление в одну пачку (или при BULK_DELETE_WORKERS = 0) выполняется сразу.
+    """
+    model, _ = TARGETS[target]
+    total = model._base_manager.filter(**filters).count()
+    job = BackgroundJob.objects.create(
+        user=user, kind=BackgroundJob.Kind.BULK_DELETE, status=BackgroundJob.Status.PENDING,
+        title=title[:255], total=total,
+        params={'target': target, 'filters': filters, 'audit': audit},
+    )
+    if _workers() <= 0 or total <= _batch_size():
+        run_bulk_delete(job.pk)
+    else:
+        # Поток должен увидеть задачу в БД — запускаем после фиксации транзакции
+        transaction.on_commit(lambda: _get_executor().submit(_run_in_thread, job.pk))
+    job.refresh_from_db()
+    return job
@@ -0,0 +1,58 @@
+# D:\New_GAT\core\csv_export.py
+
+"""
+Потоковая выгрузка CSV для обмена данными с другими системами.
+
+Строки пишутся в ответ по мере получения (StreamingHttpResponse): первый
+байт уходит сразу, файл целиком в памяти не собирается. Файл в UTF-8 с BOM —
+так Excel под Windows правильно открывает кириллицу.
+
+Источник строк — итератор. Если он тяжёлый (например, отчёт собирается
+через get_report_context), передавайте генератор: данные начнут считаться
+уже после отправки заголовков ответа.
+"""
+
+import csv
+
+from django.http import StreamingHttpResponse
+from django.utils.http import content_disposition_header
+
+CSV_CONTENT_TYPE = 'text/csv; charset=utf-8'
+CSV_BOM = '\ufeff'
+
+# Разделитель выбирается параметром ?delimiter= (Excel с русской локалью ждёт «;»)
+CSV_DELIMITERS = {
+    'comma': ',',
+    'semicolon': ';',
+    'tab': '\t',
+}
+
+
+class _Echo:
+    """Псевдо-файл для csv.writer: write() возвращает строку, а не пишет её."""
+
+    def write(self, value):
+        return value
+
+
+def csv_delimiter(get_params):
+    return CSV_DELIMITERS.get(get_params.get('delimiter'), ',')
+
+
+def csv_response(rows, filename, delimiter=','):
+    """StreamingHttpResponse с CSV: BOM, затем строки из итератора rows."""
+    writer = csv.writer(_Echo(), delimiter=delimiter)
+
+    def stream():
+        yield CSV_BOM
+        for row in rows:
+            yield writer.writerow(row)
+
+    response = StreamingHttpResponse(stream(), content_type=CSV_CONTENT_TYPE)
+    response['Content-Disposition'] = content_disposition_header(True, filename)
+    return response
+
+
+def score_cell(value):
+    """Ячейка CSV для числового значения: «—» (нет данных) пишется пустой."""
+    return '' if value in (None, '—') else value
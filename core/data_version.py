@@ -0,0 +1,131 @@
+# D:\New_GAT\core\data_version.py
+
+"""
+Штампы версий данных по школам.
+
+Любое изменение, влияющее на отчёты (загрузка/удаление результатов,
+изменение тестов, учеников, количества вопросов), увеличивает версию
+соответствующей школы. Представления и кеши используют эти версии как
+часть ключа: пока версия не изменилась, ранее посчитанный ответ валиден.
+"""
+
+import hashlib
+import threading
+from contextlib import contextmanager
+
+from django.db import DatabaseError
+from django.db.models import F
+from django.utils import timezone
+
+from .models import DataVersion
+
+GLOBAL_SCOPE = 'global'
+
+_local = threading.local()
+
+
+def school_scope(school_id):
+    """Имя области версии для конкретной школы."""
+    return f"school:{school_id}"
+
+
+def _scopes_for(school_ids):
+    """None означает «изменилось всё» — поднимаем глобальную версию."""
+    if school_ids is None:
+        return {GLOBAL_SCOPE}
+    return {school_scope(sid) for sid in school_ids if sid is not None}
+
+
+def _apply_bump(scopes):
+    if not scopes:
+        return
+    now = timezone.now()
+    updated = set(
+        DataVersion.objects.filter(scope__in=scopes).values_list('scope', flat=True)
+    )
+    if updated:
+        DataVersion.objects.filter(scope__in=updated).update(
+            version=F('version') + 1, updated_at=now
+        )
+    missing = scopes - updated
+    if missing:
+        # Отсутствующая строка читается как версия 0, поэтому создаём с 1
+        DataVersion.objects.bulk_create(
+            [DataVersion(scope=scope, version=1) for scope in missing],
+            ignore_conflicts=True,
+        )
+
+
+def bump_data_version(school_ids=None):
+    """
+    Увеличивает версию данных для указанных школ.
+    Без аргументов поднимает глобальную версию (влияет на все школы).
+    Внутри deferred_bumps() изменения накапливаются и применяются один раз.
+    """
+    scopes = _scopes_for(school_ids)
+    pending = getattr(_local, 'pending', None)
+    if pending is not None:
+        pending.update(scopes)
+        return
+    _apply_bump(scopes)
+
+
+@contextmanager
+def deferred_bumps():
+    """
+    Откладывает повышение версий до конца блока (например, на время
+    загрузки Excel-файла, где сигналы срабатывают на каждой строке).
+    """
+    if getattr(_local, 'pending', None) is not None:
+        # Вложенный вызов: внешний блок сам применит изменения
+        yield
+        return
+    _local.pending = set()
+    _local.memo = {}
+    try:
+        yield
+    except Exception:
+        scopes, _local.pending, _local.memo = _local.pending, None, None
+        try:
+            _apply_bump(scopes)
+        except DatabaseError:
+            # Транзакция уже сломана — исходная ошибка важнее
+            pass
+        raise
+    scopes, _local.pending, _local.memo = _local.pending, None, None
+    _apply_bump(scopes)
+
+
+def deferred_memo():
+    """Словарь для запоминания поисков внутри deferred_bumps() (иначе None)."""
+    return getattr(_local, 'memo', None)
+
+
+def get_data_stamp(school_ids):
+    """
+    Возвращает (token, last_modified) для набора школ с учётом глобальной
+    версии. token — короткий хеш, меняющийся при любом изменении данных.
+    """
+    scopes = _scopes_for(school_ids) | {GLOBAL_SCOPE}
+    rows = sorted(
+        DataVersion.objects.filter(scope__in=scopes).values_list('scope', 'version', 'updated_at')
+    )
+    raw = ';'.join(f"{scope}={version}" for scope, version, _ in rows)
+    token = hashlib.sha1(raw.encode('utf-8')).hexdigest()[:16]
+    last_modified = max((updated_at for _, _, updated_at in rows), default=None)
+    return token, last_modified
+
+
+def get_school_stamps(school_ids):
+    """
+    Возвращает {school_id: token} — отдельный штамп для каждой школы
+    (с учётом глобальной версии). Используется для кеша фрагментов.
+    """
+    school_ids = list(school_ids)
+    scopes = _scopes_for(school_ids) | {GLOBAL_SCOPE}
+    versions = dict(DataVersion.objects.filter(scope__in=scopes).values_list('scope', 'version'))
+    global_version = versions.get(GLOBAL_SCOPE, 0)
+    return {
+        sid: f"{global_version}.{versions.get(school_scope(sid), 0)}"
+        for sid in school_ids
+    }
@@ -15,6 +15,7 @@ from .models import (
 )
 from .models import StudentResult, GatTest
 from .views.permissions import get_accessible_schools, get_accessible_subjects
+from .batch_export import REPORT_KINDS
 
 # --- ОБЩИЕ СТИЛИ ДЛЯ ФОРМ ---
 input_class = 'mt-1 block w-full px-3 py-2 border border-gray-300 rounded-md shadow-sm focus:outline-none focus:ring-indigo-500 focus:border-indigo-500 sm:text-sm'
@@ -637,6 +638,31 @@ class StatisticsFilterForm(BaseFilterForm):
                 ).select_related('school', 'parent').order_by('name')
             except (ValueError, TypeError): pass
 
+
+class BatchExportForm(BaseFilterForm):
+    """Область пакетной выгрузки: школы, четверть и виды отчётов."""
+    schools = forms.ModelMultipleChoiceField(
+        queryset=School.objects.none(), required=True, label="Школы",
+        widget=forms.CheckboxSelectMultiple(attrs={'class': checkbox_class})
+    )
+    quarter = forms.ModelChoiceField(
+        queryset=Quarter.objects.none(), required=False, label="Четверть",
+        empty_label="Все четверти", widget=forms.Select(attrs={'class': select_class})
+    )
+    kinds = forms.MultipleChoiceField(
+        choices=REPORT_KINDS, required=True, label="Отчёты",
+        widget=forms.CheckboxSelectMultiple(attrs={'class': checkbox_class})
+    )
+
+    def apply_user_permissions(self):
+        super().apply_user_permissions()
+        quarter_ids = GatTest.objects.filter(
+            school__in=self.fields['schools'].queryset
+        ).values_list('quarter_id', flat=True).distinct()
+        self.fields['quarter'].queryset = Quarter.objects.filter(
+            id__in=quarter_ids
+        ).select_related('year').order_by('-year__start_date', '-start_date')
+
 # ==========================================================
 # --- ФОРМЫ ПРОФИЛЯ И ПОЛЬЗОВАТЕЛЕЙ ---
 # ==========================================================
@@ -0,0 +1,100 @@
+# D:\New_GAT\core\management\commands\ai_intent_hit_rate.py
+
+import json
+import time
+from collections import Counter
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from core.ai_intents import match_intent
+from core.models import School
+from core.views.permissions import get_accessible_schools
+
+
+def _read_questions(path):
+    """Вопросы из журнала AI_QUESTION_LOG (JSON-строки) или из текстового файла (вопрос на строку)."""
+    questions = []
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                questions.append((line, None))
+                continue
+            if isinstance(record, dict) and record.get('question'):
+                questions.append((record['question'], record.get('route')))
+    return questions
+
+
+class Command(BaseCommand):
+    help = (
+        "Прогоняет записанные вопросы AI-чата через локальный роутер (core/ai_intents.py) "
+        "и печатает долю вопросов, на которые можно ответить без модели."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--file', default=None,
+                            help="Журнал вопросов (по умолчанию AI_QUESTION_LOG) или текстовый файл")
+        parser.add_argument('--username', default=None,
+                            help="Права какого пользователя учитывать (по умолчанию все школы)")
+        parser.add_argument('--misses', type=int, default=10,
+                            help="Сколько частых нераспознанных вопросов показать")
+
+    def handle(self, *args, **options):
+        path = options['file'] or settings.AI_QUESTION_LOG
+        try:
+            questions = _read_questions(path)
+        except FileNotFoundError:
+            raise CommandError(f"Файл не найден: {path}")
+        if not questions:
+            self.stdout.write("Вопросов нет.")
+            return
+
+        if options['username']:
+            user = User.objects.filter(username=options['username']).first()
+            if user is None:
+                raise CommandError(f"Пользователь не найден: {options['username']}")
+            allowed_ids = list(get_accessible_schools(user).values_list('id', flat=True))
+        else:
+            allowed_ids = list(School.objects.values_list('id', flat=True))
+
+        intents = Counter()
+        logged_routes = Counter()
+        recovered = 0
+        misses = Counter()
+        elapsed = 0.0
+        for question, route in questions:
+            started = time.perf_counter()
+            intent = match_intent(question, allowed_ids)
+            elapsed += time.perf_counter() - started
+            if route:
+                logged_routes[route.split(':')[0]] += 1
+            if intent:
+                intents[intent.name] += 1
+                if route == 'model':
+                    recovered += 1
+            else:
+                misses[question.strip().lower()] += 1
+
+        total = len(questions)
+        hits = sum(intents.values())
+        self.stdout.write(f"Вопросов: {total}")
+        self.stdout.write(self.style.SUCCESS(
+            f"Локально распознано: {hits} ({100 * hits / total:.1f}%), "
+            f"в среднем {1000 * elapsed / total:.2f} мс на вопрос"
+        ))
+        for name, count in intents.most_common():
+            self.stdout.write(f"  {name:<20} {count:>6} ({100 * count / total:.1f}%)")
+        if logged_routes:
+            routes = ", ".join(f"{name}: {count}" for name, count in logged_routes.most_common())
+            self.stdout.write(f"Маршруты в журнале: {routes}")
+            self.stdout.write(f"Из отправленных модели теперь отвечаются локально: {recovered}")
+        if misses and options['misses']:
+            self.stdout.write("Частые нераспознанные вопросы:")
+            for question, count in misses.most_common(options['misses']):
+                self.stdout.write(f"  {count:>4} × {question}")
@@ -0,0 +1,81 @@
+# D:\New_GAT\core\management\commands\archive_results.py
+
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from core.archive import (
+    archive_year, closed_years, is_partitioned, partition_results_table, restore_year
+)
+from core.models import AcademicYear, StudentAnswer, StudentResult
+
+
+class Command(BaseCommand):
+    help = (
+        "Переносит результаты закрытых учебных лет в архивную часть (core/archive.py) "
+        "и удаляет их строки StudentAnswer. Без --year — все закончившиеся годы. "
+        "С --partition (PostgreSQL) сначала секционирует таблицу результатов."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--year', action='append', default=[], help="Название года (можно несколько раз)")
+        parser.add_argument('--batch-size', type=int, default=5000, help="Результатов в одной пачке")
+        parser.add_argument('--no-compact', action='store_true', help="Не удалять StudentAnswer архивных результатов")
+        parser.add_argument('--restore', action='store_true', help="Вернуть указанные годы в горячую часть")
+        parser.add_argument('--partition', action='store_true',
+                            help="Секционировать core_studentresult (только PostgreSQL, однократно)")
+        parser.add_argument('--dry-run', action='store_true', help="Только показать, что будет перенесено")
+
+    def handle(self, *args, **options):
+        if options['partition']:
+            self._partition(options['dry_run'])
+
+        if options['year']:
+            years = list(AcademicYear.objects.filter(name__in=options['year']))
+            missing = set(options['year']) - {year.name for year in years}
+            if missing:
+                raise CommandError(f"Учебный год не найден: {', '.join(sorted(missing))}")
+        elif options['restore']:
+            raise CommandError("Для --restore укажите --year")
+        else:
+            years = list(closed_years())
+
+        for year in years:
+            results = StudentResult.objects.filter(gat_test__quarter__year=year)
+            if options['dry_run']:
+                answers = StudentAnswer.objects.filter(result__gat_test__quarter__year=year).count()
+                self.stdout.write(f"{year}: результатов {results.count()}, ответов {answers}")
+                continue
+            started = time.perf_counter()
+            if options['restore']:
+                moved, _ = restore_year(year, batch_size=options['batch_size'])
+                self.stdout.write(self.style.SUCCESS(f"{year}: возвращено результатов {moved}"))
+            else:
+                moved, answers = archive_year(
+                    year, batch_size=options['batch_size'], compact=not options['no_compact']
+                )
+                self.stdout.write(self.style.SUCCESS(
+                    f"{year}: в архив результатов {moved}, удалено ответов {answers} "
+                    f"за {time.perf_counter() - started:.1f} с"
+                ))
+        if not years:
+            self.stdout.write("Нет закрытых годов для переноса.")
+
+    def _partition(self, dry_run):
+        if connection.vendor != 'postgresql':
+            raise CommandError(
+                "Секционирование доступно только в PostgreSQL; в других СУБД архив "
+                "отделяется частичным индексом по горячим строкам."
+            )
+        if is_partitioned(connection):
+            self.stdout.write("Таблица результатов уже секционирована.")
+            return
+        if dry_run:
+            self.stdout.write("core_studentresult будет секционирована по is_archived.")
+            return
+        started = time.perf_counter()
+        partition_results_table(connection)
+        self.stdout.write(self.style.SUCCESS(
+            f"core_studentresult секционирована (hot/archive) за {time.perf_counter() - started:.1f} с"
+        ))
@@ -0,0 +1,34 @@
+# D:\New_GAT\core\management\commands\backfill_result_placement.py
+
+import time
+
+from django.core.management.base import BaseCommand
+
+from core.data_version import bump_data_version
+from core.models import SchoolClass, Student, StudentResult
+from core.result_placement import backfill_result_placement
+
+
+class Command(BaseCommand):
+    help = (
+        "Заполняет StudentResult.school / school_class / parallel (core/result_placement.py) "
+        "пачками по текущему классу ученика. По умолчанию — только пустые строки."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=5000, help="Результатов в одной пачке UPDATE")
+        parser.add_argument('--all', action='store_true',
+                            help="Пересчитать все строки (перезапишет класс на момент теста текущим классом)")
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        updated = backfill_result_placement(
+            StudentResult, Student, SchoolClass,
+            batch_size=options['batch_size'], only_missing=not options['all'],
+        )
+        if updated:
+            # Отчёты фильтруют по новым полям — кеши по старым версиям неверны
+            bump_data_version()
+        self.stdout.write(self.style.SUCCESS(
+            f"Обновлено результатов: {updated} за {time.perf_counter() - started:.1f} с"
+        ))
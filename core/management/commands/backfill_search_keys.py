@@ -0,0 +1,29 @@
+# D:\New_GAT\core\management\commands\backfill_search_keys.py
+
+import time
+
+from django.core.management.base import BaseCommand
+
+from core.models import Student
+from core.search_key import backfill_search_keys
+
+
+class Command(BaseCommand):
+    help = (
+        "Пересчитывает Student.search_key (core/search_key.py) пачками. Нужен после "
+        "массовых правок имён в обход save() (queryset.update, импорт в SQL) "
+        "или после изменения правил нормализации."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=2000, help="Учеников в одном bulk_update")
+        parser.add_argument('--only-missing', action='store_true',
+                            help="Только ученики с пустым ключом")
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        updated = backfill_search_keys(Student, options['batch_size'], options['only_missing'])
+        self.stdout.write(self.style.SUCCESS(
+            f"Обновлено ключей: {updated} из {Student.objects.count()} "
+            f"за {time.perf_counter() - started:.1f} с"
+        ))
@@ -0,0 +1,88 @@
+# D:\New_GAT\core\management\commands\benchmark_pdf_render.py
+
+import time
+from types import SimpleNamespace
+
+from django.core.management.base import BaseCommand
+from django.template.loader import render_to_string
+from django.test.utils import override_settings
+
+from core.pdf_service import ChunkedDocument, document_parts, render_document
+from core.pdf_worker import render_pdf
+from core.monitoring_table import MONITORING_PDF_ROWS_PER_PAGE
+
+TEMPLATE = 'monitoring/monitoring_pdf.html'
+
+
+def _synthetic_context(rows_count, subjects_count):
+    """Контекст monitoring_pdf.html с синтетическими учениками (без БД)."""
+    subjects = [
+        SimpleNamespace(id=i, name=f"Предмет {i}", abbreviation=f"П{i}")
+        for i in range(1, subjects_count + 1)
+    ]
+    school_class = SimpleNamespace(name="10А")
+    gat_test = SimpleNamespace(name="GAT-1 (Total)")
+    rows = []
+    for n in range(rows_count):
+        scores = {s.id: {'score': (n + s.id) % 21, 'total': 20} for s in subjects}
+        rows.append({
+            'student': SimpleNamespace(full_name_ru=f"Фамилия{n} Имя{n} Отчество{n}", school_class=school_class),
+            'result_obj': SimpleNamespace(gat_test=gat_test),
+            'scores_by_subject': scores,
+            'total_score': sum(v['score'] for v in scores.values()),
+        })
+    return {
+        'title': 'Отчет по мониторингу (benchmark)',
+        'title_details': {'schools': 'Benchmark'},
+        'table_headers': [{'subject': s, 'q_count': 20} for s in subjects],
+        'table_rows': rows,
+    }
+
+
+class Command(BaseCommand):
+    help = (
+        "Сравнивает время рендеринга PDF мониторинга: один проход WeasyPrint "
+        "(как раньше) и параллельный рендер по частям (ChunkedDocument)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, nargs='+', default=[100, 1000, 5000],
+                            help="Размеры таблиц (по умолчанию 100 1000 5000)")
+        parser.add_argument('--subjects', type=int, default=6, help="Число предметов (колонок)")
+        parser.add_argument('--workers', type=int, default=None,
+                            help="Процессов в пуле (по умолчанию PDF_RENDER_WORKERS)")
+        parser.add_argument('--skip-single', action='store_true',
+                            help="Не замерять однопроходный рендер (он долгий на больших таблицах)")
+
+    def handle(self, *args, **options):
+        overrides = {}
+        if options['workers'] is not None:
+            overrides['PDF_RENDER_WORKERS'] = options['workers']
+
+        with override_settings(**overrides):
+            # Первый вызов поднимает пул процессов — не учитываем его в замерах
+            render_document(None, [render_to_string(TEMPLATE, _synthetic_context(1, 1))])
+
+            header = f"{'Строк':>7} | {'Один проход, с':>15} | {'По частям, с':>13} | {'Частей':>6} | {'Ускорение':>9}"
+            self.stdout.write(header)
+            self.stdout.write('-' * len(header))
+
+            for rows_count in options['rows']:
+                context = _synthetic_context(rows_count, options['subjects'])
+
+                single = None
+                if not options['skip_single']:
+                    started = time.perf_counter()
+                    render_pdf(render_to_string(TEMPLATE, context))
+                    single = time.perf_counter() - started
+
+                started = time.perf_counter()
+                document = ChunkedDocument(TEMPLATE, context, 'table_rows', MONITORING_PDF_ROWS_PER_PAGE)
+                render_document(document, document_parts(document))
+                chunked = time.perf_counter() - started
+
+                single_text = f"{single:.2f}" if single is not None else '—'
+                speedup = f"x{single / chunked:.1f}" if single else '—'
+                self.stdout.write(
+                    f"{rows_count:>7} | {single_text:>15} | {chunked:>13.2f} | {len(document.chunks):>6} | {speedup:>9}"
+                )
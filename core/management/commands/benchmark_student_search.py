@@ -0,0 +1,97 @@
+# D:\New_GAT\core\management\commands\benchmark_student_search.py
+
+import random
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from core import typeahead
+from core.models import School, Student
+from core.student_search import search_students
+from core.views.permissions import get_accessible_schools
+
+# Цель для поиска в шапке: запрос на каждое нажатие клавиши
+TARGET_P95_MS = 30
+
+
+def _percentile(values, percent):
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(percent / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def _measure(search, queries):
+    timings = []
+    for query in queries:
+        started = time.perf_counter()
+        search(query)
+        timings.append(1000 * (time.perf_counter() - started))
+    return timings
+
+
+class Command(BaseCommand):
+    help = (
+        "Замеряет поиск учеников для шапки (core/student_search.py) на текущей базе: "
+        "префиксы реальных фамилий и ID, как при наборе с клавиатуры. С --typeahead "
+        "сравнивает с индексом в памяти (core/typeahead.py) и печатает его объём."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--queries', type=int, default=300, help="Сколько запросов выполнить")
+        parser.add_argument('--username', default=None,
+                            help="Права какого пользователя учитывать (по умолчанию все школы)")
+        parser.add_argument('--seed', type=int, default=1)
+        parser.add_argument('--typeahead', action='store_true',
+                            help="Сравнить с индексом подсказок в памяти процесса")
+
+    def handle(self, *args, **options):
+        if options['username']:
+            user = User.objects.filter(username=options['username']).first()
+            if user is None:
+                raise CommandError(f"Пользователь не найден: {options['username']}")
+            school_ids = list(get_accessible_schools(user).values_list('id', flat=True))
+        else:
+            school_ids = list(School.objects.values_list('id', flat=True))
+
+        sample = list(Student.objects.values_list('last_name_ru', 'student_id').order_by('?')[:1000])
+        if not sample:
+            raise CommandError("В базе нет учеников")
+
+        rng = random.Random(options['seed'])
+        queries = []
+        for _ in range(options['queries']):
+            last_name, student_id = rng.choice(sample)
+            source = student_id if rng.random() < 0.2 else last_name
+            queries.append(source[:rng.randint(2, max(2, min(len(source), 6)))])
+
+        timings = _measure(lambda query: search_students(query, school_ids), queries)
+
+        total = Student.objects.count()
+        p95 = _percentile(timings, 95)
+        self.stdout.write(f"СУБД: {connection.vendor}, учеников: {total}, школ в доступе: {len(school_ids)}")
+        self._report("БД", timings)
+        style = self.style.SUCCESS if p95 <= TARGET_P95_MS else self.style.WARNING
+        self.stdout.write(style(f"Цель p95 < {TARGET_P95_MS} мс: {'да' if p95 <= TARGET_P95_MS else 'нет'}"))
+
+        if options['typeahead']:
+            typeahead.clear()
+            started = time.perf_counter()
+            typeahead.warm(school_ids)
+            self.stdout.write(f"Индекс в памяти построен за {time.perf_counter() - started:.2f} с")
+            report = typeahead.memory_report()
+            records = sum(row[1] for row in report)
+            words = sum(row[2] for row in report)
+            size = sum(row[3] for row in report)
+            self.stdout.write(
+                f"Объём индекса: {size / 1024 / 1024:.1f} МБ на процесс "
+                f"({records} записей, {words} слов, {size / max(records, 1):.0f} байт на запись)"
+            )
+            self._report("Память", _measure(lambda query: typeahead.search(query, school_ids), queries))
+
+    def _report(self, label, timings):
+        self.stdout.write(
+            f"{label}: запросов {len(timings)}; p50 {_percentile(timings, 50):.2f} мс, "
+            f"p95 {_percentile(timings, 95):.2f} мс, max {max(timings):.2f} мс"
+        )
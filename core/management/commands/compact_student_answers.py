@@ -0,0 +1,41 @@
+# D:\New_GAT\core\management\commands\compact_student_answers.py
+
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from core.models import GatTest, StudentAnswer, StudentResult
+from core.student_answers import compact_answers, materialize_answers
+
+
+class Command(BaseCommand):
+    help = (
+        "Удаляет строки StudentAnswer, которые восстанавливаются из "
+        "StudentResult.scores_by_subject (core/student_answers.py). С --materialize "
+        "наоборот строит строки для указанных тестов."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--test', type=int, action='append', default=[], help="ID теста (можно несколько раз)")
+        parser.add_argument('--materialize', action='store_true', help="Построить строки вместо удаления")
+        parser.add_argument('--batch-size', type=int, default=5000, help="Строк в одной пачке")
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        before = StudentAnswer.objects.count()
+
+        if options['materialize']:
+            tests = GatTest.objects.filter(id__in=options['test'])
+            if not options['test']:
+                raise CommandError("Для --materialize укажите --test")
+            created = sum(materialize_answers(test, batch_size=options['batch_size']) for test in tests)
+            self.stdout.write(self.style.SUCCESS(f"Создано ответов: {created}"))
+        else:
+            results = StudentResult.objects.filter(gat_test_id__in=options['test']) if options['test'] else None
+            deleted = compact_answers(results, batch_size=options['batch_size'])
+            self.stdout.write(self.style.SUCCESS(f"Удалено ответов: {deleted}"))
+
+        self.stdout.write(
+            f"Строк StudentAnswer: {before} -> {StudentAnswer.objects.count()} "
+            f"за {time.perf_counter() - started:.1f} с"
+        )
@@ -0,0 +1,201 @@
+# D:\New_GAT\core\management\commands\index_advisor.py
+
+import datetime
+import random
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+
+from core.models import (
+    AcademicYear, GatTest, Quarter, School, SchoolClass, Student, StudentResult, Subject
+)
+
+# Строки плана, на которые стоит посмотреть: полный просмотр таблицы и
+# сортировка во временном дереве (SQLite / PostgreSQL)
+PLAN_WARNINGS = ('SCAN core_', 'USE TEMP B-TREE', 'Seq Scan on core_')
+
+
+class _Rollback(Exception):
+    """Откат синтетических данных после замеров."""
+
+
+def _report_queries(ctx):
+    """Основные запросы отчётов: (название, queryset)."""
+    schools, quarters = ctx['school_ids'], ctx['quarter_ids']
+    results = StudentResult.objects.order_by()
+    tests = GatTest.objects.order_by()
+    return [
+        ("dashboard: школы + период",
+         results.filter(school_id__in=schools, gat_test__test_date__range=ctx['date_range'])),
+        ("отчёты: школы + четверть + номер GAT",
+         results.filter(school_id__in=schools, gat_test__quarter_id__in=quarters, gat_test__test_number__in=[1])),
+        ("deep analysis: классы + четверть + номер + день",
+         results.filter(school_class_id__in=ctx['class_ids'], gat_test__quarter_id__in=quarters,
+                        gat_test__test_number__in=[1], gat_test__day__in=[1])),
+        ("предметы: scores_by_subject has_any_keys",
+         results.filter(school_id__in=schools, scores_by_subject__has_any_keys=ctx['subject_keys'])),
+        ("рейтинг внутри теста",
+         results.filter(gat_test_id=ctx['test_id']).order_by('-total_score')),
+        ("GatTest: четверть + номер + день",
+         tests.filter(quarter_id__in=quarters, test_number=1, day=1)),
+        ("GatTest: школа + четверть",
+         tests.filter(school_id__in=schools, quarter_id__in=quarters)),
+        ("GatTest: класс + четверть + номер + день",
+         tests.filter(school_class_id=ctx['parallel_id'], quarter_id__in=quarters, test_number=1, day=1)),
+    ]
+
+
+class Command(BaseCommand):
+    help = (
+        "Советчик по индексам: выполняет основные запросы отчётов (dashboard, отчёты, "
+        "deep analysis, выбор тестов) и печатает их планы EXPLAIN и время. С --seed-schools "
+        "сначала создаёт синтетические данные и откатывает их после замеров."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--seed-schools', type=int, default=0,
+                            help="Создать N синтетических школ (по умолчанию — текущая база)")
+        parser.add_argument('--years', type=int, default=3, help="Учебных лет в синтетических данных")
+        parser.add_argument('--students-per-class', type=int, default=25)
+        parser.add_argument('--repeat', type=int, default=3, help="Повторов каждого запроса для времени")
+        parser.add_argument('--plans', action='store_true', help="Печатать полные планы, а не только сводку")
+
+    def handle(self, *args, **options):
+        if not options['seed_schools']:
+            self._run(self._context_from_db(), options)
+            return
+        try:
+            with transaction.atomic():
+                started = time.perf_counter()
+                ctx = self._seed(options['seed_schools'], options['years'], options['students_per_class'])
+                self.stdout.write(
+                    f"Синтетические данные: {StudentResult.objects.count()} результатов, "
+                    f"{GatTest.objects.count()} тестов за {time.perf_counter() - started:.1f} с"
+                )
+                self._run(ctx, options)
+                raise _Rollback
+        except _Rollback:
+            self.stdout.write("Синтетические данные удалены (откат транзакции).")
+
+    def _run(self, ctx, options):
+        with connection.cursor() as cursor:
+            # Статистика для планировщика: без неё SQLite не выбирает составные индексы
+            cursor.execute("ANALYZE")
+        self.stdout.write(f"СУБД: {connection.vendor}")
+        for title, qs in _report_queries(ctx):
+            plan = qs.explain()
+            timings = []
+            for _ in range(options['repeat']):
+                started = time.perf_counter()
+                rows = len(qs.values_list('id', flat=True))
+                timings.append(1000 * (time.perf_counter() - started))
+            scans = [line.strip() for line in plan.splitlines() if any(m in line for m in PLAN_WARNINGS)]
+            style = self.style.WARNING if scans else self.style.SUCCESS
+            self.stdout.write(style(f"{title}: {rows} строк, {statistics.median(timings):.1f} мс"))
+            for line in (plan.splitlines() if options['plans'] else scans):
+                self.stdout.write(f"    {line.strip()}")
+
+    # --- Данные ---
+
+    def _context_from_db(self):
+        test = GatTest.objects.order_by('-test_date').first()
+        if test is None:
+            return self._empty_context()
+        return {
+            'school_ids': [test.school_id],
+            'quarter_ids': [test.quarter_id],
+            'class_ids': list(SchoolClass.objects.filter(parent_id=test.school_class_id).values_list('id', flat=True)),
+            'parallel_id': test.school_class_id,
+            'test_id': test.id,
+            'date_range': (test.test_date - datetime.timedelta(days=90), test.test_date),
+            'subject_keys': [str(pk) for pk in test.subjects.values_list('id', flat=True)[:2]] or ['1'],
+        }
+
+    def _empty_context(self):
+        today = datetime.date.today()
+        return {
+            'school_ids': [0], 'quarter_ids': [0], 'class_ids': [0], 'parallel_id': 0, 'test_id': 0,
+            'date_range': (today, today), 'subject_keys': ['1'],
+        }
+
+    def _seed(self, schools_count, years_count, students_per_class):
+        rng = random.Random(1)
+        quarters = []
+        for offset in range(years_count):
+            start = datetime.date(2000 + offset, 9, 1)
+            year = AcademicYear.objects.create(
+                name=f"index-advisor-{offset}", start_date=start, end_date=datetime.date(2001 + offset, 5, 31)
+            )
+            quarters.extend(
+                Quarter.objects.create(
+                    name=f"Q{n}", year=year,
+                    start_date=start + datetime.timedelta(days=70 * (n - 1)),
+                    end_date=start + datetime.timedelta(days=70 * n - 1),
+                )
+                for n in range(1, 5)
+            )
+        subjects = [Subject.objects.create(name=f"advisor-{n}", abbreviation=f"A{n}") for n in range(6)]
+        subject_keys = [str(s.id) for s in subjects]
+
+        schools = School.objects.bulk_create([
+            School(school_id=f"ADV{n:03d}", name=f"Advisor {n}") for n in range(schools_count)
+        ])
+        if schools[0].pk is None:
+            schools = list(School.objects.filter(school_id__startswith="ADV").order_by('school_id'))
+
+        class_ids, parallel_id, tests = [], None, []
+        students = []
+        for school in schools:
+            for grade in (9, 10):
+                parallel = SchoolClass.objects.create(name=str(grade), school=school)
+                parallel_id = parallel_id or parallel.id
+                for letter in "АБВ":
+                    school_class = SchoolClass.objects.create(name=f"{grade}{letter}", school=school, parent=parallel)
+                    if parallel.id == parallel_id:
+                        class_ids.append(school_class.id)
+                    students.extend(
+                        Student(
+                            student_id=f"ADV-{school_class.id}-{n}", school_class=school_class,
+                            last_name_ru=f"Фамилия{n}", first_name_ru=f"Имя{n}",
+                        )
+                        for n in range(students_per_class)
+                    )
+                for quarter in quarters:
+                    for number in (1, 2):
+                        for day in (1, 2):
+                            tests.append(GatTest(
+                                name=f"GAT-{number} д{day} {school.name}", school=school, school_class=parallel,
+                                test_number=number, day=day, quarter=quarter,
+                                test_date=quarter.start_date + datetime.timedelta(days=10 * number + day),
+                            ))
+        GatTest.objects.bulk_create(tests, batch_size=1000)
+        Student.objects.bulk_create(students, batch_size=1000)
+
+        tests_by_parallel = {}
+        for test in GatTest.objects.filter(school__in=schools).values('id', 'school_class_id'):
+            tests_by_parallel.setdefault(test['school_class_id'], []).append(test['id'])
+        results = []
+        for student in Student.objects.filter(school_class__school__in=schools).select_related('school_class'):
+            for test_id in tests_by_parallel.get(student.school_class.parent_id, []):
+                keys = rng.sample(subject_keys, 3)
+                scores = {key: {str(q): rng.random() < 0.6 for q in range(1, 11)} for key in keys}
+                results.append(StudentResult(
+                    student=student, gat_test_id=test_id, scores_by_subject=scores,
+                    total_score=sum(v for answers in scores.values() for v in answers.values()),
+                    school_id=student.school_class.school_id, school_class_id=student.school_class_id,
+                    parallel_id=student.school_class.parent_id,
+                ))
+        StudentResult.objects.bulk_create(results, batch_size=2000)
+
+        test = GatTest.objects.filter(school_class_id=parallel_id).first()
+        return {
+            'school_ids': [schools[0].id],
+            'quarter_ids': [quarters[0].id],
+            'class_ids': class_ids,
+            'parallel_id': parallel_id,
+            'test_id': test.id,
+            'date_range': (quarters[0].start_date, quarters[0].end_date),
+            'subject_keys': subject_keys[:2],
+        }
@@ -0,0 +1,119 @@
+# D:\New_GAT\core\management\commands\precompute_analytics.py
+
+import time
+from collections import Counter
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from core.models import AcademicYear, AnalyticsSnapshot, GatTest, Quarter, School
+from core.rankings import build_rank_table, rank_params
+from core.snapshots import prune_snapshots, save_snapshot
+from core.views.dashboard import DashboardScope, build_dashboard_snapshot
+from core.views.deep_analysis import build_deep_analysis
+from core.views.statistics import build_statistics
+
+KINDS = {
+    'dashboard': AnalyticsSnapshot.Kind.DASHBOARD,
+    'statistics': AnalyticsSnapshot.Kind.STATISTICS,
+    'deep_analysis': AnalyticsSnapshot.Kind.DEEP_ANALYSIS,
+    'ranking': AnalyticsSnapshot.Kind.RANKING,
+}
+
+
+class Command(BaseCommand):
+    help = (
+        "Ночной предрасчёт снимков аналитики (core/snapshots.py): панель управления "
+        "по школам, статистика и углубленный анализ за текущую четверть, рейтинги "
+        "тестов четверти. Запускать по cron, например: "
+        "30 2 * * * python manage.py precompute_analytics"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--kind', action='append', choices=sorted(KINDS), default=[],
+                            help="Тип снимка (можно несколько раз); по умолчанию все")
+        parser.add_argument('--school', action='append', default=[], help="Код школы (можно несколько раз)")
+        parser.add_argument('--force', action='store_true', help="Пересчитать даже валидные снимки")
+
+    def handle(self, *args, **options):
+        kinds = {KINDS[name] for name in options['kind']} or set(KINDS.values())
+        schools = School.objects.order_by('name')
+        if options['school']:
+            schools = schools.filter(school_id__in=options['school'])
+            missing = set(options['school']) - set(schools.values_list('school_id', flat=True))
+            if missing:
+                raise CommandError(f"Школа не найдена: {', '.join(sorted(missing))}")
+        schools = list(schools)
+
+        today = timezone.now().date()
+        year = AcademicYear.objects.filter(start_date__lte=today, end_date__gte=today).first()
+        quarter = (
+            Quarter.objects.filter(start_date__lte=today, end_date__gte=today).first()
+            or Quarter.objects.filter(start_date__lte=today).order_by('-start_date').first()
+        )
+
+        self.created, self.skipped = Counter(), Counter()
+        self.force = options['force']
+        started = time.perf_counter()
+
+        if AnalyticsSnapshot.Kind.DASHBOARD in kinds:
+            self._dashboard(schools, year, quarter)
+        if quarter is None:
+            self.stdout.write("Нет текущей четверти: статистика, анализ и рейтинги пропущены.")
+        else:
+            tests = GatTest.objects.filter(quarter=quarter, school__in=schools)
+            if AnalyticsSnapshot.Kind.STATISTICS in kinds or AnalyticsSnapshot.Kind.DEEP_ANALYSIS in kinds:
+                self._quarter_reports(kinds, schools, quarter, tests)
+            if AnalyticsSnapshot.Kind.RANKING in kinds:
+                for test in tests.order_by('id'):
+                    self._save(AnalyticsSnapshot.Kind.RANKING, rank_params(test.id), [test.school_id], build_rank_table)
+
+        pruned = prune_snapshots()
+        for kind in sorted(kinds):
+            self.stdout.write(f"{kind}: новых {self.created[kind]}, актуальных {self.skipped[kind]}")
+        self.stdout.write(self.style.SUCCESS(
+            f"Готово за {time.perf_counter() - started:.1f} с, удалено устаревших снимков: {pruned}"
+        ))
+
+    def _save(self, kind, params, school_ids, compute):
+        _, created = save_snapshot(kind, params, school_ids, compute, force=self.force)
+        (self.created if created else self.skipped)[kind] += 1
+
+    def _dashboard(self, schools, year, quarter):
+        # Периоды панели: всё время, текущий год, текущая четверть
+        periods = [(None, None)]
+        for period in (year, quarter):
+            if period is not None:
+                periods.append((period.start_date, period.end_date))
+
+        # Директор/учитель школы — рейтинг классов; staff — рейтинг всех школ
+        scopes = [(School.objects.filter(pk=school.pk), False) for school in schools]
+        scopes.append((School.objects.all(), True))
+        for accessible_schools, by_school in scopes:
+            for start_date, end_date in periods:
+                scope = DashboardScope(accessible_schools, start_date, end_date, by_school)
+                self._save(
+                    AnalyticsSnapshot.Kind.DASHBOARD, scope.snapshot_params(), scope.school_ids,
+                    build_dashboard_snapshot,
+                )
+
+    def _quarter_reports(self, kinds, schools, quarter, tests):
+        """Фильтр «вся школа за четверть»: все тесты, параллели и предметы четверти."""
+        for school in schools:
+            school_tests = tests.filter(school=school)
+            test_numbers = sorted(set(school_tests.values_list('test_number', flat=True)))
+            if not test_numbers:
+                continue
+            base = {'quarters': [quarter.id], 'schools': [school.id], 'test_numbers': test_numbers, 'days': []}
+
+            if AnalyticsSnapshot.Kind.STATISTICS in kinds:
+                params = {**base, 'classes': [], 'subjects': []}
+                self._save(AnalyticsSnapshot.Kind.STATISTICS, params, [school.id], build_statistics)
+
+            if AnalyticsSnapshot.Kind.DEEP_ANALYSIS in kinds:
+                params = {
+                    **base,
+                    'classes': sorted(set(school_tests.exclude(school_class=None).values_list('school_class_id', flat=True))),
+                    'subjects': sorted(set(school_tests.exclude(subjects=None).values_list('subjects', flat=True))),
+                }
+                self._save(AnalyticsSnapshot.Kind.DEEP_ANALYSIS, params, [school.id], build_deep_analysis)
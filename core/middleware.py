@@ -0,0 +1,157 @@
+# D:\New_GAT\core\middleware.py
+
+"""
+Инструментация запросов к БД («бюджет запросов»).
+
+Включается настройкой QUERY_INSTRUMENTATION_ENABLED. Для каждого запроса
+записывает в logs/query_budget.log одну JSON-строку: число SQL-запросов,
+время в БД, время рендеринга шаблонов и самые повторяющиеся «формы» SQL
+(признак N+1). Если представление превысило бюджет из QUERY_BUDGETS,
+запись пишется с уровнем WARNING.
+"""
+
+import json
+import logging
+import re
+import threading
+import time
+from collections import defaultdict
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+
+logger = logging.getLogger('query_budget_logger')
+
+_state = threading.local()
+
+# Литералы и списки параметров заменяем, чтобы одинаковые запросы
+# с разными значениями давали одну и ту же «форму»
+_IN_LIST_RE = re.compile(r'\((?:\s*%s\s*,)+\s*%s\s*\)')
+_STRING_RE = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_RE = re.compile(r'\b\d+\b')
+
+
+def normalize_sql(sql):
+    """Приводит SQL к «форме» без конкретных значений."""
+    shape = _STRING_RE.sub('?', sql)
+    shape = _IN_LIST_RE.sub('(%s, ...)', shape)
+    shape = _NUMBER_RE.sub('?', shape)
+    return ' '.join(shape.split())
+
+
+class _RequestStats:
+    def __init__(self):
+        self.queries = 0
+        self.db_time = 0.0
+        self.template_time = 0.0
+        self.template_depth = 0
+        self.shapes = defaultdict(lambda: [0, 0.0])
+
+    def __call__(self, execute, sql, params, many, context):
+        # execute_wrapper: вызывается для каждого SQL-запроса
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            duration = time.perf_counter() - start
+            self.queries += 1
+            self.db_time += duration
+            shape = self.shapes[normalize_sql(sql)]
+            shape[0] += 1
+            shape[1] += duration
+
+    def top_shapes(self, limit):
+        repeated = [
+            {'sql': sql[:500], 'count': count, 'ms': round(total * 1000, 2)}
+            for sql, (count, total) in self.shapes.items() if count > 1
+        ]
+        repeated.sort(key=lambda item: (item['count'], item['ms']), reverse=True)
+        return repeated[:limit]
+
+
+def _install_template_timer():
+    """
+    Оборачивает рендер шаблонов Django-бэкенда. Вложенные {% include %}
+    идут мимо этой обёртки, поэтому время не считается дважды.
+    """
+    from django.template.backends.django import Template
+
+    if getattr(Template.render, '_query_budget_timer', False):
+        return
+    original_render = Template.render
+
+    def timed_render(self, context=None, request=None):
+        stats = getattr(_state, 'stats', None)
+        if stats is None:
+            return original_render(self, context, request)
+        stats.template_depth += 1
+        start = time.perf_counter()
+        try:
+            return original_render(self, context, request)
+        finally:
+            stats.template_depth -= 1
+            if stats.template_depth == 0:
+                stats.template_time += time.perf_counter() - start
+
+    timed_render._query_budget_timer = True
+    Template.render = timed_render
+
+
+def get_query_budget(view_name):
+    budgets = getattr(settings, 'QUERY_BUDGETS', {})
+    return budgets.get(view_name, getattr(settings, 'QUERY_BUDGET_DEFAULT', None))
+
+
+class QueryInstrumentationMiddleware:
+    """Считает SQL-запросы и время рендеринга для каждого запроса."""
+
+    def __init__(self, get_response):
+        if not getattr(settings, 'QUERY_INSTRUMENTATION_ENABLED', False):
+            raise MiddlewareNotUsed()
+        self.get_response = get_response
+        self.top_n = getattr(settings, 'QUERY_INSTRUMENTATION_TOP_N', 5)
+        _install_template_timer()
+
+    def __call__(self, request):
+        stats = _RequestStats()
+        _state.stats = stats
+        started = time.perf_counter()
+        try:
+            with ExitStack() as stack:
+                for conn in connections.all():
+                    stack.enter_context(conn.execute_wrapper(stats))
+                response = self.get_response(request)
+        finally:
+            _state.stats = None
+
+        self._write_record(request, response, stats, time.perf_counter() - started)
+        return response
+
+    def _write_record(self, request, response, stats, total_time):
+        match = getattr(request, 'resolver_match', None)
+        view_name = match.view_name if match else request.path
+        budget = get_query_budget(view_name)
+        over_budget = budget is not None and stats.queries > budget
+
+        record = {
+            'ts': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'view': view_name,
+            'path': request.path,
+            'method': request.method,
+            'status': response.status_code,
+            'user_id': getattr(getattr(request, 'user', None), 'pk', None),
+            'queries': stats.queries,
+            'db_ms': round(stats.db_time * 1000, 2),
+            'template_ms': round(stats.template_time * 1000, 2),
+            'total_ms': round(total_time * 1000, 2),
+            'budget': budget,
+            'over_budget': over_budget,
+            'repeated': stats.top_shapes(self.top_n),
+        }
+        line = json.dumps(record, ensure_ascii=False)
+        if over_budget:
+            logger.warning(line)
+        else:
+            logger.info(line)
@@ -0,0 +1,40 @@
+# Generated by Django 4.2.17 on 2026-10-19 12:35
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('core', '0003_dataversion'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BackgroundJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Дата создания')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='Дата обновления')),
+                ('kind', models.CharField(choices=[('PDF', 'PDF-отчёт')], max_length=20, verbose_name='Тип')),
+                ('status', models.CharField(choices=[('PENDING', 'В очереди'), ('RUNNING', 'Выполняется'), ('DONE', 'Готово'), ('FAILED', 'Ошибка')], db_index=True, default='PENDING', max_length=10, verbose_name='Статус')),
+                ('title', models.CharField(max_length=255, verbose_name='Название')),
+                ('cache_key', models.CharField(blank=True, db_index=True, max_length=64, verbose_name='Ключ результата')),
+                ('filename', models.CharField(blank=True, max_length=255, verbose_name='Имя файла')),
+                ('result_path', models.CharField(blank=True, max_length=500, verbose_name='Путь к результату')),
+                ('progress', models.PositiveIntegerField(default=0, verbose_name='Выполнено')),
+                ('total', models.PositiveIntegerField(default=0, verbose_name='Всего')),
+                ('error', models.TextField(blank=True, verbose_name='Ошибка')),
+                ('finished_at', models.DateTimeField(blank=True, null=True, verbose_name='Завершено')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='background_jobs', to=settings.AUTH_USER_MODEL, verbose_name='Пользователь')),
+            ],
+            options={
+                'verbose_name': 'Фоновая задача',
+                'verbose_name_plural': 'Фоновые задачи',
+                'ordering': ['-created_at'],
+            },
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 4.2.17 on 2026-10-19 12:46
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0004_backgroundjob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='backgroundjob',
+            name='params',
+            field=models.JSONField(blank=True, default=dict, verbose_name='Параметры'),
+        ),
+        migrations.AlterField(
+            model_name='backgroundjob',
+            name='kind',
+            field=models.CharField(choices=[('PDF', 'PDF-отчёт'), ('BATCH_EXPORT', 'Пакетная выгрузка')], max_length=20, verbose_name='Тип'),
+        ),
+    ]
@@ -0,0 +1,27 @@
+# D:\New_GAT\core\migrations\0006_student_search_index.py
+
+from django.db import migrations
+
+from core.student_search import install_search_index, remove_search_index
+
+SEARCH_FIELDS = ('student_id', 'last_name_ru', 'first_name_ru')
+
+
+def forwards(apps, schema_editor):
+    install_search_index(schema_editor, SEARCH_FIELDS)
+
+
+def backwards(apps, schema_editor):
+    remove_search_index(schema_editor, SEARCH_FIELDS)
+
+
+class Migration(migrations.Migration):
+    """Индексы поиска учеников: pg_trgm (PostgreSQL) или FTS5 (SQLite)."""
+
+    dependencies = [
+        ('core', '0005_backgroundjob_batch_export'),
+    ]
+
+    operations = [
+        migrations.RunPython(forwards, backwards),
+    ]
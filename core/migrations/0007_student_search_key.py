@@ -0,0 +1,41 @@
+# Generated by Django 4.2.17 on 2026-10-19 13:13
+
+from django.db import migrations, models
+
+from core.search_key import backfill_search_keys
+from core.student_search import install_search_index, remove_search_index
+
+OLD_SEARCH_FIELDS = ('student_id', 'last_name_ru', 'first_name_ru')
+SEARCH_FIELDS = ('search_key',)
+
+
+def fill_search_keys(apps, schema_editor):
+    backfill_search_keys(apps.get_model('core', 'Student'))
+
+
+def switch_index_to_search_key(apps, schema_editor):
+    # В SQLite AddField пересоздаёт таблицу core_student — триггеры FTS пропали
+    remove_search_index(schema_editor, OLD_SEARCH_FIELDS)
+    install_search_index(schema_editor, SEARCH_FIELDS)
+
+
+def switch_index_back(apps, schema_editor):
+    remove_search_index(schema_editor, SEARCH_FIELDS)
+    install_search_index(schema_editor, OLD_SEARCH_FIELDS)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0006_student_search_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='student',
+            name='search_key',
+            field=models.CharField(blank=True, default='', editable=False, max_length=800, verbose_name='Ключ поиска'),
+        ),
+        migrations.RunPython(fill_search_keys, migrations.RunPython.noop),
+        migrations.RunPython(switch_index_to_search_key, switch_index_back),
+    ]
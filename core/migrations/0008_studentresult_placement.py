@@ -0,0 +1,40 @@
+# Generated by Django 4.2.17 on 2026-10-19 13:19
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+from core.result_placement import backfill_result_placement
+
+
+def fill_placement(apps, schema_editor):
+    backfill_result_placement(
+        apps.get_model('core', 'StudentResult'),
+        apps.get_model('core', 'Student'),
+        apps.get_model('core', 'SchoolClass'),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0007_student_search_key'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='studentresult',
+            name='parallel',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='core.schoolclass', verbose_name='Параллель (на момент теста)'),
+        ),
+        migrations.AddField(
+            model_name='studentresult',
+            name='school',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='core.school', verbose_name='Школа (на момент теста)'),
+        ),
+        migrations.AddField(
+            model_name='studentresult',
+            name='school_class',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='core.schoolclass', verbose_name='Класс (на момент теста)'),
+        ),
+        migrations.RunPython(fill_placement, migrations.RunPython.noop),
+    ]
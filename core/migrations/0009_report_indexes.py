@@ -0,0 +1,54 @@
+# Generated by Django 4.2.17 on 2026-10-19 13:23
+
+from django.db import migrations, models
+
+# has_any_keys / has_key (операторы ?| и ?) поддерживает только jsonb_ops, не jsonb_path_ops
+SCORES_GIN_INDEX = 'core_studentresult_scores_gin'
+
+
+def create_scores_gin(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute(
+            f"CREATE INDEX IF NOT EXISTS {SCORES_GIN_INDEX} ON core_studentresult USING gin (scores_by_subject)"
+        )
+
+
+def drop_scores_gin(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute(f"DROP INDEX IF EXISTS {SCORES_GIN_INDEX}")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0008_studentresult_placement'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='gattest',
+            index=models.Index(fields=['quarter', 'test_number', 'day'], name='core_gattes_quarter_8968a4_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='gattest',
+            index=models.Index(fields=['school', 'quarter'], name='core_gattes_school__8b7a6a_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='gattest',
+            index=models.Index(fields=['school_class', 'quarter', 'test_number', 'day'], name='core_gattes_school__a68fc1_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='studentresult',
+            index=models.Index(fields=['school', 'gat_test'], name='core_studen_school__761240_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='studentresult',
+            index=models.Index(fields=['school_class', 'gat_test'], name='core_studen_school__607749_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='studentresult',
+            index=models.Index(fields=['gat_test', '-total_score'], name='core_studen_gat_tes_793d27_idx'),
+        ),
+        # GIN только в PostgreSQL: в Meta.indexes он сломал бы SQLite
+        migrations.RunPython(create_scores_gin, drop_scores_gin),
+    ]
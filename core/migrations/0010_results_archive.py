@@ -0,0 +1,27 @@
+# Generated by Django 4.2.17 on 2026-10-19 13:27
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0009_report_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='academicyear',
+            name='is_archived',
+            field=models.BooleanField(default=False, editable=False, verbose_name='В архиве'),
+        ),
+        migrations.AddField(
+            model_name='studentresult',
+            name='is_archived',
+            field=models.BooleanField(default=False, editable=False, verbose_name='В архиве'),
+        ),
+        migrations.AddIndex(
+            model_name='studentresult',
+            index=models.Index(condition=models.Q(('is_archived', False)), fields=['school', 'gat_test'], name='core_result_hot_school_idx'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.17 on 2026-10-19 13:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0010_results_archive'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='backgroundjob',
+            name='kind',
+            field=models.CharField(choices=[('PDF', 'PDF-отчёт'), ('BATCH_EXPORT', 'Пакетная выгрузка'), ('BULK_DELETE', 'Удаление данных')], max_length=20, verbose_name='Тип'),
+        ),
+    ]
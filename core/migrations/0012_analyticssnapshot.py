@@ -0,0 +1,37 @@
+# Generated by Django 4.2.17 on 2026-10-19 13:47
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0011_backgroundjob_bulk_delete'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AnalyticsSnapshot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('DASHBOARD', 'Панель управления'), ('STATISTICS', 'Статистика'), ('DEEP_ANALYSIS', 'Углубленный анализ'), ('RANKING', 'Рейтинги теста')], max_length=20, verbose_name='Тип')),
+                ('key', models.CharField(max_length=40, verbose_name='Ключ параметров')),
+                ('version', models.PositiveIntegerField(default=1, verbose_name='Версия')),
+                ('params', models.JSONField(blank=True, default=dict, verbose_name='Параметры')),
+                ('data_token', models.CharField(max_length=16, verbose_name='Версия данных')),
+                ('payload', models.JSONField(blank=True, null=True, verbose_name='Данные')),
+                ('computed_at', models.DateTimeField(default=django.utils.timezone.now, verbose_name='Рассчитан')),
+                ('duration_ms', models.PositiveIntegerField(default=0, verbose_name='Время расчёта, мс')),
+            ],
+            options={
+                'verbose_name': 'Снимок аналитики',
+                'verbose_name_plural': 'Снимки аналитики',
+                'ordering': ['kind', 'key', '-version'],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='analyticssnapshot',
+            constraint=models.UniqueConstraint(fields=('kind', 'key', 'version'), name='unique_snapshot_version'),
+        ),
+    ]
@@ -8,6 +8,11 @@ from django.utils import timezone
 # ✨ 1. ДОБАВЬТЕ ЭТОТ ИМПОРТ ✨
 from django.core.cache import cache 
 
+from .search_key import build_search_key
+
+# Дата окончания последнего архивного года (core/archive.py)
+ARCHIVE_BOUNDARY_CACHE_KEY = 'results_archive_boundary'
+
 # =============================================================================
 # --- БАЗОВЫЕ И ВСПОМОГАТЕЛЬНЫЕ МОДЕЛИ ---
 # =============================================================================
@@ -26,6 +31,8 @@ class AcademicYear(BaseModel):
     name = models.CharField(max_length=100, unique=True, verbose_name="Название")
     start_date = models.DateField(verbose_name="Дата начала")
     end_date = models.DateField(verbose_name="Дата окончания")
+    # Год закрыт: его результаты перенесены в архивную часть (команда archive_results)
+    is_archived = models.BooleanField(default=False, editable=False, verbose_name="В архиве")
 
     class Meta:
         ordering = ['-start_date']
@@ -55,6 +62,7 @@ class AcademicYear(BaseModel):
         При любом сохранении (создании или обновлении) - очищаем кеш.
         """
         cache.delete('all_archive_years')
+        cache.delete(ARCHIVE_BOUNDARY_CACHE_KEY)
         super().save(*args, **kwargs)
 
     def delete(self, *args, **kwargs):
@@ -63,6 +71,7 @@ class AcademicYear(BaseModel):
         При удалении - очищаем кеш.
         """
         cache.delete('all_archive_years')
+        cache.delete(ARCHIVE_BOUNDARY_CACHE_KEY)
         super().delete(*args, **kwargs)
 
 class Quarter(BaseModel):
@@ -189,6 +198,12 @@ class GatTest(BaseModel):
         ordering = ['-test_date', 'test_number', 'day']
         verbose_name = "GAT Тест"
         verbose_name_plural = "GAT Тесты"
+        # Выбор тестов в отчётах и фильтрах (см. команду index_advisor)
+        indexes = [
+            models.Index(fields=['quarter', 'test_number', 'day']),
+            models.Index(fields=['school', 'quarter']),
+            models.Index(fields=['school_class', 'quarter', 'test_number', 'day']),
+        ]
 
     def __str__(self):
         return self.name
@@ -262,6 +277,15 @@ class AnswerOption(BaseModel):
 # --- МОДЕЛИ УЧЕНИКОВ И ИХ РЕЗУЛЬТАТОВ ---
 # =============================================================================
 
+class StudentQuerySet(models.QuerySet):
+    def bulk_create(self, objs, *args, **kwargs):
+        # bulk_create не вызывает save() — ключ поиска заполняем здесь
+        objs = list(objs)
+        for obj in objs:
+            obj.search_key = obj.make_search_key()
+        return super().bulk_create(objs, *args, **kwargs)
+
+
 class Student(BaseModel):
     """Модель ученика."""
     STATUS_CHOICES = [('ACTIVE', 'Активен'), ('TRANSFERRED', 'Переведен'), ('GRADUATED', 'Выпустился')]
@@ -277,6 +301,10 @@ class Student(BaseModel):
     first_name_tj = models.CharField(max_length=100, verbose_name='Ном (точ.)', blank=True)
     last_name_en = models.CharField(max_length=100, verbose_name='Surname (eng.)', blank=True)
     first_name_en = models.CharField(max_length=100, verbose_name='Name (eng.)', blank=True)
+    # Нормализованные ID и все имена (core/search_key.py); индексы — pg_trgm / FTS5 (core/student_search.py)
+    search_key = models.CharField(max_length=800, blank=True, default='', editable=False, verbose_name="Ключ поиска")
+
+    objects = StudentQuerySet.as_manager()
 
     class Meta:
         ordering = ['school_class', 'last_name_ru', 'first_name_ru']
@@ -286,6 +314,19 @@ class Student(BaseModel):
 
     def __str__(self):
         return f"{self.last_name_ru} {self.first_name_ru} ({self.school_class.name})"
+
+    def make_search_key(self):
+        return build_search_key(
+            self.student_id, self.last_name_ru, self.first_name_ru,
+            self.last_name_tj, self.first_name_tj, self.last_name_en, self.first_name_en,
+        )
+
+    def save(self, *args, **kwargs):
+        self.search_key = self.make_search_key()
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None:
+            kwargs['update_fields'] = {*update_fields, 'search_key'}
+        super().save(*args, **kwargs)
     
     @property
     def full_name_ru(self):
@@ -299,6 +340,31 @@ class Student(BaseModel):
     def full_name_en(self):
         return f"{self.first_name_en} {self.last_name_en}" if self.first_name_en and self.last_name_en else ""
 
+def class_placement(school_class):
+    """Поля StudentResult «где учился ученик» для класса (параллель — родитель или сам класс)."""
+    return {
+        'school_id': school_class.school_id,
+        'school_class_id': school_class.pk,
+        'parallel_id': school_class.parent_id or school_class.pk,
+    }
+
+
+class StudentResultQuerySet(models.QuerySet):
+    def bulk_create(self, objs, *args, **kwargs):
+        # bulk_create не вызывает save() — школу/класс/параллель берём одним запросом
+        objs = list(objs)
+        missing = {obj.student_id for obj in objs if obj.school_class_id is None}
+        if missing:
+            classes = {
+                student.pk: student.school_class
+                for student in Student.objects.filter(pk__in=missing).select_related('school_class')
+            }
+            for obj in objs:
+                if obj.school_class_id is None and obj.student_id in classes:
+                    obj.set_placement(classes[obj.student_id])
+        return super().bulk_create(objs, *args, **kwargs)
+
+
 class StudentResult(BaseModel):
     """Общий результат ученика по GAT-тесту."""
     student = models.ForeignKey(Student, on_delete=models.CASCADE, related_name='results', verbose_name="Ученик")
@@ -306,15 +372,48 @@ class StudentResult(BaseModel):
     total_score = models.PositiveIntegerField(default=0, db_index=True, verbose_name="Общий балл")
     scores_by_subject = models.JSONField(default=dict, blank=True, verbose_name="Баллы по предметам")
 
+    # --- Где учился ученик, когда писал тест (денормализация) ---
+    # Заполняются при загрузке и не меняются при переводе ученика: фильтры
+    # аналитики идут по ним, без JOIN через student -> school_class -> school.
+    # Старые строки — команда backfill_result_placement.
+    school = models.ForeignKey(School, on_delete=models.SET_NULL, null=True, blank=True, related_name='+', verbose_name="Школа (на момент теста)")
+    school_class = models.ForeignKey(SchoolClass, on_delete=models.SET_NULL, null=True, blank=True, related_name='+', verbose_name="Класс (на момент теста)")
+    parallel = models.ForeignKey(SchoolClass, on_delete=models.SET_NULL, null=True, blank=True, related_name='+', verbose_name="Параллель (на момент теста)")
+    # Горячая (текущие годы) или архивная часть; в PostgreSQL — ключ секционирования (core/archive.py)
+    is_archived = models.BooleanField(default=False, editable=False, verbose_name="В архиве")
+
+    objects = StudentResultQuerySet.as_manager()
+
     class Meta:
         ordering = ['-gat_test__test_date', '-total_score']
         verbose_name = "Результат ученика"
         verbose_name_plural = "Результаты учеников"
         constraints = [UniqueConstraint(fields=['student', 'gat_test'], name='unique_result_per_student_test')]
+        # Результаты школы/класса по выбранным тестам и рейтинг внутри теста.
+        # GIN-индекс на scores_by_subject (PostgreSQL) — в миграции 0009.
+        indexes = [
+            models.Index(fields=['school', 'gat_test']),
+            models.Index(fields=['school_class', 'gat_test']),
+            models.Index(fields=['gat_test', '-total_score']),
+            # Только горячие строки: отчёты за текущий год не читают индекс по архиву
+            models.Index(fields=['school', 'gat_test'], condition=Q(is_archived=False), name='core_result_hot_school_idx'),
+        ]
 
     def __str__(self):
          return f"Результат {self.student.full_name_ru} по тесту {self.gat_test.name}"
 
+    def set_placement(self, school_class):
+        for field, value in class_placement(school_class).items():
+            setattr(self, field, value)
+
+    def save(self, *args, **kwargs):
+        # Результат, созданный не через загрузку, берёт текущий класс ученика
+        if self.school_class_id is None and self.student_id:
+            self.set_placement(self.student.school_class)
+            if kwargs.get('update_fields') is not None:
+                kwargs['update_fields'] = {*kwargs['update_fields'], 'school', 'school_class', 'parallel'}
+        super().save(*args, **kwargs)
+
 class StudentAnswer(BaseModel):
     """Хранит конкретный ответ ученика на конкретный вопрос."""
     result = models.ForeignKey(StudentResult, on_delete=models.CASCADE, related_name='answers', verbose_name="Общий результат")
@@ -416,4 +515,109 @@ class QuestionCount(BaseModel):
         # Добавим проверку на случай, если school_class или subject будут None
         class_name = self.school_class.name if self.school_class else 'N/A'
         subject_name = self.subject.name if self.subject else 'N/A'
-        return f"{subject_name} в классе {class_name}"
\ No newline at end of file
+        return f"{subject_name} в классе {class_name}"
+
+# =============================================================================
+# --- ВЕРСИИ ДАННЫХ (ДЛЯ УСЛОВНЫХ GET-ЗАПРОСОВ И КЕШЕЙ) ---
+# =============================================================================
+
+class DataVersion(models.Model):
+    """
+    Штамп версии данных. Одна строка на школу ('school:<id>') плюс одна
+    глобальная ('global'). Версия увеличивается при загрузке и удалении
+    результатов, изменении тестов и т.п. (см. core/data_version.py).
+    """
+    scope = models.CharField(max_length=50, unique=True, verbose_name="Область")
+    version = models.PositiveBigIntegerField(default=1, verbose_name="Версия")
+    updated_at = models.DateTimeField(auto_now=True, verbose_name="Дата обновления")
+
+    class Meta:
+        verbose_name = "Версия данных"
+        verbose_name_plural = "Версии данных"
+
+    def __str__(self):
+        return f"{self.scope} v{self.version}"
+
+# =============================================================================
+# --- ФОНОВЫЕ ЗАДАЧИ (PDF, ВЫГРУЗКИ) ---
+# =============================================================================
+
+class BackgroundJob(BaseModel):
+    """
+    Фоновая задача пользователя (рендер PDF, пакетная выгрузка, удаление данных).
+    Готовый результат лежит в хранилище по пути result_path и отдаётся
+    через core:background_job_download.
+    """
+    class Status(models.TextChoices):
+        PENDING = 'PENDING', 'В очереди'
+        RUNNING = 'RUNNING', 'Выполняется'
+        DONE = 'DONE', 'Готово'
+        FAILED = 'FAILED', 'Ошибка'
+
+    class Kind(models.TextChoices):
+        PDF = 'PDF', 'PDF-отчёт'
+        BATCH_EXPORT = 'BATCH_EXPORT', 'Пакетная выгрузка'
+        BULK_DELETE = 'BULK_DELETE', 'Удаление данных'
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='background_jobs', verbose_name="Пользователь")
+    kind = models.CharField(max_length=20, choices=Kind.choices, verbose_name="Тип")
+    status = models.CharField(max_length=10, choices=Status.choices, default=Status.PENDING, db_index=True, verbose_name="Статус")
+    title = models.CharField(max_length=255, verbose_name="Название")
+    cache_key = models.CharField(max_length=64, blank=True, db_index=True, verbose_name="Ключ результата")
+    filename = models.CharField(max_length=255, blank=True, verbose_name="Имя файла")
+    result_path = models.CharField(max_length=500, blank=True, verbose_name="Путь к результату")
+    progress = models.PositiveIntegerField(default=0, verbose_name="Выполнено")
+    total = models.PositiveIntegerField(default=0, verbose_name="Всего")
+    error = models.TextField(blank=True, verbose_name="Ошибка")
+    params = models.JSONField(default=dict, blank=True, verbose_name="Параметры")
+    finished_at = models.DateTimeField(null=True, blank=True, verbose_name="Завершено")
+
+    class Meta:
+        ordering = ['-created_at']
+        verbose_name = "Фоновая задача"
+        verbose_name_plural = "Фоновые задачи"
+
+    def __str__(self):
+        return f"{self.get_kind_display()}: {self.title} ({self.get_status_display()})"
+
+    @property
+    def percent(self):
+        if self.status == self.Status.DONE:
+            return 100
+        return int(self.progress * 100 / self.total) if self.total else 0
+
+# =============================================================================
+# --- СНИМКИ АНАЛИТИКИ (НОЧНОЙ ПРЕДРАСЧЁТ) ---
+# =============================================================================
+
+class AnalyticsSnapshot(models.Model):
+    """
+    Предрасчитанный результат тяжёлой аналитики (см. core/snapshots.py).
+    key — хеш параметров расчёта; каждая перестройка добавляет новую версию.
+    Снимок валиден, пока data_token совпадает с текущими версиями данных школ.
+    """
+    class Kind(models.TextChoices):
+        DASHBOARD = 'DASHBOARD', 'Панель управления'
+        STATISTICS = 'STATISTICS', 'Статистика'
+        DEEP_ANALYSIS = 'DEEP_ANALYSIS', 'Углубленный анализ'
+        RANKING = 'RANKING', 'Рейтинги теста'
+
+    kind = models.CharField(max_length=20, choices=Kind.choices, verbose_name="Тип")
+    key = models.CharField(max_length=40, verbose_name="Ключ параметров")
+    version = models.PositiveIntegerField(default=1, verbose_name="Версия")
+    params = models.JSONField(default=dict, blank=True, verbose_name="Параметры")
+    data_token = models.CharField(max_length=16, verbose_name="Версия данных")
+    payload = models.JSONField(null=True, blank=True, verbose_name="Данные")
+    computed_at = models.DateTimeField(default=timezone.now, verbose_name="Рассчитан")
+    duration_ms = models.PositiveIntegerField(default=0, verbose_name="Время расчёта, мс")
+
+    class Meta:
+        ordering = ['kind', 'key', '-version']
+        verbose_name = "Снимок аналитики"
+        verbose_name_plural = "Снимки аналитики"
+        constraints = [
+            UniqueConstraint(fields=['kind', 'key', 'version'], name='unique_snapshot_version'),
+        ]
+
+    def __str__(self):
+        return f"{self.get_kind_display()} {self.key[:8]} v{self.version}"
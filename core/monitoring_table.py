@@ -0,0 +1,217 @@
+# D:\New_GAT\core\monitoring_table.py
+
+"""
+Таблица мониторинга / оценок по уже выбранным результатам.
+
+Общая часть get_report_context (core/views/utils_reports.py) и пакетной
+выгрузки (core/batch_export.py): отчёт с фильтрами считает таблицу по
+результатам своего запроса, пакетная выгрузка — по группе результатов
+класса из одного потокового запроса. Функции не обращаются к БД: связи
+результатов (ученик, класс, тест) и количество вопросов передаются готовыми.
+"""
+
+from collections import defaultdict
+from types import SimpleNamespace
+
+from . import utils as grade_utils
+
+# Строк таблицы на странице A4 (альбом) вместе с шапкой отчёта
+MONITORING_PDF_ROWS_PER_PAGE = 22
+
+
+def placed_student(result):
+    """
+    Ученик результата с классом на момент теста (StudentResult.school_class):
+    строки, количество вопросов и фильтр по классу считаются по одному классу,
+    даже если ученика потом перевели. Класс результата пуст, только если его
+    удалили, — тогда берётся текущий класс ученика.
+    """
+    student = result.student
+    if result.school_class is not None:
+        student.school_class = result.school_class
+    return student
+
+
+def both_days_keys(day_rows):
+    """(ученик, номер теста), по которым есть оба дня; day_rows — (student_id, test_number, day)."""
+    days = defaultdict(set)
+    for student_id, test_number, day in day_rows:
+        days[(student_id, test_number)].add(day)
+    return {key for key, days_set in days.items() if days_set == {1, 2}}
+
+
+def score_subject_ids(scores_list):
+    """Предметы, встречающиеся в scores_by_subject результатов."""
+    subject_ids = set()
+    for scores_dict in scores_list:
+        if isinstance(scores_dict, dict):
+            subject_ids.update(int(sid) for sid in scores_dict.keys())
+    return subject_ids
+
+
+def resolve_question_counts(q_counts_map, header_subjects, placements):
+    """
+    {(предмет, класс): число вопросов} для пар (класс, параллель) результатов.
+    q_counts_map — {предмет: {класс: число вопросов}}; у класса без своего
+    количества берётся количество параллели.
+    """
+    q_counts = {}
+    for subj in header_subjects:
+        by_class = q_counts_map.get(subj.id, {})
+        for class_id, parallel_id in placements:
+            if class_id in by_class:
+                q_counts[(subj.id, class_id)] = by_class[class_id]
+            elif parallel_id in by_class:
+                q_counts[(subj.id, class_id)] = by_class[parallel_id]
+    return q_counts
+
+
+def build_table_headers(header_subjects, q_counts, first_class_id):
+    """Заголовки предметов; число вопросов в шапке — у первого класса."""
+    return [
+        {'subject': subj, 'q_count': q_counts.get((subj.id, first_class_id), 0) if first_class_id else 0}
+        for subj in header_subjects
+    ]
+
+
+def _grouped_rows(results, table_headers, q_counts, students_with_both_days, mode):
+    """Строки «ученик + номер теста»: дни теста складываются (выбрано 0 или 2 дня)."""
+    grouped_rows = defaultdict(lambda: {
+        'scores_by_subject': defaultdict(lambda: {'score': 0, 'total': 0}),
+        'total_score': 0,
+    })
+    student_map = {}
+
+    for result in results:
+        if not isinstance(result.scores_by_subject, dict):
+            continue
+        student = placed_student(result)
+
+        key = (result.student_id, result.gat_test.test_number)
+
+        if result.student_id not in student_map:
+            student_map[key] = student
+
+        for header in table_headers:
+            header_subject = header['subject']
+            subject_id, subject_id_str = header_subject.id, str(header_subject.id)
+            answers = result.scores_by_subject.get(subject_id_str)
+            q_count = q_counts.get((subject_id, student.school_class_id), 0)
+
+            current_score_data = grouped_rows[key]['scores_by_subject'][subject_id]
+
+            if answers is not None and isinstance(answers, dict):
+                score = sum(1 for v in answers.values() if v is True)
+                grouped_rows[key]['total_score'] += score
+
+                current_score_data['score'] += score
+                current_score_data['total'] = q_count
+
+            elif subject_id not in grouped_rows[key]['scores_by_subject']:
+                current_score_data['total'] = q_count
+
+    table_rows = []
+    for (student_id, test_number), data in grouped_rows.items():
+        student_obj = student_map.get((student_id, test_number))
+        if not student_obj:
+            continue
+
+        fake_test = SimpleNamespace(name=f"GAT-{test_number} (Total)", test_number=test_number, day=0)
+        fake_result_obj = SimpleNamespace(gat_test=fake_test)
+
+        final_grades_by_subject = {}
+        total_grade_points = 0
+        subjects_in_row = 0
+
+        if mode == 'grading':
+            for subject_id, score_data in data['scores_by_subject'].items():
+                score = score_data['score']
+                total = score_data['total']
+
+                if total > 0:
+                    percentage = (score / total) * 100
+                    grade = grade_utils.calculate_grade_from_percentage(percentage)
+                    final_grades_by_subject[subject_id] = grade
+                    total_grade_points += grade
+                    subjects_in_row += 1
+                else:
+                    final_grades_by_subject[subject_id] = "—"
+
+        if mode == 'grading':
+            final_total_score = total_grade_points if subjects_in_row > 0 else 0
+        else:
+            final_total_score = data['total_score']
+
+        table_rows.append({
+            'student': student_obj,
+            'result_obj': fake_result_obj,
+            'scores_by_subject': data['scores_by_subject'],
+            'grades_by_subject': final_grades_by_subject,
+            'total_score': final_total_score,
+            'has_both_days': (student_id, test_number) in students_with_both_days,
+        })
+    return table_rows
+
+
+def _day_rows(results, table_headers, q_counts, students_with_both_days, mode):
+    """Строка на результат (выбран один день)."""
+    table_rows = []
+    for result in results:
+        if not isinstance(result.scores_by_subject, dict):
+            continue
+        student = placed_student(result)
+
+        row_data = {
+            'student': student,
+            'result_obj': result,
+            'scores_by_subject': {},
+            'grades_by_subject': {},
+            'total_score': 0,
+            'has_both_days': (result.student_id, result.gat_test.test_number) in students_with_both_days,
+        }
+        total_grade_points, subjects_in_row = 0, 0
+
+        for header in table_headers:
+            header_subject = header['subject']
+            subject_id, subject_id_str = header_subject.id, str(header_subject.id)
+            answers = result.scores_by_subject.get(subject_id_str)
+            q_count = q_counts.get((subject_id, student.school_class_id), 0)
+
+            if answers is not None and isinstance(answers, dict):
+                score = sum(1 for v in answers.values() if v is True)
+                row_data['total_score'] += score
+                subjects_in_row += 1
+
+                if mode == 'grading':
+                    percentage = (score / q_count) * 100 if q_count > 0 else 0
+                    grade = grade_utils.calculate_grade_from_percentage(percentage)
+                    row_data['grades_by_subject'][subject_id] = grade
+                    total_grade_points += grade
+                else:  # mode == 'monitoring'
+                    row_data['scores_by_subject'][subject_id] = {'score': score, 'total': q_count}
+            else:
+                if mode == 'grading':
+                    row_data['grades_by_subject'][subject_id] = "—"
+                else:
+                    row_data['scores_by_subject'][subject_id] = {'score': '—', 'total': q_count}
+
+        if mode == 'grading':
+            row_data['total_score'] = total_grade_points if subjects_in_row > 0 else 0
+
+        table_rows.append(row_data)
+    return table_rows
+
+
+def build_table_rows(results, table_headers, q_counts, students_with_both_days, mode, group_days):
+    """
+    Строки таблицы по результатам (с загруженными student, school_class, gat_test),
+    сначала лучшие, при равенстве — по фамилии и имени.
+    """
+    build = _grouped_rows if group_days else _day_rows
+    table_rows = build(results, table_headers, q_counts, students_with_both_days, mode)
+    table_rows.sort(key=lambda x: (
+        -x.get('total_score', 0),    # 1. По общему баллу (по убыванию)
+        x['student'].last_name_ru,   # 2. По фамилии (по возрастанию)
+        x['student'].first_name_ru,  # 3. По имени (по возрастанию)
+    ))
+    return table_rows
@@ -0,0 +1,16 @@
+# D:\New_GAT\core\password_worker.py
+
+"""
+Хеширование паролей в отдельных процессах (core/account_provisioning.py).
+
+Как и pdf_worker, модуль не требует django.setup(): класс хешера
+передаётся по пути импорта, соль генерируется в основном процессе.
+"""
+
+from django.utils.module_loading import import_string
+
+
+def hash_passwords(hasher_path, pairs):
+    """Возвращает закодированные пароли для списка пар (пароль, соль)."""
+    hasher = import_string(hasher_path)()
+    return [hasher.encode(password, salt) for password, salt in pairs]
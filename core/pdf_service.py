@@ -0,0 +1,357 @@
+# D:\New_GAT\core\pdf_service.py
+
+"""
+Сервис рендеринга PDF.
+
+WeasyPrint выполняется в пуле процессов (core/pdf_worker.py), а не в потоке
+запроса. Готовые PDF кешируются в закрытом хранилище (core/private_storage.py)
+по ключу sha256(версия данных + HTML): повторное скачивание того же отчёта
+отдаётся сразу из файла. Кеш ограничен сроком PDF_CACHE_TTL_HOURS и общим
+размером PDF_CACHE_MAX_MB (prune_pdf_cache).
+
+Если рендер не уложился в PDF_RENDER_WAIT_SECONDS, пользователь получает
+сообщение, а по готовности — уведомление (Notification) со ссылкой на
+скачивание. Одинаковые отчёты, запрошенные одновременно, рендерятся один раз.
+
+Большие таблицы рендерятся по частям (ChunkedDocument): время вёрстки
+WeasyPrint растёт быстрее длины таблицы, поэтому куски по PDF_CHUNK_PAGES
+страниц верстаются параллельно и склеиваются в один PDF.
+"""
+
+import hashlib
+import io
+import logging
+import math
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, TimeoutError
+from concurrent.futures.process import BrokenProcessPool
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.db import connections, transaction
+from django.template.loader import render_to_string
+from django.urls import reverse
+from django.utils import timezone
+
+from .data_version import get_data_stamp
+from .models import BackgroundJob, Notification
+from .pdf_worker import render_pdf
+from .private_storage import private_storage
+
+logger = logging.getLogger(__name__)
+
+PDF_CACHE_DIR = 'pdf_cache'
+THREAD_NAME_PREFIX = 'pdf-render'
+
+_lock = threading.Lock()
+_process_pool = None
+_thread_pool = None
+# Рендеры в процессе: cache_key -> Future (результат — путь в хранилище)
+_inflight = {}
+
+
+def _workers():
+    return getattr(settings, 'PDF_RENDER_WORKERS', 2)
+
+
+def _get_pools():
+    global _process_pool, _thread_pool
+    with _lock:
+        if _process_pool is None:
+            _process_pool = ProcessPoolExecutor(
+                max_workers=_workers(),
+                mp_context=multiprocessing.get_context('spawn'),
+            )
+        if _thread_pool is None:
+            # Потоки только ждут процессы и сохраняют результат в хранилище
+            _thread_pool = ThreadPoolExecutor(max_workers=_workers(), thread_name_prefix=THREAD_NAME_PREFIX)
+    return _process_pool, _thread_pool
+
+
+def _render_many(parts, base_url):
+    """
+    Рендерит HTML-куски параллельно в пуле процессов, порядок сохраняется.
+    Упавший пул пересоздаётся при следующем вызове.
+    """
+    global _process_pool
+    if _workers() <= 0:
+        return [render_pdf(html, base_url) for html in parts]
+    process_pool, _ = _get_pools()
+    try:
+        futures = [process_pool.submit(render_pdf, html, base_url) for html in parts]
+        return [future.result() for future in futures]
+    except BrokenProcessPool:
+        with _lock:
+            if _process_pool is process_pool:
+                _process_pool = None
+        process_pool.shutdown(wait=False)
+        raise
+
+
+def render_pdf_bytes(html, base_url=None):
+    """
+    Рендерит PDF и ждёт результата (без кеширования).
+    Используется для документов, которые нельзя сохранять на диск (пароли).
+    """
+    return _render_many([html], base_url)[0]
+
+
+# =============================================================================
+# --- РЕНДЕРИНГ ПО ЧАСТЯМ ---
+# =============================================================================
+
+class ChunkedDocument:
+    """
+    PDF из одного шаблона, разбитый по строкам таблицы на куски.
+
+    После каждых rows_per_page строк шаблон ставит разрыв страницы, поэтому
+    кусок занимает известное число страниц и номер его первой страницы
+    считается заранее — куски можно верстать параллельно. Шапка таблицы
+    (thead) повторяется на каждой странице, заголовок отчёта — только в
+    первом куске.
+
+    Шаблон получает: row_offset (сдвиг нумерации строк), page_start и
+    total_pages (нумерация страниц; total_pages=None для одного куска),
+    chunk_index, total_rows и rows_per_page.
+    """
+
+    def __init__(self, template_name, context, rows_key, rows_per_page, pages_per_chunk=None):
+        self.template_name = template_name
+        self.context = context
+        self.rows_key = rows_key
+        self.rows_per_page = rows_per_page
+        pages_per_chunk = pages_per_chunk or getattr(settings, 'PDF_CHUNK_PAGES', 10)
+        rows = list(context.get(rows_key) or [])
+        self.total_rows = len(rows)
+        size = rows_per_page * pages_per_chunk
+        self.chunks = [rows[i:i + size] for i in range(0, len(rows), size)] or [[]]
+
+    def expected_page_counts(self):
+        return [max(1, math.ceil(len(chunk) / self.rows_per_page)) for chunk in self.chunks]
+
+    def render_html(self, page_counts=None):
+        """HTML всех кусков; page_counts — фактическое число страниц кусков."""
+        page_counts = page_counts or self.expected_page_counts()
+        total_pages = sum(page_counts) if len(self.chunks) > 1 else None
+        parts, page_start, row_offset = [], 1, 0
+        for index, (chunk, pages) in enumerate(zip(self.chunks, page_counts)):
+            context = dict(self.context)
+            context.update({
+                self.rows_key: chunk,
+                'chunk_index': index,
+                'row_offset': row_offset,
+                'page_start': page_start,
+                'total_pages': total_pages,
+                'total_rows': self.total_rows,
+                'rows_per_page': self.rows_per_page,
+            })
+            parts.append(render_to_string(self.template_name, context))
+            page_start += pages
+            row_offset += len(chunk)
+        return parts
+
+
+def _page_count(pdf):
+    from pypdf import PdfReader
+    return len(PdfReader(io.BytesIO(pdf)).pages)
+
+
+def _merge_pdfs(pdfs):
+    from pypdf import PdfReader, PdfWriter
+    writer = PdfWriter()
+    for pdf in pdfs:
+        writer.append(PdfReader(io.BytesIO(pdf)))
+    output = io.BytesIO()
+    writer.write(output)
+    return output.getvalue()
+
+
+def render_document(document, parts, base_url=None):
+    """
+    Рендерит документ (строка HTML или ChunkedDocument) в байты PDF.
+    parts — уже отрендеренный HTML кусков (он же источник ключа кеша).
+    """
+    pdfs = _render_many(parts, base_url)
+    if len(pdfs) == 1:
+        return pdfs[0]
+
+    page_counts = [_page_count(pdf) for pdf in pdfs]
+    if page_counts != document.expected_page_counts():
+        # Строки не уместились в расчётное число страниц (длинные ФИО и т.п.):
+        # повторяем рендер с точными номерами страниц
+        logger.warning(
+            "PDF %s: страниц %s вместо ожидаемых %s, повторный рендер",
+            document.template_name, page_counts, document.expected_page_counts(),
+        )
+        pdfs = _render_many(document.render_html(page_counts), base_url)
+    return _merge_pdfs(pdfs)
+
+
+def document_parts(document):
+    if isinstance(document, ChunkedDocument):
+        return document.render_html()
+    return [document]
+
+
+def pdf_cache_key(html, data_token=''):
+    """Ключ кеша: хеш версии данных и итогового HTML (строка или список кусков)."""
+    digest = hashlib.sha256()
+    digest.update(data_token.encode('utf-8'))
+    for part in ([html] if isinstance(html, str) else html):
+        digest.update(b'\n')
+        digest.update(part.encode('utf-8'))
+    return digest.hexdigest()
+
+
+def pdf_cache_path(cache_key):
+    return f"{PDF_CACHE_DIR}/{cache_key[:2]}/{cache_key}.pdf"
+
+
+def _complete_jobs(cache_key, path=None, error=''):
+    """Завершает ожидающие задачи с этим ключом и уведомляет пользователей."""
+    jobs = BackgroundJob.objects.filter(
+        cache_key=cache_key, kind=BackgroundJob.Kind.PDF,
+        status__in=[BackgroundJob.Status.PENDING, BackgroundJob.Status.RUNNING],
+    )
+    for job in jobs:
+        status = BackgroundJob.Status.FAILED if error else BackgroundJob.Status.DONE
+        # Условное обновление: задачу завершает ровно один участник гонки
+        updated = BackgroundJob.objects.filter(
+            pk=job.pk, status__in=[BackgroundJob.Status.PENDING, BackgroundJob.Status.RUNNING]
+        ).update(status=status, result_path=path or '', error=error, finished_at=timezone.now())
+        if not updated:
+            continue
+        if error:
+            Notification.objects.create(user_id=job.user_id, message=f"Не удалось сформировать PDF «{job.title}».")
+        else:
+            Notification.objects.create(
+                user_id=job.user_id,
+                message=f"PDF «{job.title}» готов к скачиванию.",
+                link=reverse('core:background_job_download', args=[job.pk]),
+            )
+
+
+def prune_pdf_cache():
+    """
+    Удаляет из кеша PDF файлы старше PDF_CACHE_TTL_HOURS, затем самые старые,
+    пока общий размер больше PDF_CACHE_MAX_MB. Возвращает число удалённых файлов.
+    """
+    root = private_storage().path(PDF_CACHE_DIR)
+    files = []
+    for dirpath, _, names in os.walk(root):
+        for name in names:
+            full_path = os.path.join(dirpath, name)
+            try:
+                stat = os.stat(full_path)
+            except FileNotFoundError:
+                continue
+            files.append((stat.st_mtime, stat.st_size, full_path))
+
+    expire_before = time.time() - getattr(settings, 'PDF_CACHE_TTL_HOURS', 72) * 3600
+    max_bytes = getattr(settings, 'PDF_CACHE_MAX_MB', 500) * 1024 * 1024
+    total = sum(size for _, size, _ in files)
+    removed = 0
+    # От старых к новым: сначала все просроченные, затем — пока кеш больше предела
+    for mtime, size, full_path in sorted(files):
+        if mtime >= expire_before and total <= max_bytes:
+            break
+        try:
+            os.remove(full_path)
+        except FileNotFoundError:
+            pass
+        total -= size
+        removed += 1
+    return removed
+
+
+def _store(cache_key, pdf):
+    """Сохраняет PDF в кеш; заодно (не чаще PDF_CACHE_PRUNE_INTERVAL) чистит кеш."""
+    path = private_storage().save(pdf_cache_path(cache_key), ContentFile(pdf))
+    if cache.add(f"{PDF_CACHE_DIR}:pruned", 1, timeout=getattr(settings, 'PDF_CACHE_PRUNE_INTERVAL', 3600)):
+        try:
+            prune_pdf_cache()
+        except OSError:
+            logger.exception("Ошибка очистки кеша PDF")
+    return path
+
+
+def _render_and_store(cache_key, document, parts, base_url):
+    """Выполняется в потоке: рендер в процессах пула и сохранение в хранилище."""
+    try:
+        pdf = render_document(document, parts, base_url)
+        return _store(cache_key, pdf)
+    except Exception:
+        logger.exception("Ошибка рендеринга PDF %s", cache_key)
+        raise
+    finally:
+        with _lock:
+            _inflight.pop(cache_key, None)
+        # У потока пула собственное подключение к БД
+        connections.close_all()
+
+
+def _finish_jobs(cache_key, future):
+    """
+    Колбэк рендера: завершает задачи ключа. Выполняется в потоке рендера
+    после его окончания или сразу, если рендер уже закончился.
+    """
+    try:
+        path, error = future.result(), ''
+    except Exception as exc:
+        path, error = None, str(exc)[:500]
+    try:
+        _complete_jobs(cache_key, path=path, error=error)
+    finally:
+        if threading.current_thread().name.startswith(THREAD_NAME_PREFIX):
+            connections.close_all()
+
+
+def _submit(cache_key, document, parts, base_url):
+    _, thread_pool = _get_pools()
+    with _lock:
+        future = _inflight.get(cache_key)
+        if future is None:
+            future = thread_pool.submit(_render_and_store, cache_key, document, parts, base_url)
+            _inflight[cache_key] = future
+    return future
+
+
+def render_cached_pdf(user, document, title, filename, school_ids=None, base_url=None):
+    """
+    Рендерит document (строка HTML или ChunkedDocument) с кешированием.
+    Возвращает (path, job):
+      path — путь к готовому PDF в закрытом хранилище (job=None);
+      job  — фоновая задача, если рендер ещё идёт (path=None).
+    school_ids — школы, чья версия данных входит в ключ кеша.
+    """
+    parts = document_parts(document)
+    data_token = get_data_stamp(school_ids or [])[0]
+    cache_key = pdf_cache_key(parts, data_token)
+    path = pdf_cache_path(cache_key)
+    if private_storage().exists(path):
+        return path, None
+
+    if _workers() <= 0:
+        # Пул отключён (разработка, тесты): рендерим прямо в запросе
+        return _store(cache_key, render_document(document, parts, base_url)), None
+
+    future = _submit(cache_key, document, parts, base_url)
+    try:
+        return future.result(timeout=getattr(settings, 'PDF_RENDER_WAIT_SECONDS', 10)), None
+    except TimeoutError:
+        pass
+
+    job = BackgroundJob.objects.create(
+        user=user, kind=BackgroundJob.Kind.PDF, status=BackgroundJob.Status.RUNNING,
+        title=title, cache_key=cache_key, filename=filename,
+    )
+    # Задачу завершает колбэк рендера: он срабатывает и тогда, когда рендер
+    # закончился, пока создавалась задача. Регистрируется после фиксации
+    # транзакции, чтобы поток рендера точно увидел строку задачи
+    transaction.on_commit(lambda: future.add_done_callback(lambda done: _finish_jobs(cache_key, done)))
+    job.refresh_from_db()
+    return None, job
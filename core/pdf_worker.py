@@ -0,0 +1,16 @@
+# D:\New_GAT\core\pdf_worker.py
+
+"""
+Код, выполняемый в отдельных процессах пула рендеринга PDF.
+
+Модуль намеренно не импортирует Django: процессы запускаются методом
+spawn (так же, как на Windows), и импорт моделей до django.setup()
+привёл бы к ошибке. Сюда передаётся только готовый HTML.
+"""
+
+
+def render_pdf(html, base_url=None):
+    """Рендерит HTML в PDF и возвращает байты."""
+    # WeasyPrint требует системные библиотеки (pango) — импортируем только при рендеринге
+    from weasyprint import HTML
+    return HTML(string=html, base_url=base_url).write_pdf()
@@ -0,0 +1,19 @@
+# D:\New_GAT\core\private_storage.py
+
+"""
+Закрытое файловое хранилище (PRIVATE_MEDIA_ROOT).
+
+MEDIA_ROOT раздаётся веб-сервером по /media/ без проверки прав, поэтому
+отчёты с данными учеников туда не кладутся: готовые PDF (core/pdf_service.py)
+и архивы пакетной выгрузки (core/batch_export.py) хранятся здесь и отдаются
+только через представления — скачивание отчёта или результата задачи
+её владельцем (core:background_job_download).
+"""
+
+from django.conf import settings
+from django.core.files.storage import FileSystemStorage
+
+
+def private_storage():
+    """Хранилище закрытых файлов (каталог берётся из текущих настроек)."""
+    return FileSystemStorage(location=settings.PRIVATE_MEDIA_ROOT)
@@ -0,0 +1,76 @@
+# D:\New_GAT\core\rankings.py
+
+"""
+Таблицы рангов теста: отсортированные (по убыванию) баллы всего теста,
+каждого класса и каждой школы. Место ученика — позиция его балла в списке.
+
+Кабинет ученика и страница прогресса раньше загружали все результаты
+каждого теста ученика при каждом открытии. Теперь таблицы берутся из
+ночных снимков (AnalyticsSnapshot.Kind.RANKING, команда
+precompute_analytics), а недостающие или устаревшие считаются одним
+запросом по values_list.
+"""
+
+from collections import defaultdict
+
+from .models import AnalyticsSnapshot, StudentResult
+from .snapshots import find_snapshots
+
+
+def rank_params(gat_test_id):
+    return {'gat_test': gat_test_id}
+
+
+def _build_tables(gat_test_ids):
+    """{id теста: таблица} по текущим результатам (класс и школа — текущие у ученика)."""
+    tables = {
+        test_id: {'test': [], 'classes': defaultdict(list), 'schools': defaultdict(list)}
+        for test_id in gat_test_ids
+    }
+    rows = StudentResult.objects.filter(gat_test_id__in=gat_test_ids).order_by().values_list(
+        'gat_test_id', 'student__school_class_id', 'student__school_class__school_id', 'total_score'
+    )
+    for test_id, class_id, school_id, score in rows:
+        table = tables[test_id]
+        table['test'].append(score)
+        # Ключи — строки, как после чтения снимка из JSON
+        table['classes'][str(class_id)].append(score)
+        table['schools'][str(school_id)].append(score)
+
+    for table in tables.values():
+        table['test'].sort(reverse=True)
+        for scores in (*table['classes'].values(), *table['schools'].values()):
+            scores.sort(reverse=True)
+        table['classes'] = dict(table['classes'])
+        table['schools'] = dict(table['schools'])
+    return tables
+
+
+def build_rank_table(params):
+    """Содержимое снимка для rank_params()."""
+    return _build_tables([params['gat_test']])[params['gat_test']]
+
+
+def get_rank_tables(gat_tests):
+    """{id теста: таблица} для тестов (объекты GatTest) — из снимков или на лету."""
+    gat_tests = {test.id: test for test in gat_tests}
+    found = find_snapshots(AnalyticsSnapshot.Kind.RANKING, {
+        test_id: (rank_params(test_id), [test.school_id]) for test_id, test in gat_tests.items()
+    })
+    tables = {test_id: snapshot.payload for test_id, snapshot in found.items()}
+    missing = [test_id for test_id in gat_tests if test_id not in tables]
+    if missing:
+        tables.update(_build_tables(missing))
+    return tables
+
+
+def place(table, score, group=None, group_id=None):
+    """
+    (место, всего) балла score в таблице теста: group=None — весь тест,
+    'classes' / 'schools' — класс или школа group_id. Место None, если балла нет.
+    """
+    scores = table['test'] if group is None else table[group].get(str(group_id), [])
+    try:
+        return scores.index(score) + 1, len(scores)
+    except ValueError:
+        return None, len(scores)
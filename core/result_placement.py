@@ -0,0 +1,43 @@
+# D:\New_GAT\core\result_placement.py
+
+"""
+Заполнение StudentResult.school / school_class / parallel для старых строк.
+
+Новые результаты получают эти поля при загрузке (services) или в save().
+Для уже существующих строк берётся ТЕКУЩИЙ класс ученика — истории
+переводов в базе нет, точнее восстановить нельзя.
+
+Обновление идёт пачками по id тремя UPDATE с подзапросами (без чтения
+строк в Python). Модели передаются параметрами — функцию вызывает и
+миграция (исторические модели), и команда backfill_result_placement.
+"""
+
+from django.db.models import OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def backfill_result_placement(result_model, student_model, class_model, batch_size=5000, only_missing=True):
+    """Возвращает число обновлённых результатов."""
+    results = result_model.objects.order_by()
+    if only_missing:
+        results = results.filter(school_class__isnull=True)
+    ids = results.values_list('id', flat=True).order_by('id')
+
+    class_of_student = student_model.objects.filter(pk=OuterRef('student_id')).values('school_class_id')[:1]
+    school_of_class = class_model.objects.filter(pk=OuterRef('school_class_id')).values('school_id')[:1]
+    parallel_of_class = class_model.objects.filter(pk=OuterRef('school_class_id')).values(
+        parallel=Coalesce('parent_id', 'id')
+    )[:1]
+
+    updated = 0
+    last_id = 0
+    while True:
+        # Пачки по id (keyset): уже обновлённые строки не мешают выбрать следующую пачку
+        batch = list(ids.filter(id__gt=last_id)[:batch_size])
+        if not batch:
+            return updated
+        last_id = batch[-1]
+        rows = result_model.objects.filter(id__in=batch)
+        rows.update(school_class_id=Subquery(class_of_student))
+        rows.update(school_id=Subquery(school_of_class), parallel_id=Subquery(parallel_of_class))
+        updated += len(batch)
@@ -0,0 +1,123 @@
+# D:\New_GAT\core\search_key.py
+
+"""
+Нормализованный ключ поиска ученика (Student.search_key).
+
+Имена приходят кириллицей, таджикской кириллицей и латиницей, а в Excel
+часто встречаются латинские буквы-двойники («Aлиев» с латинской A).
+Ключ приводит всё к одному виду:
+
+  * регистр сбрасывается (casefold), ё -> е, таджикские буквы -> русские
+    (ӣ -> и, ӯ -> у, ҳ -> х, қ -> к, ғ -> г, ҷ -> ч);
+  * в слове, где смешаны кириллица и латиница, латинские двойники
+    заменяются кириллическими (как normalize_cyrillic в services);
+  * слово целиком латиницей транслитерируется в кириллицу
+    (Aliev -> алиев), поэтому английские поля совпадают с русскими;
+  * цифровой ID дополняется нулями до 6 знаков, как при загрузке.
+
+Ключ — слова через пробел, с пробелом в начале и в конце (ID, затем
+русские, таджикские и английские поля): " 000123 алиев вали алиев вали алиев вали ".
+Поиск слова с начала — contains(" слово"), точное ФИО — contains(" фамилия имя ").
+
+Модуль не зависит от моделей: его используют models.py, миграции и поиск.
+"""
+
+import re
+
+STUDENT_ID_WIDTH = 6
+
+_WORD_RE = re.compile(r'\w+')
+_LATIN_RE = re.compile(r'[a-z]')
+_CYRILLIC_RE = re.compile(r'[а-я]')
+
+_LETTER_MAP = str.maketrans({
+    'ё': 'е', 'ӣ': 'и', 'ӯ': 'у', 'ҳ': 'х', 'қ': 'к', 'ғ': 'г', 'ҷ': 'ч',
+})
+# Латинские буквы, похожие на кириллические (нижний регистр после casefold)
+_LOOKALIKE_MAP = str.maketrans({
+    'a': 'а', 'b': 'в', 'c': 'с', 'e': 'е', 'h': 'н', 'k': 'к', 'm': 'м',
+    'o': 'о', 'p': 'р', 't': 'т', 'x': 'х', 'y': 'у',
+})
+# Транслитерация слов латиницей: сначала буквосочетания, затем отдельные буквы
+_TRANSLIT_DIGRAPHS = (
+    ('shch', 'щ'), ('sh', 'ш'), ('ch', 'ч'), ('zh', 'ж'), ('kh', 'х'), ('ts', 'ц'),
+    ('ya', 'я'), ('yu', 'ю'), ('yo', 'е'), ('ye', 'е'), ('iy', 'и'), ('dj', 'дж'),
+)
+_TRANSLIT_LETTERS = str.maketrans({
+    'a': 'а', 'b': 'б', 'c': 'к', 'd': 'д', 'e': 'е', 'f': 'ф', 'g': 'г', 'h': 'х',
+    'i': 'и', 'j': 'дж', 'k': 'к', 'l': 'л', 'm': 'м', 'n': 'н', 'o': 'о', 'p': 'п',
+    'q': 'к', 'r': 'р', 's': 'с', 't': 'т', 'u': 'у', 'v': 'в', 'w': 'в', 'x': 'кс',
+    'y': 'й', 'z': 'з',
+})
+
+
+def normalize_word(word):
+    """Одно слово в форме ключа (без пробелов)."""
+    word = word.casefold().translate(_LETTER_MAP)
+    if not _LATIN_RE.search(word):
+        return word
+    if _CYRILLIC_RE.search(word):
+        return word.translate(_LOOKALIKE_MAP)
+    for latin, cyrillic in _TRANSLIT_DIGRAPHS:
+        word = word.replace(latin, cyrillic)
+    return word.translate(_TRANSLIT_LETTERS)
+
+
+def normalize_words(text):
+    """Слова текста в форме ключа: ['алиев', 'вали']."""
+    return [normalize_word(word) for word in _WORD_RE.findall(str(text or ''))]
+
+
+def normalize_student_id(student_id):
+    student_id = str(student_id or '').strip()
+    return student_id.zfill(STUDENT_ID_WIDTH) if student_id.isdigit() else student_id
+
+
+def build_search_key(student_id, *names):
+    """Ключ ученика: ID и все поля имени по порядку."""
+    words = normalize_words(normalize_student_id(student_id))
+    for name in names:
+        words.extend(normalize_words(name))
+    return f" {' '.join(words)} " if words else ''
+
+
+def name_fragment(*names):
+    """Подстрока ключа для точного совпадения ФИО: " алиев вали "."""
+    words = [word for name in names for word in normalize_words(name)]
+    return f" {' '.join(words)} " if words else ''
+
+
+def backfill_search_keys(student_model, batch_size=2000, only_missing=False):
+    """
+    Пересчитывает search_key пачками через bulk_update. Принимает модель
+    параметром — так её может вызвать и миграция (историческая модель).
+    Возвращает число обновлённых учеников.
+    """
+    fields = (
+        'id', 'student_id', 'last_name_ru', 'first_name_ru',
+        'last_name_tj', 'first_name_tj', 'last_name_en', 'first_name_en', 'search_key',
+    )
+    students = student_model.objects.order_by('id').only(*fields)
+    if only_missing:
+        students = students.filter(search_key='')
+
+    updated = 0
+    last_id = 0
+    while True:
+        # Пачки по id (keyset): запись в таблицу не мешает чтению следующей пачки
+        chunk = list(students.filter(id__gt=last_id)[:batch_size])
+        if not chunk:
+            return updated
+        last_id = chunk[-1].id
+        changed = []
+        for student in chunk:
+            key = build_search_key(
+                student.student_id, student.last_name_ru, student.first_name_ru,
+                student.last_name_tj, student.first_name_tj, student.last_name_en, student.first_name_en,
+            )
+            if key != student.search_key:
+                student.search_key = key
+                changed.append(student)
+        if changed:
+            student_model.objects.bulk_update(changed, ['search_key'])
+            updated += len(changed)
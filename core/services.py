@@ -13,10 +13,13 @@ from django.core.exceptions import ObjectDoesNotExist, ValidationError
 from django.core.files.storage import default_storage
 
 from .models import (
-    Student, StudentResult, GatTest, Question, 
-    SchoolClass, Subject, StudentAnswer
+    Student, StudentResult, GatTest, 
+    SchoolClass, Subject, StudentAnswer, class_placement
 )
 from .utils import calculate_grade_from_percentage 
+from .data_version import bump_data_version, deferred_bumps
+from .search_key import name_fragment, normalize_words
+from .student_answers import answers_on_upload, build_answers, get_questions
 
 # =============================================================================
 # --- ВСПОМОГАТЕЛЬНЫЕ ФУНКЦИИ ---
@@ -68,6 +71,14 @@ def extract_test_date_from_excel(uploaded_file):
                 continue
     return None
 
+def _same_name(student, last_name, first_name):
+    """Фамилия и имя (русские поля) совпадают после нормализации ключа поиска."""
+    return (
+        normalize_words(student.last_name_ru) == normalize_words(last_name)
+        and normalize_words(student.first_name_ru) == normalize_words(first_name)
+    )
+
+
 def _get_or_create_student_smart(row_data, test_school_class, test_school, update_names=True):
     """
     Ищет студента. Если в Excel указана ПАРАЛЛЕЛЬ (например, 7),
@@ -105,11 +116,17 @@ def _get_or_create_student_smart(row_data, test_school_class, test_school, updat
             subclasses = test_school_class.subclasses.all()
             classes_to_search.extend(subclasses)
 
-        student = Student.objects.filter(
+        # Ключ поиска сужает выборку (регистр, ё/е, латинские двойники), но
+        # подстрока может пересечь границу полей ("Вали Алиев" внутри ключа
+        # "Алиев Вали ... Алиев Вали") — поэтому фамилия и имя сверяются
+        # по отдельности, как раньше iexact
+        candidates = Student.objects.filter(
             school_class__in=classes_to_search,
-            last_name_ru__iexact=last_name,
-            first_name_ru__iexact=first_name
-        ).first()
+            search_key__contains=name_fragment(last_name, first_name)
+        ).order_by('id')
+        student = next(
+            (c for c in candidates if _same_name(c, last_name, first_name)), None
+        )
 
         if student:
             updated = False
@@ -332,13 +349,17 @@ def process_student_results_upload(gat_test, excel_file_path, overrides_map=None
 
     max_test_score = gat_test.questions.aggregate(total=models.Sum('points'))['total'] or 0
 
-    student_answers_to_create = [] 
+    question_keys = set()
+    processed_results = []
     processed_result_ids = []
+    # Классы учеников этой загрузки: {id: SchoolClass} — для полей «на момент теста»
+    classes_by_id = {}
 
     test_school = gat_test.school
     test_school_class = gat_test.school_class
 
-    with transaction.atomic():
+    # Версии данных поднимаются один раз после загрузки, а не на каждой строке
+    with deferred_bumps(), transaction.atomic():
         for index, row in df.iterrows():
             row_num = index + 2
             row_dict = row.to_dict()
@@ -406,30 +427,25 @@ def process_student_results_upload(gat_test, excel_file_path, overrides_map=None
                 current_student_answers_data[subject][q_num] = is_correct
 
             # --- 4. Сохранение результата ---
+            # Школа/класс/параллель фиксируются на момент загрузки (перевод ученика их не меняет)
+            if student.school_class_id not in classes_by_id:
+                classes_by_id[student.school_class_id] = SchoolClass.objects.get(pk=student.school_class_id)
             student_result, _ = StudentResult.objects.update_or_create(
                 student=student,
                 gat_test=gat_test,
-                defaults={'total_score': total_score, 'scores_by_subject': scores_by_subject}
+                defaults={
+                    'total_score': total_score, 'scores_by_subject': scores_by_subject,
+                    **class_placement(classes_by_id[student.school_class_id]),
+                }
             )
             processed_result_ids.append(student_result.id)
 
-            # --- 5. Подготовка StudentAnswer ---
+            # --- 5. Ответы по вопросам ---
+            # Ключи вопросов копятся для всей загрузки; строки StudentAnswer
+            # пишутся только при STUDENT_ANSWERS_ON_UPLOAD (core/student_answers.py)
             for subject, answers in current_student_answers_data.items():
-                for q_num, is_correct in answers.items():
-                    question = Question.objects.filter(
-                        gat_test=gat_test, subject=subject, question_number=q_num
-                    ).first()
-                    
-                    if not question:
-                        question = Question.objects.create(
-                            gat_test=gat_test, subject=subject, question_number=q_num
-                        )
-                    
-                    student_answers_to_create.append(StudentAnswer(
-                        result=student_result,
-                        question=question,
-                        is_correct=is_correct
-                    ))
+                question_keys.update((subject.id, q_num) for q_num in answers)
+            processed_results.append(student_result)
 
             if max_test_score > 0:
                 percent = (total_score / max_test_score) * 100
@@ -438,18 +454,17 @@ def process_student_results_upload(gat_test, excel_file_path, overrides_map=None
             
             results_processed += 1
 
-    # ✨ ОПТИМИЗАЦИЯ BULK
-    if processed_result_ids:
-        # Удаляем старые ответы перед записью новых
-        StudentAnswer.objects.filter(result_id__in=processed_result_ids).delete()
-    
-    if student_answers_to_create:
-        # Теперь безопасно создаем новые, так как дубликатов студентов нет
-        StudentAnswer.objects.bulk_create(
-    student_answers_to_create, 
-    batch_size=2000, 
-    ignore_conflicts=True  # <--- ВАЖНОЕ ДОБАВЛЕНИЕ
-)
+        # Вопросы теста создаются одним запросом на загрузку
+        questions = get_questions(gat_test, question_keys)
+        if processed_result_ids:
+            # Удаляем старые ответы: при повторной загрузке они устарели
+            StudentAnswer.objects.filter(result_id__in=processed_result_ids).delete()
+        if answers_on_upload():
+            StudentAnswer.objects.bulk_create(
+                build_answers(processed_results, questions), batch_size=2000, ignore_conflicts=True
+            )
+
+    bump_data_version([gat_test.school_id])
 
     if default_storage.exists(excel_file_path):
         default_storage.delete(excel_file_path)
@@ -0,0 +1,88 @@
+# D:\New_GAT\core\signals.py
+
+"""
+Сигналы, поднимающие версии данных (core/data_version.py), сбрасывающие
+справочники локального роутера AI-чата (core/ai_intents.py) и обновляющие
+индекс подсказок поиска (core/typeahead.py).
+
+На StudentResult сигналы удаления намеренно НЕ вешаются: любой receiver
+на post_delete отключает быстрое каскадное удаление в Django. Места, где
+результаты удаляются или загружаются, поднимают версию явно.
+"""
+
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from . import typeahead
+from .ai_intents import invalidate_reference_data
+from .data_version import bump_data_version, deferred_memo
+from .models import (
+    AcademicYear, Quarter, Subject, School, SchoolClass, GatTest, Student, QuestionCount
+)
+
+
+def _school_id_of_class(class_id):
+    if not class_id:
+        return None
+    # При массовых операциях (deferred_bumps) не спрашиваем БД для каждого ученика
+    memo = deferred_memo()
+    if memo is not None and class_id in memo:
+        return memo[class_id]
+    school_id = SchoolClass.objects.filter(pk=class_id).values_list('school_id', flat=True).first()
+    if memo is not None:
+        memo[class_id] = school_id
+    return school_id
+
+
+@receiver([post_save, post_delete], sender=GatTest)
+def gat_test_changed(sender, instance, **kwargs):
+    bump_data_version([instance.school_id])
+
+
+@receiver([post_save, post_delete], sender=Student)
+def student_changed(sender, instance, **kwargs):
+    bump_data_version([_school_id_of_class(instance.school_class_id)])
+
+
+@receiver([post_save, post_delete], sender=QuestionCount)
+def question_count_changed(sender, instance, **kwargs):
+    bump_data_version([_school_id_of_class(instance.school_class_id)])
+
+
+@receiver([post_save, post_delete], sender=Subject)
+@receiver([post_save, post_delete], sender=Quarter)
+@receiver([post_save, post_delete], sender=AcademicYear)
+def global_data_changed(sender, instance, **kwargs):
+    # Предметы и периоды общие для всех школ
+    bump_data_version()
+
+
+@receiver([post_save, post_delete], sender=School)
+@receiver([post_save, post_delete], sender=SchoolClass)
+@receiver([post_save, post_delete], sender=Subject)
+@receiver([post_save, post_delete], sender=Quarter)
+def reference_data_changed(sender, instance, **kwargs):
+    invalidate_reference_data()
+
+
+# Индекс подсказок: receivers объявлены после повышения версий, чтобы
+# индекс запомнил уже новую версию школы
+@receiver([post_save, post_delete], sender=Student)
+def student_typeahead(sender, instance, signal, **kwargs):
+    if typeahead.is_enabled() and typeahead.is_loaded():
+        deleted = signal is post_delete
+        school_id = None if deleted else _school_id_of_class(instance.school_class_id)
+        typeahead.student_saved(instance, school_id, deleted=deleted)
+
+
+@receiver([post_save, post_delete], sender=GatTest)
+def gat_test_typeahead(sender, instance, signal, **kwargs):
+    if typeahead.is_enabled() and typeahead.is_loaded():
+        typeahead.test_saved(instance, deleted=signal is post_delete)
+
+
+@receiver(post_save, sender=School)
+@receiver(post_save, sender=SchoolClass)
+def school_labels_typeahead(sender, instance, **kwargs):
+    if typeahead.is_enabled() and typeahead.is_loaded():
+        typeahead.school_changed(instance.pk if sender is School else instance.school_id)
@@ -0,0 +1,143 @@
+# D:\New_GAT\core\snapshots.py
+
+"""
+Снимки тяжёлой аналитики (AnalyticsSnapshot).
+
+Команда precompute_analytics (ночью, по cron или расписанию хостинга:
+Celery в проекте не запущен) заранее считает панель управления по школам,
+распределение оценок (статистика), тепловые карты углубленного анализа за
+текущую четверть и рейтинги тестов. Результат хранится строкой-версией:
+параметры расчёта -> key, данные -> payload.
+
+Представления вызывают find_snapshot(s) с теми же параметрами:
+
+  * снимок валиден, если data_token совпадает с текущими версиями данных
+    его школ (core/data_version.py) и он не старше
+    ANALYTICS_SNAPSHOT_MAX_AGE_HOURS;
+  * иначе (снимка нет или данные изменились) — расчёт как раньше, на лету.
+
+Версия данных берётся ДО расчёта: если загрузка прошла во время расчёта,
+снимок сразу получается устаревшим и не используется.
+"""
+
+import hashlib
+import json
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Max
+from django.utils import timezone
+
+from .data_version import get_school_stamps
+from .models import AnalyticsSnapshot
+
+
+def is_enabled():
+    return getattr(settings, 'ANALYTICS_SNAPSHOTS_ENABLED', True)
+
+
+def snapshot_key(params):
+    """Ключ снимка по JSON-совместимым параметрам расчёта."""
+    raw = json.dumps(params, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha1(raw.encode('utf-8')).hexdigest()
+
+
+def data_token(school_ids, stamps=None):
+    """Короткий хеш версий данных набора школ (с учётом глобальной версии)."""
+    school_ids = sorted(set(school_ids))
+    if stamps is None:
+        stamps = get_school_stamps(school_ids)
+    raw = ';'.join(f"{sid}={stamps[sid]}" for sid in school_ids)
+    return hashlib.sha1(raw.encode('utf-8')).hexdigest()[:16]
+
+
+def _min_computed_at():
+    return timezone.now() - timedelta(hours=getattr(settings, 'ANALYTICS_SNAPSHOT_MAX_AGE_HOURS', 36))
+
+
+# =============================================================================
+# --- ЧТЕНИЕ ---
+# =============================================================================
+
+def find_snapshots(kind, requests):
+    """
+    requests — {ключ: (params, school_ids)}. Возвращает {ключ: AnalyticsSnapshot}
+    только для валидных снимков. Два запроса на любое число ключей.
+    """
+    if not requests or not is_enabled():
+        return {}
+    keys = {key: snapshot_key(params) for key, (params, _) in requests.items()}
+    latest = {}
+    rows = AnalyticsSnapshot.objects.filter(
+        kind=kind, key__in=set(keys.values()), computed_at__gte=_min_computed_at()
+    ).order_by('key', '-version')
+    for row in rows:
+        latest.setdefault(row.key, row)
+    if not latest:
+        return {}
+
+    all_school_ids = {sid for _, school_ids in requests.values() for sid in school_ids}
+    stamps = get_school_stamps(all_school_ids)
+    found = {}
+    for key, (_, school_ids) in requests.items():
+        row = latest.get(keys[key])
+        if row is not None and row.data_token == data_token(school_ids, stamps):
+            found[key] = row
+    return found
+
+
+def find_snapshot(kind, params, school_ids):
+    """Валидный снимок для параметров или None."""
+    return find_snapshots(kind, {None: (params, school_ids)}).get(None)
+
+
+# =============================================================================
+# --- ЗАПИСЬ ---
+# =============================================================================
+
+def save_snapshot(kind, params, school_ids, compute, force=False):
+    """
+    Считает compute(params) и сохраняет новую версию снимка.
+    Без force ничего не делает, если последний снимок ещё валиден.
+    Возвращает (AnalyticsSnapshot, создан ли новый).
+    """
+    key = snapshot_key(params)
+    token = data_token(school_ids)
+    if not force:
+        current = AnalyticsSnapshot.objects.filter(
+            kind=kind, key=key, data_token=token, computed_at__gte=_min_computed_at()
+        ).order_by('-version').first()
+        if current is not None:
+            return current, False
+
+    started = time.perf_counter()
+    payload = compute(params)
+    duration_ms = int((time.perf_counter() - started) * 1000)
+
+    for _ in range(3):
+        version = (
+            AnalyticsSnapshot.objects.filter(kind=kind, key=key).aggregate(v=Max('version'))['v'] or 0
+        ) + 1
+        try:
+            with transaction.atomic():
+                snapshot = AnalyticsSnapshot.objects.create(
+                    kind=kind, key=key, version=version, params=params,
+                    data_token=token, payload=payload, duration_ms=duration_ms,
+                )
+            break
+        except IntegrityError:
+            # Ту же версию только что записал параллельный расчёт
+            continue
+    else:
+        raise IntegrityError(f"Не удалось сохранить снимок {kind} {key}")
+
+    keep = getattr(settings, 'ANALYTICS_SNAPSHOT_KEEP', 3)
+    AnalyticsSnapshot.objects.filter(kind=kind, key=key, version__lte=version - keep).delete()
+    return snapshot, True
+
+
+def prune_snapshots():
+    """Удаляет снимки, которые уже не могут быть использованы (старше срока)."""
+    return AnalyticsSnapshot.objects.filter(computed_at__lt=_min_computed_at()).delete()[0]
@@ -0,0 +1,125 @@
+# D:\New_GAT\core\student_answers.py
+
+"""
+Ответы по вопросам: StudentResult.scores_by_subject и строки StudentAnswer.
+
+Каждая загрузка писала каждый ответ дважды: в JSON scores_by_subject
+({"id предмета": {"номер вопроса": true/false}}) и строкой StudentAnswer.
+Отчёты читают только JSON, а StudentAnswer — самая большая таблица.
+
+При STUDENT_ANSWERS_ON_UPLOAD=False (по умолчанию) загрузка пишет только
+JSON и вопросы теста. Строки StudentAnswer — производные данные:
+
+  * materialize_answers(gat_test) строит недостающие строки теста одной
+    пачкой bulk_create — вызывать перед кодом, которому нужен JOIN по
+    вопросам (answers_for_test делает это сам);
+  * compact_answers() удаляет строки, которые восстанавливаются из JSON
+    (команда compact_student_answers).
+"""
+
+from django.conf import settings
+from django.db import transaction
+
+from .models import Question, StudentAnswer, StudentResult
+
+
+def answers_on_upload():
+    return getattr(settings, 'STUDENT_ANSWERS_ON_UPLOAD', False)
+
+
+def iter_answers(scores_by_subject):
+    """(id предмета, номер вопроса, верно) из JSON; старый формат — список по порядку."""
+    if not isinstance(scores_by_subject, dict):
+        return
+    for subject_key, answers in scores_by_subject.items():
+        if not str(subject_key).isdigit():
+            continue
+        if isinstance(answers, dict):
+            items = answers.items()
+        elif isinstance(answers, list):
+            items = enumerate(answers, start=1)
+        else:
+            continue
+        for number, is_correct in items:
+            if str(number).isdigit():
+                yield int(subject_key), int(number), is_correct is True
+
+
+def get_questions(gat_test, keys):
+    """
+    {(id предмета, номер): Question} для ключей keys; недостающие вопросы
+    создаются одним bulk_create (а не запросом на каждый ответ).
+    """
+    questions = {
+        (q.subject_id, q.question_number): q
+        for q in Question.objects.filter(gat_test=gat_test)
+    }
+    missing = set(keys) - set(questions)
+    if missing:
+        Question.objects.bulk_create(
+            [Question(gat_test=gat_test, subject_id=subject_id, question_number=number)
+             for subject_id, number in sorted(missing)],
+            ignore_conflicts=True,
+        )
+        questions = {
+            (q.subject_id, q.question_number): q
+            for q in Question.objects.filter(gat_test=gat_test)
+        }
+    return questions
+
+
+def build_answers(results, questions):
+    """Несохранённые StudentAnswer для результатов по их scores_by_subject."""
+    answers = []
+    for result in results:
+        for subject_id, number, is_correct in iter_answers(result.scores_by_subject):
+            question = questions.get((subject_id, number))
+            if question is not None:
+                answers.append(StudentAnswer(result=result, question=question, is_correct=is_correct))
+    return answers
+
+
+def materialize_answers(gat_test, batch_size=2000):
+    """
+    Строит StudentAnswer для результатов теста, у которых их нет.
+    Возвращает число созданных строк; если всё уже есть — один запрос.
+    """
+    results = list(
+        StudentResult.objects.filter(gat_test=gat_test, answers__isnull=True)
+        .only('id', 'scores_by_subject')
+    )
+    if not results:
+        return 0
+    keys = {
+        (subject_id, number)
+        for result in results for subject_id, number, _ in iter_answers(result.scores_by_subject)
+    }
+    with transaction.atomic():
+        answers = build_answers(results, get_questions(gat_test, keys))
+        StudentAnswer.objects.bulk_create(answers, batch_size=batch_size, ignore_conflicts=True)
+    return len(answers)
+
+
+def answers_for_test(gat_test):
+    """StudentAnswer теста для JOIN-запросов по вопросам (строки строятся при необходимости)."""
+    materialize_answers(gat_test)
+    return StudentAnswer.objects.filter(result__gat_test=gat_test)
+
+
+def compact_answers(results=None, batch_size=5000):
+    """
+    Удаляет строки StudentAnswer (всех результатов или результатов из
+    queryset results) пачками по id. Возвращает число удалённых строк.
+    """
+    answers = StudentAnswer.objects.order_by('id')
+    if results is not None:
+        answers = answers.filter(result__in=results)
+    ids = answers.values_list('id', flat=True)
+    deleted = 0
+    last_id = 0
+    while True:
+        chunk = list(ids.filter(id__gt=last_id)[:batch_size])
+        if not chunk:
+            return deleted
+        last_id = chunk[-1]
+        deleted += StudentAnswer.objects.filter(id__in=chunk).delete()[0]
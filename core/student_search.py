@@ -0,0 +1,182 @@
+# D:\New_GAT\core\student_search.py
+
+"""
+Индексный поиск учеников для поиска в шапке (header_search_api).
+
+Раньше каждый символ в строке поиска запускал icontains по трём полям
+через JOIN на школу — последовательный просмотр всей таблицы учеников.
+
+Ищем по одной колонке Student.search_key (core/search_key.py): ID и все
+шесть полей имени в нормализованном виде. Запрос нормализуется так же,
+поэтому «Aлиев» с латинской A и «Aliev» находят «Алиев».
+
+  * PostgreSQL: GIN-индекс pg_trgm (gin_trgm_ops) на search_key. Слово
+    ищется с начала (LIKE '% слово%') или по word similarity (%>),
+    порядок — по степени сходства, опечатки прощаются.
+  * SQLite: внешняя FTS5-таблица core_student_fts с префиксными индексами,
+    её поддерживают триггеры на core_student (в т.ч. при bulk_create).
+    Каждое слово запроса ищется как префикс, порядок — по bm25.
+  * Если индекса нет (другая СУБД или SQLite без FTS5) — contains по ключу.
+
+Результат всегда ограничен школами, доступными пользователю: список id
+передаётся снаружи (get_accessible_schools).
+"""
+
+from django.db import OperationalError, connection
+from django.db.models import F, Q
+
+from .models import Student
+from .search_key import STUDENT_ID_WIDTH, normalize_words
+
+FTS_TABLE = 'core_student_fts'
+# Индексируемые колонки (в том же порядке — колонки FTS-таблицы)
+SEARCH_FIELDS = ('search_key',)
+# Слова короче ищутся только с начала: триграммное сходство для них бессмысленно
+MIN_TRIGRAM_LENGTH = 3
+
+
+# =============================================================================
+# --- ИНДЕКСЫ (вызываются из миграций) ---
+# =============================================================================
+
+def install_search_index(schema_editor, fields=SEARCH_FIELDS):
+    """
+    Создаёт индексы поиска по колонкам fields для текущей СУБД. Повторный
+    вызов безопасен: после пересоздания таблицы core_student (ALTER в SQLite)
+    триггеры нужно поставить заново — для этого миграции вызывают функцию
+    ещё раз. Миграции передают fields явно, чтобы не зависеть от версии кода.
+    """
+    vendor = schema_editor.connection.vendor
+    if vendor == 'postgresql':
+        schema_editor.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+        for field in fields:
+            schema_editor.execute(
+                f"CREATE INDEX IF NOT EXISTS core_student_{field}_trgm "
+                f"ON core_student USING gin ({field} gin_trgm_ops)"
+            )
+    elif vendor == 'sqlite' and _sqlite_has_fts5(schema_editor.connection):
+        columns = ", ".join(fields)
+        new_values = ", ".join(f"new.{field}" for field in fields)
+        old_values = ", ".join(f"old.{field}" for field in fields)
+        delete_old = (
+            f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, {columns}) VALUES ('delete', old.id, {old_values});"
+        )
+        insert_new = f"INSERT INTO {FTS_TABLE}(rowid, {columns}) VALUES (new.id, {new_values});"
+        schema_editor.execute(
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5("
+            f"{columns}, content='core_student', content_rowid='id', "
+            f"prefix='1 2 3', tokenize='unicode61 remove_diacritics 2')"
+        )
+        for suffix in ('ai', 'ad', 'au'):
+            schema_editor.execute(f"DROP TRIGGER IF EXISTS {FTS_TABLE}_{suffix}")
+        schema_editor.execute(f"CREATE TRIGGER {FTS_TABLE}_ai AFTER INSERT ON core_student BEGIN {insert_new} END")
+        schema_editor.execute(f"CREATE TRIGGER {FTS_TABLE}_ad AFTER DELETE ON core_student BEGIN {delete_old} END")
+        schema_editor.execute(
+            f"CREATE TRIGGER {FTS_TABLE}_au AFTER UPDATE ON core_student BEGIN {delete_old} {insert_new} END"
+        )
+        schema_editor.execute(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')")
+
+
+def remove_search_index(schema_editor, fields=SEARCH_FIELDS):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'postgresql':
+        for field in fields:
+            schema_editor.execute(f"DROP INDEX IF EXISTS core_student_{field}_trgm")
+    elif vendor == 'sqlite':
+        for suffix in ('ai', 'ad', 'au'):
+            schema_editor.execute(f"DROP TRIGGER IF EXISTS {FTS_TABLE}_{suffix}")
+        schema_editor.execute(f"DROP TABLE IF EXISTS {FTS_TABLE}")
+
+
+def _sqlite_has_fts5(conn):
+    with conn.cursor() as cursor:
+        cursor.execute("SELECT sqlite_compileoption_used('ENABLE_FTS5')")
+        if cursor.fetchone()[0]:
+            return True
+        # Модуль может быть подключён и без флага компиляции
+        cursor.execute("SELECT 1 FROM pragma_module_list WHERE name = 'fts5'")
+        return cursor.fetchone() is not None
+
+
+# =============================================================================
+# --- ПОИСК ---
+# =============================================================================
+
+def search_students(query, school_ids, limit=5):
+    """
+    Ученики из школ school_ids, подходящие под запрос, лучшие совпадения
+    первыми. Возвращает список Student с подгруженным school_class.
+    """
+    words = normalize_words(query)
+    school_ids = list(school_ids)
+    if not words or not school_ids:
+        return []
+
+    if connection.vendor == 'postgresql':
+        return _search_postgresql(words, school_ids, limit)
+    if connection.vendor == 'sqlite':
+        try:
+            return _search_sqlite_fts(words, school_ids, limit)
+        except OperationalError:
+            # SQLite без FTS5: миграция таблицу не создала
+            pass
+    return _search_fallback(words, school_ids, limit)
+
+
+def _scoped_students(school_ids):
+    return Student.objects.filter(school_class__school_id__in=school_ids).select_related('school_class')
+
+
+def _word_prefix(word):
+    """Условие «слово ключа начинается с word»; короткий цифровой ID дополняется нулями."""
+    condition = Q(search_key__contains=f" {word}")
+    if word.isdigit() and len(word) < STUDENT_ID_WIDTH:
+        condition |= Q(search_key__contains=f" {word.zfill(STUDENT_ID_WIDTH)} ")
+    return condition
+
+
+def _search_postgresql(words, school_ids, limit):
+    # django.contrib.postgres импортирует драйвер psycopg — только для PostgreSQL
+    from django.contrib.postgres.lookups import TrigramWordSimilar
+    from django.contrib.postgres.search import TrigramWordSimilarity
+
+    students = _scoped_students(school_ids)
+    # Каждое слово должно найтись в ключе («алиев вали»)
+    for word in words:
+        condition = _word_prefix(word)
+        if len(word) >= MIN_TRIGRAM_LENGTH:
+            condition |= Q(TrigramWordSimilar(F('search_key'), word))
+        students = students.filter(condition)
+    return list(students.annotate(
+        rank=TrigramWordSimilarity(" ".join(words), 'search_key')
+    ).order_by('-rank', 'last_name_ru', 'first_name_ru')[:limit])
+
+
+def _search_sqlite_fts(words, school_ids, limit):
+    # Каждое слово — префикс: "али"* "вал"* (между словами неявное AND)
+    terms = []
+    for word in words:
+        if word.isdigit() and len(word) < STUDENT_ID_WIDTH:
+            terms.append(f'("{word}"* OR "{word.zfill(STUDENT_ID_WIDTH)}")')
+        else:
+            terms.append(f'"{word}"*')
+    placeholders = ", ".join(["%s"] * len(school_ids))
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"SELECT s.id FROM {FTS_TABLE} "
+            f"JOIN core_student s ON s.id = {FTS_TABLE}.rowid "
+            f"JOIN core_schoolclass c ON c.id = s.school_class_id "
+            f"WHERE {FTS_TABLE} MATCH %s AND c.school_id IN ({placeholders}) "
+            f"ORDER BY {FTS_TABLE}.rank LIMIT %s",
+            [" ".join(terms), *school_ids, limit],
+        )
+        ids = [row[0] for row in cursor.fetchall()]
+    found = _scoped_students(school_ids).in_bulk(ids)
+    return [found[pk] for pk in ids if pk in found]
+
+
+def _search_fallback(words, school_ids, limit):
+    students = _scoped_students(school_ids)
+    for word in words:
+        students = students.filter(_word_prefix(word))
+    return list(students[:limit])
@@ -1,17 +1,62 @@
 # D:\New_GAT\core\tests.py (ПОЛНЫЙ И ИСПРАВЛЕННЫЙ КОД)
 
-from django.test import TestCase
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.contrib.auth.models import User
+from django.urls import reverse
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.core.cache import cache
 from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.files.storage import default_storage
 import pandas as pd
 import io
 import datetime
+import json
+import os
 
 from .models import (
     AcademicYear, Quarter, School, SchoolClass, Subject,
-    GatTest, Student, StudentResult
+    GatTest, Student, StudentResult, QuestionCount
 )
+from accounts.models import UserProfile
 # Импортируем правильную функцию из сервисов
 from .services import process_student_results_upload
+from .data_version import bump_data_version
+from .private_storage import private_storage
+
+# Манифест статики (whitenoise) в тестах не собирается
+PLAIN_STATIC = override_settings(
+    STATICFILES_STORAGE='django.contrib.staticfiles.storage.StaticFilesStorage'
+)
+
+
+def isolate_ai_question_log(testcase):
+    """
+    Журнал вопросов AI-чата (AI_QUESTION_LOG) на время теста — во временном
+    файле: тестовые вопросы не попадают в logs/ и в ai_intent_hit_rate.
+    Возвращает путь к файлу.
+    """
+    import logging
+    import tempfile
+    from unittest import mock
+
+    directory = tempfile.TemporaryDirectory()
+    testcase.addCleanup(directory.cleanup)
+    path = os.path.join(directory.name, 'ai_questions.log')
+    log_override = override_settings(AI_QUESTION_LOG=path)
+    log_override.enable()
+    testcase.addCleanup(log_override.disable)
+
+    logger = logging.getLogger('ai_question_logger')
+    handler = logging.FileHandler(path, encoding='utf-8', delay=True)
+    if logger.handlers:
+        handler.setFormatter(logger.handlers[0].formatter)
+    handlers = mock.patch.object(logger, 'handlers', [handler])
+    handlers.start()
+    testcase.addCleanup(handlers.stop)
+    # Закрываем файл до удаления каталога (cleanup выполняются в обратном порядке)
+    testcase.addCleanup(handler.close)
+    return path
 
 class ServicesTestCase(TestCase):
 
@@ -73,13 +118,17 @@ class ServicesTestCase(TestCase):
     def test_process_excel_creates_correct_classes(self):
         """
         Основной тест.
-        Проверяет, что сервис правильно создает классы (10А, 10Б),
-        привязывает к ним учеников и корректно сохраняет их результаты.
+        Сервис не создаёт классы: ученик попадает в существующий подкласс
+        параллели по колонке Section (10 + А = 10А), а если такого класса
+        нет — в класс теста (параллель 10). Результаты сохраняются корректно.
         """
+        class_a = SchoolClass.objects.create(name="10А", school=self.school, parent=self.base_class)
         excel_file = self.create_test_excel_file()
+        # Сервис работает с путём во временном хранилище (как upload_results_view)
+        temp_path = default_storage.save(f"temp/results_{excel_file.name}", excel_file)
         
         # Вызываем правильную функцию и получаем (success, report)
-        success, report = process_student_results_upload(self.gat_test, excel_file)
+        success, report = process_student_results_upload(self.gat_test, temp_path)
 
         # Проверяем, что отчет вернул успех
         self.assertTrue(success)
@@ -89,15 +138,15 @@ class ServicesTestCase(TestCase):
         self.assertEqual(report['created_students'], 3)
         self.assertEqual(len(report['errors']), 0)
 
-        # Проверяем, что сервис создал подклассы
-        self.assertTrue(SchoolClass.objects.filter(name='10А', school=self.school, parent=self.base_class).exists())
-        self.assertTrue(SchoolClass.objects.filter(name='10Б', school=self.school, parent=self.base_class).exists())
-        self.assertEqual(SchoolClass.objects.count(), 3) # 10, 10А, 10Б
+        # Новых классов нет: 10А найден, для «Б» подкласса нет
+        self.assertFalse(SchoolClass.objects.filter(name='10Б').exists())
+        self.assertEqual(SchoolClass.objects.count(), 2) # 10, 10А
+        self.assertEqual(Student.objects.get(student_id='S-1001').school_class, class_a)
 
         # Проверяем конкретного студента
         sidorov = Student.objects.get(student_id='S-1003')
         self.assertEqual(sidorov.last_name_ru, "Сидоров")
-        self.assertEqual(sidorov.school_class.name, '10Б')
+        self.assertEqual(sidorov.school_class, self.base_class)
 
         # Проверяем его результат
         sidorov_result = StudentResult.objects.get(student=sidorov)
@@ -115,4 +164,1780 @@ class ServicesTestCase(TestCase):
         
         # Проверяем, что итоговый балл подсчитан верно (1 + 1 + 0 = 2)
         # Эта логика в services.py была правильной
-        self.assertEqual(sidorov_result.total_score, 2)
\ No newline at end of file
+        self.assertEqual(sidorov_result.total_score, 2)
+
+    def test_name_match_is_per_field(self):
+        """Переставленные имя/фамилия и неполное ФИО не находят чужого ученика."""
+        from .services import _get_or_create_student_smart
+
+        aliev = Student.objects.create(
+            student_id="S-2001", school_class=self.base_class, last_name_ru="Алиев", first_name_ru="Вали"
+        )
+        karimov = Student.objects.create(
+            student_id="S-2002", school_class=self.base_class, last_name_ru="Каримов Саид", first_name_ru="Ахмад"
+        )
+
+        def match(last_name, first_name):
+            row = {'student_id': None, 'last_name': last_name, 'first_name': first_name}
+            return _get_or_create_student_smart(row, self.base_class, self.school)[:2]
+
+        # Регистр и ё/е по-прежнему не мешают
+        self.assertEqual(match("АЛИЕВ", "вали"), (aliev, False))
+        self.assertEqual(match("Каримов Саид", "Ахмад"), (karimov, False))
+
+        swapped, created = match("Вали", "Алиев")
+        self.assertTrue(created)
+        self.assertNotEqual(swapped, aliev)
+
+        partial, created = match("Каримов", "Саид")
+        self.assertTrue(created)
+        self.assertNotEqual(partial, karimov)
+
+    def _upload(self):
+        excel_file = self.create_test_excel_file()
+        temp_path = default_storage.save(f"temp/results_{excel_file.name}", excel_file)
+        return process_student_results_upload(self.gat_test, temp_path)
+
+    def test_upload_skips_student_answers_and_materializes_on_demand(self):
+        from .models import Question, StudentAnswer
+        from .student_answers import answers_for_test
+
+        self._upload()
+        self.assertEqual(Question.objects.filter(gat_test=self.gat_test).count(), 3)
+        self.assertFalse(StudentAnswer.objects.exists())
+
+        answers = answers_for_test(self.gat_test)
+        self.assertEqual(answers.count(), 9)
+        self.assertTrue(answers.get(
+            result__student__student_id='S-1003', question__subject=self.math, question__question_number=2
+        ).is_correct)
+
+    @override_settings(STUDENT_ANSWERS_ON_UPLOAD=True)
+    def test_upload_writes_student_answers_when_enabled(self):
+        from django.core.management import call_command
+        from .models import StudentAnswer
+
+        self._upload()
+        self.assertEqual(StudentAnswer.objects.count(), 9)
+        call_command('compact_student_answers', stdout=io.StringIO())
+        self.assertFalse(StudentAnswer.objects.exists())
+
+
+@PLAIN_STATIC
+class ConditionalGetTestCase(TestCase):
+    """Проверяет ETag/304 для страниц отчётов и их сброс при изменении данных."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.school = School.objects.create(school_id="SCH01", name="Тестовая Школа")
+        cls.admin = User.objects.create_superuser('admin', 'admin@example.com', 'pass')
+
+    def setUp(self):
+        self.client.force_login(self.admin)
+
+    def test_dashboard_returns_304_until_data_changes(self):
+        url = reverse('core:dashboard')
+        first = self.client.get(url)
+        self.assertEqual(first.status_code, 200)
+        etag = first.headers['ETag']
+        self.assertIn('no-cache', first.headers['Cache-Control'])
+        self.assertIn('HX-Request', first.headers['Vary'])
+
+        second = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(second.status_code, 304)
+
+        # Загрузка/удаление результатов поднимает версию школы
+        bump_data_version([self.school.id])
+        third = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(third.status_code, 200)
+        self.assertNotEqual(third.headers['ETag'], etag)
+
+    def test_etag_depends_on_params_and_htmx(self):
+        url = reverse('core:statistics')
+        plain = self.client.get(url).headers['ETag']
+        self.assertNotEqual(plain, self.client.get(url, {'test_numbers': '1'}).headers['ETag'])
+        self.assertNotEqual(plain, self.client.get(url, HTTP_HX_REQUEST='true').headers['ETag'])
+
+
+@PLAIN_STATIC
+class GatTestCardCacheTestCase(TestCase):
+    """Удаление теста перерисовывает только карточку своей школы."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_superuser('admin', 'admin@example.com', 'pass')
+        year = AcademicYear.objects.create(name="2025", start_date="2025-09-01", end_date="2026-05-31")
+        quarter = Quarter.objects.create(name="1 четверть", year=year, start_date="2025-09-01", end_date="2025-10-31")
+        cls.school = School.objects.create(school_id="SCH01", name="Школа А")
+        parallel = SchoolClass.objects.create(name="10", school=cls.school)
+        cls.tests = [
+            GatTest.objects.create(
+                name=f"GAT-{n}", test_number=n, test_date=datetime.date.today(),
+                quarter=quarter, school=cls.school, school_class=parallel
+            )
+            for n in (1, 2)
+        ]
+
+    def setUp(self):
+        self.client.force_login(self.admin)
+
+    def test_delete_swaps_single_school_card(self):
+        url = reverse('core:gat_test_delete', args=[self.tests[0].pk])
+        response = self.client.post(url, HTTP_HX_REQUEST='true')
+
+        self.assertEqual(response.headers['HX-Retarget'], f'#school-card-{self.school.id}')
+        self.assertEqual(response.headers['HX-Reswap'], 'outerHTML')
+        self.assertContains(response, 'GAT-2')
+        self.assertNotContains(response, 'GAT-1<')
+
+    def test_list_uses_cached_cards(self):
+        self.client.get(reverse('core:gat_test_list'))
+        with CaptureQueriesContext(connection) as ctx:
+            self.client.get(reverse('core:gat_test_list'))
+        # Тесты с подсчётом результатов для карточек повторно не загружаются
+        self.assertFalse(any('core_studentresult' in q['sql'] for q in ctx.captured_queries))
+
+
+class QueryInstrumentationTestCase(TestCase):
+    """Нормализация SQL для поиска повторяющихся запросов (N+1)."""
+
+    def test_same_query_with_different_values_has_one_shape(self):
+        from .middleware import normalize_sql
+
+        first = normalize_sql('SELECT * FROM t WHERE id = 15 AND name = \'Иван\' AND x IN (%s, %s)')
+        second = normalize_sql('SELECT * FROM t WHERE id = 7 AND name = \'Пётр\' AND x IN (%s, %s, %s)')
+        self.assertEqual(first, second)
+
+    def _records(self, *requests):
+        """JSON-записи логгера query_budget_logger за выполненные запросы: [(уровень, запись)]."""
+        with self.assertLogs('query_budget_logger', level='INFO') as logs:
+            for url, params in requests:
+                self.client.get(url, params)
+        return [(record.levelname, json.loads(record.getMessage())) for record in logs.records]
+
+    @override_settings(QUERY_INSTRUMENTATION_ENABLED=True, QUERY_BUDGETS={}, QUERY_BUDGET_DEFAULT=None)
+    def test_middleware_records_queries_per_view(self):
+        from .views.instrumentation import _summarize_query_records
+
+        admin = User.objects.create_superuser('admin', 'admin@example.com', 'pass')
+        self.client.force_login(admin)
+        search = reverse('core:api_header_search')
+        records = self._records((search, {'q': 'ал'}), (search, {'q': 'иван'}), (reverse('core:api_load_quarters'), {}))
+
+        self.assertEqual([level for level, _ in records], ['INFO'] * 3)
+        first = records[0][1]
+        self.assertEqual((first['view'], first['path'], first['status']), ('core:api_header_search', search, 200))
+        self.assertEqual(first['user_id'], admin.pk)
+        self.assertGreater(first['queries'], 0)
+        self.assertFalse(first['over_budget'])
+
+        rows = {row['view']: row for row in _summarize_query_records([record for _, record in records])}
+        self.assertEqual(rows['core:api_header_search']['requests'], 2)
+        self.assertEqual(rows['core:api_load_quarters']['requests'], 1)
+
+    @override_settings(QUERY_INSTRUMENTATION_ENABLED=True, QUERY_BUDGETS={'core:api_header_search': 1})
+    def test_over_budget_request_is_logged_as_warning(self):
+        admin = User.objects.create_superuser('admin', 'admin@example.com', 'pass')
+        self.client.force_login(admin)
+        ((level, record),) = self._records((reverse('core:api_header_search'), {'q': 'ал'}))
+
+        self.assertEqual(level, 'WARNING')
+        self.assertEqual(record['budget'], 1)
+        self.assertTrue(record['over_budget'])
+        self.assertGreater(record['queries'], 1)
+
+    @PLAIN_STATIC
+    def test_summary_page_is_for_superusers_only(self):
+        import tempfile
+
+        log = tempfile.NamedTemporaryFile('w', suffix='.log', encoding='utf-8', delete=False)
+        self.addCleanup(os.remove, log.name)
+        for queries, over_budget in ((12, False), (140, True)):
+            log.write(json.dumps({'view': 'core:monitoring', 'path': '/dashboard/monitoring/', 'queries': queries,
+                                  'budget': 30, 'over_budget': over_budget}) + '\n')
+        log.close()
+        url = reverse('core:query_stats')
+
+        with override_settings(QUERY_INSTRUMENTATION_LOG=log.name):
+            teacher = User.objects.create_user('teacher', password='pass')
+            self.client.force_login(teacher)
+            self.assertRedirects(self.client.get(url), reverse('core:dashboard'), fetch_redirect_response=False)
+
+            self.client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'pass'))
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['total_records'], 2)
+        (row,) = response.context['rows']
+        self.assertEqual((row['view'], row['requests'], row['max_queries'], row['over_budget']),
+                         ('core:monitoring', 2, 140, 1))
+        self.assertContains(response, 'core:monitoring')
+
+
+
+@PLAIN_STATIC
+class QueryBudgetTestCase(TestCase):
+    """
+    Регрессионные тесты на количество SQL-запросов.
+
+    Каждая страница открывается дважды: на исходной выборке и после того,
+    как учеников стало вдвое больше. Число запросов не должно превышать
+    бюджет и не должно расти вместе с числом учеников (иначе это N+1).
+    """
+    STUDENTS_PER_CLASS = 40
+    QUESTIONS_PER_SUBJECT = 5
+
+    @classmethod
+    def setUpTestData(cls):
+        today = datetime.date.today()
+        cls.year = AcademicYear.objects.create(
+            name="Текущий", start_date=today - datetime.timedelta(days=60),
+            end_date=today + datetime.timedelta(days=200)
+        )
+        cls.quarter = Quarter.objects.create(
+            name="1 четверть", year=cls.year,
+            start_date=today - datetime.timedelta(days=30), end_date=today + datetime.timedelta(days=30)
+        )
+        cls.subjects = [
+            Subject.objects.create(name=name, abbreviation=abbr)
+            for name, abbr in [("Математика", "МАТ"), ("Физика", "ФИЗ"), ("Химия", "ХИМ"), ("Биология", "БИО")]
+        ]
+        cls.schools, cls.parallels, cls.classes, cls.tests = [], [], [], []
+        for n in range(1, 4):
+            school = School.objects.create(school_id=f"SCH{n:02}", name=f"Школа {n}")
+            parallel = SchoolClass.objects.create(name="10", school=school)
+            cls.schools.append(school)
+            cls.parallels.append(parallel)
+            for letter in "АБ":
+                cls.classes.append(SchoolClass.objects.create(name=f"10{letter}", school=school, parent=parallel))
+            for subject in cls.subjects:
+                QuestionCount.objects.create(
+                    school_class=parallel, subject=subject, number_of_questions=cls.QUESTIONS_PER_SUBJECT
+                )
+            # Двухдневный GAT-1: по два предмета в день
+            for day, day_subjects in ((1, cls.subjects[:2]), (2, cls.subjects[2:])):
+                test = GatTest.objects.create(
+                    name=f"GAT-1 День {day}", test_number=1, day=day, test_date=today,
+                    quarter=cls.quarter, school=school, school_class=parallel
+                )
+                test.subjects.set(day_subjects)
+                cls.tests.append(test)
+
+        cls.admin = User.objects.create_superuser('admin', 'admin@example.com', 'pass')
+        # По умолчанию профиль получает роль учителя без предметов — отчёты были бы пустыми
+        cls.admin.profile.role = UserProfile.Role.SUPERUSER
+        cls.admin.profile.save()
+        cls._seed_students(cls.STUDENTS_PER_CLASS)
+
+        cls.student = Student.objects.order_by('id').first()
+        cls.student_user = User.objects.create_user('student', password='pass')
+        cls.student_user.profile.role = UserProfile.Role.STUDENT
+        cls.student_user.profile.student = cls.student
+        cls.student_user.profile.save()
+
+    @classmethod
+    def _seed_students(cls, per_class):
+        """Добавляет per_class учеников в каждый класс с результатами за оба дня."""
+        start = Student.objects.count()
+        students = []
+        for school_class in cls.classes:
+            for i in range(per_class):
+                number = start + len(students)
+                students.append(Student(
+                    student_id=f"ST{number:05}", school_class=school_class,
+                    last_name_ru=f"Фамилия{number}", first_name_ru=f"Имя{number}"
+                ))
+        students = Student.objects.bulk_create(students)
+
+        tests_by_school = {}
+        for test in cls.tests:
+            tests_by_school.setdefault(test.school_id, []).append(test)
+        class_school = {c.id: c.school_id for c in cls.classes}
+
+        results = []
+        for idx, student in enumerate(students):
+            for test in tests_by_school[class_school[student.school_class_id]]:
+                scores = {
+                    str(subject.id): {str(q): (idx + q) % 3 != 0 for q in range(1, cls.QUESTIONS_PER_SUBJECT + 1)}
+                    for subject in test.subjects.all()
+                }
+                total = sum(v for answers in scores.values() for v in answers.values())
+                results.append(StudentResult(student=student, gat_test=test, total_score=total, scores_by_subject=scores))
+        StudentResult.objects.bulk_create(results)
+
+    def _count_queries(self, url, params=None, user=None):
+        cache.clear()
+        self.client.force_login(user or self.admin)
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(url, params or {})
+        self.assertEqual(response.status_code, 200, url)
+        return len(ctx.captured_queries)
+
+    @classmethod
+    def _seed_student_tests(cls, student, count):
+        """Добавляет count тестов школы ученика с его результатами."""
+        school_class = SchoolClass.objects.select_related('parent').get(pk=student.school_class_id)
+        parallel = school_class.parent or school_class
+        offset = GatTest.objects.count()
+        for number in range(offset + 1, offset + count + 1):
+            test = GatTest.objects.create(
+                name=f"GAT-{number}", test_number=number, test_date=datetime.date.today(),
+                quarter=cls.quarter, school_id=school_class.school_id, school_class=parallel
+            )
+            test.subjects.set(cls.subjects)
+            scores = {
+                str(subject.id): {str(q): (number + q) % 2 == 0 for q in range(1, cls.QUESTIONS_PER_SUBJECT + 1)}
+                for subject in cls.subjects
+            }
+            total = sum(v for answers in scores.values() for v in answers.values())
+            StudentResult.objects.create(student=student, gat_test=test, total_score=total, scores_by_subject=scores)
+
+    def assertFlatQueryBudget(self, budget, url, params=None, user=None, grow=None):
+        """Бюджет запросов и его независимость от объёма данных (по умолчанию — числа учеников)."""
+        before = self._count_queries(url, params, user)
+        if grow is None:
+            self._seed_students(self.STUDENTS_PER_CLASS)
+        else:
+            grow()
+        after = self._count_queries(url, params, user)
+        self.assertLessEqual(before, budget, f"{url}: {before} запросов при бюджете {budget}")
+        self.assertLessEqual(after, before, f"{url}: число запросов растёт с объёмом данных ({before} -> {after})")
+
+    def _filter_params(self, **extra):
+        params = {
+            'quarters': [self.quarter.id],
+            'schools': [s.id for s in self.schools],
+            'test_numbers': ['1'],
+        }
+        params.update(extra)
+        return params
+
+    def test_dashboard(self):
+        self.assertFlatQueryBudget(35, reverse('core:dashboard'))
+
+    def test_deep_analysis(self):
+        params = self._filter_params(
+            school_classes=[p.id for p in self.parallels],
+            subjects=[s.id for s in self.subjects],
+        )
+        self.assertFlatQueryBudget(32, reverse('core:deep_analysis'), params)
+
+    def test_statistics(self):
+        self.assertFlatQueryBudget(28, reverse('core:statistics'), self._filter_params())
+
+    def test_monitoring(self):
+        self.assertFlatQueryBudget(30, reverse('core:monitoring'), self._filter_params())
+
+    def test_grading(self):
+        self.assertFlatQueryBudget(30, reverse('core:grading'), self._filter_params())
+
+    def test_student_progress(self):
+        # Число запросов не зависит ни от числа учеников, ни от числа результатов ученика
+        url = reverse('core:student_progress', args=[self.student.id])
+        self.assertFlatQueryBudget(18, url)
+        self.assertFlatQueryBudget(18, url, grow=lambda: self._seed_student_tests(self.student, 3))
+
+    def test_student_dashboard(self):
+        self.assertFlatQueryBudget(15, reverse('core:student_dashboard'), user=self.student_user)
+
+    def test_header_search(self):
+        self.assertFlatQueryBudget(10, reverse('core:api_header_search'), {'q': 'Фамилия1'})
+
+    def test_detailed_results_excel(self):
+        params = {'test_id': self.tests[0].id}
+        self.assertFlatQueryBudget(10, reverse('core:export_detailed_results_excel', args=[1]), params)
+
+    def test_monitoring_excel(self):
+        self.assertFlatQueryBudget(20, reverse('core:export_monitoring_excel'), self._filter_params())
+
+    def test_grading_excel(self):
+        self.assertFlatQueryBudget(20, reverse('core:export_grading_excel'), self._filter_params())
+
+    def test_students_excel(self):
+        self.assertFlatQueryBudget(8, reverse('core:school_student_export_excel', args=[self.schools[0].id]))
+
+    def test_monitoring_excel_is_streamed(self):
+        """Excel отдаётся потоком (FileResponse) с объединённой двухстрочной шапкой."""
+        from openpyxl import load_workbook
+
+        self.client.force_login(self.admin)
+        response = self.client.get(reverse('core:export_monitoring_excel'), self._filter_params())
+        self.assertTrue(response.streaming)
+        self.assertIn('monitoring_report.xlsx', response['Content-Disposition'])
+
+        sheet = load_workbook(io.BytesIO(b''.join(response.streaming_content))).active
+        merged = {str(r) for r in sheet.merged_cells.ranges}
+        self.assertTrue({'A1:A2', 'B1:B2', 'C1:C2', 'D1:D2'} <= merged)
+        self.assertEqual(sheet.cell(row=1, column=2).value, "ФИО Студента")
+        # Ячейки вне объединений в обеих строках шапки не теряются
+        self.assertTrue(sheet.cell(row=1, column=5).value)
+        self.assertTrue(sheet.cell(row=2, column=5).value.startswith("(из "))
+        self.assertEqual(sheet.cell(row=1, column=sheet.max_column).value, "Общий балл")
+        self.assertEqual(sheet.max_row, 2 + Student.objects.count())
+
+
+@PLAIN_STATIC
+class PdfRenderServiceTestCase(TestCase):
+    """Кеш готовых PDF и скачивание результата фоновой задачи."""
+
+    def setUp(self):
+        import tempfile
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        media_override = override_settings(MEDIA_ROOT=media.name, PRIVATE_MEDIA_ROOT=media.name, PDF_RENDER_WORKERS=0)
+        media_override.enable()
+        self.addCleanup(media_override.disable)
+
+        self.school = School.objects.create(school_id="SCH01", name="Школа 1")
+        self.user = User.objects.create_user('teacher', password='pass')
+
+    def _cached_path(self, html):
+        from .data_version import get_data_stamp
+        from .pdf_service import pdf_cache_key, pdf_cache_path
+        key = pdf_cache_key(html, get_data_stamp([self.school.id])[0])
+        return key, pdf_cache_path(key)
+
+    def test_cached_pdf_is_served_without_rendering(self):
+        from django.core.files.base import ContentFile
+        from .pdf_service import render_cached_pdf
+
+        html = "<h1>Отчёт</h1>"
+        _, path = self._cached_path(html)
+        private_storage().save(path, ContentFile(b"%PDF-cached"))
+
+        # WeasyPrint не вызывается: файл уже есть в хранилище
+        served, job = render_cached_pdf(self.user, html, "Отчёт", "report.pdf", school_ids=[self.school.id])
+        self.assertEqual(served, path)
+        self.assertIsNone(job)
+
+        # Новая версия данных школы — другой ключ кеша
+        bump_data_version([self.school.id])
+        self.assertNotEqual(self._cached_path(html)[1], path)
+
+    def test_finished_job_notifies_and_downloads_for_owner_only(self):
+        from django.core.files.base import ContentFile
+        from .models import BackgroundJob, Notification
+        from .pdf_service import _complete_jobs
+
+        key, path = self._cached_path("<p>long</p>")
+        job = BackgroundJob.objects.create(
+            user=self.user, kind=BackgroundJob.Kind.PDF, status=BackgroundJob.Status.RUNNING,
+            title="Мониторинг", cache_key=key, filename="monitoring_report.pdf",
+        )
+        path = private_storage().save(path, ContentFile(b"%PDF-ready"))
+        _complete_jobs(key, path=path)
+        _complete_jobs(key, path=path)  # повторное завершение не дублирует уведомление
+
+        job.refresh_from_db()
+        self.assertEqual(job.status, BackgroundJob.Status.DONE)
+        url = reverse('core:background_job_download', args=[job.pk])
+        self.assertEqual(list(Notification.objects.filter(user=self.user).values_list('link', flat=True)), [url])
+
+        self.client.force_login(self.user)
+        response = self.client.get(url)
+        self.assertEqual(b''.join(response.streaming_content), b"%PDF-ready")
+        self.assertIn('monitoring_report.pdf', response['Content-Disposition'])
+
+        User.objects.create_user('other', password='pass')
+        self.client.login(username='other', password='pass')
+        self.assertEqual(self.client.get(url).status_code, 404)
+
+    def test_cache_is_outside_media_and_pruned_by_age_and_size(self):
+        import tempfile
+        import time
+        from django.core.files.base import ContentFile
+        from .pdf_service import prune_pdf_cache
+
+        private = tempfile.TemporaryDirectory()
+        self.addCleanup(private.cleanup)
+        with override_settings(PRIVATE_MEDIA_ROOT=private.name, PDF_CACHE_TTL_HOURS=1, PDF_CACHE_MAX_MB=1):
+            storage = private_storage()
+            _, path = self._cached_path("<p>report</p>")
+            path = storage.save(path, ContentFile(b"%PDF"))
+            self.assertTrue(storage.path(path).startswith(private.name))
+            self.assertFalse(default_storage.exists(path))
+
+            stale = storage.save("pdf_cache/aa/stale.pdf", ContentFile(b"%PDF"))
+            old = time.time() - 2 * 3600
+            os.utime(storage.path(stale), (old, old))
+            # Свежие, но вместе больше 1 МБ: удаляется самый старый из них
+            big_old = storage.save("pdf_cache/bb/big_old.pdf", ContentFile(b"0" * 700 * 1024))
+            os.utime(storage.path(big_old), (time.time() - 60, time.time() - 60))
+            big_new = storage.save("pdf_cache/cc/big_new.pdf", ContentFile(b"0" * 700 * 1024))
+
+            self.assertEqual(prune_pdf_cache(), 2)
+            self.assertEqual(
+                [storage.exists(p) for p in (stale, big_old, big_new, path)], [False, False, True, True]
+            )
+
+    @override_settings(PDF_RENDER_WORKERS=1, PDF_RENDER_WAIT_SECONDS=0)
+    def test_job_is_finished_by_render_callback(self):
+        from concurrent.futures import Future
+        from unittest import mock
+        from .models import BackgroundJob
+        from .pdf_service import render_cached_pdf
+
+        future = Future()
+        with mock.patch('core.pdf_service._submit', return_value=future):
+            with self.captureOnCommitCallbacks(execute=True):
+                path, job = render_cached_pdf(self.user, "<p>slow</p>", "Отчёт", "report.pdf", school_ids=[self.school.id])
+        self.assertIsNone(path)
+        self.assertEqual(job.status, BackgroundJob.Status.RUNNING)
+
+        # Рендер закончился уже после создания задачи
+        future.set_result("pdf_cache/ab/ready.pdf")
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.result_path), (BackgroundJob.Status.DONE, "pdf_cache/ab/ready.pdf"))
+
+
+@override_settings(PDF_RENDER_WORKERS=0, PDF_CHUNK_PAGES=2)
+class ChunkedPdfTestCase(TestCase):
+    """Рендер больших таблиц по частям: нумерация строк и страниц, склейка."""
+
+    ROWS_PER_PAGE = 5
+
+    def _document(self, rows_count):
+        from types import SimpleNamespace
+        from .pdf_service import ChunkedDocument
+
+        subject = SimpleNamespace(id=1, name="Математика", abbreviation="МАТ")
+        rows = [{
+            'student': SimpleNamespace(full_name_ru=f"Ученик {n}", school_class=SimpleNamespace(name="10А")),
+            'result_obj': SimpleNamespace(gat_test=SimpleNamespace(name="GAT-1")),
+            'scores_by_subject': {1: {'score': n % 10, 'total': 10}},
+            'total_score': n % 10,
+        } for n in range(1, rows_count + 1)]
+        context = {'title': 'Мониторинг', 'title_details': {}, 'table_headers': [{'subject': subject, 'q_count': 10}], 'table_rows': rows}
+        return ChunkedDocument('monitoring/monitoring_pdf.html', context, 'table_rows', self.ROWS_PER_PAGE)
+
+    @staticmethod
+    def _fake_pdf(pages):
+        from pypdf import PdfWriter
+        writer = PdfWriter()
+        for _ in range(pages):
+            writer.add_blank_page(width=842, height=595)
+        output = io.BytesIO()
+        writer.write(output)
+        return output.getvalue()
+
+    def test_chunks_continue_row_and_page_numbering(self):
+        document = self._document(23)  # куски по 10 строк: 10 + 10 + 3
+        self.assertEqual([len(c) for c in document.chunks], [10, 10, 3])
+        self.assertEqual(document.expected_page_counts(), [2, 2, 1])
+
+        first, second, last = document.render_html()
+        self.assertIn("Найдено студентов: 23", first)
+        self.assertNotIn("Найдено студентов", second)
+        self.assertIn('" из 5"', last)
+        self.assertIn("counter-reset: page 3", second)
+        self.assertIn("counter-reset: page 5", last)
+        self.assertNotIn("counter-reset", first)
+        self.assertIn("<td>21</td>", last)
+
+    def test_single_chunk_uses_document_page_counter(self):
+        (html,) = self._document(4).render_html()
+        self.assertIn('counter(pages)', html)
+        self.assertIn("<td>1</td>", html)
+
+    def test_parts_are_merged_and_rerendered_on_overflow(self):
+        from unittest import mock
+        from pypdf import PdfReader
+        from .pdf_service import document_parts, render_document
+
+        document = self._document(23)
+        parts = document_parts(document)
+        rendered = []
+
+        def fake_render(html, base_url=None):
+            # Второй кусок (ученики 11–20) «не уместился» и занял 3 страницы вместо 2
+            rendered.append(html)
+            if "Ученик 21<" in html:
+                return self._fake_pdf(1)
+            return self._fake_pdf(3 if "Ученик 11<" in html else 2)
+
+        with mock.patch('core.pdf_service.render_pdf', side_effect=fake_render):
+            pdf = render_document(document, parts)
+
+        self.assertEqual(len(PdfReader(io.BytesIO(pdf)).pages), 6)
+        # Повторный проход получил точные номера: третий кусок начинается с 6-й страницы из 6
+        self.assertEqual(len(rendered), 6)
+        self.assertIn("counter-reset: page 6", rendered[-1])
+        self.assertIn('" из 6"', rendered[-1])
+
+
+@override_settings(
+    ACCOUNT_HASH_WORKERS=0,
+    PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'],
+)
+class AccountProvisioningTestCase(TestCase):
+    """Массовое создание аккаунтов: логины, профили и число запросов."""
+
+    @classmethod
+    def setUpTestData(cls):
+        school = School.objects.create(school_id="SCH01", name="Школа 1")
+        cls.school_class = SchoolClass.objects.create(name="10А", school=school)
+        names = [("Ivan", "Ivanov")] * 3 + [("Anna", "Petrova"), ("", "")]
+        for n, (first, last) in enumerate(names):
+            Student.objects.create(
+                student_id=f"ST-{n}", school_class=cls.school_class,
+                first_name_en=first, last_name_en=last,
+                last_name_ru=f"Фамилия{n}", first_name_ru=f"Имя{n}",
+            )
+        User.objects.create_user('ivanivanov', password='x')
+        User.objects.create_user('ivanivanov1', password='x')
+
+    def test_usernames_are_reserved_for_whole_batch(self):
+        from .account_provisioning import provision_student_accounts
+
+        students = Student.objects.filter(school_class=self.school_class)
+        with CaptureQueriesContext(connection) as ctx:
+            result = provision_student_accounts(students)
+        # Без цикла exists()/create_user на каждого ученика
+        self.assertLessEqual(len(ctx.captured_queries), 8)
+
+        self.assertEqual(result['created'], 5)
+        usernames = sorted(c['username'] for c in result['credentials'])
+        self.assertEqual(usernames, ['annapetrova', 'ivanivanov2', 'ivanivanov3', 'ivanivanov4', 'st4'])
+
+        for item in result['credentials']:
+            user = User.objects.get(username=item['username'])
+            self.assertTrue(user.check_password(item['password']))
+            self.assertEqual(user.profile.role, UserProfile.Role.STUDENT)
+            self.assertEqual(user.profile.student.full_name_ru, item['full_name'])
+
+    def test_reset_updates_existing_passwords(self):
+        from .account_provisioning import PASSWORD_SET_LABEL, provision_student_accounts
+
+        students = Student.objects.filter(school_class=self.school_class)
+        provision_student_accounts(students)
+
+        kept = provision_student_accounts(students)
+        self.assertEqual((kept['created'], kept['reset']), (0, 0))
+        self.assertTrue(all(c['password'] == PASSWORD_SET_LABEL for c in kept['credentials']))
+
+        reset = provision_student_accounts(students, reset_passwords=True)
+        self.assertEqual(reset['reset'], 5)
+        for item in reset['credentials']:
+            self.assertTrue(User.objects.get(username=item['username']).check_password(item['password']))
+
+    @override_settings(ACCOUNT_HASH_WORKERS=2, PASSWORD_HASHERS=['django.contrib.auth.hashers.PBKDF2PasswordHasher'])
+    def test_process_pool_hashes_with_configured_hasher(self):
+        from django.contrib.auth.hashers import check_password
+        from .account_provisioning import hash_password_batch
+
+        passwords = ['alpha123', 'beta4567', 'gamma890']
+        encoded = hash_password_batch(passwords)
+        self.assertTrue(all(e.startswith('pbkdf2_sha256$') for e in encoded))
+        self.assertTrue(all(check_password(p, e) for p, e in zip(passwords, encoded)))
+
+
+@PLAIN_STATIC
+class BatchExportTestCase(TestCase):
+    """Пакетная выгрузка всех классов школы в ZIP."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_superuser('admin', 'admin@example.com', 'pass')
+        cls.admin.profile.role = UserProfile.Role.SUPERUSER
+        cls.admin.profile.save()
+        year = AcademicYear.objects.create(name="2025", start_date="2025-09-01", end_date="2026-05-31")
+        cls.quarter = Quarter.objects.create(name="1 четверть", year=year, start_date="2025-09-01", end_date="2025-10-31")
+        cls.school = School.objects.create(school_id="SCH01", name="Школа А")
+        parallel = SchoolClass.objects.create(name="10", school=cls.school)
+        class_a = SchoolClass.objects.create(name="10А", school=cls.school, parent=parallel)
+        class_b = SchoolClass.objects.create(name="10Б", school=cls.school, parent=parallel)
+        math = Subject.objects.create(name="Математика", abbreviation="МАТ")
+        QuestionCount.objects.create(school_class=parallel, subject=math, number_of_questions=3)
+        gat = GatTest.objects.create(
+            name="GAT-1", test_number=1, test_date=datetime.date.today(),
+            quarter=cls.quarter, school=cls.school, school_class=parallel
+        )
+        # По три ученика в классе (третий в 10Б — переведён): файлов по-прежнему по одному на класс
+        answers = [{'1': True, '2': True, '3': False}, {'1': True, '2': True, '3': True}, {'1': False, '2': False, '3': False}]
+        for class_index, school_class in enumerate([class_a, class_b]):
+            for index, scores in enumerate(answers):
+                student = Student.objects.create(
+                    student_id=f"S{class_index}{index}", school_class=school_class,
+                    last_name_ru=f"Фамилия{class_index}{index}", first_name_ru="Имя",
+                    status='TRANSFERRED' if (class_index, index) == (1, 2) else 'ACTIVE',
+                )
+                StudentResult.objects.create(student=student, gat_test=gat, scores_by_subject={str(math.id): scores})
+
+    def setUp(self):
+        import tempfile
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        media_override = override_settings(MEDIA_ROOT=media.name, PRIVATE_MEDIA_ROOT=media.name, BATCH_EXPORT_WORKERS=0)
+        media_override.enable()
+        self.addCleanup(media_override.disable)
+        self.client.force_login(self.admin)
+
+    def test_export_writes_file_per_class_and_kind(self):
+        import zipfile
+        from openpyxl import load_workbook
+        from .batch_export import KIND_MONITORING_XLSX, KIND_STUDENTS_XLSX, start_batch_export
+        from .models import BackgroundJob
+
+        job = start_batch_export(
+            self.admin, [self.school.id], [KIND_STUDENTS_XLSX, KIND_MONITORING_XLSX], quarter_id=self.quarter.id
+        )
+        self.assertEqual(job.status, BackgroundJob.Status.DONE)
+        self.assertEqual((job.progress, job.total), (4, 4))
+
+        with private_storage().open(job.result_path, 'rb') as f, zipfile.ZipFile(f) as archive:
+            self.assertEqual(sorted(archive.namelist()), [
+                'Школа А/10А/Мониторинг.xlsx', 'Школа А/10А/Ученики.xlsx',
+                'Школа А/10Б/Мониторинг.xlsx', 'Школа А/10Б/Ученики.xlsx',
+            ])
+            sheet = load_workbook(io.BytesIO(archive.read('Школа А/10А/Мониторинг.xlsx'))).active
+            # Две строки шапки, затем ученики по убыванию балла (число вопросов берётся у параллели)
+            self.assertEqual(sheet.cell(row=3, column=2).value, "Фамилия01 Имя")
+            self.assertEqual(sheet.cell(row=3, column=5).value, "3/3")
+            self.assertEqual(sheet.cell(row=4, column=5).value, "2/3")
+            self.assertEqual(sheet.max_row, 5)
+
+            # Ученики — только активные, как в выгрузке одного класса
+            students = load_workbook(io.BytesIO(archive.read('Школа А/10Б/Ученики.xlsx'))).active
+            self.assertEqual(students.max_row, 3)
+
+            # Мониторинг класса совпадает с выгрузкой мониторинга с фильтром по классу
+            class_b = SchoolClass.objects.get(name="10Б")
+            single = self.client.get(reverse('core:export_monitoring_excel'), {
+                'schools': [self.school.id], 'school_classes': [class_b.id], 'quarters': [self.quarter.id],
+            })
+            expected = load_workbook(io.BytesIO(b''.join(single.streaming_content))).active
+            batch = load_workbook(io.BytesIO(archive.read('Школа А/10Б/Мониторинг.xlsx'))).active
+            self.assertEqual(list(batch.values), list(expected.values))
+
+    def test_monitoring_reads_are_shared_across_classes(self):
+        from .batch_export import KIND_MONITORING_XLSX, start_batch_export
+
+        def reads():
+            with CaptureQueriesContext(connection) as ctx:
+                start_batch_export(self.admin, [self.school.id], [KIND_MONITORING_XLSX], quarter_id=self.quarter.id)
+            # Прогресс задачи обновляется после каждого файла — считаем только чтения данных
+            return [q['sql'] for q in ctx.captured_queries
+                    if q['sql'].startswith('SELECT') and 'core_backgroundjob' not in q['sql']]
+
+        before = reads()
+        parallel = SchoolClass.objects.get(name="10")
+        gat = GatTest.objects.get(name="GAT-1")
+        math = Subject.objects.get(name="Математика")
+        for name in ("10В", "10Г"):
+            school_class = SchoolClass.objects.create(name=name, school=self.school, parent=parallel)
+            student = Student.objects.create(
+                student_id=f"S{name}", school_class=school_class, last_name_ru="Фамилия", first_name_ru="Имя"
+            )
+            StudentResult.objects.create(student=student, gat_test=gat, scores_by_subject={str(math.id): {'1': True}})
+        self.assertEqual(len(reads()), len(before))
+
+    def test_view_starts_job_and_owner_downloads_zip(self):
+        from .models import BackgroundJob
+
+        response = self.client.post(reverse('core:batch_export'), {
+            'schools': [self.school.id], 'kinds': ['students_xlsx'],
+        })
+        self.assertRedirects(response, reverse('core:batch_export'))
+
+        job = BackgroundJob.objects.get(kind=BackgroundJob.Kind.BATCH_EXPORT)
+        response = self.client.get(reverse('core:background_job_download', args=[job.pk]))
+        self.assertEqual(response['Content-Type'], 'application/zip')
+
+        jobs_html = self.client.get(reverse('core:batch_export_jobs')).content.decode()
+        self.assertIn('Скачать', jobs_html)
+        self.assertNotIn('hx-trigger', jobs_html)
+
+
+class CsvExportTestCase(TestCase):
+    """Потоковые CSV-выгрузки отчётов."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_superuser('admin', 'admin@example.com', 'pass')
+        cls.admin.profile.role = UserProfile.Role.SUPERUSER
+        cls.admin.profile.save()
+        year = AcademicYear.objects.create(name="2025", start_date="2025-09-01", end_date="2026-05-31")
+        quarter = Quarter.objects.create(name="1 четверть", year=year, start_date="2025-09-01", end_date="2025-10-31")
+        cls.school = School.objects.create(school_id="SCH01", name="Школа А")
+        parallel = SchoolClass.objects.create(name="10", school=cls.school)
+        class_a = SchoolClass.objects.create(name="10А", school=cls.school, parent=parallel)
+        math = Subject.objects.create(name="Математика", abbreviation="МАТ")
+        QuestionCount.objects.create(school_class=parallel, subject=math, number_of_questions=2)
+        gat = GatTest.objects.create(
+            name="GAT-1", test_number=1, test_date=datetime.date.today(),
+            quarter=quarter, school=cls.school, school_class=parallel
+        )
+        gat.subjects.add(math)
+        for index, (answers, total) in enumerate([({'1': True, '2': False}, 1), ({'1': True, '2': True}, 2)]):
+            student = Student.objects.create(
+                student_id=f"S{index}", school_class=class_a,
+                last_name_ru=f"Иванов{index}", first_name_ru="Иван",
+            )
+            StudentResult.objects.create(
+                student=student, gat_test=gat, total_score=total,
+                scores_by_subject={str(math.id): answers},
+            )
+
+    def setUp(self):
+        self.client.force_login(self.admin)
+
+    def _read_csv(self, response, delimiter=','):
+        import csv
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['Content-Type'], 'text/csv; charset=utf-8')
+        content = b''.join(response.streaming_content).decode('utf-8')
+        # BOM для Excel под Windows
+        self.assertTrue(content.startswith('\ufeff'))
+        return list(csv.reader(io.StringIO(content[1:]), delimiter=delimiter))
+
+    def test_detailed_results_csv_streams_ranking(self):
+        response = self.client.get(reverse('core:export_detailed_results_csv', args=[1]))
+        rows = self._read_csv(response)
+        self.assertEqual(rows[0], ["№", "ID", "ФИО", "Класс", "Школа", "МАТ_1", "МАТ_2", "Общий балл", "Место"])
+        self.assertEqual(rows[1], ["1", "S1", "Иванов1 Иван", "10А", "Школа А", "1", "1", "2", "1"])
+        self.assertEqual(rows[2][5:], ["1", "0", "1", "2"])
+
+    def test_detailed_results_excel_matches_csv(self):
+        from openpyxl import load_workbook
+
+        rows = self._read_csv(self.client.get(reverse('core:export_detailed_results_csv', args=[1])))
+        response = self.client.get(reverse('core:export_detailed_results_excel', args=[1]))
+        sheet = load_workbook(io.BytesIO(b''.join(response.streaming_content))).active
+        excel_rows = [["" if value is None else str(value) for value in row] for row in sheet.values]
+        self.assertEqual(excel_rows, rows)
+
+    def test_monitoring_csv_uses_report_context(self):
+        response = self.client.get(reverse('core:export_monitoring_csv'), {
+            'schools': [self.school.id], 'delimiter': 'semicolon',
+        })
+        rows = self._read_csv(response, delimiter=';')
+        self.assertEqual(rows[0], ['№', 'ID', 'ФИО', 'Класс', 'Школа', 'Тест', 'МАТ', 'МАТ (из)', 'Общий балл'])
+        self.assertEqual(rows[1], ['1', 'S1', 'Иванов1 Иван', '10А', 'Школа А', 'GAT-1 (Total)', '2', '2', '2'])
+        self.assertEqual(len(rows), 3)
+
+
+# Вопросы вида «Топ школ по GAT-1» теперь отвечает локальный роутер — здесь проверяется путь через модель
+@override_settings(AI_INTENT_ROUTER_ENABLED=False)
+class AiChatCacheTestCase(TestCase):
+    """Двухуровневый кеш AI-чата и объединение одинаковых запросов."""
+
+    SQL_ANSWER = '{"sql": "SELECT name AS school_name FROM core_school", "text_response": "Школы:", "is_sql_needed": true}'
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_superuser('admin', 'admin@example.com', 'pass')
+        cls.school = School.objects.create(school_id="SCH01", name="Школа А")
+
+    def setUp(self):
+        self.question_log = isolate_ai_question_log(self)
+        cache.clear()
+
+    def test_repeated_question_is_served_from_both_levels(self):
+        from unittest import mock
+        from .ai_service import ask_database, get_ai_cache_stats
+
+        with mock.patch('core.ai_service._get_ai_response', return_value=self.SQL_ANSWER) as model:
+            first = ask_database(self.admin, "Топ школ по GAT-1?")
+            second = ask_database(self.admin, "  топ школ   по GAT-1 ")
+            self.assertEqual(model.call_count, 1)
+            self.assertEqual(first, second)
+            self.assertIn("Школа А", first)
+
+            # Данные школы изменились: SQL берётся из кеша, таблица считается заново
+            bump_data_version([self.school.id])
+            ask_database(self.admin, "Топ школ по GAT-1")
+            self.assertEqual(model.call_count, 1)
+
+        stats = get_ai_cache_stats()
+        self.assertEqual((stats['sql_hit'], stats['sql_miss']), (2, 1))
+        self.assertEqual((stats['table_hit'], stats['table_miss']), (1, 2))
+
+    def test_chat_history_is_part_of_sql_key(self):
+        from unittest import mock
+        from .ai_service import ask_database
+
+        history = [{'role': 'user', 'text': 'Средний балл 10А'}, {'role': 'ai', 'text': 'Вот таблица'}]
+        with mock.patch('core.ai_service._get_ai_response', return_value=self.SQL_ANSWER) as model:
+            ask_database(self.admin, "Топ школ по GAT-1?")
+            ask_database(self.admin, "Топ школ по GAT-1?", chat_history=history)
+            self.assertEqual(model.call_count, 2)
+            ask_database(self.admin, "Топ школ по GAT-1?", chat_history=list(history))
+            self.assertEqual(model.call_count, 2)
+
+    def test_concurrent_identical_calls_share_one_upstream_call(self):
+        import threading
+        import time
+        from .ai_service import _single_flight, get_ai_cache_stats
+
+        release = threading.Event()
+        calls = []
+
+        def upstream():
+            calls.append(1)
+            release.wait(5)
+            return "answer"
+
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(_single_flight('key', upstream))) for _ in range(3)]
+        threads[0].start()
+        while not calls:
+            time.sleep(0.01)
+        for thread in threads[1:]:
+            thread.start()
+        # Ждём, пока оба повторных вызова встанут в ожидание первого
+        deadline = time.monotonic() + 5
+        while get_ai_cache_stats()['shared'] < 2 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        release.set()
+        for thread in threads:
+            thread.join(5)
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, ["answer"] * 3)
+
+
+@override_settings(AI_STREAM_BATCH_SIZE=2)
+class AiChatStreamTestCase(TestCase):
+    """Потоковый AI-чат: статусы, порции строк таблицы и сохранение истории."""
+
+    SQL_ANSWER = '{"sql": "SELECT name AS school_name FROM core_school ORDER BY name", "text_response": "Школы:", "is_sql_needed": true}'
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_superuser('admin', 'admin@example.com', 'pass')
+        for index in range(3):
+            School.objects.create(school_id=f"SCH0{index}", name=f"Школа {index}")
+
+    def setUp(self):
+        self.question_log = isolate_ai_question_log(self)
+        cache.clear()
+        self.async_client.force_login(self.admin)
+
+    async def _events(self, question):
+        import json
+        response = await self.async_client.post(reverse('core:ai_ask_stream'), {'question': question})
+        self.assertEqual(response['Content-Type'], 'text/event-stream; charset=utf-8')
+        body = ''
+        async for chunk in response.streaming_content:
+            body += chunk.decode('utf-8')
+        events = []
+        for block in body.strip().split('\n\n'):
+            event_line, data_line = block.split('\n')
+            events.append((event_line[len('event: '):], json.loads(data_line[len('data: '):])))
+        return events
+
+    async def test_stream_sends_statuses_and_row_batches(self):
+        from unittest import mock
+        from asgiref.sync import sync_to_async
+        from .ai_service import AI_STATUS_LABELS, STATUS_QUERY, STATUS_RENDERING, STATUS_THINKING
+
+        with mock.patch('core.ai_service._get_ai_response', return_value=self.SQL_ANSWER):
+            events = await self._events("Список школ")
+
+        kinds = [kind for kind, _ in events]
+        self.assertEqual(kinds, ['start', 'status', 'status', 'status', 'html', 'rows', 'rows', 'html', 'done'])
+        statuses = [data for kind, data in events if kind == 'status']
+        self.assertEqual(statuses, [AI_STATUS_LABELS[code] for code in (STATUS_THINKING, STATUS_QUERY, STATUS_RENDERING)])
+        rows = [data for kind, data in events if kind == 'rows']
+        self.assertEqual([batch.count('<tr') for batch in rows], [2, 1])
+        self.assertIn("Школа 2", rows[1])
+
+        # Полный ответ попал в историю сессии и в кеш таблиц
+        history = await sync_to_async(lambda: self.async_client.session['ai_chat_history'])()
+        self.assertEqual(history[0], {'role': 'user', 'text': "Список школ"})
+        self.assertIn("</tbody></table>", history[1]['text'])
+        self.assertIn("Школа 0", history[1]['text'])
+        with mock.patch('core.ai_service._get_ai_response', return_value=self.SQL_ANSWER):
+            cached = await self._events("Список школ")
+        self.assertEqual([data for kind, data in cached if kind == 'html'], [history[1]['text']])
+
+
+class AiIntentRouterTestCase(TestCase):
+    """Локальный роутер частых вопросов AI-чата (без вызова модели)."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_superuser('admin', 'admin@example.com', 'pass')
+        year = AcademicYear.objects.create(name="2025", start_date="2025-09-01", end_date="2026-05-31")
+        cls.quarter = Quarter.objects.create(name="1 четверть", year=year, start_date="2025-09-01", end_date="2025-10-31")
+        cls.math = Subject.objects.create(name="Математика", abbreviation="МАТ")
+        cls.lyceum = School.objects.create(school_id="SCH01", name="Лицей №1")
+        cls.other = School.objects.create(school_id="SCH02", name="Мактаби Адолат")
+
+        cls.students = {}
+        for school, scores in ((cls.lyceum, {"Иванов": 9, "Петров": 3}), (cls.other, {"Сидоров": 6})):
+            parallel = SchoolClass.objects.create(name="10", school=school)
+            school_class = SchoolClass.objects.create(name="10А", school=school, parent=parallel)
+            test = GatTest.objects.create(
+                name=f"GAT-1 {school.name}", test_number=1, test_date=datetime.date(2025, 10, 1),
+                quarter=cls.quarter, school=school, school_class=parallel,
+            )
+            for n, (last_name, score) in enumerate(scores.items()):
+                student = Student.objects.create(
+                    student_id=f"{school.school_id}-{n}", school_class=school_class,
+                    last_name_ru=last_name, first_name_ru="Тест",
+                )
+                answers = {str(q): q <= score for q in range(1, 11)}
+                StudentResult.objects.create(
+                    student=student, gat_test=test, total_score=score,
+                    scores_by_subject={str(cls.math.id): answers},
+                )
+                cls.students[last_name] = student
+
+    def setUp(self):
+        self.question_log = isolate_ai_question_log(self)
+        cache.clear()
+        self.allowed_ids = [self.lyceum.id, self.other.id]
+
+    def test_top_students_with_school_and_test_entities(self):
+        from .ai_intents import match_intent
+
+        intent = match_intent("Покажи топ 5 учеников по школе Лицей №1 за GAT-1", self.allowed_ids)
+        self.assertEqual(intent.name, 'top_students')
+        self.assertEqual(intent.params['schools'], [self.lyceum.id])
+        self.assertEqual(intent.params['limit'], 5)
+        self.assertIn("GAT-1", intent.text_response)
+        self.assertEqual([(row[0], row[1], row[4]) for row in intent.run()], [(1, "Иванов Тест", 9), (2, "Петров Тест", 3)])
+
+    def test_averages_history_and_at_risk(self):
+        from .ai_intents import match_intent
+
+        schools = match_intent("Средний балл по школам", self.allowed_ids)
+        self.assertEqual(schools.name, 'average_by_school')
+        self.assertEqual({row[1]: row[2] for row in schools.run()}, {"Лицей №1": 6.0, "Мактаби Адолат": 6.0})
+
+        subjects = match_intent("Какой средний балл по математике в 10А?", self.allowed_ids)
+        self.assertEqual(subjects.name, 'average_by_subject')
+        self.assertEqual(subjects.run(), [("Математика", 60.0, 30)])
+
+        risk = match_intent("Группа риска 10 класса", self.allowed_ids)
+        self.assertEqual(risk.name, 'at_risk')
+        self.assertEqual([row[0] for row in risk.run()], ["Петров Тест"])
+
+        history = match_intent("История результатов ученика Сидоров", self.allowed_ids)
+        self.assertEqual(history.name, 'student_history')
+        self.assertEqual(history.params['students'], [self.students["Сидоров"].pk])
+        self.assertEqual(history.run(), [("GAT-1 Мактаби Адолат", "01.10.2025", "1 четверть", 6)])
+
+        # Объяснения и неизвестные классы остаются модели
+        self.assertIsNone(match_intent("Почему у Лицей №1 средний балл ниже?", self.allowed_ids))
+        self.assertIsNone(match_intent("Топ учеников 7Б класса", self.allowed_ids))
+        # Ученики чужой школы не видны
+        self.assertIsNone(match_intent("История результатов ученика Сидоров", [self.lyceum.id]))
+
+    def test_ask_database_answers_locally_and_command_reports_hit_rate(self):
+        import tempfile
+        from io import StringIO
+        from unittest import mock
+        from django.core.management import call_command
+        from .ai_service import ask_database, get_ai_cache_stats
+
+        with mock.patch('core.ai_service._get_ai_response') as model:
+            html = ask_database(self.admin, "Топ 3 ученика по GAT-1")
+            model.assert_not_called()
+        self.assertIn("Иванов Тест", html)
+        self.assertEqual(get_ai_cache_stats()['intent_hit'], 1)
+        # Вопрос записан во временный журнал теста, а не в logs/ai_questions.log
+        with open(self.question_log, encoding='utf-8') as log:
+            self.assertEqual(json.loads(log.read())['route'], 'intent:top_students')
+
+        with tempfile.NamedTemporaryFile('w', suffix='.log', delete=False, encoding='utf-8') as f:
+            f.write('{"question": "Средний балл по классам", "route": "model"}\n')
+            f.write('{"question": "Как дела?", "route": "model"}\n')
+        try:
+            out = StringIO()
+            call_command('ai_intent_hit_rate', file=f.name, stdout=out)
+        finally:
+            os.unlink(f.name)
+        self.assertIn("Локально распознано: 1 (50.0%)", out.getvalue())
+        self.assertIn("Из отправленных модели теперь отвечаются локально: 1", out.getvalue())
+
+
+@override_settings(AI_TABLE_PAGE_SIZE=2, AI_SQL_MAX_ROWS=3, AI_INTENT_ROUTER_ENABLED=False)
+class AiSqlSandboxTestCase(TestCase):
+    """SQL модели: только чтение, постраничный вывод и предел строк."""
+
+    SQL_ANSWER = '{"sql": "SELECT name AS school_name FROM core_school ORDER BY name", "text_response": "Школы:", "is_sql_needed": true}'
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_superuser('admin', 'admin@example.com', 'pass')
+        cls.outsider = User.objects.create_user('outsider', password='pass')
+        for index in range(4):
+            School.objects.create(school_id=f"SCH0{index}", name=f"Школа {index}")
+
+    def setUp(self):
+        self.question_log = isolate_ai_question_log(self)
+        cache.clear()
+
+    def test_sandbox_cursor_rejects_writes(self):
+        from django.db import DatabaseError
+        from .ai_sql_sandbox import readonly_cursor
+
+        with self.assertRaises(DatabaseError):
+            with readonly_cursor("DELETE FROM core_school") as cursor:
+                cursor.execute("DELETE FROM core_school")
+        self.assertEqual(School.objects.count(), 4)
+        # Ограничение снимается после запроса
+        School.objects.filter(school_id="SCH03").delete()
+
+    def test_answer_holds_first_page_and_next_pages_load_by_token(self):
+        import re
+        from unittest import mock
+        from .ai_service import ask_database
+
+        with mock.patch('core.ai_service._get_ai_response', return_value=self.SQL_ANSWER):
+            html = ask_database(self.admin, "Список школ")
+        self.assertEqual(html.count('<tr class='), 2)
+        self.assertNotIn("Школа 2", html)
+        next_url = re.search(r'hx-get="([^"]+\?page=2)"', html).group(1)
+
+        self.client.force_login(self.admin)
+        page = self.client.get(next_url).content.decode()
+        self.assertIn("Школа 2", page)
+        self.assertEqual(page.count('<tr class='), 1)
+        self.assertIn("Показаны первые 3 строк", page)
+        self.assertIn("?page=1", page)
+
+        # Без доступа к школам запроса страница не отдаётся
+        self.client.force_login(self.outsider)
+        self.assertIn("Нет доступа", self.client.get(next_url).content.decode())
+
+
+class AiClientTestCase(TestCase):
+    """Клиент API модели против локальной заглушки (429 / 404 / медленный ответ)."""
+
+    @classmethod
+    def setUpClass(cls):
+        import json
+        import threading
+        import time
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+        super().setUpClass()
+        cls.behaviours = {}
+        cls.hits = []
+
+        class StubHandler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                self.rfile.read(int(self.headers.get('Content-Length', 0)))
+                model = self.path.split('/models/')[1].split(':')[0]
+                cls.hits.append(model)
+                behaviour = cls.behaviours.get(model, 'ok')
+                if behaviour == '429':
+                    self.send_response(429)
+                    self.send_header('Retry-After', '30')
+                    self.end_headers()
+                    return
+                if behaviour == '404':
+                    self.send_response(404)
+                    self.end_headers()
+                    return
+                if behaviour == 'slow':
+                    time.sleep(1.5)
+                body = json.dumps({'candidates': [{'content': {'parts': [{'text': f'answer from {model}'}]}}]})
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.end_headers()
+                self.wfile.write(body.encode('utf-8'))
+
+            def log_message(self, *args):
+                pass
+
+        cls.server = ThreadingHTTPServer(('127.0.0.1', 0), StubHandler)
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+        super().tearDownClass()
+
+    def setUp(self):
+        self.question_log = isolate_ai_question_log(self)
+        from . import ai_client
+        ai_client.reset_breakers()
+        self.hits.clear()
+        self.behaviours.clear()
+        stub = override_settings(
+            AI_API_BASE_URL=f"http://127.0.0.1:{self.server.server_port}",
+            AI_MODELS=['m-limited', 'm-missing', 'm-ok'], AI_HEDGE_DELAY=0.2, GOOGLE_API_KEY='test',
+        )
+        stub.enable()
+        self.addCleanup(stub.disable)
+
+    def test_failed_models_are_skipped_and_breakers_open(self):
+        from . import ai_client
+
+        self.behaviours.update({'m-limited': '429', 'm-missing': '404'})
+        self.assertEqual(ai_client.generate("prompt"), 'answer from m-ok')
+        self.assertEqual(ai_client.get_breaker('m-limited').state, 'open')
+        self.assertEqual(ai_client.get_breaker('m-missing').state, 'open')
+
+        # Второй вопрос сразу идёт к рабочей модели
+        self.hits.clear()
+        self.assertEqual(ai_client.generate("prompt"), 'answer from m-ok')
+        self.assertEqual(self.hits, ['m-ok'])
+
+    def test_slow_model_is_hedged(self):
+        import time
+        from . import ai_client
+
+        self.behaviours.update({'m-limited': 'slow'})
+        started = time.monotonic()
+        answer = ai_client.generate("prompt", models=['m-limited', 'm-ok'])
+        self.assertEqual(answer, 'answer from m-ok')
+        self.assertLess(time.monotonic() - started, 1.0)
+
+    def test_all_models_down_raises(self):
+        from . import ai_client
+
+        self.behaviours.update({'m-limited': '429', 'm-missing': '404', 'm-ok': '404'})
+        with self.assertRaises(ai_client.AllModelsFailed):
+            ai_client.generate("prompt")
+        # Все предохранители разомкнуты: запросы больше не отправляются
+        self.hits.clear()
+        with self.assertRaises(ai_client.AllModelsFailed):
+            ai_client.generate("prompt")
+        self.assertEqual(self.hits, [])
+
+
+class StudentSearchTestCase(TestCase):
+    """Индексный поиск учеников для шапки (core/student_search.py)."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.lyceum = School.objects.create(school_id="SCH01", name="Лицей №1")
+        cls.other = School.objects.create(school_id="SCH02", name="Мактаби Адолат")
+        lyceum_class = SchoolClass.objects.create(name="10А", school=cls.lyceum)
+        other_class = SchoolClass.objects.create(name="10Б", school=cls.other)
+        # bulk_create не шлёт сигналов — индекс должны обновить триггеры
+        Student.objects.bulk_create([
+            Student(student_id="100001", school_class=lyceum_class, last_name_ru="Алиев", first_name_ru="Вали"),
+            Student(student_id="100002", school_class=lyceum_class, last_name_ru="Алимов", first_name_ru="Рустам"),
+            Student(student_id="200001", school_class=other_class, last_name_ru="Алиева", first_name_ru="Зарина"),
+        ])
+        cls.director = User.objects.create_user('director', password='pass')
+        cls.director.profile.role = UserProfile.Role.DIRECTOR
+        cls.director.profile.save()
+        cls.director.profile.schools.add(cls.lyceum)
+
+    def test_prefix_search_is_scoped_and_ranked(self):
+        from .student_search import search_students
+
+        found = search_students("али", [self.lyceum.id])
+        self.assertEqual({s.last_name_ru for s in found}, {"Алиев", "Алимов"})
+        self.assertEqual([s.last_name_ru for s in search_students("алиев вал", [self.lyceum.id, self.other.id])], ["Алиев"])
+        self.assertEqual([s.student_id for s in search_students("2000", [self.lyceum.id, self.other.id])], ["200001"])
+        self.assertEqual(search_students("али", []), [])
+
+    def test_search_key_unifies_scripts(self):
+        from .student_search import search_students
+
+        student = Student.objects.get(student_id="100001")
+        self.assertEqual(student.search_key, " 100001 алиев вали ")
+        all_schools = [self.lyceum.id, self.other.id]
+        # Латинская «A» в кириллическом слове, транслит и ё/е дают тот же ключ
+        for query in ("Aлиев", "aliev vali", "АЛИЁВ"):
+            self.assertIn(student, search_students(query, all_schools), query)
+
+        student.last_name_tj = "Қодирӣ"
+        student.save(update_fields=['last_name_tj'])
+        student.refresh_from_db()
+        self.assertIn(" кодири ", student.search_key)
+        self.assertEqual(search_students("кодири", all_schools), [student])
+
+    def test_index_follows_updates(self):
+        from .student_search import search_students
+
+        student = Student.objects.get(student_id="100002")
+        student.last_name_ru = "Каримов"
+        student.save()
+        self.assertEqual([s.id for s in search_students("карим", [self.lyceum.id])], [student.id])
+        self.assertEqual([s.last_name_ru for s in search_students("алим", [self.lyceum.id])], [])
+
+    def test_header_search_respects_permissions(self):
+        self.client.force_login(self.director)
+        response = self.client.get(reverse('core:api_header_search'), {'q': 'Алиев'})
+        names = [item['name'] for item in response.json()['results']]
+        self.assertEqual(names, ["Вали Алиев (10А)"])
+
+
+@override_settings(TYPEAHEAD_ENABLED=True, TYPEAHEAD_CHECK_INTERVAL=60)
+class TypeaheadTestCase(TestCase):
+    """Индекс подсказок поиска в памяти процесса (core/typeahead.py)."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_superuser('admin', 'admin@example.com', 'pass')
+        year = AcademicYear.objects.create(name="2025", start_date="2025-09-01", end_date="2026-05-31")
+        quarter = Quarter.objects.create(name="1 четверть", year=year, start_date="2025-09-01", end_date="2025-10-31")
+        cls.school = School.objects.create(school_id="SCH01", name="Лицей №1")
+        cls.school_class = SchoolClass.objects.create(name="10А", school=cls.school)
+        Student.objects.create(student_id="100001", school_class=cls.school_class, last_name_ru="Алиев", first_name_ru="Вали")
+        GatTest.objects.create(
+            name="GAT Алгебра", test_number=1, test_date=datetime.date(2025, 10, 1),
+            quarter=quarter, school=cls.school, school_class=cls.school_class,
+        )
+
+    def setUp(self):
+        from . import typeahead
+
+        typeahead.clear()
+        self.addCleanup(typeahead.clear)
+        self.client.force_login(self.admin)
+
+    def _search(self, query):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(reverse('core:api_header_search'), {'q': query})
+        return [item['name'] for item in response.json()['results']], ctx.captured_queries
+
+    def test_header_search_served_from_memory(self):
+        names, _ = self._search("ал")
+        self.assertEqual(names, ["Вали Алиев (10А)", "GAT Алгебра (Лицей №1)"])
+
+        # Индекс построен, школы пользователя прочитаны: до следующей проверки
+        # версий запросы только у сессии и аутентификации (без ETag и поиска)
+        names, queries = self._search("Aliev")
+        self.assertEqual(names, ["Вали Алиев (10А)"])
+        self.assertEqual([q['sql'] for q in queries if 'django_session' not in q['sql'] and 'auth_user' not in q['sql']], [])
+
+    def test_signals_update_loaded_index(self):
+        from . import typeahead
+
+        typeahead.warm([self.school.id])
+        Student.objects.create(student_id="100002", school_class=self.school_class, last_name_ru="Алимов", first_name_ru="Рустам")
+        Student.objects.filter(student_id="100001").get().delete()
+        names, queries = self._search("али")
+        self.assertEqual(names, ["Рустам Алимов (10А)"])
+        self.assertFalse([q for q in queries if 'core_student' in q['sql']])
+
+        self.school_class.name = "11А"
+        self.school_class.save()
+        self.assertEqual(self._search("али")[0], ["Рустам Алимов (11А)"])
+        self.assertGreater(typeahead.memory_report()[0][3], 0)
+
+    def test_index_is_built_outside_the_lock(self):
+        import threading
+        from unittest import mock
+        from . import typeahead
+
+        real_build = typeahead._build
+        lock_free = []
+
+        def build(school_id, stamp):
+            # Пока строится индекс, другой поток (поиск, сигнал) получает блокировку
+            probe = threading.Thread(target=lambda: lock_free.append(
+                typeahead._lock.acquire(timeout=2) and (typeahead._lock.release() or True)
+            ))
+            probe.start()
+            probe.join()
+            # Сигнал во время перестройки: построенный индекс будет перестроен при следующей проверке
+            typeahead.school_changed(school_id)
+            return real_build(school_id, stamp)
+
+        with mock.patch('core.typeahead._build', side_effect=build):
+            (index,) = typeahead._get_indexes([self.school.id])
+        self.assertEqual(lock_free, [True])
+        self.assertIsNone(index.stamp)
+        self.assertEqual(self._search("ал")[0], ["Вали Алиев (10А)", "GAT Алгебра (Лицей №1)"])
+
+
+class ResultPlacementTestCase(TestCase):
+    """Школа/класс/параллель ученика на момент теста в StudentResult."""
+
+    @classmethod
+    def setUpTestData(cls):
+        year = AcademicYear.objects.create(name="2025", start_date="2025-09-01", end_date="2026-05-31")
+        quarter = Quarter.objects.create(name="1 четверть", year=year, start_date="2025-09-01", end_date="2025-10-31")
+        cls.school = School.objects.create(school_id="SCH01", name="Лицей №1")
+        cls.parallel = SchoolClass.objects.create(name="10", school=cls.school)
+        cls.class_a = SchoolClass.objects.create(name="10А", school=cls.school, parent=cls.parallel)
+        cls.class_b = SchoolClass.objects.create(name="10Б", school=cls.school, parent=cls.parallel)
+        cls.student = Student.objects.create(student_id="100001", school_class=cls.class_a, last_name_ru="Алиев", first_name_ru="Вали")
+        cls.test = GatTest.objects.create(
+            name="GAT-1", test_number=1, test_date=datetime.date(2025, 10, 1),
+            quarter=quarter, school=cls.school, school_class=cls.parallel,
+        )
+
+    def test_placement_is_frozen_on_transfer(self):
+        result = StudentResult.objects.create(student=self.student, gat_test=self.test, total_score=5)
+        self.assertEqual((result.school_id, result.school_class_id, result.parallel_id),
+                         (self.school.id, self.class_a.id, self.parallel.id))
+
+        self.student.school_class = self.class_b
+        self.student.save()
+        result.total_score = 6
+        result.save()
+        result.refresh_from_db()
+        self.assertEqual(result.school_class_id, self.class_a.id)
+
+    def test_monitoring_uses_class_at_test_time(self):
+        from django.http import QueryDict
+        from .views.utils_reports import get_report_context
+
+        math = Subject.objects.create(name="Математика", abbreviation="МАТ")
+        QuestionCount.objects.create(school_class=self.class_a, subject=math, number_of_questions=4)
+        QuestionCount.objects.create(school_class=self.class_b, subject=math, number_of_questions=7)
+        StudentResult.objects.create(
+            student=self.student, gat_test=self.test, scores_by_subject={str(math.id): {'1': True, '2': False}}
+        )
+        self.student.school_class = self.class_b
+        self.student.save()
+
+        admin = User.objects.create_superuser('admin', 'admin@example.com', 'pass')
+        admin.profile.role = UserProfile.Role.SUPERUSER
+        admin.profile.save()
+        params = QueryDict(mutable=True)
+        params.setlist('schools', [str(self.school.id)])
+        for school_class, expected_rows in ((self.class_a, 1), (self.class_b, 0)):
+            params.setlist('school_classes', [str(school_class.id)])
+            rows = get_report_context(params, admin)['table_rows']
+            self.assertEqual(len(rows), expected_rows)
+
+        # Строка и число вопросов — по классу 10А, где ученик писал тест
+        params.setlist('school_classes', [str(self.parallel.id)])
+        (row,) = get_report_context(params, admin)['table_rows']
+        self.assertEqual(row['student'].school_class, self.class_a)
+        self.assertEqual(row['scores_by_subject'][math.id], {'score': 1, 'total': 4})
+
+    def test_backfill_command_fills_missing_rows(self):
+        from django.core.management import call_command
+
+        result = StudentResult.objects.bulk_create([
+            StudentResult(student=self.student, gat_test=self.test, total_score=5)
+        ])[0]
+        self.assertEqual(result.school_class_id, self.class_a.id)
+        StudentResult.objects.update(school=None, school_class=None, parallel=None)
+
+        call_command('backfill_result_placement', batch_size=1, stdout=io.StringIO())
+        result.refresh_from_db()
+        self.assertEqual((result.school_id, result.school_class_id, result.parallel_id),
+                         (self.school.id, self.class_a.id, self.parallel.id))
+
+
+class IndexAdvisorTestCase(TestCase):
+    """Команда index_advisor: планы по синтетическим данным и их откат."""
+
+    def test_seeded_run_uses_report_indexes_and_rolls_back(self):
+        from django.core.management import call_command
+
+        out = io.StringIO()
+        call_command('index_advisor', seed_schools=1, years=1, students_per_class=2, repeat=1, plans=True, stdout=out)
+        output = out.getvalue()
+        self.assertIn("GatTest: школа + четверть", output)
+        self.assertIn("откат", output)
+        if connection.vendor == 'sqlite':
+            self.assertNotIn("USE TEMP B-TREE", output)
+        self.assertFalse(School.objects.filter(school_id__startswith="ADV").exists())
+        self.assertFalse(StudentResult.objects.exists())
+
+
+class ResultsArchiveTestCase(TestCase):
+    """Перенос закрытых лет в архивную часть (core/archive.py)."""
+
+    @classmethod
+    def setUpTestData(cls):
+        from .models import Question, StudentAnswer
+
+        # Текущий год идёт сейчас, прошлый — закончился
+        today = datetime.date.today()
+        cls.old_year = AcademicYear.objects.create(
+            name="old", start_date=today - datetime.timedelta(days=400), end_date=today - datetime.timedelta(days=100)
+        )
+        cls.new_year = AcademicYear.objects.create(
+            name="current", start_date=today - datetime.timedelta(days=30), end_date=today + datetime.timedelta(days=200)
+        )
+        school = School.objects.create(school_id="SCH01", name="Лицей №1")
+        parallel = SchoolClass.objects.create(name="10", school=school)
+        student = Student.objects.create(
+            student_id="100001", school_class=SchoolClass.objects.create(name="10А", school=school, parent=parallel),
+            last_name_ru="Алиев", first_name_ru="Вали",
+        )
+        cls.results = {}
+        for year in (cls.old_year, cls.new_year):
+            quarter = Quarter.objects.create(
+                name="1 четверть", year=year, start_date=year.start_date,
+                end_date=year.start_date + datetime.timedelta(days=60),
+            )
+            test = GatTest.objects.create(
+                name=f"GAT-1 {year.name}", test_number=1, quarter=quarter, school=school, school_class=parallel,
+                test_date=year.start_date + datetime.timedelta(days=10),
+            )
+            result = StudentResult.objects.create(student=student, gat_test=test, total_score=1)
+            StudentAnswer.objects.create(
+                result=result, question=Question.objects.create(gat_test=test, question_number=1), is_correct=True
+            )
+            cls.results[year.name] = result
+
+    def setUp(self):
+        cache.clear()
+
+    def test_command_archives_closed_years_and_compacts_answers(self):
+        from django.core.management import call_command
+        from .models import StudentAnswer
+
+        call_command('archive_results', stdout=io.StringIO())
+
+        self.old_year.refresh_from_db()
+        self.assertTrue(self.old_year.is_archived)
+        self.assertEqual(
+            set(StudentResult.objects.filter(is_archived=True).values_list('id', flat=True)),
+            {self.results["old"].id},
+        )
+        self.assertFalse(StudentAnswer.objects.filter(result=self.results["old"]).exists())
+        self.assertTrue(StudentAnswer.objects.filter(result=self.results["current"]).exists())
+
+        call_command('archive_results', year=["old"], restore=True, stdout=io.StringIO())
+        self.assertFalse(StudentResult.objects.filter(is_archived=True).exists())
+
+    def test_hot_results_only_for_periods_after_archive(self):
+        from .archive import archive_year, hot_results
+
+        archive_year(self.old_year)
+        results = StudentResult.objects.all()
+        self.assertIn('is_archived', str(hot_results(results, self.new_year.start_date).query))
+        self.assertEqual(hot_results(results, self.old_year.start_date).count(), 2)
+        self.assertEqual(hot_results(results, None).count(), 2)
+
+
+@PLAIN_STATIC
+@override_settings(BULK_DELETE_WORKERS=0, BULK_DELETE_BATCH_SIZE=1)
+class BulkDeleteTestCase(TestCase):
+    """Массовое удаление пачками без сбора каскада в памяти (core/bulk_delete.py)."""
+
+    @classmethod
+    def setUpTestData(cls):
+        from .models import Question, StudentAnswer, TeacherNote
+
+        year = AcademicYear.objects.create(name="2025", start_date="2025-09-01", end_date="2026-05-31")
+        quarter = Quarter.objects.create(name="1 четверть", year=year, start_date="2025-09-01", end_date="2025-10-31")
+        cls.school = School.objects.create(school_id="SCH01", name="Лицей №1")
+        parallel = SchoolClass.objects.create(name="10", school=cls.school)
+        cls.school_class = SchoolClass.objects.create(name="10А", school=cls.school, parent=parallel)
+        cls.test = GatTest.objects.create(
+            name="GAT-1", test_number=1, test_date=datetime.date(2025, 10, 1),
+            quarter=quarter, school=cls.school, school_class=parallel,
+        )
+        question = Question.objects.create(gat_test=cls.test, question_number=1)
+        cls.admin = User.objects.create_superuser('admin', 'admin@example.com', 'pass')
+        cls.students = []
+        for n in range(3):
+            student = Student.objects.create(
+                student_id=f"10000{n}", school_class=cls.school_class, last_name_ru=f"Ученик{n}", first_name_ru="Имя"
+            )
+            result = StudentResult.objects.create(student=student, gat_test=cls.test, total_score=1)
+            StudentAnswer.objects.create(result=result, question=question, is_correct=True)
+            TeacherNote.objects.create(student=student, author=cls.admin, note="заметка")
+            cls.students.append(student)
+        cls.student_user = User.objects.create_user('student', password='pass')
+        cls.student_user.profile.student = cls.students[0]
+        cls.student_user.profile.save()
+
+    def test_students_are_deleted_with_dependents_in_batches(self):
+        from .bulk_delete import TARGET_STUDENTS, start_bulk_delete
+        from .data_version import get_school_stamps
+        from .models import BackgroundJob, StudentAnswer, TeacherNote
+
+        stamp = get_school_stamps([self.school.id])[self.school.id]
+        with self.assertLogs('cleanup_logger', 'CRITICAL') as logs:
+            job = start_bulk_delete(
+                self.admin, TARGET_STUDENTS, {'school_class_id': self.school_class.id}, "Класс 10А",
+                audit={'level': 'critical', 'message': "удалено {count} учеников"},
+            )
+
+        self.assertEqual((job.status, job.progress, job.total), (BackgroundJob.Status.DONE, 3, 3))
+        self.assertEqual(logs.output, ["CRITICAL:cleanup_logger:удалено 3 учеников"])
+        self.assertFalse(Student.objects.exists())
+        self.assertFalse(StudentResult.objects.exists() or StudentAnswer.objects.exists() or TeacherNote.objects.exists())
+        self.student_user.profile.refresh_from_db()
+        self.assertIsNone(self.student_user.profile.student_id)
+        self.assertNotEqual(get_school_stamps([self.school.id])[self.school.id], stamp)
+
+    def test_data_cleanup_clears_class_results(self):
+        self.client.force_login(self.admin)
+        with self.assertLogs('cleanup_logger', 'WARNING'):
+            response = self.client.post(
+                reverse('core:data_cleanup'), {'clear_results_class': '1', 'class_id': self.school_class.id}
+            )
+        self.assertRedirects(response, reverse('core:data_cleanup'), fetch_redirect_response=False)
+        self.assertFalse(StudentResult.objects.exists())
+        self.assertEqual(Student.objects.count(), 3)
+        self.assertContains(self.client.get(reverse('core:data_cleanup')), 'Результаты класса')
+
+
+@PLAIN_STATIC
+class DashboardWidgetsTestCase(TransactionTestCase):
+    """Виджеты панели считаются параллельно и кешируются по версии данных."""
+
+    def setUp(self):
+        cache.clear()
+        today = datetime.date.today()
+        year = AcademicYear.objects.create(
+            name="Текущий", start_date=today - datetime.timedelta(days=60), end_date=today + datetime.timedelta(days=200)
+        )
+        quarter = Quarter.objects.create(
+            name="1 четверть", year=year, start_date=today - datetime.timedelta(days=30),
+            end_date=today + datetime.timedelta(days=30)
+        )
+        subject = Subject.objects.create(name="Математика", abbreviation="МАТ")
+        self.school = School.objects.create(school_id="SCH01", name="Школа 1")
+        parallel = SchoolClass.objects.create(name="10", school=self.school)
+        school_class = SchoolClass.objects.create(name="10А", school=self.school, parent=parallel)
+        QuestionCount.objects.create(school_class=parallel, subject=subject, number_of_questions=4)
+        test = GatTest.objects.create(
+            name="GAT-1", test_number=1, test_date=today, quarter=quarter, school=self.school, school_class=parallel
+        )
+        test.subjects.set([subject])
+        for n in range(6):
+            student = Student.objects.create(
+                student_id=f"ST{n:03}", school_class=school_class, last_name_ru=f"Фамилия{n}", first_name_ru="Имя"
+            )
+            answers = {str(q): q <= n % 5 for q in range(1, 5)}
+            StudentResult.objects.create(
+                student=student, gat_test=test, total_score=sum(answers.values()),
+                scores_by_subject={str(subject.id): answers},
+            )
+        self.admin = User.objects.create_superuser('admin', 'admin@example.com', 'pass')
+        self.client.force_login(self.admin)
+
+    def _context(self):
+        response = self.client.get(reverse('core:dashboard'))
+        self.assertEqual(response.status_code, 200)
+        return {key: response.context[key] for key in (
+            'student_count', 'test_count', 'school_chart_data', 'subject_chart_data',
+            'distribution_chart_data', 'top_students', 'recent_tests',
+        )}
+
+    def test_threaded_widgets_match_sequential_and_are_cached(self):
+        with override_settings(DASHBOARD_WIDGET_WORKERS=0):
+            sequential = self._context()
+        cache.clear()
+        with override_settings(DASHBOARD_WIDGET_WORKERS=3):
+            threaded = self._context()
+        self.assertEqual(threaded, sequential)
+        self.assertEqual(threaded['student_count'], 6)
+
+        # Все виджеты из кеша: запросы только на права, версии и сессию
+        with CaptureQueriesContext(connection) as ctx:
+            self._context()
+        self.assertFalse(any('core_studentresult' in q['sql'] for q in ctx.captured_queries))
+
+        # Новая версия данных школы — виджеты пересчитываются
+        Student.objects.filter(student_id="ST000").delete()
+        self.assertEqual(self._context()['student_count'], 5)
+
+
+@PLAIN_STATIC
+class AnalyticsSnapshotTestCase(TestCase):
+    """Ночные снимки аналитики: отдаются вместо расчёта и устаревают с данными."""
+
+    @classmethod
+    def setUpTestData(cls):
+        today = datetime.date.today()
+        year = AcademicYear.objects.create(
+            name="Текущий", start_date=today - datetime.timedelta(days=60), end_date=today + datetime.timedelta(days=200)
+        )
+        cls.quarter = Quarter.objects.create(
+            name="1 четверть", year=year, start_date=today - datetime.timedelta(days=30),
+            end_date=today + datetime.timedelta(days=30)
+        )
+        cls.subjects = [Subject.objects.create(name=name, abbreviation=abbr) for name, abbr in [("Математика", "МАТ"), ("Физика", "ФИЗ")]]
+        cls.school = School.objects.create(school_id="SCH01", name="Школа 1")
+        cls.parallel = SchoolClass.objects.create(name="10", school=cls.school)
+        classes = [SchoolClass.objects.create(name=f"10{letter}", school=cls.school, parent=cls.parallel) for letter in "АБ"]
+        for subject in cls.subjects:
+            QuestionCount.objects.create(school_class=cls.parallel, subject=subject, number_of_questions=4)
+        cls.tests = []
+        for number in (1, 2):
+            test = GatTest.objects.create(
+                name=f"GAT-{number}", test_number=number, test_date=today,
+                quarter=cls.quarter, school=cls.school, school_class=cls.parallel
+            )
+            test.subjects.set(cls.subjects)
+            cls.tests.append(test)
+        for n in range(8):
+            student = Student.objects.create(
+                student_id=f"ST{n:03}", school_class=classes[n % 2], last_name_ru=f"Фамилия{n}", first_name_ru="Имя"
+            )
+            for test in cls.tests:
+                scores = {
+                    str(subject.id): {str(q): (n + q + test.test_number) % 3 != 0 for q in range(1, 5)}
+                    for subject in cls.subjects
+                }
+                StudentResult.objects.create(
+                    student=student, gat_test=test, scores_by_subject=scores,
+                    total_score=sum(v for answers in scores.values() for v in answers.values()),
+                )
+        cls.student = Student.objects.order_by('id').first()
+        cls.admin = User.objects.create_superuser('admin', 'admin@example.com', 'pass')
+        cls.admin.profile.role = UserProfile.Role.SUPERUSER
+        cls.admin.profile.save()
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.admin)
+
+    def _precompute(self, *args):
+        from django.core.management import call_command
+        out = io.StringIO()
+        call_command('precompute_analytics', *args, stdout=out)
+        return out.getvalue()
+
+    def _get(self, name, params=None, *args):
+        cache.clear()
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(reverse(name, args=args), params or {})
+        self.assertEqual(response.status_code, 200)
+        reads_results = any('FROM "core_studentresult"' in q['sql'] for q in ctx.captured_queries)
+        return response.context, reads_results
+
+    def test_views_serve_snapshots_equal_to_live_computation(self):
+        from .models import AnalyticsSnapshot
+
+        keys = ('average_score', 'grade_distribution_report', 'school_summary_report', 'chart_data', 'top_subject')
+        statistics = {
+            'quarters': [self.quarter.id], 'schools': [self.school.id], 'test_numbers': ['1', '2'],
+        }
+        deep = {
+            **statistics, 'school_classes': [self.parallel.id], 'subjects': [s.id for s in self.subjects],
+        }
+        live_statistics, reads = self._get('core:statistics', statistics)
+        self.assertTrue(reads)
+        live_deep, _ = self._get('core:deep_analysis', deep)
+        live_progress, _ = self._get('core:student_progress', None, self.student.id)
+
+        self._precompute()
+        self.assertEqual(
+            set(AnalyticsSnapshot.objects.values_list('kind', flat=True)), set(AnalyticsSnapshot.Kind.values)
+        )
+
+        snap_statistics, reads = self._get('core:statistics', statistics)
+        self.assertFalse(reads)
+        self.assertEqual({k: snap_statistics[k] for k in keys}, {k: live_statistics[k] for k in keys})
+        snap_deep, reads = self._get('core:deep_analysis', deep)
+        self.assertFalse(reads)
+        self.assertTrue(snap_deep['heatmap_data'])
+        self.assertEqual(snap_deep['heatmap_data'], live_deep['heatmap_data'])
+        self.assertEqual(snap_deep['heatmap_summary'], live_deep['heatmap_summary'])
+        snap_progress, _ = self._get('core:student_progress', None, self.student.id)
+        ranks = ('class_rank', 'class_total', 'school_rank', 'school_total', 'parallel_rank', 'parallel_total')
+        self.assertEqual(
+            [[row[k] for k in ranks] for row in snap_progress['detailed_results_data']],
+            [[row[k] for k in ranks] for row in live_progress['detailed_results_data']],
+        )
+
+        # Данные школы изменились — снимок не используется до следующего пересчёта
+        bump_data_version([self.school.id])
+        _, reads = self._get('core:statistics', statistics)
+        self.assertTrue(reads)
+
+    def test_precompute_skips_valid_snapshots_and_adds_versions(self):
+        from .models import AnalyticsSnapshot
+
+        self.assertIn("новых 1, актуальных 0", self._precompute('--kind', 'statistics'))
+        self.assertIn("новых 0, актуальных 1", self._precompute('--kind', 'statistics'))
+
+        bump_data_version([self.school.id])
+        self._precompute('--kind', 'statistics')
+        snapshot = AnalyticsSnapshot.objects.get(kind=AnalyticsSnapshot.Kind.STATISTICS, version=2)
+        self.assertEqual(AnalyticsSnapshot.objects.filter(key=snapshot.key).count(), 2)
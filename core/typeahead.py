@@ -0,0 +1,372 @@
+# D:\New_GAT\core\typeahead.py
+
+"""
+Индекс подсказок для поиска в шапке (header_search_api) в памяти процесса.
+
+Даже с индексами в БД поиск на каждое нажатие клавиши — это запрос к базе.
+Учеников и тестов — сотни тысяч коротких строк, поэтому (при
+TYPEAHEAD_ENABLED) каждый процесс держит компактный индекс по школам:
+
+  * отсортированный список слов и параллельный список ссылок на записи;
+    поиск по началу слова — bisect, без SQL;
+  * слова ученика — его search_key (core/search_key.py), слова теста —
+    нормализованное название; запрос нормализуется так же;
+  * индекс школы строится при первом обращении к ней.
+
+Актуальность:
+  * сигналы (core/signals.py) правят загруженные индексы точечно:
+    сохранение/удаление ученика или теста; переименование класса или
+    школы сбрасывает индекс школы целиком;
+  * изменения из других процессов видны по версиям данных
+    (core/data_version.py): версия школы сверяется не чаще раза в
+    TYPEAHEAD_CHECK_INTERVAL секунд, при расхождении индекс перестраивается;
+  * после TYPEAHEAD_MAX_AGE секунд индекс перестраивается в любом случае.
+
+Доступные пользователю школы тоже помнятся TYPEAHEAD_CHECK_INTERVAL
+секунд (user_school_ids): между проверками подсказки не читают БД.
+"""
+
+import heapq
+import sys
+import threading
+import time
+from bisect import bisect_left
+
+from django.conf import settings
+
+from .data_version import get_school_stamps
+from .models import GatTest, Student
+from .search_key import STUDENT_ID_WIDTH, normalize_words
+
+KIND_STUDENT = 0
+KIND_TEST = 1
+
+_lock = threading.RLock()
+_indexes = {}
+# Ученик или тест мог перейти в другую школу: помним, в чьём индексе он лежит
+_owners = {}
+# Счётчик изменений школы в этом процессе (сигналы): индекс, который строился
+# во время изменения, мог его не увидеть
+_changes = {}
+# Школы пользователя для поиска: {user_id: (school_ids, когда прочитаны)}
+_user_schools = {}
+
+
+def is_enabled():
+    return getattr(settings, 'TYPEAHEAD_ENABLED', False)
+
+
+def is_loaded():
+    """Есть ли в процессе хоть один индекс (иначе сигналам нечего обновлять)."""
+    return bool(_indexes)
+
+
+class SchoolIndex:
+    """
+    Индекс одной школы. words — отсортированные слова, refs[i] — запись для
+    words[i]: (вид, pk). records — данные для ответа и слова записи (нужны,
+    чтобы точечно удалить её из индекса).
+    """
+
+    def __init__(self, school_id, stamp):
+        self.school_id = school_id
+        self.stamp = stamp
+        self.built_at = time.monotonic()
+        self.checked_at = self.built_at
+        self.words = []
+        self.refs = []
+        self.records = {}
+
+    def add(self, kind, pk, words, payload):
+        ref = (kind, pk)
+        self.records[ref] = (tuple(words), payload)
+        for word in set(words):
+            position = bisect_left(self.words, word)
+            self.words.insert(position, word)
+            self.refs.insert(position, ref)
+
+    def load(self, entries):
+        """Первичное заполнение: одна сортировка вместо вставки каждого слова."""
+        pairs = []
+        for kind, pk, words, payload in entries:
+            ref = (kind, pk)
+            self.records[ref] = (tuple(words), payload)
+            pairs.extend((word, ref) for word in set(words))
+        pairs.sort()
+        self.words = [word for word, _ in pairs]
+        self.refs = [ref for _, ref in pairs]
+
+    def remove(self, kind, pk):
+        record = self.records.pop((kind, pk), None)
+        if record is None:
+            return
+        for word in set(record[0]):
+            position = bisect_left(self.words, word)
+            while position < len(self.words) and self.words[position] == word:
+                if self.refs[position] == (kind, pk):
+                    del self.words[position]
+                    del self.refs[position]
+                    break
+                position += 1
+
+    def _refs(self, low, high):
+        position = bisect_left(self.words, low)
+        return set(self.refs[position:bisect_left(self.words, high, position)])
+
+    def _prefix_refs(self, word):
+        refs = self._refs(word, word + '\uffff')
+        if word.isdigit() and len(word) < STUDENT_ID_WIDTH:
+            padded = word.zfill(STUDENT_ID_WIDTH)
+            refs |= self._refs(padded, padded + '\uffff')
+        return refs
+
+    def search(self, words, limit):
+        """
+        Лучшие limit записей каждого вида, где нашлись все слова запроса:
+        {вид: [(ключ сортировки, payload)]}. Выше те, где больше слов
+        совпали целиком, затем по алфавиту.
+        """
+        found = None
+        for word in words:
+            refs = self._prefix_refs(word)
+            found = refs if found is None else found & refs
+            if not found:
+                return {}
+        # Совпадений по префиксу может быть тысячи («ал»), целых слов — единицы:
+        # оценку считаем только для них, остальные добираем по алфавиту
+        exact = {}
+        for word in words:
+            for ref in self._refs(word, word + ' ') & found:
+                exact[ref] = exact.get(ref, 0) + 1
+        best = {}
+        for kind in (KIND_STUDENT, KIND_TEST):
+            ranked = sorted(
+                ((-score, self.records[ref][1][2]), self.records[ref][1])
+                for ref, score in exact.items() if ref[0] == kind
+            )[:limit]
+            if len(ranked) < limit:
+                rest = (ref for ref in found if ref[0] == kind and ref not in exact)
+                ranked += [
+                    ((0, self.records[ref][1][2]), self.records[ref][1])
+                    for ref in heapq.nsmallest(limit - len(ranked), rest, key=lambda ref: self.records[ref][1][2])
+                ]
+            best[kind] = ranked
+        return best
+
+    def memory_bytes(self):
+        """Приблизительный объём в памяти: списки, строки, кортежи и словарь записей."""
+        size = sys.getsizeof(self.words) + sys.getsizeof(self.refs) + sys.getsizeof(self.records)
+        size += sum(sys.getsizeof(word) for word in self.words)
+        # Кортеж-ссылка один на запись, в refs лежат только указатели на него
+        size += sum(sys.getsizeof(ref) for ref in self.records)
+        for words, payload in self.records.values():
+            size += sys.getsizeof(words) + sys.getsizeof(payload)
+            size += sum(sys.getsizeof(value) for value in payload)
+        return size
+
+
+# =============================================================================
+# --- ЗАПИСИ ---
+# =============================================================================
+
+def _student_entry(student, class_name):
+    # payload: (подпись, pk для ссылки, ключ сортировки)
+    return (
+        student.search_key.split(),
+        (f"{student.first_name_ru} {student.last_name_ru} ({class_name})", student.pk,
+         f"{student.last_name_ru} {student.first_name_ru}"),
+    )
+
+
+def _test_entry(test, school_name):
+    return (
+        normalize_words(test.name),
+        (f"{test.name} ({school_name})", test.pk, test.test_number),
+    )
+
+
+def _build(school_id, stamp):
+    index = SchoolIndex(school_id, stamp)
+    entries = []
+    students = (
+        Student.objects.filter(school_class__school_id=school_id)
+        .select_related('school_class')
+        .only('id', 'search_key', 'first_name_ru', 'last_name_ru', 'school_class__name')
+    )
+    for student in students.iterator(chunk_size=2000):
+        entries.append((KIND_STUDENT, student.pk, *_student_entry(student, student.school_class.name)))
+    tests = GatTest.objects.filter(school_id=school_id).select_related('school').only(
+        'id', 'name', 'test_number', 'school__name'
+    )
+    for test in tests:
+        entries.append((KIND_TEST, test.pk, *_test_entry(test, test.school.name)))
+    index.load(entries)
+    return index
+
+
+def _get_indexes(school_ids):
+    """
+    Индексы школ с проверкой версии данных (не чаще TYPEAHEAD_CHECK_INTERVAL).
+    Индекс строится без блокировки (чтение из БД) и подменяется под ней:
+    поиск по другим школам и сигналы не ждут перестройки.
+    """
+    now = time.monotonic()
+    check_interval = getattr(settings, 'TYPEAHEAD_CHECK_INTERVAL', 5)
+    max_age = getattr(settings, 'TYPEAHEAD_MAX_AGE', 900)
+    with _lock:
+        to_check = [
+            sid for sid in school_ids
+            if sid not in _indexes or now - _indexes[sid].checked_at >= check_interval
+        ]
+    stamps = get_school_stamps(to_check) if to_check else {}
+
+    to_build = {}
+    with _lock:
+        for sid in to_check:
+            index = _indexes.get(sid)
+            if index is None or index.stamp != stamps[sid] or now - index.built_at >= max_age:
+                to_build[sid] = _changes.get(sid, 0)
+            else:
+                index.checked_at = now
+
+    built = {sid: _build(sid, stamps[sid]) for sid in to_build}
+
+    with _lock:
+        for sid, index in built.items():
+            if _changes.get(sid, 0) != to_build[sid]:
+                # Сигнал пришёл во время перестройки: индекс отвечает сейчас,
+                # но при следующей проверке версии строится заново
+                index.stamp = None
+            _drop(sid)
+            _indexes[sid] = index
+            for ref in index.records:
+                _owners[ref] = sid
+        # Индекс школы мог быть сброшен (school_changed) после проверки —
+        # тогда он построится при следующем поиске
+        indexes = (_indexes.get(sid) or built.get(sid) for sid in school_ids)
+        return [index for index in indexes if index is not None]
+
+
+def _drop(school_id):
+    index = _indexes.pop(school_id, None)
+    if index is not None:
+        for ref in index.records:
+            _owners.pop(ref, None)
+
+
+# =============================================================================
+# --- ПОИСК ---
+# =============================================================================
+
+def search(query, school_ids, limit=5):
+    """
+    Подсказки для шапки: (ученики, тесты), каждый — список (подпись, pk, ...).
+    Лучше те записи, где больше слов запроса совпали целиком.
+    """
+    words = normalize_words(query)
+    if not words or not school_ids:
+        return [], []
+
+    scored = {KIND_STUDENT: [], KIND_TEST: []}
+    for index in _get_indexes(sorted(set(school_ids))):
+        with _lock:
+            for kind, ranked in index.search(words, limit).items():
+                scored[kind].extend(ranked)
+    return tuple(
+        [payload for _, payload in heapq.nsmallest(limit, scored[kind], key=lambda item: item[0])]
+        for kind in (KIND_STUDENT, KIND_TEST)
+    )
+
+
+def user_school_ids(user_id, load):
+    """
+    Школы пользователя для поиска: load() читает их из БД не чаще раза в
+    TYPEAHEAD_CHECK_INTERVAL секунд, в остальное время — из памяти процесса.
+    """
+    now = time.monotonic()
+    check_interval = getattr(settings, 'TYPEAHEAD_CHECK_INTERVAL', 5)
+    with _lock:
+        cached = _user_schools.get(user_id)
+        if cached is not None and now - cached[1] < check_interval:
+            return cached[0]
+    school_ids = load()
+    with _lock:
+        # Устаревшие записи больше не нужны: словарь не растёт с числом пользователей
+        for uid in [uid for uid, (_, read_at) in _user_schools.items() if now - read_at >= check_interval]:
+            del _user_schools[uid]
+        _user_schools[user_id] = (school_ids, now)
+    return school_ids
+
+
+def memory_report():
+    """[(school_id, записей, слов, байт)] для загруженных индексов."""
+    with _lock:
+        return [
+            (sid, len(index.records), len(index.words), index.memory_bytes())
+            for sid, index in sorted(_indexes.items())
+        ]
+
+
+def warm(school_ids):
+    """Строит индексы заранее (команда benchmark_student_search, старт процесса)."""
+    _get_indexes(sorted(set(school_ids)))
+
+
+def clear():
+    with _lock:
+        _indexes.clear()
+        _owners.clear()
+        _changes.clear()
+        _user_schools.clear()
+
+
+# =============================================================================
+# --- ТОЧЕЧНЫЕ ОБНОВЛЕНИЯ (из core/signals.py) ---
+# =============================================================================
+
+def _refresh_stamp(index):
+    # Изменение уже учтено в индексе: принимаем новую версию школы без перестройки.
+    # Внутри deferred_bumps() версия поднимется позже — индекс перестроится сам.
+    index.stamp = get_school_stamps([index.school_id])[index.school_id]
+    index.checked_at = time.monotonic()
+
+
+def _changed(school_id):
+    _changes[school_id] = _changes.get(school_id, 0) + 1
+
+
+def _replace(kind, pk, school_id, entry):
+    with _lock:
+        old_school = _owners.pop((kind, pk), None)
+        if old_school in _indexes:
+            _indexes[old_school].remove(kind, pk)
+        index = _indexes.get(school_id)
+        if index is not None and entry is not None:
+            index.add(kind, pk, *entry)
+            _owners[(kind, pk)] = school_id
+        for sid in {old_school, school_id}:
+            if sid is not None:
+                _changed(sid)
+            if sid in _indexes:
+                _refresh_stamp(_indexes[sid])
+
+
+def student_saved(student, school_id, deleted=False):
+    entry = None
+    if not deleted and school_id in _indexes:
+        entry = _student_entry(student, student.school_class.name)
+    _replace(KIND_STUDENT, student.pk, school_id, entry)
+
+
+def test_saved(test, deleted=False):
+    entry = None
+    if not deleted and test.school_id in _indexes:
+        entry = _test_entry(test, test.school.name)
+    _replace(KIND_TEST, test.pk, test.school_id, entry)
+
+
+def school_changed(school_id):
+    """Переименование класса или школы меняет подписи — индекс школы строится заново."""
+    with _lock:
+        _changed(school_id)
+        _drop(school_id)
@@ -7,14 +7,16 @@ from django.shortcuts import render
 from accounts import views as account_views
 
 # --- Импорты View-функций AI (ВАЖНО) ---
-from core.views import ai_chat_page, ai_ask_api
+from core.views import ai_chat_page, ai_ask_api, ai_ask_stream, ai_table_page
 
 # --- Импорты из приложения 'core' ---
 from core.views import (
     api,
+    background_jobs,
     dashboard,
     deep_analysis,
     grading,
+    instrumentation,
     monitoring,
     permissions,
     reports,
@@ -72,6 +74,8 @@ urlpatterns = [
     # =============================================================================
     path('dashboard/management/', management_dashboard_view, name='management'),
     path('management/data-cleanup/', students.data_cleanup_view, name='data_cleanup'),
+    path('management/data-cleanup/jobs/', students.bulk_delete_jobs_view, name='bulk_delete_jobs'),
+    path('management/query-stats/', instrumentation.query_stats_view, name='query_stats'),
 
     # Учебные годы
     path('dashboard/years/', AcademicYearListView.as_view(), name='year_list'),
@@ -164,10 +168,16 @@ urlpatterns = [
     path('dashboard/results/archive/quarter/<int:quarter_pk>/school/<int:school_pk>/class/<int:class_pk>/', reports.archive_subclasses_view, name='archive_subclasses'),
     path('dashboard/results/gat/<int:test_number>/export/excel/', reports.export_detailed_results_excel, name='export_detailed_results_excel'),
     path('dashboard/results/gat/<int:test_number>/export/pdf/', reports.export_detailed_results_pdf, name='export_detailed_results_pdf'),
+    path('dashboard/results/gat/<int:test_number>/export/csv/', reports.export_detailed_results_csv, name='export_detailed_results_csv'),
     path('dashboard/monitoring/export/pdf/', monitoring.export_monitoring_pdf, name='export_monitoring_pdf'),
     path('dashboard/monitoring/export/excel/', monitoring.export_monitoring_excel, name='export_monitoring_excel'),
+    path('dashboard/monitoring/export/csv/', monitoring.export_monitoring_csv, name='export_monitoring_csv'),
     path('dashboard/grading/export/excel/', grading.export_grading_excel, name='export_grading_excel'),
     path('dashboard/grading/export/pdf/', grading.export_grading_pdf, name='export_grading_pdf'),
+    path('dashboard/grading/export/csv/', grading.export_grading_csv, name='export_grading_csv'),
+    path('dashboard/jobs/<int:job_id>/download/', background_jobs.background_job_download_view, name='background_job_download'),
+    path('dashboard/batch-export/', background_jobs.batch_export_view, name='batch_export'),
+    path('dashboard/batch-export/jobs/', background_jobs.batch_export_jobs_view, name='batch_export_jobs'),
 
     # =============================================================================
     # --- API (ДЛЯ HTMX И JAVASCRIPT) ---
@@ -199,6 +209,8 @@ urlpatterns = [
     # 🔥 AI CHAT (ИСПРАВЛЕНО) 🔥
     path('ai-chat/', ai_chat_page, name='ai_chat'),
     path('api/ai-ask/', ai_ask_api, name='ai_ask_api'),
+    path('api/ai-ask/stream/', ai_ask_stream, name='ai_ask_stream'),
+    path('api/ai-table/<str:token>/', ai_table_page, name='ai_table_page'),
 
     # Простой тестовый путь
     path('test-simple/', lambda request: render(request, 'test_simple.html'), name='test_simple'),
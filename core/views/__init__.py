@@ -16,6 +16,13 @@ from .api import (
     load_fields_for_qc,
 )
 
+# --- Импорты из background_jobs.py ---
+from .background_jobs import (
+    background_job_download_view,
+    batch_export_view,
+    batch_export_jobs_view,
+)
+
 # --- Импорты из crud.py ---
 from .crud import (
     AcademicYearListView, AcademicYearCreateView, AcademicYearUpdateView, AcademicYearDeleteView,
@@ -46,6 +53,12 @@ from .grading import (
     grading_view,
     export_grading_pdf,
     export_grading_excel,
+    export_grading_csv,
+)
+
+# --- Импорты из instrumentation.py ---
+from .instrumentation import (
+    query_stats_view,
 )
 
 # --- Импорты из monitoring.py ---
@@ -53,6 +66,7 @@ from .monitoring import (
     monitoring_view,
     export_monitoring_pdf,
     export_monitoring_excel,
+    export_monitoring_csv,
 )
 
 # --- Импорты из permissions.py ---
@@ -78,6 +92,7 @@ from .reports import (
     # statistics_view теперь в statistics.py
     export_detailed_results_excel,
     export_detailed_results_pdf,
+    export_detailed_results_csv,
     archive_subclasses_view,
     combined_class_report_view
 )
@@ -117,7 +132,8 @@ from .students import (
     student_class_list_view,
     student_list_combined_view,
     parallel_create_export_accounts,
-    data_cleanup_view
+    data_cleanup_view,
+    bulk_delete_jobs_view
 )
 
-from .ai_chat import ai_chat_page, ai_ask_api
\ No newline at end of file
+from .ai_chat import ai_chat_page, ai_ask_api, ai_ask_stream, ai_table_page
\ No newline at end of file
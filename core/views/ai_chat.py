@@ -1,11 +1,51 @@
 # D:\Project Archive\GAT\core\views\ai_chat.py
 
+import json
+
+from asgiref.sync import sync_to_async
 from django.shortcuts import render
-from django.http import HttpResponse
+from django.http import HttpResponse, HttpResponseNotAllowed, StreamingHttpResponse
 from django.contrib.auth.decorators import login_required
+from django.contrib.auth.views import redirect_to_login
 from django.views.decorators.http import require_POST
 from django.template.loader import render_to_string # Важно!
-from core.ai_service import ask_database
+from django.utils.html import escape
+from core.ai_service import AI_STATUS_LABELS, ask_database, iter_answer_events, render_table_page
+
+# Сколько сообщений истории хранится в сессии
+CHAT_HISTORY_LIMIT = 20
+
+
+def _user_bubble(user_question):
+    return f"""
+    <div class="flex justify-end animate-fade-in-up mb-4">
+        <div class="bg-indigo-600 text-white p-3.5 rounded-2xl rounded-tr-none text-sm shadow-md shadow-indigo-500/20 max-w-[85%] leading-relaxed font-medium">
+            {escape(user_question)}
+        </div>
+    </div>
+    """
+
+
+def _ai_bubble(ai_response_html):
+    return f"""
+    <div class="flex gap-3 animate-fade-in-up mb-4">
+        <div class="w-8 h-8 rounded-full bg-gradient-to-br from-indigo-500 to-purple-600 flex items-center justify-center shadow-sm shrink-0 overflow-hidden p-1">
+             <img src="https://cdn-icons-png.flaticon.com/512/4712/4712027.png" alt="AI" class="w-full h-full object-cover">
+        </div>
+        <div class="ai-answer bg-white p-3.5 rounded-2xl rounded-tl-none text-slate-700 text-sm shadow-sm border border-slate-100 leading-relaxed max-w-[95%] overflow-hidden prose prose-sm prose-indigo">
+            {ai_response_html}
+        </div>
+    </div>
+    """
+
+
+def _remember_exchange(session, user_question, ai_response_html):
+    """Добавляет вопрос и ответ в историю чата (последние CHAT_HISTORY_LIMIT сообщений)."""
+    chat_history = session.get('ai_chat_history', [])
+    chat_history.append({'role': 'user', 'text': user_question})
+    chat_history.append({'role': 'ai', 'text': ai_response_html})
+    session['ai_chat_history'] = chat_history[-CHAT_HISTORY_LIMIT:]
+    session.modified = True
 
 @login_required
 def ai_chat_page(request):
@@ -34,35 +74,99 @@ def ai_ask_api(request):
         ai_response_html = f"Простите, ошибка системы: {str(e)}"
 
     # 3. Обновляем историю
-    chat_history.append({'role': 'user', 'text': user_question})
-    chat_history.append({'role': 'ai', 'text': ai_response_html})
-    
-    # Храним последние 20 сообщений
-    request.session['ai_chat_history'] = chat_history[-20:]
-    request.session.modified = True
+    _remember_exchange(request.session, user_question, ai_response_html)
 
-    # 4. Рендерим ОТВЕТ (Юзер + ИИ)
-    
-    # А) Сообщение Юзера (HTML)
-    user_html = f"""
-    <div class="flex justify-end animate-fade-in-up mb-4">
-        <div class="bg-indigo-600 text-white p-3.5 rounded-2xl rounded-tr-none text-sm shadow-md shadow-indigo-500/20 max-w-[85%] leading-relaxed font-medium">
-            {user_question}
-        </div>
-    </div>
+    # 4. Рендерим ОТВЕТ (Юзер + ИИ) — возвращаем оба куска сразу!
+    return HttpResponse(_user_bubble(user_question) + _ai_bubble(ai_response_html))
+
+
+@login_required
+def ai_table_page(request, token):
+    """Страница таблицы из ответа ИИ (HTMX): подгружается кнопками под таблицей."""
+    try:
+        page = max(1, int(request.GET.get('page', 1)))
+    except ValueError:
+        page = 1
+    return HttpResponse(render_table_page(request.user, token, page))
+
+
+# =============================================================================
+# --- ПОТОКОВЫЙ ЧАТ (SERVER-SENT EVENTS) ---
+# =============================================================================
+
+def _sse(event, data):
+    """Одно событие text/event-stream; данные — JSON (переводы строк не ломают формат)."""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+async def _iterate_in_thread(iterator):
+    """
+    Обходит синхронный итератор из асинхронного кода. Каждый шаг выполняется
+    через sync_to_async (thread_sensitive): все шаги идут в одном потоке
+    запроса, поэтому открытый курсор БД переживает паузы между порциями, а
+    цикл событий в это время обслуживает другие потоки ответов.
     """
+    sentinel = object()
+    step = sync_to_async(next)
+    try:
+        while True:
+            item = await step(iterator, sentinel)
+            if item is sentinel:
+                break
+            yield item
+    finally:
+        # Клиент ушёл посреди ответа — закрываем генератор (и курсор) в том же потоке
+        await sync_to_async(iterator.close)()
 
-    # Б) Сообщение ИИ (HTML)
-    ai_html = f"""
-    <div class="flex gap-3 animate-fade-in-up mb-4">
-        <div class="w-8 h-8 rounded-full bg-gradient-to-br from-indigo-500 to-purple-600 flex items-center justify-center shadow-sm shrink-0 overflow-hidden p-1">
-             <img src="https://cdn-icons-png.flaticon.com/512/4712/4712027.png" alt="AI" class="w-full h-full object-cover">
-        </div>
-        <div class="bg-white p-3.5 rounded-2xl rounded-tl-none text-slate-700 text-sm shadow-sm border border-slate-100 leading-relaxed max-w-[95%] overflow-hidden prose prose-sm prose-indigo">
-            {ai_response_html}
-        </div>
-    </div>
+
+async def ai_ask_stream(request):
     """
-    
-    # Возвращаем оба куска сразу!
-    return HttpResponse(user_html + ai_html)
\ No newline at end of file
+    Потоковый вариант ai_ask_api (text/event-stream) для ASGI.
+
+    События: start (пузыри вопроса и пустого ответа), status (этап: думаю /
+    выполняю запрос / формирую таблицу), html (фрагмент ответа), rows
+    (порция строк таблицы), done. Долгий ответ не занимает синхронный
+    воркер: между событиями поток свободен. Под WSGI ответ тоже работает,
+    но отдаётся целиком в конце.
+    """
+    # login_required / require_POST в Django 4.2 не поддерживают async-представления
+    if request.method != 'POST':
+        return HttpResponseNotAllowed(['POST'])
+    is_authenticated = await sync_to_async(lambda: request.user.is_authenticated)()
+    if not is_authenticated:
+        return redirect_to_login(request.get_full_path())
+
+    user_question = request.POST.get('question', '').strip()
+    if not user_question:
+        return HttpResponse("")
+    chat_history = await sync_to_async(request.session.get)('ai_chat_history', [])
+
+    async def stream():
+        yield _sse('start', _user_bubble(user_question) + _ai_bubble(''))
+        parts = []
+        events = iter_answer_events(request.user, user_question, list(chat_history))
+        try:
+            async for kind, payload in _iterate_in_thread(events):
+                if kind == 'status':
+                    yield _sse('status', AI_STATUS_LABELS.get(payload, payload))
+                    continue
+                parts.append(payload)
+                yield _sse('rows' if kind == 'rows' else 'html', payload)
+        except Exception as e:
+            error_html = f"Простите, ошибка системы: {str(e)}"
+            parts.append(error_html)
+            yield _sse('html', error_html)
+
+        # SessionMiddleware уже отработал (ответ потоковый) — сохраняем сессию сами
+        def save_history():
+            _remember_exchange(request.session, user_question, ''.join(parts))
+            request.session.save()
+
+        await sync_to_async(save_history)()
+        yield _sse('done', '')
+
+    response = StreamingHttpResponse(stream(), content_type='text/event-stream; charset=utf-8')
+    response['Cache-Control'] = 'no-cache'
+    # Не буферизовать поток на прокси (nginx)
+    response['X-Accel-Buffering'] = 'no'
+    return response
@@ -2,7 +2,6 @@
 
 import json
 import pytz
-from django.db.models import Q
 from django.shortcuts import render, get_object_or_404
 from django.http import HttpResponse, JsonResponse
 from django.urls import reverse
@@ -12,7 +11,7 @@ from accounts.forms import UserProfileForm
 
 # --- Импорты моделей ---
 from ..models import (
-    Notification, School, SchoolClass, Subject, Quarter, GatTest, Student,
+    Notification, School, SchoolClass, Subject, Quarter, GatTest,
     QuestionCount
 )
 from accounts.models import UserProfile
@@ -21,6 +20,9 @@ from ..forms import GatTestForm, QuestionCountForm
 
 # --- Импорты из permissions ---
 from .permissions import get_accessible_schools
+from .conditional import conditional_view
+from .. import typeahead
+from ..student_search import search_students
 
 # =============================================================================
 # --- API ДЛЯ ЗАГРУЗКИ ДАННЫХ В ФИЛЬТРЫ И ФОРМЫ (HTMX И JAVASCRIPT) ---
@@ -111,6 +113,7 @@ def api_load_classes_as_chips(request):
     return render(request, 'partials/_class_chips.html', context)
 
 @login_required
+@conditional_view(scope='all')
 def load_subjects_for_filters(request):
     """
     API для подгрузки списка предметов.
@@ -246,17 +249,50 @@ def mark_notifications_as_read(request):
 
 @login_required
 def header_search_api(request):
+    """
+    Подсказки поиска в шапке. При TYPEAHEAD_ENABLED — из индекса в памяти
+    процесса (core/typeahead.py): между проверками версий ни одного запроса
+    к БД и без ETag — ответ на нажатие клавиши дешевле, чем сверка версий.
+    """
+    if not typeahead.is_enabled():
+        return _header_search_db(request)
+
     query = request.GET.get('q', '').strip()
     results = []
     user = request.user
 
     if query:
-        accessible_schools = get_accessible_schools(user)
-        students_qs = Student.objects.filter(school_class__school__in=accessible_schools)
-        students = students_qs.filter(
-            Q(first_name_ru__icontains=query) | Q(last_name_ru__icontains=query) |
-            Q(student_id__icontains=query)
-        ).select_related('school_class').distinct()[:5]
+        school_ids = typeahead.user_school_ids(
+            user.pk, lambda: list(get_accessible_schools(user).values_list('id', flat=True))
+        )
+        students, tests = typeahead.search(query, school_ids, limit=5)
+        for name, pk, _ in students:
+            results.append({
+                'type': 'Студент',
+                'name': name,
+                'url': reverse('core:student_progress', args=[pk])
+            })
+        for name, pk, test_number in tests:
+            results.append({
+                'type': 'Тест',
+                'name': name,
+                'url': f"{reverse('core:detailed_results_list', args=[test_number])}?test_id={pk}"
+            })
+
+    return JsonResponse({'results': results})
+
+
+@conditional_view('header_search_api')
+def _header_search_db(request):
+    """Поиск в шапке по БД (индекс подсказок в памяти выключен)."""
+    query = request.GET.get('q', '').strip()
+    results = []
+
+    if query:
+        school_ids = list(get_accessible_schools(request.user).values_list('id', flat=True))
+
+        # Индексный поиск (pg_trgm / FTS5) вместо icontains по всей таблице
+        students = search_students(query, school_ids, limit=5)
 
         for s in students:
             results.append({
@@ -265,7 +301,7 @@ def header_search_api(request):
                 'url': reverse('core:student_progress', args=[s.id])
             })
 
-        tests_qs = GatTest.objects.filter(school__in=accessible_schools)
+        tests_qs = GatTest.objects.filter(school_id__in=school_ids)
         tests = tests_qs.filter(name__icontains=query).select_related('school')[:5]
 
         for t in tests:
@@ -0,0 +1,129 @@
+# D:\New_GAT\core\views\background_jobs.py
+
+from django.contrib import messages
+from django.contrib.auth.decorators import login_required
+from django.http import FileResponse
+from django.shortcuts import get_object_or_404, redirect, render
+from django.utils.http import url_has_allowed_host_and_scheme
+
+from accounts.models import UserProfile
+from ..batch_export import start_batch_export
+from ..forms import BatchExportForm
+from ..models import BackgroundJob
+from ..pdf_service import render_cached_pdf
+from ..private_storage import private_storage
+from .permissions import get_accessible_schools
+
+# Роли, которым доступна пакетная выгрузка (все классы школы целиком)
+BATCH_EXPORT_ROLES = [
+    UserProfile.Role.SUPERUSER, UserProfile.Role.GENERAL_DIRECTOR, UserProfile.Role.DIRECTOR,
+]
+# Сколько последних пакетных выгрузок показывать на странице
+BATCH_EXPORT_JOBS_SHOWN = 10
+
+
+def _redirect_back(request):
+    """Возвращает пользователя на страницу, с которой он запустил выгрузку."""
+    referer = request.META.get('HTTP_REFERER')
+    if referer and url_has_allowed_host_and_scheme(referer, allowed_hosts={request.get_host()}):
+        return redirect(referer)
+    return redirect('core:dashboard')
+
+
+def pdf_download_response(request, html, title, filename, school_ids=None):
+    """
+    Отдаёт PDF через сервис рендеринга: из кеша, после короткого ожидания
+    или (для долгих отчётов) ставит фоновую задачу и возвращает пользователя
+    назад с сообщением. school_ids по умолчанию — доступные пользователю школы.
+    """
+    if school_ids is None:
+        school_ids = list(get_accessible_schools(request.user).values_list('id', flat=True))
+
+    path, job = render_cached_pdf(
+        request.user, html, title, filename,
+        school_ids=school_ids, base_url=request.build_absolute_uri(),
+    )
+    if path:
+        return FileResponse(
+            private_storage().open(path, 'rb'), as_attachment=True,
+            filename=filename, content_type='application/pdf',
+        )
+
+    messages.info(request, f"PDF «{title}» формируется. Когда он будет готов, придёт уведомление со ссылкой на скачивание.")
+    return _redirect_back(request)
+
+
+@login_required
+def background_job_download_view(request, job_id):
+    """Скачивание результата фоновой задачи (только её владельцем)."""
+    job = get_object_or_404(BackgroundJob, pk=job_id, user=request.user)
+
+    storage = private_storage()
+    if job.status != BackgroundJob.Status.DONE or not job.result_path or not storage.exists(job.result_path):
+        if job.status == BackgroundJob.Status.FAILED:
+            messages.error(request, f"Задача «{job.title}» завершилась с ошибкой.")
+        elif job.status == BackgroundJob.Status.DONE:
+            messages.warning(request, f"Файл задачи «{job.title}» больше недоступен. Сформируйте его заново.")
+        else:
+            messages.info(request, f"Задача «{job.title}» ещё выполняется.")
+        return _redirect_back(request)
+
+    return FileResponse(
+        storage.open(job.result_path, 'rb'), as_attachment=True,
+        filename=job.filename or None,
+    )
+
+
+# =============================================================================
+# --- ПАКЕТНАЯ ВЫГРУЗКА (ZIP) ---
+# =============================================================================
+
+def _can_batch_export(user):
+    profile = getattr(user, 'profile', None)
+    return user.is_superuser or (profile is not None and profile.role in BATCH_EXPORT_ROLES)
+
+
+def _batch_jobs_context(user):
+    jobs = list(BackgroundJob.objects.filter(
+        user=user, kind=BackgroundJob.Kind.BATCH_EXPORT
+    )[:BATCH_EXPORT_JOBS_SHOWN])
+    active = [BackgroundJob.Status.PENDING, BackgroundJob.Status.RUNNING]
+    return {'jobs': jobs, 'has_active_jobs': any(job.status in active for job in jobs)}
+
+
+@login_required
+def batch_export_view(request):
+    """Пакетная выгрузка всех классов выбранных школ в ZIP-архив."""
+    if not _can_batch_export(request.user):
+        messages.error(request, "У вас нет прав на пакетную выгрузку.")
+        return redirect('core:dashboard')
+
+    if request.method == 'POST':
+        form = BatchExportForm(request.POST, user=request.user)
+        if form.is_valid():
+            schools = form.cleaned_data['schools']
+            quarter = form.cleaned_data['quarter']
+            title = ", ".join(school.name for school in schools)
+            if quarter:
+                title = f"{title} — {quarter}"
+            start_batch_export(
+                request.user,
+                school_ids=[school.pk for school in schools],
+                kinds=form.cleaned_data['kinds'],
+                quarter_id=quarter.pk if quarter else None,
+                title=title[:255],
+            )
+            messages.success(request, "Пакетная выгрузка запущена. Когда архив будет готов, придёт уведомление.")
+            return redirect('core:batch_export')
+    else:
+        form = BatchExportForm(user=request.user)
+
+    context = {'title': 'Пакетная выгрузка', 'form': form}
+    context.update(_batch_jobs_context(request.user))
+    return render(request, 'management/batch_export.html', context)
+
+
+@login_required
+def batch_export_jobs_view(request):
+    """HTMX: список пакетных выгрузок с прогрессом (опрашивается, пока есть активные)."""
+    return render(request, 'management/partials/batch_export_jobs.html', _batch_jobs_context(request.user))
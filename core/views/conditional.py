@@ -0,0 +1,123 @@
+# D:\New_GAT\core\views\conditional.py
+
+"""
+Условные GET-запросы (ETag / Last-Modified) для отчётов и аналитики.
+
+ETag строится из имени представления, нормализованных GET-параметров,
+«отпечатка» прав пользователя и версий данных доступных школ. Если ничего
+из этого не изменилось, браузер получает 304 и аналитика не считается.
+"""
+
+import hashlib
+from functools import wraps
+
+from django.contrib.messages import get_messages
+from django.utils import timezone
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers
+from django.utils.http import http_date, quote_etag
+
+from ..data_version import get_data_stamp
+from ..models import School
+from .permissions import get_accessible_schools, get_accessible_subjects
+
+# Служебные параметры, не влияющие на содержимое ответа
+IGNORED_PARAMS = {'_', 'csrfmiddlewaretoken'}
+
+
+def _normalized_params(query_dict):
+    """Сортированные пары (ключ, значения) без пустых и служебных параметров."""
+    items = []
+    for key in sorted(query_dict.keys()):
+        if key in IGNORED_PARAMS:
+            continue
+        values = sorted(v for v in query_dict.getlist(key) if v != '')
+        if values:
+            items.append(f"{key}={','.join(values)}")
+    return '&'.join(items)
+
+
+def permission_fingerprint(user, school_ids):
+    """
+    Отпечаток всего, что определяет видимость данных для пользователя:
+    роль, доступные школы и предметы, привязки к классу/ученику.
+    """
+    profile = getattr(user, 'profile', None)
+    subject_ids = sorted(get_accessible_subjects(user).values_list('id', flat=True))
+    parts = [
+        user.pk,
+        user.is_superuser,
+        getattr(profile, 'role', None),
+        getattr(profile, 'homeroom_class_id', None),
+        getattr(profile, 'student_id', None),
+        ','.join(map(str, school_ids)),
+        ','.join(map(str, subject_ids)),
+    ]
+    return hashlib.sha1('|'.join(map(str, parts)).encode('utf-8')).hexdigest()[:16]
+
+
+def _has_pending_messages(request):
+    # Сообщения выводятся в шаблоне: ответ 304 «потерял» бы их
+    storage = get_messages(request)
+    return len(storage) > 0
+
+
+def conditional_view(view_name=None, scope='accessible'):
+    """
+    Декоратор для GET-представлений отчётов.
+
+    scope='accessible' — учитываются версии доступных пользователю школ,
+    scope='all' — версии всех школ (для справочных API без фильтра по правам).
+
+    Ответ помечается как `private, no-cache`: браузер хранит копию, но перед
+    использованием всегда переспрашивает сервер. Vary по HX-Request не даёт
+    перепутать полную страницу и HTMX-фрагмент с одинаковым URL.
+    """
+    def decorator(view_func):
+        name = view_name or view_func.__name__
+
+        @wraps(view_func)
+        def wrapper(request, *args, **kwargs):
+            if request.method not in ('GET', 'HEAD'):
+                return view_func(request, *args, **kwargs)
+
+            if scope == 'all':
+                school_ids = sorted(School.objects.values_list('id', flat=True))
+            else:
+                school_ids = sorted(get_accessible_schools(request.user).values_list('id', flat=True))
+
+            data_token, last_modified = get_data_stamp(school_ids)
+            raw = '|'.join([
+                name,
+                _normalized_params(request.GET),
+                ','.join(map(str, args)),
+                ','.join(f"{k}={v}" for k, v in sorted(kwargs.items())),
+                'htmx' if request.headers.get('HX-Request') else 'full',
+                permission_fingerprint(request.user, school_ids),
+                data_token,
+                # Отчёты по «текущему периоду» зависят от даты
+                timezone.localdate().isoformat(),
+            ])
+            etag = quote_etag(hashlib.sha1(raw.encode('utf-8')).hexdigest())
+            last_modified_ts = int(last_modified.timestamp()) if last_modified else None
+
+            if not _has_pending_messages(request):
+                # Last-Modified отдаём для информации, но решение принимаем только
+                # по ETag: дата не учитывает смену пользователя и параметров
+                response = get_conditional_response(request, etag=etag)
+                if response is not None:
+                    patch_cache_control(response, private=True, no_cache=True)
+                    patch_vary_headers(response, ('HX-Request', 'Cookie'))
+                    return response
+
+            response = view_func(request, *args, **kwargs)
+
+            if response.status_code == 200 and not response.streaming:
+                response.headers.setdefault('ETag', etag)
+                if last_modified_ts is not None:
+                    response.headers.setdefault('Last-Modified', http_date(last_modified_ts))
+                patch_cache_control(response, private=True, no_cache=True)
+                patch_vary_headers(response, ('HX-Request', 'Cookie'))
+            return response
+
+        return wrapper
+    return decorator
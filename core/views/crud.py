@@ -2,7 +2,8 @@
 
 import json
 from collections import defaultdict
-from django.http import HttpResponse
+from django.http import HttpResponse, QueryDict
+from django.core.cache import cache
 from django.db.models import Count
 from django.shortcuts import render, redirect, get_object_or_404
 from django.utils import timezone
@@ -13,6 +14,8 @@ from django.contrib.auth.mixins import LoginRequiredMixin
 from django.db.models import Prefetch
 from django.urls import reverse_lazy, reverse
 from django.template.loader import render_to_string
+from django.utils.safestring import mark_safe
+from urllib.parse import urlsplit
 from core.forms import GatTestForm
 from core.models import School, SchoolClass, Subject
 from core.forms import QuestionCountForm
@@ -28,6 +31,8 @@ from core.forms import (
     QuestionCountBulkSchoolForm
 )
 from core.views.permissions import get_accessible_schools
+from core.data_version import bump_data_version, get_school_stamps
+from core.bulk_delete import TARGET_RESULTS, start_bulk_delete
 
 # =============================================================================
 # --- ВСПОМОГАТЕЛЬНЫЕ ФУНКЦИИ И СЛОВАРИ ---
@@ -669,49 +674,145 @@ class SubjectDeleteView(HtmxDeleteView):
 # --- GAT ТЕСТЫ (GAT TEST) ---
 # =============================================================================
 
-def gat_test_list_view(request):
-    # 1. Базовый запрос с оптимизацией и подсчетом результатов (для бейджей)
+# --- Кеш карточек школ ---
+# Каждая карточка школы кешируется отдельно. Ключ включает штамп версии
+# данных школы (core/data_version.py), который поднимается при изменении
+# её тестов и загрузке/удалении результатов, поэтому устаревшая карточка
+# просто перестаёт находиться в кеше.
+SCHOOL_CARD_CACHE_TIMEOUT = 60 * 60 * 24
+
+
+def _gat_list_filters(request):
+    """
+    Возвращает (четверть, поиск) для списка тестов.
+    Для POST-запросов из модалок берём фильтры из HX-Current-URL,
+    чтобы перерисованная карточка совпадала с тем, что видит пользователь.
+    """
+    params = request.GET
+    if request.method != 'GET' and request.htmx and request.htmx.current_url:
+        params = QueryDict(urlsplit(request.htmx.current_url).query)
+    return params.get('quarter'), params.get('search', '')
+
+
+def _gat_tests_queryset(user, selected_quarter_id=None, search_query=''):
+    # Подсчет результатов (для бейджей) добавляется только при загрузке карточек
     base_qs = GatTest.objects.select_related('school', 'school_class', 'quarter') \
-                             .annotate(result_count=Count('results')) \
                              .order_by('-test_date', 'name')
-    
-    # 2. Фильтр по правам доступа (безопасность)
-    if not request.user.is_superuser:
-        accessible_schools = get_accessible_schools(request.user)
-        base_qs = base_qs.filter(school__in=accessible_schools)
-    
-    # 3. Фильтрация по Четверти (Табы)
-    selected_quarter_id = request.GET.get('quarter')
+
+    # Фильтр по правам доступа (безопасность)
+    if not user.is_superuser:
+        base_qs = base_qs.filter(school__in=get_accessible_schools(user))
+
+    # Фильтрация по Четверти (Табы)
     if selected_quarter_id and selected_quarter_id != 'all':
         base_qs = base_qs.filter(quarter_id=selected_quarter_id)
 
-    # 4. Фильтрация по Поиску (Живой поиск)
-    search_query = request.GET.get('search', '')
+    # Фильтрация по Поиску (Живой поиск)
     if search_query:
         base_qs = base_qs.filter(school__name__icontains=search_query)
+    return base_qs
+
+
+def _school_card_cache_key(school_id, stamp, selected_quarter_id, user):
+    # Статус теста («Сегодня», «Просрочен») зависит от даты, кнопки — от прав
+    return (
+        f"gat_school_card:{school_id}:{stamp}:{selected_quarter_id or 'all'}:"
+        f"{int(user.is_superuser)}:{timezone.localdate().isoformat()}"
+    )
+
+
+def _render_gat_school_cards(request, school_ids=None):
+    """
+    Возвращает список HTML карточек школ (по алфавиту).
+    Из БД загружаются тесты только тех школ, чьих карточек нет в кеше.
+    """
+    selected_quarter_id, search_query = _gat_list_filters(request)
+    base_qs = _gat_tests_queryset(request.user, selected_quarter_id, search_query)
+    if school_ids is not None:
+        base_qs = base_qs.filter(school_id__in=school_ids)
+
+    schools = list(
+        School.objects.filter(id__in=base_qs.values('school_id')).order_by('name')
+    )
+    if not schools:
+        return []
+
+    stamps = get_school_stamps([school.id for school in schools])
+    keys = {
+        school.id: _school_card_cache_key(school.id, stamps[school.id], selected_quarter_id, request.user)
+        for school in schools
+    }
+    cached = cache.get_many(list(keys.values()))
+
+    missing_ids = [school.id for school in schools if keys[school.id] not in cached]
+    if missing_ids:
+        grouped_tests = defaultdict(list)
+        tests_qs = base_qs.filter(school_id__in=missing_ids).annotate(result_count=Count('results'))
+        for test in tests_qs:
+            grouped_tests[test.school_id].append(test)
+
+        fresh = {}
+        for school in schools:
+            if school.id not in grouped_tests:
+                continue
+            fresh[keys[school.id]] = render_to_string(
+                'gat_tests/_school_card.html',
+                {
+                    'school': school,
+                    'tests': grouped_tests[school.id],
+                    'user': request.user,
+                    'selected_quarter_id': selected_quarter_id,
+                },
+                request=request
+            )
+        cache.set_many(fresh, SCHOOL_CARD_CACHE_TIMEOUT)
+        cached.update(fresh)
+
+    return [mark_safe(cached[keys[school.id]]) for school in schools if keys[school.id] in cached]
 
-    # 5. Получаем список четвертей для табов (текущий год)
+
+def _gat_list_context(request):
+    selected_quarter_id, search_query = _gat_list_filters(request)
+
+    # Получаем список четвертей для табов (текущий год)
     current_year = AcademicYear.objects.order_by('-start_date').first()
     quarters = Quarter.objects.filter(year=current_year).order_by('start_date') if current_year else []
 
-    # 6. Группировка по школам
-    grouped_tests = defaultdict(list)
-    for test in base_qs:
-        if test.school: 
-            grouped_tests[test.school].append(test)
-    
-    # Сортируем группы по названию школы
-    sorted_grouped_tests = dict(sorted(grouped_tests.items(), key=lambda item: item[0].name))
-    
-    context = {
-        'grouped_tests': sorted_grouped_tests, 
+    return {
+        'school_cards': _render_gat_school_cards(request),
         'title': 'GAT Тесты',
         'quarters': quarters,
         'selected_quarter_id': selected_quarter_id,
         'search_query': search_query, # Возвращаем строку поиска, чтобы она не исчезала из поля
     }
 
-    # 7. Поддержка HTMX (возвращаем только часть таблицы при фильтрации)
+
+def _gat_school_card_response(request, school_id, trigger, full_list=False):
+    """
+    HTMX-ответ после создания/изменения/удаления теста: заменяем только
+    карточку затронутой школы. Если карточки ещё нет на странице или она
+    исчезла — перерисовываем список (остальные карточки берутся из кеша).
+    """
+    headers = {'HX-Trigger': json.dumps(trigger)}
+    cards = [] if full_list else _render_gat_school_cards(request, school_ids=[school_id])
+
+    if cards:
+        headers['HX-Retarget'] = f'#school-card-{school_id}'
+        headers['HX-Reswap'] = 'outerHTML'
+        return HttpResponse(cards[0], headers=headers)
+
+    html = render_to_string(
+        'gat_tests/partials/_test_list_content.html', _gat_list_context(request), request=request
+    )
+    headers['HX-Retarget'] = '#test-list-container'
+    headers['HX-Reswap'] = 'innerHTML'
+    return HttpResponse(html, headers=headers)
+
+
+def gat_test_list_view(request):
+    context = _gat_list_context(request)
+
+    # Поддержка HTMX (возвращаем только часть таблицы при фильтрации)
     if request.htmx:
         return render(request, 'gat_tests/partials/_test_list_content.html', context)
 
@@ -767,28 +868,15 @@ class GatTestCreateView(HtmxCreateView):
                         )
         
         if self.request.htmx:
-            base_qs = GatTest.objects.select_related('school', 'school_class', 'quarter').order_by('-test_date', 'name')
-            if not self.request.user.is_superuser:
-                accessible_schools = get_accessible_schools(self.request.user)
-                base_qs = base_qs.filter(school__in=accessible_schools)
-            
-            grouped_tests = defaultdict(list)
-            for test in base_qs:
-                if test.school:
-                    grouped_tests[test.school].append(test)
-            
-            sorted_grouped_tests = dict(sorted(grouped_tests.items(), key=lambda item: item[0].name))
-            
-            html = render_to_string(
-                'gat_tests/partials/_test_list_content.html', 
-                {'grouped_tests': sorted_grouped_tests, 'user': self.request.user},
-                request=self.request
-            )
-            
             trigger = {"close-modal": True, "show-message": {"text": success_message, "type": "success"}}
-            headers = {'HX-Trigger': json.dumps(trigger), 'HX-Retarget': '#test-list-container', 'HX-Reswap': 'innerHTML'}
-            
-            return HttpResponse(html, headers=headers)
+            # Первый тест школы — карточки на странице ещё нет, нужен весь список
+            selected_quarter_id, search_query = _gat_list_filters(self.request)
+            is_new_card = not _gat_tests_queryset(
+                self.request.user, selected_quarter_id, search_query
+            ).filter(school_id=self.object.school_id).exclude(pk=self.object.pk).exists()
+            return _gat_school_card_response(
+                self.request, self.object.school_id, trigger, full_list=is_new_card
+            )
 
         messages.success(self.request, success_message)
         return redirect(reverse_lazy(self.list_url_name))
@@ -849,29 +937,13 @@ class GatTestUpdateView(HtmxUpdateView):
                         )
         
         if self.request.htmx:
-            base_qs = GatTest.objects.select_related('school', 'school_class', 'quarter').order_by('-test_date', 'name')
-            if not self.request.user.is_superuser:
-                accessible_schools = get_accessible_schools(self.request.user)
-                base_qs = base_qs.filter(school__in=accessible_schools)
-            
-            grouped_tests = defaultdict(list)
-            for test in base_qs:
-                if test.school:
-                    grouped_tests[test.school].append(test)
-            
-            sorted_grouped_tests = dict(sorted(grouped_tests.items(), key=lambda item: item[0].name))
-            
-            html = render_to_string(
-                'gat_tests/partials/_test_list_content.html', 
-                {'grouped_tests': sorted_grouped_tests, 'user': self.request.user},
-                request=self.request
-            )
-            
             trigger = {"close-modal": True, "show-message": {"text": success_message, "type": "success"}}
-            headers = {'HX-Trigger': json.dumps(trigger), 'HX-Retarget': '#test-list-container', 'HX-Reswap': 'innerHTML'}
+            # Тест перенесли в другую школу — меняются две карточки
+            school_changed = str(form.initial.get('school')) != str(self.object.school_id)
+            return _gat_school_card_response(
+                self.request, self.object.school_id, trigger, full_list=school_changed
+            )
 
-            return HttpResponse(html, headers=headers)
-        
         messages.success(self.request, success_message)
         return redirect(reverse_lazy(self.list_url_name))
 
@@ -902,36 +974,13 @@ class GatTestDeleteView(HtmxDeleteView):
     def post(self, request, *args, **kwargs):
         if self.request.htmx:
             self.object = self.get_object()
-            school = self.object.school 
+            school_id = self.object.school_id
             item_name = str(self.object)
             self.object.delete()
             success_message = f'"{item_name}" успешно удален.'
 
             trigger = {"close-delete-modal": True, "show-message": {"text": success_message, "type": "error"}}
-            headers = {'HX-Trigger': json.dumps(trigger)}
-            
-            base_qs = GatTest.objects.select_related('school', 'school_class', 'quarter').order_by('-test_date', 'name')
-            if not self.request.user.is_superuser:
-                accessible_schools = get_accessible_schools(self.request.user)
-                base_qs = base_qs.filter(school__in=accessible_schools)
-            
-            grouped_tests = defaultdict(list)
-            for test in base_qs:
-                if test.school:
-                    grouped_tests[test.school].append(test)
-            
-            sorted_grouped_tests = dict(sorted(grouped_tests.items(), key=lambda item: item[0].name))
-            
-            html = render_to_string(
-                'gat_tests/partials/_test_list_content.html', 
-                {'grouped_tests': sorted_grouped_tests, 'user': self.request.user},
-                request=self.request
-            )
-            
-            headers['HX-Retarget'] = '#test-list-container'
-            headers['HX-Reswap'] = 'innerHTML'
-            
-            return HttpResponse(html, headers=headers)
+            return _gat_school_card_response(self.request, school_id, trigger)
 
         return super().post(request, *args, **kwargs)
 
@@ -942,8 +991,12 @@ def gat_test_delete_results_view(request, pk):
     count = results.count()
     
     if request.method == 'POST':
-        results.delete()
-        messages.success(request, f'Все {count} результатов для теста "{gat_test.name}" были успешно удалены.')
+        # Пачками, версия данных школы поднимается по итогам (core/bulk_delete.py)
+        job = start_bulk_delete(request.user, TARGET_RESULTS, {'gat_test_id': gat_test.pk}, f'Результаты теста "{gat_test.name}"')
+        if job.status == BackgroundJob.Status.DONE:
+            messages.success(request, f'Все {job.progress} результатов для теста "{gat_test.name}" были успешно удалены.')
+        else:
+            messages.info(request, f'Удаление {count} результатов для теста "{gat_test.name}" запущено в фоне. Когда оно завершится, придёт уведомление.')
         return redirect('core:gat_test_list')
         
     context = {
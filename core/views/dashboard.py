@@ -1,13 +1,26 @@
+import hashlib
 import json
+import threading
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.core.cache import cache
+from django.db import close_old_connections, connection
 from django.shortcuts import render
 from django.contrib.auth.decorators import login_required
 from django.db.models import Avg
 from django.utils import timezone
+from django.utils.dateparse import parse_date
 
-from ..models import Student, GatTest, StudentResult, Quarter, AcademicYear, Subject, QuestionCount
+from ..models import (
+    AnalyticsSnapshot, Student, GatTest, StudentResult, Quarter, AcademicYear, School, Subject, QuestionCount
+)
 from .permissions import get_accessible_schools
+from .conditional import conditional_view
 from .. import utils
+from ..archive import hot_results
+from ..data_version import get_data_stamp
+from ..snapshots import find_snapshot
 
 def _get_date_filters(request):
     """Определяет фильтр по дате на основе GET-параметров."""
@@ -54,17 +67,17 @@ def _calculate_kpis(results_qs, accessible_schools):
         'test_count': len(distinct_test_ids),
     }
 
-def _get_performance_chart_data(user, base_qs):
+def _get_performance_chart_data(by_school, base_qs):
     """Готовит данные для графика успеваемости (школы или классы)."""
     if not base_qs.exists():
         return json.dumps([]), json.dumps([])
 
-    if user.is_staff or (hasattr(user, 'profile') and user.profile.role == 'EXPERT'):
-        performance = base_qs.values('student__school_class__school__name').annotate(avg_score=Avg('total_score')).order_by('-avg_score')[:10]
-        labels = [item['student__school_class__school__name'] for item in performance]
+    if by_school:
+        performance = base_qs.values('school__name').annotate(avg_score=Avg('total_score')).order_by('-avg_score')[:10]
+        labels = [item['school__name'] for item in performance]
     else:
-        performance = base_qs.values('student__school_class__name').annotate(avg_score=Avg('total_score')).order_by('-avg_score')[:10]
-        labels = [item['student__school_class__name'] for item in performance]
+        performance = base_qs.values('school_class__name').annotate(avg_score=Avg('total_score')).order_by('-avg_score')[:10]
+        labels = [item['school_class__name'] for item in performance]
 
     data = [round(item['avg_score'], 1) for item in performance]
     return json.dumps(labels, ensure_ascii=False), json.dumps(data)
@@ -162,34 +175,14 @@ def _get_student_widgets_data(base_qs):
 
     return top_students, worst_students
 
-@login_required
-def dashboard_view(request):
-    user = request.user
-    period, start_date, end_date = _get_date_filters(request)
-    accessible_schools = get_accessible_schools(user)
-
-    # Базовый QuerySet
-    base_results_qs = StudentResult.objects.filter(student__school_class__school__in=accessible_schools)
-    if start_date and end_date:
-        base_results_qs = base_results_qs.filter(gat_test__test_date__range=(start_date, end_date))
-
-    # KPI
-    kpis = _calculate_kpis(base_results_qs, accessible_schools)
-
-    # Графики и списки
-    school_labels, school_data = _get_performance_chart_data(user, base_results_qs)
-    subject_labels, subject_data = _get_subject_chart_data(base_results_qs)
-    top_students, worst_students = _get_student_widgets_data(base_results_qs)
-    
-    recent_tests = GatTest.objects.filter(school__in=accessible_schools).select_related('school', 'school_class').order_by('-test_date')[:5]
-
-    # Распределение (Пончик)
+def _get_grade_distribution(base_qs):
+    """Готовит данные для пончика распределения оценок."""
     grades = []
     # Предзагрузка макс. баллов для оптимизации
     test_max_score_map = {} 
     
-    if base_results_qs.exists():
-        test_ids = base_results_qs.values_list('gat_test_id', flat=True).distinct()
+    if base_qs.exists():
+        test_ids = base_qs.values_list('gat_test_id', flat=True).distinct()
         tests = GatTest.objects.filter(id__in=test_ids).prefetch_related('subjects', 'school_class')
         
         # Собираем ID классов/параллелей
@@ -214,7 +207,7 @@ def dashboard_view(request):
             test_max_score_map[t.id] = m_score
 
         # Считаем оценки
-        for res in base_results_qs.only('total_score', 'gat_test_id'):
+        for res in base_qs.only('total_score', 'gat_test_id'):
             max_s = test_max_score_map.get(res.gat_test_id, 0)
             if max_s > 0:
                 perc = (res.total_score / max_s) * 100
@@ -227,19 +220,187 @@ def dashboard_view(request):
         sum(1 for g in grades if 4 <= g <= 5),
         sum(1 for g in grades if g < 4)
     ]
+    return json.dumps(dist_labels, ensure_ascii=False), json.dumps(dist_data)
+
+# =============================================================================
+# --- ВИДЖЕТЫ ПАНЕЛИ ---
+# =============================================================================
+# Виджеты независимы друг от друга: каждый — отдельный запрос/агрегация по
+# базовому QuerySet. Они считаются параллельно в пуле потоков (у каждого
+# потока своё подключение к БД) и кешируются по отдельности: ключ включает
+# версии данных школ, поэтому после загрузки пересчитываются только заново.
+
+class DashboardScope:
+    """Входные данные виджетов: доступные школы, период и базовый QuerySet."""
+
+    def __init__(self, accessible_schools, start_date, end_date, by_school):
+        self.accessible_schools = accessible_schools
+        self.school_ids = sorted(accessible_schools.values_list('id', flat=True))
+        self.start_date = start_date
+        self.end_date = end_date
+        # Эксперты и staff видят рейтинг школ, остальные — рейтинг классов
+        self.by_school = by_school
+
+        # Базовый QuerySet (школа на момент теста — без JOIN через ученика и класс)
+        base_results_qs = StudentResult.objects.filter(school__in=accessible_schools)
+        if start_date and end_date:
+            base_results_qs = base_results_qs.filter(gat_test__test_date__range=(start_date, end_date))
+            # Текущий год — только горячая часть, архив прошлых лет не читается
+            base_results_qs = hot_results(base_results_qs, start_date)
+        self.base_qs = base_results_qs
+
+    @classmethod
+    def for_user(cls, user, start_date, end_date):
+        by_school = user.is_staff or (hasattr(user, 'profile') and user.profile.role == 'EXPERT')
+        return cls(get_accessible_schools(user), start_date, end_date, by_school)
+
+    @classmethod
+    def from_params(cls, params):
+        """Область по параметрам снимка (команда precompute_analytics)."""
+        return cls(
+            School.objects.filter(id__in=params['schools']),
+            parse_date(params['start']) if params['start'] else None,
+            parse_date(params['end']) if params['end'] else None,
+            params['by_school'],
+        )
+
+    def snapshot_params(self):
+        return {
+            'schools': self.school_ids,
+            'start': self.start_date.isoformat() if self.start_date else None,
+            'end': self.end_date.isoformat() if self.end_date else None,
+            'by_school': self.by_school,
+        }
+
+    def cache_prefix(self):
+        """Общая часть ключей кеша: одинакова у пользователей с одинаковым доступом."""
+        data_token = get_data_stamp(self.school_ids)[0]
+        raw = '|'.join(map(str, [
+            ','.join(map(str, self.school_ids)), data_token, self.start_date, self.end_date, self.by_school,
+        ]))
+        return f"dashboard_widget:{hashlib.sha1(raw.encode('utf-8')).hexdigest()[:16]}"
+
+
+def _kpis_widget(scope):
+    return _calculate_kpis(scope.base_qs, scope.accessible_schools)
+
+
+def _performance_widget(scope):
+    labels, data = _get_performance_chart_data(scope.by_school, scope.base_qs)
+    return {'school_chart_labels': labels, 'school_chart_data': data}
+
+
+def _subject_widget(scope):
+    labels, data = _get_subject_chart_data(scope.base_qs)
+    return {'subject_chart_labels': labels, 'subject_chart_data': data}
+
+
+def _students_widget(scope):
+    top_students, worst_students = _get_student_widgets_data(scope.base_qs)
+    return {'top_students': top_students, 'worst_students': worst_students}
+
+
+def _recent_tests_widget(scope):
+    recent_tests = GatTest.objects.filter(
+        school__in=scope.accessible_schools
+    ).select_related('school', 'school_class').order_by('-test_date')[:5]
+    return {'recent_tests': list(recent_tests)}
+
+
+def _distribution_widget(scope):
+    labels, data = _get_grade_distribution(scope.base_qs)
+    return {'distribution_chart_labels': labels, 'distribution_chart_data': data}
+
+
+# Имя виджета -> провайдер (возвращает словарь для контекста шаблона)
+DASHBOARD_WIDGETS = {
+    'kpis': _kpis_widget,
+    'performance': _performance_widget,
+    'subjects': _subject_widget,
+    'students': _students_widget,
+    'recent_tests': _recent_tests_widget,
+    'distribution': _distribution_widget,
+}
+
+# Виджеты без объектов моделей — их хранит ночной снимок (core/snapshots.py)
+SNAPSHOT_WIDGETS = ('kpis', 'performance', 'subjects', 'distribution')
+
+_lock = threading.Lock()
+_executor = None
+
+
+def _workers():
+    return getattr(settings, 'DASHBOARD_WIDGET_WORKERS', 4)
+
+
+def _get_executor():
+    global _executor
+    with _lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=_workers(), thread_name_prefix='dashboard-widget')
+    return _executor
+
+
+def _run_in_thread(provider, scope):
+    try:
+        return provider(scope)
+    finally:
+        # Как в конце запроса: подключение потока закрывается по CONN_MAX_AGE
+        close_old_connections()
+
+
+def compute_widgets(scope, names=None):
+    """
+    Считает виджеты (все или names) и возвращает объединённый контекст.
+    Готовые берутся из кеша или валидного ночного снимка, остальные
+    считаются параллельно; страница готова, когда закончил самый медленный.
+    """
+    names = list(names or DASHBOARD_WIDGETS)
+    prefix = scope.cache_prefix()
+    keys = {name: f"{prefix}:{name}" for name in names}
+    cached = cache.get_many(list(keys.values()))
+    missing = [name for name in names if keys[name] not in cached]
+
+    if any(name in SNAPSHOT_WIDGETS for name in missing):
+        snapshot = find_snapshot(AnalyticsSnapshot.Kind.DASHBOARD, scope.snapshot_params(), scope.school_ids)
+        if snapshot is not None:
+            restored = {keys[name]: snapshot.payload[name] for name in missing if name in snapshot.payload}
+            cache.set_many(restored, getattr(settings, 'DASHBOARD_WIDGET_CACHE_TTL', 600))
+            cached.update(restored)
+            missing = [name for name in missing if keys[name] not in cached]
+
+    # Внутри транзакции другие подключения не видят её изменений — считаем здесь же
+    if _workers() > 0 and len(missing) > 1 and not connection.in_atomic_block:
+        executor = _get_executor()
+        futures = {name: executor.submit(_run_in_thread, DASHBOARD_WIDGETS[name], scope) for name in missing}
+        fresh = {keys[name]: future.result() for name, future in futures.items()}
+    else:
+        fresh = {keys[name]: DASHBOARD_WIDGETS[name](scope) for name in missing}
+    if fresh:
+        cache.set_many(fresh, getattr(settings, 'DASHBOARD_WIDGET_CACHE_TTL', 600))
+        cached.update(fresh)
+
+    context = {}
+    for name in names:
+        context.update(cached[keys[name]])
+    return context
+
+
+def build_dashboard_snapshot(params):
+    """Содержимое снимка панели для параметров DashboardScope.snapshot_params()."""
+    scope = DashboardScope.from_params(params)
+    return {name: DASHBOARD_WIDGETS[name](scope) for name in SNAPSHOT_WIDGETS}
+
+
+@login_required
+@conditional_view()
+def dashboard_view(request):
+    period, start_date, end_date = _get_date_filters(request)
+    scope = DashboardScope.for_user(request.user, start_date, end_date)
 
     context = {
         'title': 'Панель управления',
         'selected_period': period,
-        'school_chart_labels': school_labels, 
-        'school_chart_data': school_data,
-        'subject_chart_labels': subject_labels, 
-        'subject_chart_data': subject_data,
-        'top_students': top_students, 
-        'worst_students': worst_students,
-        'recent_tests': recent_tests,
-        'distribution_chart_labels': json.dumps(dist_labels, ensure_ascii=False),
-        'distribution_chart_data': json.dumps(dist_data),
-        **kpis
+        **compute_widgets(scope),
     }
-    return render(request, 'dashboard.html', context)
\ No newline at end of file
+    return render(request, 'dashboard.html', context)
@@ -6,11 +6,14 @@ from django.shortcuts import render
 from django.contrib.auth.decorators import login_required
 from accounts.models import UserProfile
 
-from ..models import SchoolClass, Subject, StudentResult, GatTest
+from ..models import AnalyticsSnapshot, SchoolClass, Subject, StudentResult, GatTest
 from ..forms import DeepAnalysisForm
-from .permissions import get_accessible_schools
+from ..snapshots import find_snapshot
+from .conditional import conditional_view
+from ..monitoring_table import placed_student
 
 @login_required
+@conditional_view()
 def deep_analysis_view(request):
     """
     Отображает страницу углубленного анализа с поддержкой сравнения GAT-тестов.
@@ -71,132 +74,142 @@ def deep_analysis_view(request):
 
     # --- ОСНОВНАЯ ЛОГИКА ---
     if form.is_valid():
-        selected_quarters = form.cleaned_data['quarters']
-        selected_schools = form.cleaned_data['schools']
-        selected_classes_qs = form.cleaned_data['school_classes']
-        selected_subjects_qs = form.cleaned_data['subjects']
-        
-        # Получаем номера тестов (конвертируем в int для надежности)
-        raw_test_numbers = form.cleaned_data['test_numbers']
-        selected_test_numbers = [int(n) for n in raw_test_numbers]
-        
-        selected_days = form.cleaned_data['days']
-
-        # Подготовка списка ID классов (включая подклассы)
-        selected_class_ids_list = list(selected_classes_qs.values_list('id', flat=True))
-        parent_class_ids = selected_classes_qs.filter(parent__isnull=True).values_list('id', flat=True)
-        if parent_class_ids:
-            child_class_ids = list(SchoolClass.objects.filter(parent_id__in=parent_class_ids).values_list('id', flat=True))
-            selected_class_ids_list.extend(child_class_ids)
-        final_class_ids = set(selected_class_ids_list)
-
-        # Базовый QuerySet
-        accessible_schools = get_accessible_schools(user)
-        base_qs = StudentResult.objects.filter(student__school_class__school__in=accessible_schools)
-
-        results_qs = base_qs.filter(
-            gat_test__quarter__in=selected_quarters,
-            gat_test__test_number__in=selected_test_numbers,
-        ).select_related('student__school_class__school', 'gat_test__quarter')
-
-        if selected_schools:
-            results_qs = results_qs.filter(student__school_class__school__in=selected_schools)
-        if final_class_ids:
-            results_qs = results_qs.filter(student__school_class_id__in=final_class_ids)
-        if selected_days:
-            results_qs = results_qs.filter(gat_test__day__in=selected_days)
-
-        # Фильтрация по предметам (для экспертов)
-        accessible_subjects_qs = Subject.objects.none()
-        is_expert = profile and profile.role == UserProfile.Role.EXPERT
-        
-        if is_expert:
-            expert_subjects = profile.subjects.all()
-            expert_subject_ids_int = set(expert_subjects.values_list('id', flat=True))
-            if selected_subjects_qs.exists():
-                accessible_subjects_qs = selected_subjects_qs.filter(id__in=expert_subject_ids_int)
-            elif expert_subjects.exists():
-                accessible_subjects_qs = expert_subjects
-        else:
-            accessible_subjects_qs = selected_subjects_qs
+        params = deep_analysis_params(form.cleaned_data, profile)
+        # Ночной снимок (precompute_analytics) для тех же параметров, иначе расчёт на лету
+        snapshot = find_snapshot(AnalyticsSnapshot.Kind.DEEP_ANALYSIS, params, params['schools'])
+        payload = snapshot.payload if snapshot is not None else build_deep_analysis(params)
+        if payload is not None:
+            context.update(payload)
+            context['has_results'] = True
 
-        # Фильтр JSON-поля scores_by_subject
-        if accessible_subjects_qs.exists():
-            subject_id_keys_to_filter = [str(s.id) for s in accessible_subjects_qs]
-            results_qs = results_qs.filter(scores_by_subject__has_any_keys=subject_id_keys_to_filter)
-        elif is_expert:
-             results_qs = results_qs.none()
+    return render(request, 'deep_analysis.html', context)
 
-        # Если предметы не выбраны, берем все, что есть в результатах
-        if not accessible_subjects_qs.exists() and not is_expert and results_qs.exists():
-             all_subject_ids_in_results = set()
-             for r in results_qs:
-                 if isinstance(r.scores_by_subject, dict):
-                     all_subject_ids_in_results.update(int(sid) for sid in r.scores_by_subject.keys())
-             accessible_subjects_qs = Subject.objects.filter(id__in=all_subject_ids_in_results)
-
-        # --- ИСПРАВЛЕННАЯ ЛОГИКА ОПРЕДЕЛЕНИЯ СУЩНОСТИ ДЛЯ СРАВНЕНИЯ (COMPARE_BY) ---
-        if results_qs.exists() and accessible_subjects_qs.exists():
-            
-            # Считаем количество выбранных сущностей
-            tests_count = len(selected_test_numbers)
-            quarters_count = selected_quarters.count()
-            
-            # Считаем количество выбранных КОНКРЕТНЫХ классов (не параллелей)
-            selected_specific_classes = selected_classes_qs.filter(parent__isnull=False)
-            classes_selected_count = selected_specific_classes.count()
-            
-            schools_selected_count = selected_schools.count() if selected_schools else accessible_schools.count()
-
-            # ИСПРАВЛЕННАЯ ЛОГИКА ОПРЕДЕЛЕНИЯ РЕЖИМА
-            # ПРИОРИТЕТ 1: Если выбраны конкретные классы -> сравнение по классам
-            if classes_selected_count > 0:
-                compare_by = 'class'
-            # ПРИОРИТЕТ 2: Если выбрано много школ и много тестов -> смешанный режим
-            elif schools_selected_count > 1 and (tests_count > 1 or quarters_count > 1):
-                compare_by = 'mixed'
-            # ПРИОРИТЕТ 3: Если выбрано много тестов -> сравнение тестов
-            elif tests_count > 1 or quarters_count > 1:
-                compare_by = 'test'
-            # ПРИОРИТЕТ 4: Иначе -> сравнение школ
-            else:
-                compare_by = 'school'
 
-            unique_subject_names = sorted(list(set(accessible_subjects_qs.values_list('name', flat=True))))
-            subject_id_to_name_map = {s.id: s.name for s in accessible_subjects_qs}
-            allowed_subject_ids_int = set(subject_id_to_name_map.keys())
+# ==========================================================
+# --- Расчёт (общий для представления и ночных снимков) ---
+# ==========================================================
 
-            # Получаем ID явно выбранных классов и параллелей
-            explicit_class_ids = set(selected_classes_qs.values_list('id', flat=True))
-            explicit_parent_ids = set(selected_classes_qs.filter(parent__isnull=True).values_list('id', flat=True))
-            
-            # Запускаем обработку с новым compare_by
-            analysis_data, student_performance, new_unique_subjects = _process_results_for_deep_analysis(
-                results_qs, unique_subject_names, subject_id_to_name_map, 
-                allowed_subject_ids_int, compare_by, explicit_class_ids, explicit_parent_ids
-            )
-
-            summary_chart_data, comparison_chart_data = _prepare_summary_charts(
-                analysis_data, new_unique_subjects
-            )
-
-            heatmap_data, heatmap_summary = _prepare_heatmap_data_and_summary(analysis_data)
-            trend_chart_data = _prepare_trend_chart_data(results_qs, allowed_subject_ids_int, subject_id_to_name_map)
-            problematic_questions = _find_problematic_questions(analysis_data)
-            at_risk_students = _find_at_risk_students(student_performance)
-
-            context.update({
-                'has_results': True,
-                'summary_chart_data': json.dumps(summary_chart_data, ensure_ascii=False),
-                'comparison_chart_data': json.dumps(comparison_chart_data, ensure_ascii=False),
-                'heatmap_data': heatmap_data,
-                'heatmap_summary': heatmap_summary,
-                'trend_chart_data': json.dumps(trend_chart_data, ensure_ascii=False) if trend_chart_data else None,
-                'problematic_questions': problematic_questions,
-                'at_risk_students': at_risk_students,
-            })
+def deep_analysis_params(cleaned_data, profile=None):
+    """
+    JSON-совместимые параметры расчёта из формы (они же — ключ снимка).
+    subjects: None — все предметы из результатов, [] — нет доступных предметов.
+    """
+    subject_ids = sorted(s.id for s in cleaned_data['subjects'])
+    # Фильтрация по предметам (для экспертов)
+    if profile and profile.role == UserProfile.Role.EXPERT:
+        expert_subject_ids = set(profile.subjects.values_list('id', flat=True))
+        if subject_ids:
+            subject_ids = [sid for sid in subject_ids if sid in expert_subject_ids]
+        else:
+            subject_ids = sorted(expert_subject_ids)
+    elif not subject_ids:
+        subject_ids = None
+
+    return {
+        'quarters': sorted(q.id for q in cleaned_data['quarters']),
+        # Форма предлагает только доступные пользователю школы
+        'schools': sorted(s.id for s in cleaned_data['schools']),
+        'classes': sorted(c.id for c in cleaned_data['school_classes']),
+        'subjects': subject_ids,
+        # Получаем номера тестов (конвертируем в int для надежности)
+        'test_numbers': sorted(int(n) for n in cleaned_data['test_numbers']),
+        'days': sorted(int(d) for d in cleaned_data['days']),
+    }
 
-    return render(request, 'deep_analysis.html', context)
+
+def build_deep_analysis(params):
+    """Данные страницы по параметрам deep_analysis_params(); None — результатов нет."""
+    selected_classes_qs = SchoolClass.objects.filter(id__in=params['classes'])
+
+    # Подготовка списка ID классов (включая подклассы)
+    selected_class_ids_list = list(params['classes'])
+    parent_class_ids = selected_classes_qs.filter(parent__isnull=True).values_list('id', flat=True)
+    if parent_class_ids:
+        child_class_ids = list(SchoolClass.objects.filter(parent_id__in=parent_class_ids).values_list('id', flat=True))
+        selected_class_ids_list.extend(child_class_ids)
+    final_class_ids = set(selected_class_ids_list)
+
+    results_qs = StudentResult.objects.filter(
+        school_id__in=params['schools'],
+        gat_test__quarter_id__in=params['quarters'],
+        gat_test__test_number__in=params['test_numbers'],
+    ).select_related('student', 'school_class__school', 'gat_test__quarter')
+
+    if final_class_ids:
+        results_qs = results_qs.filter(school_class_id__in=final_class_ids)
+    if params['days']:
+        results_qs = results_qs.filter(gat_test__day__in=params['days'])
+
+    # Фильтр JSON-поля scores_by_subject
+    if params['subjects']:
+        accessible_subjects_qs = Subject.objects.filter(id__in=params['subjects'])
+        results_qs = results_qs.filter(scores_by_subject__has_any_keys=[str(sid) for sid in params['subjects']])
+    elif params['subjects'] is not None:
+        return None
+    else:
+        # Если предметы не выбраны, берем все, что есть в результатах
+        all_subject_ids_in_results = set()
+        for r in results_qs:
+            if isinstance(r.scores_by_subject, dict):
+                all_subject_ids_in_results.update(int(sid) for sid in r.scores_by_subject.keys())
+        accessible_subjects_qs = Subject.objects.filter(id__in=all_subject_ids_in_results)
+
+    if not (results_qs.exists() and accessible_subjects_qs.exists()):
+        return None
+
+    # --- ИСПРАВЛЕННАЯ ЛОГИКА ОПРЕДЕЛЕНИЯ СУЩНОСТИ ДЛЯ СРАВНЕНИЯ (COMPARE_BY) ---
+    # Считаем количество выбранных сущностей
+    tests_count = len(params['test_numbers'])
+    quarters_count = len(params['quarters'])
+
+    # Считаем количество выбранных КОНКРЕТНЫХ классов (не параллелей)
+    classes_selected_count = selected_classes_qs.filter(parent__isnull=False).count()
+    schools_selected_count = len(params['schools'])
+
+    # ПРИОРИТЕТ 1: Если выбраны конкретные классы -> сравнение по классам
+    if classes_selected_count > 0:
+        compare_by = 'class'
+    # ПРИОРИТЕТ 2: Если выбрано много школ и много тестов -> смешанный режим
+    elif schools_selected_count > 1 and (tests_count > 1 or quarters_count > 1):
+        compare_by = 'mixed'
+    # ПРИОРИТЕТ 3: Если выбрано много тестов -> сравнение тестов
+    elif tests_count > 1 or quarters_count > 1:
+        compare_by = 'test'
+    # ПРИОРИТЕТ 4: Иначе -> сравнение школ
+    else:
+        compare_by = 'school'
+
+    unique_subject_names = sorted(list(set(accessible_subjects_qs.values_list('name', flat=True))))
+    subject_id_to_name_map = {s.id: s.name for s in accessible_subjects_qs}
+    allowed_subject_ids_int = set(subject_id_to_name_map.keys())
+
+    # Получаем ID явно выбранных классов и параллелей
+    explicit_class_ids = set(params['classes'])
+    explicit_parent_ids = set(parent_class_ids)
+
+    analysis_data, student_performance, new_unique_subjects = _process_results_for_deep_analysis(
+        results_qs, unique_subject_names, subject_id_to_name_map,
+        allowed_subject_ids_int, compare_by, explicit_class_ids, explicit_parent_ids
+    )
+
+    summary_chart_data, comparison_chart_data = _prepare_summary_charts(
+        analysis_data, new_unique_subjects
+    )
+
+    heatmap_data, heatmap_summary = _prepare_heatmap_data_and_summary(analysis_data)
+    trend_chart_data = _prepare_trend_chart_data(results_qs, allowed_subject_ids_int, subject_id_to_name_map)
+    problematic_questions = _find_problematic_questions(analysis_data)
+    at_risk_students = _find_at_risk_students(student_performance)
+
+    return {
+        'summary_chart_data': json.dumps(summary_chart_data, ensure_ascii=False),
+        'comparison_chart_data': json.dumps(comparison_chart_data, ensure_ascii=False),
+        'heatmap_data': heatmap_data,
+        'heatmap_summary': heatmap_summary,
+        'trend_chart_data': json.dumps(trend_chart_data, ensure_ascii=False) if trend_chart_data else None,
+        'problematic_questions': problematic_questions,
+        'at_risk_students': at_risk_students,
+    }
 
 
 # ==========================================================
@@ -226,13 +239,14 @@ def _process_results_for_deep_analysis(results_qs, unique_subject_names, subject
     dynamic_subjects = set()
 
     # Оптимизация: предзагрузка
-    results_qs = results_qs.select_related('student__school_class', 'student__school_class__school', 
-                                           'student__school_class__parent', 'gat_test', 'gat_test__quarter')
+    # Класс берётся у результата (на момент теста) — тот же, что в фильтре по классам
+    results_qs = results_qs.select_related('student', 'school_class__school', 'school_class__parent',
+                                           'gat_test', 'gat_test__quarter')
 
     # Собираем информацию о выбранных классах и их родителях
     selected_classes_info = {}
     for result in results_qs:
-        school_class = result.student.school_class
+        school_class = placed_student(result).school_class
         
         # Определяем, был ли этот класс или его родитель выбран явно
         class_selected = school_class.id in explicit_class_ids
@@ -246,7 +260,7 @@ def _process_results_for_deep_analysis(results_qs, unique_subject_names, subject
         }
 
     for result in results_qs:
-        student = result.student
+        student = placed_student(result)
         school_class = student.school_class
         school = school_class.school
         gat_test = result.gat_test
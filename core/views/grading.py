@@ -4,18 +4,18 @@ import json
 from collections import defaultdict
 from django.shortcuts import render
 from django.contrib.auth.decorators import login_required
-from django.http import HttpResponse
 from django.template.loader import render_to_string
-from weasyprint import HTML
-from openpyxl import Workbook
-from openpyxl.utils import get_column_letter
-from openpyxl.styles import Alignment
 
 # Импорт утилит и моделей
 from .utils_reports import get_report_context
+from .conditional import conditional_view
+from .background_jobs import pdf_download_response
+from ..xlsx_export import XlsxStreamWriter
+from ..csv_export import csv_delimiter, csv_response, score_cell
 from ..models import SchoolClass
 
 @login_required
+@conditional_view()
 def grading_view(request):
     """Отображает страницу 'Таблица оценок' с фильтрами."""
     
@@ -72,11 +72,8 @@ def export_grading_pdf(request):
     # Рендерим HTML для PDF
     html_string = render_to_string('grading/grading_pdf.html', context) 
     
-    # Генерируем PDF
-    response = HttpResponse(content_type='application/pdf')
-    response['Content-Disposition'] = 'attachment; filename="grading_report.pdf"'
-    HTML(string=html_string, base_url=request.build_absolute_uri()).write_pdf(response)
-    return response
+    # Генерируем PDF (в пуле процессов; повторные скачивания — из кеша)
+    return pdf_download_response(request, html_string, context['title'], 'grading_report.pdf')
 
 
 @login_required
@@ -131,13 +128,8 @@ def export_grading_excel(request):
     # Выбираем нужный словарь (если языка нет, берем RU)
     t = translations.get(lang, translations['ru'])
 
-    # Создаем Excel файл
-    response = HttpResponse(content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
-    response['Content-Disposition'] = 'attachment; filename="grading_report.xlsx"'
-    
-    workbook = Workbook()
-    sheet = workbook.active
-    sheet.title = t['sheet_title']
+    # Создаем Excel файл (потоковая запись, отступ ширины колонок 3)
+    writer = XlsxStreamWriter(t['sheet_title'], width_padding=3)
     
     # --- СТРОКА ЗАГОЛОВКОВ 1 (Названия колонок) ---
     header1 = [t['no'], t['student'], t['class'], t['test']]
@@ -147,26 +139,15 @@ def export_grading_excel(request):
         header1.append(header_data['subject'].abbreviation or header_data['subject'].name)
     header1.append(t['total_header'])
     
-    sheet.append(header1)
-    
     # --- СТРОКА ЗАГОЛОВКОВ 2 (Подписи "(10 баллов)") ---
     header2 = ["", "", "", ""]
     for _ in table_headers: 
         header2.append(t['points_label'])
     header2.append("")
     
-    sheet.append(header2)
-    
     # --- ОФОРМЛЕНИЕ ЗАГОЛОВКОВ (Объединение ячеек) ---
-    # Объединяем первые 4 колонки (№, Имя, Класс, Тест) по вертикали
-    for col in range(1, 5):
-        sheet.merge_cells(start_row=1, start_column=col, end_row=2, end_column=col)
-        sheet.cell(row=1, column=col).alignment = Alignment(vertical='center')
-    
-    # Объединяем колонку "Общий балл" по вертикали
-    total_score_col = len(header1)
-    sheet.merge_cells(start_row=1, start_column=total_score_col, end_row=2, end_column=total_score_col)
-    sheet.cell(row=1, column=total_score_col).alignment = Alignment(vertical='center')
+    # Первые 4 колонки (№, Имя, Класс, Тест) и "Общий балл" объединяются по вертикали
+    writer.header([header1, header2], merge_columns=[0, 1, 2, 3, len(header1) - 1])
     
     # --- ЗАПОЛНЕНИЕ ДАННЫМИ ---
     for i, row_data in enumerate(table_rows, 1):
@@ -203,20 +184,42 @@ def export_grading_excel(request):
             row.append(grade)
             
         row.append(total_grade_score)
-        sheet.append(row)
+        writer.append(row)
         
-    # --- АВТОМАТИЧЕСКАЯ ШИРИНА КОЛОНОК ---
-    for col_idx, column_cells in enumerate(sheet.columns, 1):
-        max_length = 0
-        column = get_column_letter(col_idx)
-        for cell in column_cells:
-            try:
-                if len(str(cell.value)) > max_length: 
-                    max_length = len(str(cell.value))
-            except: 
-                pass
-        # Добавляем немного отступа
-        sheet.column_dimensions[column].width = (max_length + 3)
-        
-    workbook.save(response)
-    return response
\ No newline at end of file
+    # Ширина колонок считается автоматически по мере записи строк
+    return writer.response('grading_report.xlsx')
+
+
+@login_required
+def export_grading_csv(request):
+    """
+    Экспортирует таблицу оценок в CSV (плоская таблица для других систем).
+    Ответ потоковый: отчёт считается уже после отправки заголовков.
+    """
+    get_params = request.GET.copy()
+    user = request.user
+
+    def rows():
+        context = get_report_context(get_params, user, mode='grading')
+        table_headers = context.get('table_headers', [])
+
+        header = ['№', 'ID', 'ФИО', 'Класс', 'Школа', 'Тест']
+        header.extend(h['subject'].abbreviation or h['subject'].name for h in table_headers)
+        header.append('Общий балл')
+        yield header
+
+        for i, row_data in enumerate(context.get('table_rows', []), 1):
+            student = row_data['student']
+            grades = row_data['grades_by_subject']
+            result_obj = row_data.get('result_obj')
+            row = [
+                i, student.student_id, student.full_name_ru,
+                student.school_class.name, student.school_class.school.name,
+                result_obj.gat_test.name if result_obj else '',
+            ]
+            row.extend(score_cell(grades.get(h['subject'].id)) for h in table_headers)
+            # Как в Excel: сумма оценок без «—»
+            row.append(sum(v for v in grades.values() if isinstance(v, (int, float))))
+            yield row
+
+    return csv_response(rows(), 'grading_report.csv', delimiter=csv_delimiter(request.GET))
@@ -0,0 +1,75 @@
+# D:\New_GAT\core\views\instrumentation.py
+
+import json
+import os
+from collections import defaultdict, deque
+
+from django.conf import settings
+from django.contrib import messages
+from django.contrib.auth.decorators import login_required
+from django.shortcuts import render, redirect
+
+from ..ai_service import get_ai_cache_stats
+
+# Сколько последних записей лога учитывать в сводке
+SUMMARY_MAX_RECORDS = 5000
+
+
+def _read_query_records(path, limit=SUMMARY_MAX_RECORDS):
+    """Читает последние `limit` JSON-записей из лога инструментации."""
+    if not path or not os.path.exists(path):
+        return []
+    records = []
+    with open(path, encoding='utf-8') as log_file:
+        for line in deque(log_file, maxlen=limit):
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                continue
+    return records
+
+
+def _summarize_query_records(records):
+    """Агрегирует записи по представлениям: средние/максимальные значения и N+1."""
+    by_view = defaultdict(list)
+    for record in records:
+        by_view[record.get('view', '?')].append(record)
+
+    rows = []
+    for view_name, items in by_view.items():
+        count = len(items)
+        worst = max(items, key=lambda r: r.get('queries', 0))
+        repeated = worst.get('repeated') or []
+        rows.append({
+            'view': view_name,
+            'requests': count,
+            'avg_queries': round(sum(r.get('queries', 0) for r in items) / count, 1),
+            'max_queries': worst.get('queries', 0),
+            'avg_db_ms': round(sum(r.get('db_ms', 0) for r in items) / count, 1),
+            'avg_template_ms': round(sum(r.get('template_ms', 0) for r in items) / count, 1),
+            'avg_total_ms': round(sum(r.get('total_ms', 0) for r in items) / count, 1),
+            'budget': worst.get('budget'),
+            'over_budget': sum(1 for r in items if r.get('over_budget')),
+            'worst_path': worst.get('path'),
+            'top_repeated': repeated[0] if repeated else None,
+        })
+    rows.sort(key=lambda row: (row['over_budget'], row['max_queries']), reverse=True)
+    return rows
+
+
+@login_required
+def query_stats_view(request):
+    """Сводка по бюджету SQL-запросов (только для суперпользователя)."""
+    if not request.user.is_superuser:
+        messages.error(request, "У вас нет прав для просмотра этой страницы.")
+        return redirect('core:dashboard')
+
+    records = _read_query_records(getattr(settings, 'QUERY_INSTRUMENTATION_LOG', None))
+    context = {
+        'title': 'Бюджет SQL-запросов',
+        'enabled': getattr(settings, 'QUERY_INSTRUMENTATION_ENABLED', False),
+        'rows': _summarize_query_records(records),
+        'total_records': len(records),
+        'ai_cache': get_ai_cache_stats(),
+    }
+    return render(request, 'management/query_stats.html', context)
@@ -4,17 +4,18 @@ import json
 from collections import defaultdict
 from django.shortcuts import render
 from django.contrib.auth.decorators import login_required
-from django.http import HttpResponse
-from openpyxl import Workbook
-from openpyxl.utils import get_column_letter
-from openpyxl.styles import Alignment
-from weasyprint import HTML
-from django.template.loader import render_to_string
 
 from .utils_reports import get_report_context
+from .conditional import conditional_view
+from .background_jobs import pdf_download_response
+from ..xlsx_export import XlsxStreamWriter, write_monitoring_sheet
+from ..csv_export import csv_delimiter, csv_response, score_cell
+from ..pdf_service import ChunkedDocument
+from ..monitoring_table import MONITORING_PDF_ROWS_PER_PAGE
 from ..models import SchoolClass
 
 @login_required
+@conditional_view()
 def monitoring_view(request):
     """Отображает страницу Мониторинга с новой панелью фильтров."""
     
@@ -76,11 +77,12 @@ def export_monitoring_pdf(request):
     
     # Можно добавить сюда ту же логику переводов, если нужно для PDF
     
-    html_string = render_to_string('monitoring/monitoring_pdf.html', context)
-    response = HttpResponse(content_type='application/pdf')
-    response['Content-Disposition'] = 'attachment; filename="monitoring_report.pdf"'
-    HTML(string=html_string, base_url=request.build_absolute_uri()).write_pdf(response)
-    return response
+    # Большие таблицы верстаются по частям параллельно (см. ChunkedDocument);
+    # повторные скачивания отдаются из кеша
+    document = ChunkedDocument(
+        'monitoring/monitoring_pdf.html', context, 'table_rows', MONITORING_PDF_ROWS_PER_PAGE
+    )
+    return pdf_download_response(request, document, context['title'], 'monitoring_report.pdf')
 
 @login_required
 def export_monitoring_excel(request):
@@ -89,97 +91,47 @@ def export_monitoring_excel(request):
     table_headers = context.get('table_headers', [])
     table_rows = context.get('table_rows', [])
     
-    # 1. Получаем язык из запроса (по умолчанию 'ru')
+    # Язык заголовков и имён: ru (по умолчанию), en, tj
     lang = request.GET.get('lang', 'ru')
-    
-    # 2. Словарь переводов заголовков
-    translations = {
-        'ru': {
-            'no': "№", 'student': "ФИО Студента", 'class': "Класс", 
-            'test': "Тест", 'total': "Общий балл", 'from': "из"
-        },
-        'en': {
-            'no': "#", 'student': "Student Name", 'class': "Class", 
-            'test': "Test", 'total': "Total Score", 'from': "of"
-        },
-        'tj': {
-            'no': "№", 'student': "Ному насаб", 'class': "Синф", 
-            'test': "Тест", 'total': "Холи умумӣ", 'from': "аз"
-        }
-    }
-    # Выбираем текущий словарь, если язык не найден — берем ru
-    t = translations.get(lang, translations['ru'])
-
-    response = HttpResponse(content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
-    response['Content-Disposition'] = 'attachment; filename="monitoring_report.xlsx"'
-    
-    workbook = Workbook()
-    sheet = workbook.active
-    sheet.title = 'Monitoring'
-    
-    # 3. Используем переводы для заголовков
-    header1 = [t['no'], t['student'], t['class'], t['test']]
-    for header_data in table_headers:
-        header1.append(header_data['subject'].abbreviation or header_data['subject'].name)
-    header1.append(t['total'])
-    
-    sheet.append(header1)
-    
-    header2 = ["", "", "", ""]
-    for header_data in table_headers:
-        q_count = header_data.get('q_count', 0)
-        header2.append(f"({t['from']} {q_count})" if q_count > 0 else "")
-    header2.append("")
-    
-    sheet.append(header2)
-    
-    # Объединение и стилизация заголовков
-    for col in range(1, 5):
-        sheet.merge_cells(start_row=1, start_column=col, end_row=2, end_column=col)
-        sheet.cell(row=1, column=col).alignment = Alignment(vertical='center')
-    
-    total_score_col = len(header1)
-    sheet.merge_cells(start_row=1, start_column=total_score_col, end_row=2, end_column=total_score_col)
-    sheet.cell(row=1, column=total_score_col).alignment = Alignment(vertical='center')
-    
-    # 4. Заполняем данными с учетом языка
-    for i, row_data in enumerate(table_rows, 1):
-        student = row_data['student']
-        
-        # Выбираем имя в зависимости от языка
-        if lang == 'en':
-            student_name = student.full_name_en or student.full_name_ru
-        elif lang == 'tj':
-            student_name = student.full_name_tj or student.full_name_ru
-        else:
-            student_name = student.full_name_ru
-
-        row = [
-            i,
-            student_name, # Используем выбранное имя
-            str(student.school_class),
-            row_data['result_obj'].gat_test.name if row_data.get('result_obj') else "Total"
-        ]
-        
+
+    writer = XlsxStreamWriter('Monitoring')
+    write_monitoring_sheet(writer, table_headers, table_rows, lang)
+
+    # Ширина колонок считается по мере записи строк
+    return writer.response('monitoring_report.xlsx')
+
+
+@login_required
+def export_monitoring_csv(request):
+    """
+    Экспортирует отчет по мониторингу в CSV (плоская таблица для других систем).
+    Ответ потоковый: отчёт считается уже после отправки заголовков.
+    """
+    get_params = request.GET.copy()
+    user = request.user
+
+    def rows():
+        context = get_report_context(get_params, user, mode='monitoring')
+        table_headers = context.get('table_headers', [])
+
+        header = ['№', 'ID', 'ФИО', 'Класс', 'Школа', 'Тест']
         for header_data in table_headers:
-            score_data = row_data.get('scores_by_subject', {}).get(header_data['subject'].id)
-            if score_data and score_data.get('score') != '—':
-                cell_value = f"{score_data.get('score', 0)}/{score_data.get('total', 0)}"
-            else:
-                cell_value = "—"
-            row.append(cell_value)
-            
-        row.append(row_data['total_score'])
-        sheet.append(row)
-        
-    for col_idx, column_cells in enumerate(sheet.columns, 1):
-        max_length = 0
-        column = get_column_letter(col_idx)
-        for cell in column_cells:
-            try:
-                if len(str(cell.value)) > max_length: max_length = len(str(cell.value))
-            except: pass
-        sheet.column_dimensions[column].width = (max_length + 2)
-        
-    workbook.save(response)
-    return response
\ No newline at end of file
+            subject_name = header_data['subject'].abbreviation or header_data['subject'].name
+            header.extend([subject_name, f"{subject_name} (из)"])
+        header.append('Общий балл')
+        yield header
+
+        for i, row_data in enumerate(context.get('table_rows', []), 1):
+            student = row_data['student']
+            row = [
+                i, student.student_id, student.full_name_ru,
+                student.school_class.name, student.school_class.school.name,
+                row_data['result_obj'].gat_test.name if row_data.get('result_obj') else "Total",
+            ]
+            for header_data in table_headers:
+                score_data = row_data.get('scores_by_subject', {}).get(header_data['subject'].id) or {}
+                row.extend([score_cell(score_data.get('score')), score_data.get('total', '')])
+            row.append(row_data['total_score'])
+            yield row
+
+    return csv_response(rows(), 'monitoring_report.csv', delimiter=csv_delimiter(request.GET))
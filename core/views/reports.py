@@ -6,14 +6,10 @@ from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
 from django.http import HttpResponse, JsonResponse
-from django.template.loader import render_to_string
 from django.urls import reverse
 from django.db.models import Count, Q
+from django.utils import timezone
 from django.core.files.storage import default_storage # Нужно для удаления временных файлов
-from openpyxl import Workbook
-from openpyxl.utils import get_column_letter
-from openpyxl.styles import Alignment
-from weasyprint import HTML
 
 from accounts.models import UserProfile
 from core.models import (
@@ -22,9 +18,18 @@ from core.models import (
 )
 from core.forms import UploadFileForm, StatisticsFilterForm
 from core.views.permissions import get_accessible_schools
+from core.views.background_jobs import pdf_download_response
+from core.monitoring_table import placed_student
 from core import services
+from core.data_version import bump_data_version
+from core.xlsx_export import XlsxStreamWriter
+from core.csv_export import csv_delimiter, csv_response
+from core.pdf_service import ChunkedDocument
 from core import utils
 
+# Строк таблицы на странице A4 (альбом) в PDF детальных результатов
+DETAILED_PDF_ROWS_PER_PAGE = 24
+
 # =============================================================================
 # --- 1. ЗАГРУЗКА И ВСПОМОГАТЕЛЬНЫЕ ФУНКЦИИ ---
 # =============================================================================
@@ -110,10 +115,8 @@ def upload_results_view(request):
         'title': 'Загрузка результатов GAT'
     })
 
-def get_detailed_results_data(test_number, request_get, request_user):
-    """
-    Универсальная функция подготовки данных для детального рейтинга и экспорта.
-    """
+def _find_detailed_test(test_number, request_get, request_user):
+    """Тест для детального рейтинга: из загрузки (test_id) или последний по фильтрам."""
     year_id = request_get.get('year')
     quarter_id = request_get.get('quarter')
     school_id = request_get.get('school')
@@ -153,9 +156,11 @@ def get_detailed_results_data(test_number, request_get, request_user):
 
         latest_test = tests_qs.order_by('-test_date').first()
 
-    if not latest_test:
-        return {'table_header': [], 'students_data': [], 'test': None}
+    return latest_test
+
 
+def _detailed_table_header(latest_test):
+    """Шапка детального рейтинга: предметы теста и число вопросов."""
     table_header = []
     if latest_test.school_class:
         parent_class = latest_test.school_class.parent if latest_test.school_class.parent else latest_test.school_class
@@ -174,26 +179,69 @@ def get_detailed_results_data(test_number, request_get, request_user):
                 'questions_count': q_count,
                 'school_class': parent_class
             })
+    return table_header
 
-    student_results = StudentResult.objects.filter(gat_test=latest_test).select_related(
+
+def detailed_results_queryset(latest_test):
+    """Результаты теста в порядке рейтинга (лучшие первыми)."""
+    return StudentResult.objects.filter(gat_test=latest_test).select_related(
         'student__school_class__school'
-    )
-    
+    ).order_by('-total_score', 'pk')
+
+
+def _detailed_result_rows(latest_test):
+    """
+    Плоская таблица детального рейтинга для Excel и CSV: сначала строка
+    шапки, затем строка на результат (ответы по вопросам: 1/0). Результаты
+    читаются из БД порциями по мере потребления.
+    """
+    header = _detailed_table_header(latest_test) if latest_test else []
+
+    row1 = ["№", "ID", "ФИО", "Класс", "Школа"]
+    for h in header:
+        subj = h['subject'].abbreviation or h['subject'].name
+        row1.extend(f"{subj}_{i}" for i in range(1, h['questions_count'] + 1))
+    row1.extend(["Общий балл", "Место"])
+    yield row1
+
+    if not latest_test:
+        return
+    total_q = sum(h['questions_count'] for h in header)
+    for position, result in enumerate(detailed_results_queryset(latest_test).iterator(chunk_size=2000), 1):
+        student = result.student
+        row = [position, student.student_id, student.full_name_ru, student.school_class.name, student.school_class.school.name]
+        if isinstance(result.scores_by_subject, dict):
+            for h in header:
+                answers = result.scores_by_subject.get(str(h['subject'].id), {})
+                for q in range(1, h['questions_count'] + 1):
+                    val = answers.get(str(q), "")
+                    row.append(1 if val is True else (0 if val is False else ""))
+        else:
+            row.extend([""] * total_q)
+        # В рейтинге место совпадает с номером строки
+        row.extend([result.total_score, position])
+        yield row
+
+
+def get_detailed_results_data(test_number, request_get, request_user):
+    """
+    Универсальная функция подготовки данных для детального рейтинга и экспорта.
+    """
+    latest_test = _find_detailed_test(test_number, request_get, request_user)
+    if not latest_test:
+        return {'table_header': [], 'students_data': [], 'test': None}
+
     students_data = []
-    for result in student_results:
+    for idx, result in enumerate(detailed_results_queryset(latest_test), 1):
         students_data.append({
             'student': result.student,
             'result': result,
             'total_score': result.total_score,
-            'position': 0
+            'position': idx
         })
 
-    students_data.sort(key=lambda x: x['total_score'], reverse=True)
-    for idx, item in enumerate(students_data, 1):
-        item['position'] = idx
-
     return {
-        'table_header': table_header,
+        'table_header': _detailed_table_header(latest_test),
         'students_data': students_data,
         'test': latest_test
     }
@@ -288,6 +336,7 @@ def student_result_delete_view(request, pk):
     if request.method == 'POST':
         try:
             result.delete()
+            bump_data_version([result.gat_test.school_id])
             messages.success(request, f'Результат удален.')
             base_url = reverse('core:detailed_results_list', kwargs={'test_number': test_number})
             return redirect(f"{base_url}?test_id={test_id}")
@@ -572,10 +621,10 @@ def analysis_view(request):
 
     if form.is_valid():
         accessible_schools = get_accessible_schools(user)
-        results_qs = StudentResult.objects.filter(student__school_class__school__in=accessible_schools)
+        results_qs = StudentResult.objects.filter(school__in=accessible_schools)
         
         if form.cleaned_data['quarters']: results_qs = results_qs.filter(gat_test__quarter__in=form.cleaned_data['quarters'])
-        if form.cleaned_data['schools']: results_qs = results_qs.filter(student__school_class__school__in=form.cleaned_data['schools'])
+        if form.cleaned_data['schools']: results_qs = results_qs.filter(school__in=form.cleaned_data['schools'])
         # (добавить остальные фильтры из StatisticsFilterForm, если нужно)
 
         if results_qs.exists():
@@ -589,8 +638,9 @@ def analysis_view(request):
 
             agg_data = defaultdict(lambda: defaultdict(lambda: {'correct': 0, 'total_possible': 0}))
             
-            for result in results_qs.select_related('student__school_class', 'gat_test'):
-                class_name = result.student.school_class.name
+            for result in results_qs.select_related('student', 'school_class', 'gat_test'):
+                # Класс на момент теста, как в фильтре по школам выше
+                class_name = placed_student(result).school_class.name
                 parallel_id = result.gat_test.school_class_id 
                 
                 if isinstance(result.scores_by_subject, dict):
@@ -638,46 +688,30 @@ def analysis_view(request):
 
 @login_required
 def export_detailed_results_excel(request, test_number):
-    data = get_detailed_results_data(test_number, request.GET, request.user)
-    students_data = data['students_data']
-    header = data['table_header']
-
-    response = HttpResponse(content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
-    response['Content-Disposition'] = f'attachment; filename="GAT-{test_number}_results.xlsx"'
-
-    wb = Workbook()
-    ws = wb.active
-    ws.title = "Результаты"
-
-    row1 = ["№", "ID", "ФИО", "Класс", "Школа"]
-    for h in header:
-        subj = h['subject'].abbreviation or h['subject'].name
-        for i in range(1, h['questions_count'] + 1):
-            row1.append(f"{subj}_{i}")
-    row1.extend(["Общий балл", "Место"])
-    ws.append(row1)
+    """
+    Экспорт детальных результатов в Excel.
+    Результаты читаются из БД порциями и сразу пишутся в книгу (как в CSV).
+    """
+    latest_test = _find_detailed_test(test_number, request.GET, request.user)
+    rows = _detailed_result_rows(latest_test)
 
-    for i, d in enumerate(students_data, 1):
-        row = [i, d['student'].student_id, d['student'].full_name_ru, d['student'].school_class.name, d['student'].school_class.school.name]
-        
-        result = d.get('result')
-        if result and isinstance(result.scores_by_subject, dict):
-            for h in header:
-                sid = str(h['subject'].id)
-                answers = result.scores_by_subject.get(sid, {})
-                for q in range(1, h['questions_count'] + 1):
-                    val = answers.get(str(q), "")
-                    row.append(1 if val is True else (0 if val is False else ""))
-        else:
-            total_q = sum(h['questions_count'] for h in header)
-            row.extend([""] * total_q)
+    # Потоковая запись: книга не собирается целиком в памяти
+    writer = XlsxStreamWriter("Результаты", max_width=50)
+    writer.header([next(rows)])
+    for row in rows:
+        writer.append(row)
 
-        row.append(d['total_score'])
-        row.append(d['position'])
-        ws.append(row)
+    return writer.response(f"GAT-{test_number}_results.xlsx")
 
-    wb.save(response)
-    return response
+@login_required
+def export_detailed_results_csv(request, test_number):
+    """
+    Экспорт детальных результатов в CSV (ответы по вопросам: 1/0).
+    Результаты читаются из БД порциями и сразу пишутся в ответ.
+    """
+    latest_test = _find_detailed_test(test_number, request.GET, request.user)
+    rows = _detailed_result_rows(latest_test)
+    return csv_response(rows, f"GAT-{test_number}_results.csv", delimiter=csv_delimiter(request.GET))
 
 @login_required
 def export_detailed_results_pdf(request, test_number):
@@ -688,11 +722,14 @@ def export_detailed_results_pdf(request, test_number):
         'students_data': data['students_data'],
         'table_header': data['table_header'],
         'test_info': data['test'],
-        'export_date': utils.get_current_date()
+        # utils.get_current_date() в проекте нет — дата экспорта берётся здесь
+        'export_date': timezone.localdate().strftime('%d.%m.%Y')
     }
     
-    html = render_to_string('results/detailed_results_pdf.html', context)
-    response = HttpResponse(content_type='application/pdf')
-    response['Content-Disposition'] = f'attachment; filename="GAT-{test_number}.pdf"'
-    HTML(string=html, base_url=request.build_absolute_uri()).write_pdf(response)
-    return response
\ No newline at end of file
+    # Большие таблицы верстаются по частям параллельно (см. ChunkedDocument);
+    # повторные скачивания отдаются из кеша
+    document = ChunkedDocument(
+        'results/detailed_results_pdf.html', context, 'students_data', DETAILED_PDF_ROWS_PER_PAGE
+    )
+    school_ids = [data['test'].school_id] if data['test'] else None
+    return pdf_download_response(request, document, context['title'], f"GAT-{test_number}.pdf", school_ids=school_ids)
@@ -10,10 +10,12 @@ from django.db.models import QuerySet
 from django.core.cache import cache
 
 # Импорты из вашего проекта
-from ..models import StudentResult, Subject, SchoolClass, QuestionCount
+from ..models import AnalyticsSnapshot, StudentResult, Subject, SchoolClass, QuestionCount
 from ..forms import StatisticsFilterForm
 from .. import utils
+from ..snapshots import find_snapshot
 from .permissions import get_accessible_schools
+from .conditional import conditional_view
 from accounts.models import UserProfile
 
 
@@ -105,86 +107,43 @@ def _process_grade_distribution_report(
     return processed_report
 
 
-@login_required
-def statistics_view(request):
-    """Отображает страницу 'Статистика' с оптимизированными запросами."""
-    user = request.user
-    form = StatisticsFilterForm(request.GET or None, user=user)
-    
-    # Базовый контекст
-    context = {
-        'title': 'Статистика результатов GAT тестов',
-        'form': form,
-        'has_results': False,
-        'selected_quarter_ids': request.GET.getlist('quarters'),
-        'selected_school_ids': request.GET.getlist('schools'),
-        'selected_class_ids': request.GET.getlist('school_classes'),
-        'selected_class_ids_json': json.dumps(request.GET.getlist('school_classes')),
-        'selected_subject_ids': request.GET.getlist('subjects'),
-        'selected_subject_ids_json': json.dumps(request.GET.getlist('subjects')),
-    }
-    
-    # --- ИСПРАВЛЕНИЕ: Логика для восстановления списка классов при перезагрузке ---
-    # Если форма была отправлена, нам нужно заново собрать grouped_classes,
-    # чтобы шаблон мог отрисовать чекбоксы классов.
-    grouped_classes = defaultdict(list)
-    
-    # Пытаемся получить школы из формы (если валидна) или напрямую из GET (для первичной отрисовки)
-    selected_school_ids = request.GET.getlist('schools')
-    
-    if selected_school_ids:
-        try:
-            # Превращаем строки ID в числа
-            school_ids_int = [int(sid) for sid in selected_school_ids]
-            
-            # Получаем классы для этих школ
-            classes_qs = SchoolClass.objects.filter(
-                school_id__in=school_ids_int
-            ).select_related('parent', 'school').order_by('school__name', 'name')
+# ==========================================================
+# --- Расчёт (общий для представления и ночных снимков) ---
+# ==========================================================
 
-            is_multiple_schools = len(school_ids_int) > 1
+def statistics_params(cleaned_data: Dict[str, Any]) -> Dict[str, Any]:
+    """JSON-совместимые параметры расчёта из формы (они же — ключ снимка)."""
+    return {
+        'quarters': sorted(q.id for q in cleaned_data['quarters']),
+        'schools': sorted(s.id for s in cleaned_data['schools']),
+        'classes': sorted(c.id for c in cleaned_data.get('school_classes') or []),
+        # Пустой список — все предметы
+        'subjects': sorted(s.id for s in cleaned_data.get('subjects') or []),
+        'test_numbers': sorted(int(n) for n in cleaned_data.get('test_numbers') or []),
+        'days': sorted(int(d) for d in cleaned_data.get('days') or []),
+    }
 
-            for cls in classes_qs:
-                group_name = ""
-                if cls.parent is None:
-                    group_name = f"{cls.name} классы (Параллель)"
-                else:
-                    group_name = f"{cls.parent.name} классы"
 
-                if is_multiple_schools:
-                    group_name = f"{cls.school.name} - {group_name}"
+def _restore_grade_keys(payload: Dict[str, Any]) -> Dict[str, Any]:
+    """В JSON снимка ключи-оценки стали строками — шаблон ищет их числами."""
+    def restore(grades):
+        return {int(grade): count for grade, count in grades.items()}
 
-                grouped_classes[group_name].append(cls)
-        except ValueError:
-            pass
+    for class_data in payload['grade_distribution_report'].values():
+        for data in class_data.values():
+            data['grades'] = restore(data['grades'])
+    if 'school_summary_report' in payload:
+        payload['school_summary_report']['grades'] = restore(payload['school_summary_report']['grades'])
+    return payload
 
-    # Сортируем группы и добавляем в контекст
-    final_grouped_classes = {}
-    sorted_group_items = sorted(
-        grouped_classes.items(),
-        key=lambda item: (not item[0].endswith("(Параллель)"), item[0])
-    )
-    for group_name, classes_in_group in sorted_group_items:
-        classes_in_group.sort(key=lambda x: x.name)
-        final_grouped_classes[group_name] = classes_in_group
-    
-    context['grouped_classes'] = final_grouped_classes
-    # --- КОНЕЦ ИСПРАВЛЕНИЯ ---
 
-    if not form.is_valid():
-        return render(request, 'statistics/statistics.html', context)
-    
-    # Получение отфильтрованных данных
-    schools = form.cleaned_data.get('schools')
-    school_classes = form.cleaned_data.get('school_classes')
-    subjects = form.cleaned_data.get('subjects')
-    quarters = form.cleaned_data.get('quarters')
-    test_numbers = form.cleaned_data.get('test_numbers') # Не забываем про номера тестов
-    days = form.cleaned_data.get('days') # И дни
-    
+def build_statistics(params: Dict[str, Any]) -> Any:
+    """Данные страницы по параметрам statistics_params(); None — результатов нет."""
+    context = {}
     # Если предметы не выбраны - используем все доступные
-    if not subjects:
-        subjects = Subject.objects.all()
+    subjects = Subject.objects.all()
+    if params['subjects']:
+        subjects = subjects.filter(id__in=params['subjects'])
     
     # Базовый запрос с оптимизацией
     results_qs = StudentResult.objects.select_related(
@@ -192,24 +151,21 @@ def statistics_view(request):
         'gat_test', 
         'student__school_class',
         'student__school_class__school'
-    ).filter(gat_test__quarter__in=quarters)
+    ).filter(gat_test__quarter_id__in=params['quarters'])
     
     # Применение фильтров
-    if schools:
-        results_qs = results_qs.filter(gat_test__school__in=schools) # Исправлено на gat_test__school
-    if school_classes:
+    if params['schools']:
+        results_qs = results_qs.filter(gat_test__school_id__in=params['schools']) # Исправлено на gat_test__school
+    if params['classes']:
         # Учитываем и прямую привязку к классу, и родительскую (параллель)
-        results_qs = results_qs.filter(gat_test__school_class__in=school_classes)
-    if test_numbers:
-        results_qs = results_qs.filter(gat_test__test_number__in=test_numbers)
-    if days:
-        results_qs = results_qs.filter(gat_test__day__in=days)
-    
-    has_results = results_qs.exists()
-    context['has_results'] = has_results
+        results_qs = results_qs.filter(gat_test__school_class_id__in=params['classes'])
+    if params['test_numbers']:
+        results_qs = results_qs.filter(gat_test__test_number__in=params['test_numbers'])
+    if params['days']:
+        results_qs = results_qs.filter(gat_test__day__in=params['days'])
     
-    if not has_results:
-        return render(request, 'statistics/statistics.html', context)
+    if not results_qs.exists():
+        return None
     
     # Подготовка вспомогательных структур
     subject_ids = [s.id for s in subjects]
@@ -281,7 +237,6 @@ def statistics_view(request):
     
     # Подготовка данных для графиков
     grade_range = range(10, 0, -1)
-    context['grade_range'] = grade_range
     
     # График распределения оценок
     context['grade_labels'] = list(grade_distribution.keys())
@@ -336,4 +291,90 @@ def statistics_view(request):
         }
         context['school_summary_report'] = school_summary_report
 
+    return context
+
+
+@login_required
+@conditional_view()
+def statistics_view(request):
+    """Отображает страницу 'Статистика' с оптимизированными запросами."""
+    user = request.user
+    form = StatisticsFilterForm(request.GET or None, user=user)
+    
+    # Базовый контекст
+    context = {
+        'title': 'Статистика результатов GAT тестов',
+        'form': form,
+        'has_results': False,
+        'selected_quarter_ids': request.GET.getlist('quarters'),
+        'selected_school_ids': request.GET.getlist('schools'),
+        'selected_class_ids': request.GET.getlist('school_classes'),
+        'selected_class_ids_json': json.dumps(request.GET.getlist('school_classes')),
+        'selected_subject_ids': request.GET.getlist('subjects'),
+        'selected_subject_ids_json': json.dumps(request.GET.getlist('subjects')),
+    }
+    
+    # --- ИСПРАВЛЕНИЕ: Логика для восстановления списка классов при перезагрузке ---
+    # Если форма была отправлена, нам нужно заново собрать grouped_classes,
+    # чтобы шаблон мог отрисовать чекбоксы классов.
+    grouped_classes = defaultdict(list)
+    
+    # Пытаемся получить школы из формы (если валидна) или напрямую из GET (для первичной отрисовки)
+    selected_school_ids = request.GET.getlist('schools')
+    
+    if selected_school_ids:
+        try:
+            # Превращаем строки ID в числа
+            school_ids_int = [int(sid) for sid in selected_school_ids]
+            
+            # Получаем классы для этих школ
+            classes_qs = SchoolClass.objects.filter(
+                school_id__in=school_ids_int
+            ).select_related('parent', 'school').order_by('school__name', 'name')
+
+            is_multiple_schools = len(school_ids_int) > 1
+
+            for cls in classes_qs:
+                group_name = ""
+                if cls.parent is None:
+                    group_name = f"{cls.name} классы (Параллель)"
+                else:
+                    group_name = f"{cls.parent.name} классы"
+
+                if is_multiple_schools:
+                    group_name = f"{cls.school.name} - {group_name}"
+
+                grouped_classes[group_name].append(cls)
+        except ValueError:
+            pass
+
+    # Сортируем группы и добавляем в контекст
+    final_grouped_classes = {}
+    sorted_group_items = sorted(
+        grouped_classes.items(),
+        key=lambda item: (not item[0].endswith("(Параллель)"), item[0])
+    )
+    for group_name, classes_in_group in sorted_group_items:
+        classes_in_group.sort(key=lambda x: x.name)
+        final_grouped_classes[group_name] = classes_in_group
+    
+    context['grouped_classes'] = final_grouped_classes
+    # --- КОНЕЦ ИСПРАВЛЕНИЯ ---
+
+    if not form.is_valid():
+        return render(request, 'statistics/statistics.html', context)
+    
+    params = statistics_params(form.cleaned_data)
+    # Ночной снимок (precompute_analytics) для тех же параметров, иначе расчёт на лету
+    snapshot = find_snapshot(AnalyticsSnapshot.Kind.STATISTICS, params, params['schools'])
+    if snapshot is not None:
+        payload = snapshot.payload and _restore_grade_keys(snapshot.payload)
+    else:
+        payload = build_statistics(params)
+
+    context['has_results'] = payload is not None
+    if payload is not None:
+        context.update(payload)
+        context['grade_range'] = range(10, 0, -1)
+
     return render(request, 'statistics/statistics.html', context)
\ No newline at end of file
@@ -7,6 +7,7 @@ from django.contrib import messages # Добавлен messages
 
 from ..models import StudentResult, Subject, Student # Добавлен Student
 from .. import utils
+from ..rankings import get_rank_tables, place
 
 @login_required
 def student_dashboard_view(request):
@@ -41,36 +42,8 @@ def student_dashboard_view(request):
         })
 
     # ... (дальнейший код функции) ...
-    test_ids = [r.gat_test_id for r in student_results_qs]
-
-    # Загружаем все результаты по нужным тестам для расчёта рангов
-    all_results_for_tests = StudentResult.objects.filter(gat_test_id__in=test_ids).select_related('student__school_class__school')
-
-    # Группируем баллы по тесту, классу и школе для эффективности
-    scores_by_test = defaultdict(list)
-    scores_by_class = defaultdict(lambda: defaultdict(list))
-    scores_by_school = defaultdict(lambda: defaultdict(list))
-
-    for res in all_results_for_tests:
-        test_id = res.gat_test_id
-        # Добавим проверку, что у студента есть класс и школа
-        if not (res.student and res.student.school_class and res.student.school_class.school):
-            continue
-        class_id = res.student.school_class_id
-        school_id = res.student.school_class.school_id
-        score = res.total_score
-
-        scores_by_test[test_id].append(score)
-        scores_by_class[test_id][class_id].append(score)
-        scores_by_school[test_id][school_id].append(score)
-
-    # Сортируем все списки один раз для быстрого нахождения ранга
-    for test_id in scores_by_test:
-        scores_by_test[test_id].sort(reverse=True)
-        for class_id in scores_by_class[test_id]:
-            scores_by_class[test_id][class_id].sort(reverse=True)
-        for school_id in scores_by_school[test_id]:
-            scores_by_school[test_id][school_id].sort(reverse=True)
+    # Таблицы рангов тестов ученика: из ночного снимка или одним запросом
+    rank_tables = get_rank_tables(r.gat_test for r in student_results_qs)
 
     detailed_results_data = []
     subject_map = {s.id: s.name for s in Subject.objects.all()}
@@ -82,18 +55,11 @@ def student_dashboard_view(request):
         if not (result.student and result.student.school_class and result.student.school_class.school):
             continue
 
-        # Получаем нужные списки для этого теста
-        class_scores = scores_by_class.get(gat_test.id, {}).get(result.student.school_class_id, [])
-        school_scores = scores_by_school.get(gat_test.id, {}).get(result.student.school_class.school_id, [])
-        parallel_scores = scores_by_test.get(gat_test.id, [])
-
-        # Находим ранг по каждому списку с помощью index()
-        try: class_rank = class_scores.index(student_score) + 1
-        except ValueError: class_rank = None
-        try: school_rank = school_scores.index(student_score) + 1
-        except ValueError: school_rank = None
-        try: parallel_rank = parallel_scores.index(student_score) + 1
-        except ValueError: parallel_rank = None
+        # Находим ранг в таблицах этого теста
+        table = rank_tables[gat_test.id]
+        class_rank, class_total = place(table, student_score, 'classes', result.student.school_class_id)
+        school_rank, school_total = place(table, student_score, 'schools', result.student.school_class.school_id)
+        parallel_rank, parallel_total = place(table, student_score)
 
         best_subject, worst_subject = None, None
         subject_performance, processed_scores = [], []
@@ -130,9 +96,9 @@ def student_dashboard_view(request):
         # Добавляем все новые ранги в словарь
         detailed_results_data.append({
             'result': result,
-            'class_rank': class_rank, 'class_total': len(class_scores),
-            'school_rank': school_rank, 'school_total': len(school_scores),
-            'parallel_rank': parallel_rank, 'parallel_total': len(parallel_scores),
+            'class_rank': class_rank, 'class_total': class_total,
+            'school_rank': school_rank, 'school_total': school_total,
+            'parallel_rank': parallel_rank, 'parallel_total': parallel_total,
             'best_subject': best_subject, 'worst_subject': worst_subject,
             'processed_scores': sorted(processed_scores, key=lambda x: x['percentage'], reverse=True),
         })
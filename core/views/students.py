@@ -2,11 +2,8 @@
 
 # Стандартная библиотека Python
 import json
-import logging
 from collections import defaultdict
 from django.db.models import Q
-import pandas as pd
-import urllib.parse
 from django.db.models import Count, Q
 from django.views.decorators.http import require_POST
 from django.core.files.storage import default_storage
@@ -25,13 +22,13 @@ from django.template.loader import render_to_string
 from django.urls import reverse_lazy
 from django.utils.crypto import get_random_string
 from django.views.generic import CreateView, DeleteView, UpdateView
-from weasyprint import HTML
 
 # Локальные импорты
 from accounts.models import UserProfile
 from .. import utils
 from ..forms import StudentForm, StudentUploadForm
 from ..models import (
+    BackgroundJob,
     QuestionCount,
     School,
     SchoolClass,
@@ -41,9 +38,16 @@ from ..models import (
 )
 # Импортируем функцию загрузки напрямую
 from ..services import process_student_upload
+from ..xlsx_export import XlsxStreamWriter, STUDENT_SHEET_HEADER, student_sheet_queryset, student_sheet_row
+from ..pdf_service import render_pdf_bytes
+from ..account_provisioning import provision_student_accounts
+from ..bulk_delete import TARGET_RESULTS, TARGET_STUDENTS, start_bulk_delete
+from ..rankings import get_rank_tables, place
 from .permissions import get_accessible_schools
 
-logger = logging.getLogger('cleanup_logger')
+# Журнал очистки (cleanup_logger) ведёт core/bulk_delete.py по итогам удаления
+# Сколько последних фоновых удалений показывать на странице очистки
+BULK_DELETE_JOBS_SHOWN = 10
 
 # =============================================================================
 # --- ВСПОМОГАТЕЛЬНЫЕ ФУНКЦИИ И МИКСИНЫ ---
@@ -340,14 +344,21 @@ def student_delete_multiple_view(request):
     # 3. Удаляем только тех, кто:
     #    а) Есть в списке ID
     #    б) Учится в школе, к которой у нас есть доступ!
-    deleted_count, _ = Student.objects.filter(
-        id__in=student_ids,
-        school_class__school__in=accessible_schools  # <--- ВОТ ГЛАВНАЯ ЗАЩИТА
-    ).delete()
+    #    (пачками, без сбора каскада в памяти — core/bulk_delete.py)
+    job = start_bulk_delete(
+        request.user, TARGET_STUDENTS,
+        {
+            'id__in': [int(sid) for sid in student_ids if str(sid).isdigit()],
+            'school_class__school_id__in': list(accessible_schools.values_list('id', flat=True)),  # <--- ВОТ ГЛАВНАЯ ЗАЩИТА
+        },
+        f"Выбранные ученики ({len(student_ids)})",
+    )
 
     # 4. Сообщаем результат
-    if deleted_count > 0:
-        messages.success(request, f"Успешно удалено учеников: {deleted_count}")
+    if job.status == BackgroundJob.Status.DONE and job.progress > 0:
+        messages.success(request, f"Успешно удалено учеников: {job.progress}")
+    elif job.total > 0 and job.status != BackgroundJob.Status.FAILED:
+        messages.info(request, f"Удаление {job.total} учеников запущено в фоне. Когда оно завершится, придёт уведомление.")
     else:
         # Если ID были, но ничего не удалилось - значит, пытались удалить чужих
         messages.error(request, "Не удалось удалить. Возможно, у вас нет прав на этих учеников.")
@@ -524,77 +535,27 @@ def class_create_export_accounts(request, class_id):
         return redirect(redirect_url)
     
     action = request.POST.get('action')
-    credentials_list = []
-    
-    # 1. Обрабатываем учеников, у которых уже есть аккаунт
-    students_with_accounts = Student.objects.filter(
-        school_class=school_class, 
-        user_profile__isnull=False
-    ).select_related('user_profile__user')
-
-    reset_count = 0
-    for student in students_with_accounts:
-        user = student.user_profile.user
-        password_to_show = '(пароль установлен)'
-
-        if action == 'reset_and_export':
-            new_password = get_random_string(length=8)
-            user.set_password(new_password)
-            user.save()
-            password_to_show = new_password
-            reset_count += 1
-        
-        credentials_list.append({
-            'full_name': student.full_name_ru, 
-            'username': user.username, 
-            'password': password_to_show
-        })
 
-    # 2. Создаем аккаунты для новых учеников
-    students_to_create = Student.objects.filter(
-        school_class=school_class, 
-        user_profile__isnull=True
+    # 1–2. Создаём аккаунты новым ученикам и (при сбросе) меняем пароли
+    # существующим — пачкой: общий подбор логинов, параллельное хеширование
+    result = provision_student_accounts(
+        Student.objects.filter(school_class=school_class),
+        reset_passwords=(action == 'reset_and_export'),
     )
-    
-    created_count = 0
-    for student in students_to_create:
-        first_name = student.first_name_en or ''
-        last_name = student.last_name_en or ''
-        base_username = f"{first_name}{last_name}" if first_name or last_name else student.student_id
-        base_username = ''.join(e for e in base_username if e.isalnum()).lower()
-        username = base_username or 'student'
-        counter = 1
-        while User.objects.filter(username=username).exists():
-            username = f"{base_username}{counter}"
-            counter += 1
-        password = get_random_string(length=8)
-        user = User.objects.create_user(
-            username=username, password=password, 
-            first_name=student.first_name_ru, last_name=student.last_name_ru
-        )
-        profile = user.profile
-        profile.role = UserProfile.Role.STUDENT
-        profile.student = student
-        profile.save()
-        credentials_list.append({
-            'full_name': student.full_name_ru, 
-            'username': username, 
-            'password': password
-        })
-        created_count += 1
+    credentials_list = result['credentials']
+    created_count, reset_count = result['created'], result['reset']
 
     # 3. Генерируем PDF
     if not credentials_list:
         messages.warning(request, "В этом классе нет учеников для экспорта.")
         return redirect(redirect_url)
-        
-    credentials_list.sort(key=lambda x: x['full_name'])
     
     context = {'credentials': credentials_list, 'school_class': school_class}
     html_string = render_to_string('students/logins_pdf.html', context)
     response = HttpResponse(content_type='application/pdf')
     response['Content-Disposition'] = f'attachment; filename="logins_{school_class.name}.pdf"'
-    HTML(string=html_string).write_pdf(response)
+    # Рендер в пуле процессов, без кеша: в листе логинов открытые пароли
+    response.write(render_pdf_bytes(html_string))
     
     message_parts = []
     if created_count > 0:
@@ -639,75 +600,27 @@ def parallel_create_export_accounts(request, parallel_id):
         return redirect(redirect_url)
     
     action = request.POST.get('action')
-    students_in_parallel = Student.objects.filter(school_class__parent=parallel)
-    
-    credentials_list = []
-    reset_count = 0
-    created_count = 0
-
-    # 1. Обрабатываем учеников, у которых уже есть аккаунт
-    students_with_accounts = students_in_parallel.filter(
-        user_profile__isnull=False
-    ).select_related('user_profile__user')
-
-    for student in students_with_accounts:
-        user = student.user_profile.user
-        password_to_show = '(пароль установлен)'
-
-        if action == 'reset_and_export':
-            new_password = get_random_string(length=8)
-            user.set_password(new_password)
-            user.save()
-            password_to_show = new_password
-            reset_count += 1
-        
-        credentials_list.append({
-            'full_name': student.full_name_ru, 
-            'username': user.username, 
-            'password': password_to_show
-        })
 
-    # 2. Создаем аккаунты для новых учеников
-    students_to_create = students_in_parallel.filter(user_profile__isnull=True)
-    
-    for student in students_to_create:
-        first_name = student.first_name_en or ''
-        last_name = student.last_name_en or ''
-        base_username = f"{first_name}{last_name}" if first_name or last_name else student.student_id
-        base_username = ''.join(e for e in base_username if e.isalnum()).lower()
-        username = base_username or 'student'
-        counter = 1
-        while User.objects.filter(username=username).exists():
-            username = f"{base_username}{counter}"
-            counter += 1
-        password = get_random_string(length=8)
-        user = User.objects.create_user(
-            username=username, password=password, 
-            first_name=student.first_name_ru, last_name=student.last_name_ru
-        )
-        profile, _ = UserProfile.objects.get_or_create(user=user)
-        profile.role = UserProfile.Role.STUDENT
-        profile.student = student
-        profile.save()
-        credentials_list.append({
-            'full_name': student.full_name_ru, 
-            'username': username, 
-            'password': password
-        })
-        created_count += 1
+    # 1–2. Создаём аккаунты новым ученикам и (при сбросе) меняем пароли
+    # существующим — пачкой: общий подбор логинов, параллельное хеширование
+    result = provision_student_accounts(
+        Student.objects.filter(school_class__parent=parallel),
+        reset_passwords=(action == 'reset_and_export'),
+    )
+    credentials_list = result['credentials']
+    created_count, reset_count = result['created'], result['reset']
 
     # 3. Генерируем PDF
     if not credentials_list:
         messages.warning(request, "В этой параллели нет учеников для экспорта.")
         return redirect(redirect_url)
-        
-    credentials_list.sort(key=lambda x: x['full_name'])
     
     context = {'credentials': credentials_list, 'school_class': parallel}
     html_string = render_to_string('students/logins_pdf.html', context)
     response = HttpResponse(content_type='application/pdf')
     response['Content-Disposition'] = f'attachment; filename="logins_parallel_{parallel.name}.pdf"'
-    HTML(string=html_string).write_pdf(response)
+    # Рендер в пуле процессов, без кеша: в листе логинов открытые пароли
+    response.write(render_pdf_bytes(html_string))
     
     message_parts = []
     if created_count > 0:
@@ -747,57 +660,40 @@ def student_progress_view(request, student_id):
             'has_results': False
         })
 
-    test_ids = student_results_qs.values_list('gat_test_id', flat=True)
-    all_results_for_tests = StudentResult.objects.filter(
-        gat_test_id__in=test_ids
-    ).select_related('student__school_class__school')
-    
-    scores_by_test, scores_by_class, scores_by_school = defaultdict(list), defaultdict(lambda: defaultdict(list)), defaultdict(lambda: defaultdict(list))
-    
-    for res in all_results_for_tests:
-        scores_by_test[res.gat_test_id].append(res.total_score)
-        scores_by_class[res.gat_test_id][res.student.school_class_id].append(res.total_score)
-        scores_by_school[res.gat_test_id][res.student.school_class.school_id].append(res.total_score)
-    
-    for test_id in scores_by_test:
-        scores_by_test[test_id].sort(reverse=True)
-        for class_id in scores_by_class[test_id]: 
-            scores_by_class[test_id][class_id].sort(reverse=True)
-        for school_id in scores_by_school[test_id]: 
-            scores_by_school[test_id][school_id].sort(reverse=True)
+    # Таблицы рангов тестов ученика: из ночного снимка или одним запросом
+    rank_tables = get_rank_tables(r.gat_test for r in student_results_qs)
     
     subject_map = {s.id: s.name for s in Subject.objects.all()}
+
+    # Количество вопросов по параллелям результатов (на момент теста) — одним запросом
+    current_parallel_id = student.school_class.parent_id or student.school_class_id
+    parallel_ids = {r.parallel_id or current_parallel_id for r in student_results_qs}
+    q_counts_by_parallel = defaultdict(dict)
+    for qc in QuestionCount.objects.filter(school_class_id__in=parallel_ids):
+        q_counts_by_parallel[qc.school_class_id][qc.subject_id] = qc.number_of_questions
+
     detailed_results_data = []
     
     for result in student_results_qs:
         student_score = result.total_score
-        class_scores = scores_by_class.get(result.gat_test_id, {}).get(student.school_class_id, [])
-        school_scores = scores_by_school.get(result.gat_test_id, {}).get(student.school_class.school_id, [])
-        parallel_scores = scores_by_test.get(result.gat_test_id, [])
-
-        try: 
-            class_rank = class_scores.index(student_score) + 1
-        except ValueError: 
-            class_rank = None
-        try: 
-            school_rank = school_scores.index(student_score) + 1
-        except ValueError: 
-            school_rank = None
-        try: 
-            parallel_rank = parallel_scores.index(student_score) + 1
-        except ValueError: 
-            parallel_rank = None
-
-        grade, best_s, worst_s, processed_scores = _get_grade_and_subjects_performance(result, subject_map)
+        table = rank_tables[result.gat_test_id]
+        class_rank, class_total = place(table, student_score, 'classes', student.school_class_id)
+        school_rank, school_total = place(table, student_score, 'schools', student.school_class.school_id)
+        parallel_rank, parallel_total = place(table, student_score)
+
+        q_counts_parallel = q_counts_by_parallel[result.parallel_id or current_parallel_id]
+        grade, best_s, worst_s, processed_scores = _get_grade_and_subjects_performance(
+            result, subject_map, q_counts_parallel
+        )
         
         detailed_results_data.append({
             'result': result, 
             'class_rank': class_rank, 
-            'class_total': len(class_scores),
+            'class_total': class_total,
             'parallel_rank': parallel_rank, 
-            'parallel_total': len(parallel_scores),
+            'parallel_total': parallel_total,
             'school_rank': school_rank, 
-            'school_total': len(school_scores),
+            'school_total': school_total,
             'grade': grade, 
             'best_subject': best_s, 
             'worst_subject': worst_s, 
@@ -834,15 +730,8 @@ def student_progress_view(request, student_id):
     }
     return render(request, 'students/student_progress.html', context)
 
-def _get_grade_and_subjects_performance(result, subject_map):
-    student_class = result.student.school_class
-    parent_class = student_class.parent if student_class.parent else student_class
-
-    q_counts_parallel = {
-        qc.subject_id: qc.number_of_questions
-        for qc in QuestionCount.objects.filter(school_class=parent_class)
-    }
-
+def _get_grade_and_subjects_performance(result, subject_map, q_counts_parallel):
+    """q_counts_parallel — {предмет: число вопросов} параллели результата."""
     total_student_score = 0
     total_max_score = 0
     subject_performance = []
@@ -910,45 +799,51 @@ def data_cleanup_view(request):
         
         # Подтверждение "ядерной кнопки"
         confirmation_text = request.POST.get('confirmation_text')
+        # Удаление идёт фоновой задачей (core/bulk_delete.py); {count} в записи
+        # журнала подставляется по итогам
+        job = None
 
         if 'delete_students_parallel' in request.POST:
             parallel_id = request.POST.get('parallel_id')
             if parallel_id:
                 parallel = get_object_or_404(SchoolClass, pk=parallel_id)
-                students_to_delete = Student.objects.filter(school_class__parent_id=parallel_id)
-                deleted_count, _ = students_to_delete.delete()
-                
-                logger.critical(f"USER: '{user.username}' удалил {deleted_count} УЧЕНИКОВ из параллели '{parallel.name}'.")
-                messages.warning(request, f'ВНИМАНИЕ: Удалено {deleted_count} учеников из параллели "{parallel.name}".')
+                job = start_bulk_delete(
+                    user, TARGET_STUDENTS, {'school_class__parent_id': parallel.pk},
+                    f'Ученики параллели "{parallel.name}"',
+                    audit={'level': 'critical', 'message': f"USER: '{user.username}' удалил {{count}} УЧЕНИКОВ из параллели '{parallel.name}'."},
+                )
             else:
                 messages.error(request, 'Вы не выбрали параллель для удаления учеников.')
 
         elif 'clear_results_class' in request.POST:
             class_id = request.POST.get('class_id')
             if class_id:
-                school_class = SchoolClass.objects.get(pk=class_id)
+                school_class = get_object_or_404(SchoolClass, pk=class_id)
                 class_name = school_class.name
-                deleted_count, _ = StudentResult.objects.filter(student__school_class_id=class_id).delete()
-                
-                logger.warning(f"USER: '{user.username}' удалил {deleted_count} РЕЗУЛЬТАТОВ ТЕСТОВ для класса '{class_name}'.")
-                messages.success(request, f'Успешно удалено {deleted_count} записей для класса "{class_name}".')
+                job = start_bulk_delete(
+                    user, TARGET_RESULTS, {'student__school_class_id': school_class.pk},
+                    f'Результаты класса "{class_name}"',
+                    audit={'level': 'warning', 'message': f"USER: '{user.username}' удалил {{count}} РЕЗУЛЬТАТОВ ТЕСТОВ для класса '{class_name}'."},
+                )
             else:
                 messages.error(request, 'Вы не выбрали класс для очистки результатов.')
 
         elif 'clear_results_all' in request.POST:
-            deleted_count, _ = StudentResult.objects.all().delete()
-            logger.warning(f"USER: '{user.username}' удалил ВСЕ ({deleted_count}) РЕЗУЛЬТАТЫ ТЕСТОВ в системе.")
-            messages.success(request, f'ПОЛНАЯ ОЧИСТКА РЕЗУЛЬТАТОВ ЗАВЕРШЕНА. Удалено {deleted_count} записей.')
+            job = start_bulk_delete(
+                user, TARGET_RESULTS, {}, 'Все результаты тестов',
+                audit={'level': 'warning', 'message': f"USER: '{user.username}' удалил ВСЕ ({{count}}) РЕЗУЛЬТАТЫ ТЕСТОВ в системе."},
+            )
 
         elif 'delete_students_class' in request.POST:
             class_id = request.POST.get('class_id')
             if class_id:
-                school_class = SchoolClass.objects.get(pk=class_id)
+                school_class = get_object_or_404(SchoolClass, pk=class_id)
                 class_name = school_class.name
-                deleted_count, _ = Student.objects.filter(school_class_id=class_id).delete()
-                
-                logger.critical(f"USER: '{user.username}' удалил {deleted_count} УЧЕНИКОВ из класса '{class_name}'.")
-                messages.warning(request, f'ВНИМАНИЕ: Удалено {deleted_count} учеников из класса "{class_name}".')
+                job = start_bulk_delete(
+                    user, TARGET_STUDENTS, {'school_class_id': school_class.pk},
+                    f'Ученики класса "{class_name}"',
+                    audit={'level': 'critical', 'message': f"USER: '{user.username}' удалил {{count}} УЧЕНИКОВ из класса '{class_name}'."},
+                )
             else:
                 messages.error(request, 'Вы не выбрали класс для удаления учеников.')
 
@@ -957,9 +852,13 @@ def data_cleanup_view(request):
             if confirmation_text != "УДАЛИТЬ":
                  messages.error(request, "Для удаления всей базы необходимо ввести слово 'УДАЛИТЬ' в поле подтверждения.")
             else:
-                deleted_count, _ = Student.objects.all().delete()
-                logger.critical(f"USER: '{user.username}' удалил ВСЕХ ({deleted_count}) УЧЕНИКОВ в системе.")
-                messages.warning(request, f'ВНИМАНИЕ: ВСЕ УЧЕНИКИ В СИСТЕМЕ ({deleted_count}) БЫЛИ УДАЛЕНЫ.')
+                job = start_bulk_delete(
+                    user, TARGET_STUDENTS, {}, 'Все ученики',
+                    audit={'level': 'critical', 'message': f"USER: '{user.username}' удалил ВСЕХ ({{count}}) УЧЕНИКОВ в системе."},
+                )
+
+        if job is not None:
+            _bulk_delete_message(request, job)
 
         return redirect('core:data_cleanup')
 
@@ -971,71 +870,51 @@ def data_cleanup_view(request):
         'classes': classes,
         'parallels': parallels,
     }
+    context.update(_bulk_delete_jobs_context(request.user))
     return render(request, 'students/data_cleanup.html', context)
 
+
+def _bulk_delete_message(request, job):
+    if job.status == BackgroundJob.Status.DONE:
+        messages.warning(request, f'«{job.title}»: удалено {job.progress} записей.')
+    elif job.status == BackgroundJob.Status.FAILED:
+        messages.error(request, f'«{job.title}»: удаление прервано ({job.error}).')
+    else:
+        messages.info(request, f'«{job.title}»: удаление {job.total} записей запущено в фоне. Прогресс — ниже на странице.')
+
+
+def _bulk_delete_jobs_context(user):
+    jobs = list(BackgroundJob.objects.filter(user=user, kind=BackgroundJob.Kind.BULK_DELETE)[:BULK_DELETE_JOBS_SHOWN])
+    active = [BackgroundJob.Status.PENDING, BackgroundJob.Status.RUNNING]
+    return {'jobs': jobs, 'has_active_jobs': any(job.status in active for job in jobs)}
+
+
+@login_required
+def bulk_delete_jobs_view(request):
+    """HTMX: фоновые удаления пользователя с прогрессом (опрашивается, пока есть активные)."""
+    return render(request, 'students/partials/_bulk_delete_jobs.html', _bulk_delete_jobs_context(request.user))
+
 # =============================================================================
 # --- ЭКСПОРТ В EXCEL ---
 # =============================================================================
 
 def _generate_students_excel(students_queryset, filename_prefix):
     """
-    Генерирует HTTP response с Excel-файлом для переданного списка учеников.
+    Генерирует потоковый Excel-файл для переданного списка учеников.
+    Ученики читаются из БД порциями (.iterator), строки сразу пишутся в файл.
     """
-    data = []
-    students = students_queryset.select_related(
-        'school_class',
-        'school_class__school',
-        'user_profile__user'
-    ).order_by('school_class__name', 'last_name_ru', 'first_name_ru')
-
-    for index, s in enumerate(students, start=1):
-        username = s.user_profile.user.username if hasattr(s, 'user_profile') and s.user_profile.user else ''
-        
-        data.append({
-            '№': index,
-            'Школа': s.school_class.school.name,
-            'Класс': s.school_class.name,
-            'ID': s.student_id,
-            'Фамилия (RU)': s.last_name_ru,
-            'Имя (RU)': s.first_name_ru,
-            'Насаб (TJ)': s.last_name_tj,
-            'Ном (TJ)': s.first_name_tj,
-            'Surname (EN)': s.last_name_en,
-            'Name (EN)': s.first_name_en,
-            'Логин': username,
-            'Статус': s.get_status_display()
-        })
-
-    if not data:
-        df = pd.DataFrame(columns=[
-            '№', 'Школа', 'Класс', 'ID', 'Фамилия (RU)', 'Имя (RU)', 
-            'Насаб (TJ)', 'Ном (TJ)', 'Surname (EN)', 'Name (EN)', 'Логин', 'Статус'
-        ])
-    else:
-        df = pd.DataFrame(data)
+    students = student_sheet_queryset(students_queryset).order_by(
+        'school_class__name', 'last_name_ru', 'first_name_ru'
+    )
 
-    response = HttpResponse(content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
-    
-    # Кодировка имени файла
-    quoted_filename = urllib.parse.quote(f"{filename_prefix}.xlsx")
-    response['Content-Disposition'] = f'attachment; filename="{quoted_filename}"; filename*=UTF-8\'\'{quoted_filename}'
+    writer = XlsxStreamWriter('Students', max_width=50)
+    writer.header([STUDENT_SHEET_HEADER])
 
-    with pd.ExcelWriter(response, engine='openpyxl') as writer:
-        df.to_excel(writer, index=False, sheet_name='Students')
-        
-        # Авто-ширина колонок
-        worksheet = writer.sheets['Students']
-        for idx, col in enumerate(df.columns):
-            max_len = len(str(col))
-            if not df.empty:
-                # Избегаем ошибки с int/float в len(), преобразуем в str
-                max_val_len = df[col].astype(str).map(len).max()
-                if max_val_len > max_len:
-                    max_len = max_val_len
-            
-            worksheet.column_dimensions[chr(65 + idx)].width = min(max_len + 2, 50)
+    for index, s in enumerate(students.iterator(chunk_size=2000), start=1):
+        writer.append(student_sheet_row(index, s))
 
-    return response
+    # Имя файла (в т.ч. кириллица) кодируется FileResponse по RFC 6266
+    return writer.response(f"{filename_prefix}.xlsx")
 
 
 @login_required
@@ -0,0 +1,221 @@
+# D:\New_GAT\core\xlsx_export.py
+
+"""
+Потоковая выгрузка Excel (XLSX) с постоянным расходом памяти.
+
+XlsxWriter в режиме constant_memory сбрасывает каждую строку на диск сразу
+после перехода к следующей, поэтому в памяти держится только текущая строка.
+Готовая книга пишется во временный файл (SpooledTemporaryFile: небольшие
+файлы остаются в памяти, большие уходят на диск) и отдаётся через
+FileResponse кусками, без сборки всего файла в HttpResponse.
+
+Ограничение режима: строки пишутся строго сверху вниз. Вернуться к уже
+записанной строке нельзя, поэтому шапка с объединёнными ячейками пишется
+через header(), а ширина колонок считается на лету и применяется в конце.
+"""
+
+import tempfile
+
+import xlsxwriter
+from django.http import FileResponse
+
+XLSX_CONTENT_TYPE = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+
+# До этого размера временный файл остаётся в памяти
+SPOOL_MAX_SIZE = 4 * 1024 * 1024
+
+
+class XlsxStreamWriter:
+    """
+    Однолистовая книга для потоковой записи строк.
+
+    Использование:
+        writer = XlsxStreamWriter('Результаты')
+        writer.header([row1, row2], merge_columns=[0, 1])
+        for row in rows:
+            writer.append(row)
+        return writer.response('report.xlsx')
+    """
+
+    def __init__(self, sheet_title, width_padding=2, max_width=None):
+        self._file = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE)
+        self.workbook = xlsxwriter.Workbook(self._file, {
+            'constant_memory': True,
+            'strings_to_numbers': False,
+            'strings_to_formulas': False,
+            'strings_to_urls': False,
+        })
+        # Excel ограничивает имя листа 31 символом
+        self.sheet = self.workbook.add_worksheet(sheet_title[:31])
+        self.header_format = self.workbook.add_format({'valign': 'vcenter'})
+        self.width_padding = width_padding
+        self.max_width = max_width
+        self._widths = []
+        self._row = 0
+
+    def _track_widths(self, values):
+        for col, value in enumerate(values):
+            length = len(str(value)) if value is not None else 0
+            if col >= len(self._widths):
+                self._widths.append(length)
+            elif length > self._widths[col]:
+                self._widths[col] = length
+
+    def header(self, rows, merge_columns=()):
+        """
+        Пишет строки шапки. Колонки из merge_columns объединяются
+        по вертикали на всю высоту шапки (значение берётся из первой строки).
+        """
+        rows = [list(row) for row in rows]
+        if not rows:
+            return
+        first_row = self._row
+        last_row = first_row + len(rows) - 1
+
+        # merge_range() с форматом заполняет диапазон форматированными
+        # пустыми ячейками, и в constant_memory запись во вторую строку
+        # сбрасывает первую на диск — следующие ячейки первой строки
+        # теряются. Без формата пустые ячейки не пишутся, поэтому сначала
+        # регистрируются все объединения, затем шапка пишется построчно
+        # (первая ячейка объединения перезаписывается уже с форматом).
+        merged = set(merge_columns) if last_row > first_row else set()
+        for col in sorted(merged):
+            self.sheet.merge_range(first_row, col, last_row, col, rows[0][col])
+        for offset, row in enumerate(rows):
+            for col, value in enumerate(row):
+                if col not in merged or offset == 0:
+                    self.sheet.write(first_row + offset, col, value, self.header_format)
+
+        for row in rows:
+            self._track_widths(row)
+        self._row = last_row + 1
+
+    def append(self, values):
+        """Пишет одну строку данных."""
+        values = list(values)
+        self.sheet.write_row(self._row, 0, values)
+        self._track_widths(values)
+        self._row += 1
+
+    def close(self):
+        """Задаёт ширину колонок и дописывает книгу во временный файл."""
+        for col, length in enumerate(self._widths):
+            width = length + self.width_padding
+            if self.max_width:
+                width = min(width, self.max_width)
+            self.sheet.set_column(col, col, width)
+        self.workbook.close()
+        self._file.seek(0)
+        return self._file
+
+    def response(self, filename):
+        """FileResponse, отдающий книгу кусками (имя файла кодируется по RFC 6266)."""
+        return FileResponse(
+            self.close(),
+            as_attachment=True,
+            filename=filename,
+            content_type=XLSX_CONTENT_TYPE,
+        )
+
+
+# =============================================================================
+# --- ТИПОВЫЕ ЛИСТЫ (общие для выгрузок из views и пакетной выгрузки) ---
+# =============================================================================
+
+STUDENT_SHEET_HEADER = [
+    '№', 'Школа', 'Класс', 'ID', 'Фамилия (RU)', 'Имя (RU)',
+    'Насаб (TJ)', 'Ном (TJ)', 'Surname (EN)', 'Name (EN)', 'Логин', 'Статус'
+]
+
+
+def student_sheet_queryset(students):
+    """Ученики для листа «Ученики»: только активные, со связями для student_sheet_row."""
+    return students.filter(status='ACTIVE').select_related(
+        'school_class', 'school_class__school', 'user_profile__user'
+    )
+
+
+def student_sheet_row(index, student):
+    """Строка листа «Ученики» (school_class__school и user_profile__user подгружены)."""
+    username = student.user_profile.user.username if hasattr(student, 'user_profile') and student.user_profile.user else ''
+    return [
+        index,
+        student.school_class.school.name,
+        student.school_class.name,
+        student.student_id,
+        student.last_name_ru,
+        student.first_name_ru,
+        student.last_name_tj,
+        student.first_name_tj,
+        student.last_name_en,
+        student.first_name_en,
+        username,
+        student.get_status_display(),
+    ]
+
+
+# Переводы заголовков отчёта по мониторингу
+MONITORING_TRANSLATIONS = {
+    'ru': {
+        'no': "№", 'student': "ФИО Студента", 'class': "Класс",
+        'test': "Тест", 'total': "Общий балл", 'from': "из"
+    },
+    'en': {
+        'no': "#", 'student': "Student Name", 'class': "Class",
+        'test': "Test", 'total': "Total Score", 'from': "of"
+    },
+    'tj': {
+        'no': "№", 'student': "Ному насаб", 'class': "Синф",
+        'test': "Тест", 'total': "Холи умумӣ", 'from': "аз"
+    }
+}
+
+
+def write_monitoring_sheet(writer, table_headers, table_rows, lang='ru'):
+    """Пишет отчёт по мониторингу (формат get_report_context) в writer."""
+    # Если язык не найден — берем ru
+    t = MONITORING_TRANSLATIONS.get(lang, MONITORING_TRANSLATIONS['ru'])
+
+    header1 = [t['no'], t['student'], t['class'], t['test']]
+    for header_data in table_headers:
+        header1.append(header_data['subject'].abbreviation or header_data['subject'].name)
+    header1.append(t['total'])
+
+    header2 = ["", "", "", ""]
+    for header_data in table_headers:
+        q_count = header_data.get('q_count', 0)
+        header2.append(f"({t['from']} {q_count})" if q_count > 0 else "")
+    header2.append("")
+
+    # Первые 4 колонки и «Общий балл» объединяются по вертикали
+    writer.header([header1, header2], merge_columns=[0, 1, 2, 3, len(header1) - 1])
+
+    for i, row_data in enumerate(table_rows, 1):
+        student = row_data['student']
+
+        # Выбираем имя в зависимости от языка
+        if lang == 'en':
+            student_name = student.full_name_en or student.full_name_ru
+        elif lang == 'tj':
+            student_name = student.full_name_tj or student.full_name_ru
+        else:
+            student_name = student.full_name_ru
+
+        row = [
+            i,
+            student_name,
+            str(student.school_class),
+            row_data['result_obj'].gat_test.name if row_data.get('result_obj') else "Total"
+        ]
+
+        for header_data in table_headers:
+            score_data = row_data.get('scores_by_subject', {}).get(header_data['subject'].id)
+            if score_data and score_data.get('score') != '—':
+                cell_value = f"{score_data.get('score', 0)}/{score_data.get('total', 0)}"
+            else:
+                cell_value = "—"
+            row.append(cell_value)
+
+        row.append(row_data['total_score'])
+        writer.append(row)
+    return writer